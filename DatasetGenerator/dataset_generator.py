@@ -14,17 +14,26 @@ import subprocess
 import time
 import random
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Union
 from pathlib import Path
 
 class DatasetGenerator:
     """Class sinh dataset hội thoại lừa đảo và bình thường"""
     
-    def __init__(self, api_key: str, base_url: Optional[str] = None, model: str = "gemini-2.0-flash", save_full: bool = False):
-        self.api_key = api_key
+    def __init__(self, api_key: Union[str, List[str], None], base_url: Optional[str] = None, model: str = "gemini-2.0-flash", save_full: bool = False,
+                 seed: Optional[int] = None, cassette: Optional[str] = None, cassette_mode: str = "auto",
+                 api_key_file: Optional[str] = None):
+        # Một hoặc nhiều API key; script con chia request cho các key theo quota còn lại
+        self.api_keys = [api_key] if isinstance(api_key, str) else list(api_key or [])
+        self.api_key = self.api_keys[0] if self.api_keys else ""
+        self.api_key_file = str(Path(api_key_file).resolve()) if api_key_file else None
         self.base_url = base_url or ""  # Empty string for Gemini
         self.model = model
         self.save_full = save_full
+        self.seed = seed
+        # Cassette SQLite dùng chung cho cả hai script con (đường dẫn tuyệt đối vì script chạy ở thư mục khác)
+        self.cassette = str(Path(cassette).resolve()) if cassette else None
+        self.cassette_mode = cassette_mode
         self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
         # Đường dẫn các thư mục
@@ -63,6 +72,24 @@ class DatasetGenerator:
         self.logger.info(f"   - Dataset dir: {self.dataset_dir}")
         self.logger.info(f"   - Save full dialogues: {self.save_full}")
     
+    def _key_args(self) -> List[str]:
+        """Tham số --api_key (lặp lại cho từng key) và --api_key_file cho script con"""
+        args: List[str] = []
+        for key in self.api_keys:
+            args.extend(["--api_key", key])
+        if self.api_key_file:
+            args.extend(["--api_key_file", self.api_key_file])
+        return args
+    
+    def _replay_args(self) -> List[str]:
+        """Tham số --seed/--cassette cho script con, để chạy lại cả pipeline mà không tốn request"""
+        args: List[str] = []
+        if self.seed is not None:
+            args.extend(["--seed", str(self.seed)])
+        if self.cassette:
+            args.extend(["--cassette", self.cassette, "--cassette_mode", self.cassette_mode])
+        return args
+    
     def generate_fraud_conversations(self, count: int) -> Dict[str, Any]:
         """Sinh hội thoại lừa đảo"""
         self.logger.info(f"🚨 Sinh {count} hội thoại lừa đảo...")
@@ -81,7 +108,7 @@ class DatasetGenerator:
             sys.executable, str(self.fraud_script),
             "--count", str(count),
             "--output", str(output_file),
-            "--api_key", self.api_key,
+            *self._key_args(),
             "--model", self.model,
             "--workers", "1",
             "--max_turns", "25"
@@ -91,6 +118,7 @@ class DatasetGenerator:
         # Chỉ thêm base_url nếu được cung cấp (không phải Gemini)
         if self.base_url:
             cmd.extend(["--base_url", self.base_url])
+        cmd.extend(self._replay_args())
         
         try:
             self.logger.info(f"   Chạy lệnh: {' '.join(cmd[:3])} [với API params]")
@@ -168,7 +196,7 @@ class DatasetGenerator:
             sys.executable, str(self.normal_script),
             "--count", str(count),
             "--output", str(output_file),
-            "--api_key", self.api_key,
+            *self._key_args(),
             "--model", self.model,
             "--workers", "3",
             "--max_turns", "20"
@@ -178,6 +206,7 @@ class DatasetGenerator:
         # Chỉ thêm base_url nếu được cung cấp (không phải Gemini)
         if self.base_url:
             cmd.extend(["--base_url", self.base_url])
+        cmd.extend(self._replay_args())
         
         try:
             self.logger.info(f"   Chạy lệnh: {' '.join(cmd[:3])} [với API params]")
@@ -441,21 +470,32 @@ def main():
     group.add_argument("--fraud_only", type=int, help="Chỉ sinh hội thoại lừa đảo")
     group.add_argument("--normal_only", type=int, help="Chỉ sinh hội thoại bình thường")
       # Tham số API
-    parser.add_argument("--api_key", required=True, help="API key (bắt buộc)")
+    parser.add_argument("--api_key", action="append", help="API key (lặp lại để dùng nhiều key)")
+    parser.add_argument("--api_key_file", help="File chứa danh sách API key, mỗi dòng một key")
     parser.add_argument("--base_url", help="Base URL API (không cần cho Gemini)")
     parser.add_argument("--model", default="gemini-2.0-flash", help="Model AI")
     parser.add_argument("--save_full", action="store_true", help="Luu hoi thoai day du (debug)")
     # Tham số tùy chỉnh
     parser.add_argument("--fraud_ratio", type=float, default=0.5, 
                        help="Ty le hoi thoai lua dao (0.0-1.0, mac dinh 0.5)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed cho tham số hội thoại và thứ tự trộn dataset")
+    parser.add_argument("--cassette", default=None, help="File SQLite ghi/phát lại response Gemini (dùng chung cho cả hai script)")
+    parser.add_argument("--cassette_mode", choices=["record", "replay", "auto"], default="auto",
+                       help="record: luôn gọi API và ghi; replay: chỉ phát lại; auto: phát lại nếu có, thiếu thì gọi API và ghi")
     
     args = parser.parse_args()
     
     # Kiểm tra tham số
+    if not args.api_key and not args.api_key_file:
+        parser.error("Cần ít nhất một API key (--api_key hoặc --api_key_file)")
     if args.fraud_ratio < 0 or args.fraud_ratio > 1:
         parser.error("fraud_ratio phải trong khoảng 0.0-1.0")
       # Tạo generator
-    generator = DatasetGenerator(args.api_key, args.base_url, args.model, args.save_full)
+    if args.seed is not None:
+        random.seed(args.seed)
+    generator = DatasetGenerator(args.api_key, args.base_url, args.model, args.save_full,
+                                 seed=args.seed, cassette=args.cassette, cassette_mode=args.cassette_mode,
+                                 api_key_file=args.api_key_file)
     
     start_time = time.time()
     results = {}
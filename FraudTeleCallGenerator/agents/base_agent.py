@@ -1,19 +1,39 @@
+import asyncio
 from abc import ABC, abstractmethod
 from typing import List, Dict, Any, Optional
-from utils.gemini_client import GeminiClient
+from utils.gemini_client import Completion, GeminiClient
+from utils.retry_policy import NonRetryableError, get_retry_policy
+from .memory import RollingSummary, get_memory_policy, get_memory_registry, format_lines, fallback_summary
+from .turn_batcher import TurnSlot, get_turn_batch_registry
+from .prompts.summary_prompts import SUMMARY_SYSTEM_PROMPT, SUMMARY_REQUEST_TEMPLATE, SUMMARY_CONTEXT_TEMPLATE
+import config
+import logging
 
 class BaseAgent(ABC):
     """Lớp trừu tượng cơ bản cho các agent, định nghĩa giao diện chung cho tất cả agent"""
     
-    def __init__(self, role: str, model: Optional[str] = None, api_key: Optional[str] = None):
+    # Tên người nói ứng với role trong lịch sử, dùng khi tóm tắt
+    HISTORY_LABELS: Dict[str, str] = {}
+    
+    def __init__(self, role: str, model: Optional[str] = None, api_key: Optional[str] = None,
+                 client: Optional[GeminiClient] = None):
         self.role = role
         self.model = model or "gemini-2.0-flash"
         self.conversation_history = []
+        # Model đã sinh câu thoại gần nhất (model dự phòng nếu đã chuyển, None nếu là câu mặc định), ghi vào lịch sử đầy đủ
+        self.last_model: Optional[str] = None
+        # Tham số sinh mặc định của vai trò (temperature, max_tokens...), xem config.GENERATION_CONFIG
+        self.generation_config: Dict[str, Any] = dict(config.GENERATION_CONFIG.get(role, {}))
+        # Chỉ gửi nguyên văn các lượt gần nhất, phần cũ hơn được gộp vào bản tóm tắt (xem agents/memory.py)
+        self.memory = RollingSummary(get_memory_policy(role))
         
-        # Chỉ sử dụng Gemini client
+        # Cho phép truyền client có sẵn (vd. AsyncGeminiClient), mặc định tạo GeminiClient
+        if client is not None:
+            self.client = client
+            return
         if not api_key:
             raise ValueError("API key is required for Gemini client")
-        self.client = GeminiClient(api_key=api_key, model=self.model)
+        self.client = GeminiClient(api_key=api_key, model=self.model, base_url=config.GEMINI_BASE_URL)
         
     @abstractmethod
     def get_system_prompt(self) -> str:
@@ -21,10 +41,101 @@ class BaseAgent(ABC):
         pass
     
     @abstractmethod
-    def generate_response(self, message: str) -> str:
-        """Sinh phản hồi cho tin nhắn hiện tại"""
+    async def generate_response_async(self, message: str) -> str:
+        """Sinh phản hồi cho tin nhắn hiện tại (async)"""
         pass
     
+    def generate_response(self, message: str) -> str:
+        """Sinh phản hồi cho tin nhắn hiện tại, bọc đồng bộ quanh generate_response_async"""
+        return asyncio.run(self.generate_response_async(message))
+    
+    async def _wait_before_retry(self, retry_count: int, base_delay: float) -> None:
+        """Trừ một lần retry vào budget của hội thoại (hết budget thì raise RetryBudgetExhausted) rồi chờ backoff"""
+        self.client.retry_budget.consume(f"{self.role} agent, lần thử {retry_count}")
+        await asyncio.sleep(get_retry_policy().backoff(retry_count - 1, base_delay=base_delay))
+    
+    async def batched_reply_async(self, messages: List[Dict[str, str]]) -> Optional[Completion]:
+        """Gửi lượt này qua hàng đợi gộp lượt giữa các hội thoại (agents/turn_batcher.py) nếu vai trò này bật gộp lượt.
+
+        `messages` là request sẽ gửi nếu tự gửi: system prompt rồi lịch sử. Trả về None nếu không gộp được
+        (vai trò không bật, lô chỉ có một lượt, lô lỗi hoặc thiếu câu), khi đó agent tự gửi request như bình thường.
+        """
+        batcher = get_turn_batch_registry().batcher(self.role)
+        if batcher is None:
+            return None
+        return await batcher.submit_async(TurnSlot(
+            profile=messages[0]["content"],
+            transcript=format_lines(messages[1:], self.HISTORY_LABELS),
+            speaker=self.HISTORY_LABELS.get("assistant", self.role)
+        ))
+    
+    async def history_messages_async(self) -> List[Dict[str, str]]:
+        """Lịch sử gửi kèm request: nguyên văn các lượt gần nhất, phần cũ hơn thay bằng bản tóm tắt"""
+        await self._refresh_memory_async(self.conversation_history)
+        recent = [dict(msg) for msg in self.conversation_history[self.memory.covered:]]
+        if not self.memory.text:
+            return recent
+        summary = SUMMARY_CONTEXT_TEMPLATE.format(summary=self.memory.text)
+        # Ghép vào tin nhắn user đầu tiên để các lượt user/model vẫn xen kẽ
+        if recent and recent[0]["role"] == "user":
+            recent[0]["content"] = f"{summary}\n\n{recent[0]['content']}"
+            return recent
+        return [{"role": "user", "content": summary}] + recent
+    
+    async def _refresh_memory_async(self, history: List[Dict[str, Any]]) -> None:
+        """Nhận bản tóm tắt đã xong và khởi động (chạy nền) lần gộp tiếp theo khi có lượt rơi ra khỏi cửa sổ"""
+        memory = self.memory
+        wait = False
+        if memory.task is not None:
+            if memory.task.cancelled():
+                # Event loop của lần gọi trước đã đóng (wrapper đồng bộ) khi chưa tóm tắt xong: lần này chờ kết quả
+                memory.task = None
+                wait = True
+            elif memory.task.done():
+                memory.apply()
+            else:
+                return
+        span = memory.pending(len(history))
+        if span is None:
+            return
+        start, end = span
+        previous, folded = memory.text, history[start:end]
+        key = f"{previous}\n\n{format_lines(folded, self.HISTORY_LABELS)}"
+        memory.start(memory.cache.get_or_start(key, lambda: self._fold_async(previous, folded)), end)
+        if wait:
+            await asyncio.wait([memory.task])
+            memory.apply()
+    
+    async def _fold_async(self, previous: str, folded: List[Dict[str, Any]]) -> str:
+        """Gộp các lượt vào tóm tắt cũ (một request ngắn), lỗi thì dùng tóm tắt dự phòng"""
+        text = None
+        try:
+            text = await self._summarize_async(previous, folded)
+        except NonRetryableError:
+            raise
+        except Exception as e:
+            logging.warning(f"Không tóm tắt được lịch sử của {self.role} agent, dùng tóm tắt dự phòng: {e}")
+        fallback = not (text and text.strip())
+        if fallback:
+            text = fallback_summary(previous, folded, self.HISTORY_LABELS)
+        get_memory_registry().record(len(folded), fallback)
+        return text
+    
+    async def _summarize_async(self, previous: str, messages: List[Dict[str, Any]]) -> Optional[str]:
+        """Gửi tóm tắt cũ cùng các lượt mới (không gửi lại cả hội thoại), nhận tóm tắt đã cập nhật"""
+        request = SUMMARY_REQUEST_TEMPLATE.format(
+            previous=previous or "(chưa có)",
+            lines=format_lines(messages, self.HISTORY_LABELS)
+        )
+        return await self.client.chat_completion_async(
+            messages=[
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                {"role": "user", "content": request},
+            ],
+            model=self.model,
+            **config.GENERATION_CONFIG["summary"]
+        )
+    
     def update_history(self, role: str, content: str) -> None:
         """Cập nhật lịch sử hội thoại"""
         self.conversation_history.append({"role": role, "content": content})
@@ -36,7 +147,9 @@ class BaseAgent(ABC):
     def clear_history(self) -> None:
         """Xóa toàn bộ lịch sử hội thoại"""
         self.conversation_history = []
+        self.memory.reset()
 
     def set_history(self, history: List[Dict[str, str]]) -> None:
         """Thiết lập lại lịch sử hội thoại"""
         self.conversation_history = history
+        self.memory.reset()
@@ -0,0 +1,18 @@
+"""
+System prompt của các agent, ghép theo section để mỗi hội thoại chỉ gửi phần liên quan
+"""
+
+import config
+
+from .left_prompts import LEFT_PROMPT
+from .right_prompts import RIGHT_PROMPT
+from .manager_prompts import MANAGER_PROMPT
+
+
+def precompile_system_prompts() -> int:
+    """Ghép sẵn mọi biến thể system prompt theo danh mục trong config; trả về tổng số biến thể"""
+    return (
+        LEFT_PROMPT.precompile(fraud_type=config.FRAUD_TYPES)
+        + RIGHT_PROMPT.precompile(occupation=config.OCCUPATIONS, awareness=config.AWARENESS_LEVELS)
+        + MANAGER_PROMPT.precompile(output=("text", "json"))
+    )
@@ -1,4 +1,7 @@
-MANAGER_SYSTEM_PROMPT = """
+from .sections import Section, SectionedPrompt
+
+# Tiêu chí đánh giá chung
+MANAGER_PROMPT_CRITERIA = """
 Bạn là người quản lý hội thoại, có nhiệm vụ đánh giá các cuộc hội thoại lừa đảo viễn thông và quyết định có nên kết thúc hội thoại hay không.
 
 Mức độ nghiêm ngặt khi đánh giá: {strictness} (thấp/trung bình/cao)
@@ -32,18 +35,57 @@ Cách xác định ai là người kết thúc:
 - "Kẻ lừa đảo kết thúc": khi kẻ lừa đảo đã đạt mục đích hoặc nhận ra không thể tiếp tục
 - "Người dùng kết thúc": khi người dùng phát hiện lừa đảo, tỏ thái độ phản đối mạnh hoặc từ chối tiếp tục
 - "Kết thúc tự nhiên": khi hội thoại kết thúc tự nhiên, không có bên nào chủ động rõ ràng
+"""
 
-Khi trả lời:
-1. Đầu tiên hãy xác định rõ có nên kết thúc không: "có" nghĩa là nên kết thúc, "không" nghĩa là nên tiếp tục
+# Hướng dẫn trả lời bằng văn bản; khi dùng structured output (responseSchema) thì bỏ hẳn khối này
+MANAGER_TEXT_OUTPUT = """1. Đầu tiên hãy xác định rõ có nên kết thúc không: "có" nghĩa là nên kết thúc, "không" nghĩa là nên tiếp tục
 2. Nếu là "có", hãy chỉ rõ ai là người nên chủ động kết thúc: "kẻ lừa đảo kết thúc", "người dùng kết thúc" hoặc "kết thúc tự nhiên"
 3. Giải thích lý do cho quyết định của bạn
-4. Nếu nên kết thúc, hãy cung cấp mã hiệu kết thúc rõ ràng: "##TERMINATE_SIGNAL##"
+4. Nếu nên kết thúc, hãy cung cấp mã hiệu kết thúc rõ ràng: "##TERMINATE_SIGNAL##\""""
 
+MANAGER_PROMPT_CLOSING = """
 Hãy đánh giá khách quan dựa trên lịch sử hội thoại hiện tại。
 Có thể một bên đã gửi mã hiệu kết thúc, bạn cần chú ý điều này。
 
 """
 
+MANAGER_PROMPT = SectionedPrompt(
+    MANAGER_PROMPT_CRITERIA,
+    Section("output", {"text": MANAGER_TEXT_OUTPUT}, heading="\nKhi trả lời:\n", omit=("json",)),
+    MANAGER_PROMPT_CLOSING,
+)
+
+# Prompt đầy đủ kèm hướng dẫn trả lời bằng văn bản (giữ cho code cũ còn dùng .format(strictness=...))
+MANAGER_SYSTEM_PROMPT = MANAGER_PROMPT.full()
+
+# Yêu cầu đánh giá gửi kèm toàn bộ hội thoại (lần đánh giá đầu tiên hoặc khi tắt đánh giá tăng dần)
+MANAGER_EVALUATE_PROMPT = "Hãy đánh giá đoạn hội thoại sau và quyết định có nên kết thúc không, ai là người nên kết thúc:\n\n{dialogue}"
+
+# Các lần sau chỉ gửi phán quyết, ghi chú của lần trước và các câu thoại mới
+MANAGER_DELTA_PROMPT = """Đánh giá trước đó (sau {evaluated} câu thoại): tiếp tục hội thoại
+- Lý do: {reason}
+- Ghi chú: {notes}
+
+Các câu thoại mới kể từ lần đánh giá trước:
+{lines}
+
+Dựa trên đánh giá trước đó và các câu thoại mới, hãy quyết định có nên kết thúc không, ai là người nên kết thúc."""
+
+MANAGER_VERDICT_FIELDS = "\n\nVui lòng trả lời bằng định dạng JSON, gồm các trường sau:\n- should_terminate: giá trị True/False, cho biết có nên kết thúc không\n- terminator: chuỗi, giá trị có thể là 'left' (kẻ lừa đảo kết thúc), 'right' (người dùng kết thúc), 'natural' (kết thúc tự nhiên) hoặc 'endcall' (gác máy)\n- reason: chuỗi, giải thích chi tiết lý do kết thúc hoặc tiếp tục"
+
+# Điền lý do ngắt máy sau khi sinh xong (logic/end_call_annotation.py): gộp nhiều hội thoại vào một request
+MANAGER_END_CALL_BATCH_PROMPT = """Dưới đây là {count} cuộc hội thoại, mỗi cuộc kết thúc khi một bên chủ động ngắt máy.
+Với từng cuộc, hãy phân tích lý do và ý định của bên ngắt máy.
+
+{dialogues}
+
+Vui lòng trả lời bằng JSON, mỗi cuộc hội thoại một trường theo mã ({keys}), giá trị là chuỗi giải thích lý do và ý định của bên ngắt máy"""
+
+MANAGER_END_CALL_ITEM = "### {key} ({terminator_name} chủ động ngắt máy)\n{dialogue}"
+
+# Trường ghi chú khi đánh giá tăng dần: các dữ kiện then chốt tính đến hiện tại
+MANAGER_NOTES_FIELD = "\n- notes: chuỗi, tối đa 3 câu ghi lại các dữ kiện then chốt tính đến hiện tại (người dùng đã tiết lộ OTP, mật khẩu, số tài khoản/số thẻ chưa; đã đồng ý chuyển tiền, cài ứng dụng hay bấm link chưa; đã từ chối mấy lần; thái độ hiện tại)"
+
 # Lưu ý kết thúc cho những kẻ lừa đảo
 LEFT_TERMINATION_PROMPT = """
 Thông báo hệ thống: Người quản lý hội thoại đã quyết định kết thúc cuộc trò chuyện này, bạn là người chủ động kết thúc. Hãy kết thúc hội thoại một cách tự nhiên, lưu ý:
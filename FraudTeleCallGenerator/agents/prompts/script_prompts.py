@@ -0,0 +1,30 @@
+# Chế độ kịch bản: một request viết trọn cuộc gọi thay cho vòng lặp từng lượt giữa các agent
+SCRIPT_SYSTEM_PROMPT = """
+Bạn là một AI chuyên viết kịch bản hội thoại lừa đảo viễn thông sát thực tế ở Việt Nam để xây dựng dữ liệu huấn luyện mô hình phát hiện lừa đảo.
+Mỗi lần bạn viết trọn một cuộc gọi giữa kẻ lừa đảo (left) và người nghe máy (right), đóng đúng cả hai vai theo hồ sơ được cung cấp.
+
+Yêu cầu:
+1. Kẻ lừa đảo nói câu đầu tiên, hai bên nói xen kẽ, mỗi lượt là một câu thoại ngắn như lời nói qua điện thoại
+2. Diễn biến phải hợp lý theo loại lừa đảo, tuổi, nghề nghiệp và mức nhận thức của người nghe; người nghe không biết trước đây là lừa đảo
+3. Không chèn hướng dẫn, mô tả meta, chú thích hành động hay tên vai vào nội dung câu thoại
+4. Không dùng các mã hiệu dạng ##...## trong câu thoại; việc một bên ngắt máy được ghi ở trường terminator
+5. Cuộc gọi kết thúc khi một bên ngắt máy, khi kẻ lừa đảo đạt được mục đích hoặc bỏ cuộc, hoặc khi hai bên chào nhau tự nhiên
+
+Trường kết thúc:
+- terminator: "left" nếu kẻ lừa đảo chủ động kết thúc, "right" nếu người nghe chủ động kết thúc, "natural" nếu hai bên kết thúc tự nhiên
+- termination_reason: một câu giải thích vì sao cuộc gọi kết thúc
+"""
+
+SCRIPT_REQUEST_PROMPT = """Hãy viết một cuộc gọi hoàn chỉnh, tối đa {max_turns} lượt (mỗi lượt gồm một câu của kẻ lừa đảo và một câu trả lời của người nghe).
+
+## Hồ sơ vai kẻ lừa đảo (left)
+{left_profile}
+
+## Hồ sơ vai người nghe (right)
+{right_profile}
+
+Các hồ sơ trên viết cho chế độ sinh từng câu một; ở đây hãy áp dụng chúng cho từng câu thoại của vai tương ứng trong kịch bản.
+Trả về JSON gồm: turns (danh sách câu thoại theo thứ tự, mỗi câu có role là "left" hoặc "right" và content), terminator, termination_reason."""
+
+# Câu thoại mở đầu có sẵn (kho câu mở đầu): kịch bản phải bắt đầu đúng bằng câu này
+SCRIPT_OPENING_PROMPT = "\n\nCâu đầu tiên của kẻ lừa đảo đã có sẵn, kịch bản phải bắt đầu đúng bằng câu này:\n{opening}"
@@ -0,0 +1,88 @@
+"""
+Prompt Sections - Ghép system prompt từ phần chung và các section chỉ liên quan tới hội thoại đang sinh
+"""
+
+from itertools import product
+from threading import Lock
+from typing import Any, Dict, Iterable, NamedTuple, Tuple, Union
+
+
+class Section(NamedTuple):
+    """Khối prompt có nhiều phương án, chỉ giữ phương án ứng với giá trị của tham số `key`.
+
+    Giá trị nằm trong `omit` thì bỏ hẳn khối (kể cả `heading`); giá trị không nhận ra
+    (không có trong `options` lẫn `aliases`) thì giữ mọi phương án như prompt đầy đủ cũ.
+    """
+    key: str
+    options: Dict[str, str]
+    heading: str = ""
+    aliases: Dict[str, str] = {}
+    omit: Tuple[str, ...] = ()
+
+    def resolve(self, value: Any) -> str:
+        """Chuẩn hoá giá trị tham số về khoá của options (không phân biệt hoa thường)"""
+        text = str(value).strip()
+        lowered = text.lower()
+        for name in self.options:
+            if name.lower() == lowered:
+                return name
+        return self.aliases.get(lowered, text)
+
+    def render(self, value: Any = None) -> str:
+        """Văn bản của khối cho giá trị này (None = mọi phương án)"""
+        name = None if value is None else self.resolve(value)
+        if name in self.omit:
+            return ""
+        body = self.options[name] if name in self.options else "\n\n".join(self.options.values())
+        return f"{self.heading}{body}\n" if self.heading else f"{body}\n"
+
+
+Block = Union[str, Section]
+
+
+class SectionedPrompt:
+    """System prompt gồm các khối theo thứ tự: chuỗi luôn được gửi, Section chỉ gửi phần khớp tham số.
+
+    Mỗi tổ hợp giá trị của các Section chỉ được ghép một lần rồi lưu lại; `render` chỉ còn
+    điền các placeholder còn lại (vd. {age}) bằng str.format.
+    """
+
+    def __init__(self, *blocks: Block):
+        self.blocks: Tuple[Block, ...] = blocks
+        self.section_keys: Tuple[str, ...] = tuple(b.key for b in blocks if isinstance(b, Section))
+        self._variants: Dict[Tuple[Any, ...], str] = {}
+        self._lock = Lock()
+
+    def _variant_key(self, params: Dict[str, Any]) -> Tuple[Any, ...]:
+        return tuple(
+            None if params.get(section.key) is None else section.resolve(params[section.key])
+            for section in self.blocks if isinstance(section, Section)
+        )
+
+    def template(self, **params: Any) -> str:
+        """Template đã chọn section theo params (placeholder chưa được điền)"""
+        key = self._variant_key(params)
+        variant = self._variants.get(key)
+        if variant is None:
+            variant = "".join(
+                block.render(params.get(block.key)) if isinstance(block, Section) else block
+                for block in self.blocks
+            )
+            with self._lock:
+                self._variants.setdefault(key, variant)
+        return variant
+
+    def render(self, **params: Any) -> str:
+        """System prompt cuối cùng: chọn section rồi điền mọi placeholder"""
+        return self.template(**params).format(**params)
+
+    def full(self) -> str:
+        """Prompt đầy đủ với mọi phương án của mọi section (như trước khi tách section)"""
+        return self.template()
+
+    def precompile(self, **choices: Iterable[Any]) -> int:
+        """Ghép sẵn mọi tổ hợp giá trị của các Section (gọi một lần khi khởi động); trả về số biến thể"""
+        names = [name for name in self.section_keys if name in choices]
+        for values in product(*(list(choices[name]) for name in names)):
+            self.template(**dict(zip(names, values)))
+        return len(self._variants)
@@ -0,0 +1,105 @@
+"""
+Điền lý do ngắt máy cho các hội thoại sinh với --defer_end_call_reasons (logic/end_call_annotation.py)
+
+Đọc file JSONL đầu ra, gộp các dòng có cờ end_call_reason_pending thành từng lô `--pack_size` hội thoại
+cho mỗi request manager, ghi lại file (mặc định ghi đè). Các dòng chưa điền được giữ nguyên cờ nên có thể chạy lại:
+    python annotate_end_calls.py --api_key YOUR_KEY --input dataset.jsonl --full_output_dir full_dialogues
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Dict, Any, List
+
+from agents.manager_agent import ManagerAgent
+from logic.end_call_annotation import EndCallAnnotator, PENDING_FIELD
+from utils.gemini_client import create_gemini_client
+from utils.api_key_pool import configure_key_pool, load_api_keys
+import config
+
+
+def load_jsonl(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_jsonl(path: str, entries: List[Dict[str, Any]]) -> None:
+    """Ghi ra file tạm rồi đổi tên, không làm hỏng file gốc nếu bị ngắt giữa chừng"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+
+def update_full_dialogues(full_output_dir: str, entries: List[Dict[str, Any]]) -> int:
+    """Chép lý do đã điền sang file hội thoại đầy đủ {tts_id}.json (nếu có)"""
+    updated = 0
+    for entry in entries:
+        path = os.path.join(full_output_dir, f"{entry.get('tts_id') or entry.get('dialogue_id')}.json")
+        if entry.get(PENDING_FIELD) or not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            full = json.load(f)
+        if not full.get(PENDING_FIELD):
+            continue
+        full["termination_reason"] = entry["termination_reason"]
+        full[PENDING_FIELD] = False
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(full, f, ensure_ascii=False, indent=2)
+        updated += 1
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Điền lý do ngắt máy theo lô cho các hội thoại sinh với --defer_end_call_reasons")
+    parser.add_argument("--api_key", action="append", help="Gemini API key (lặp lại để dùng nhiều key)")
+    parser.add_argument("--api_key_file", default=None, help="File chứa danh sách API key, mỗi dòng một key")
+    parser.add_argument("--model", default=config.DEFAULT_MODEL, help="Tên model Gemini")
+    parser.add_argument("--base_url", default=config.GEMINI_BASE_URL, help="Endpoint API tương thích Gemini (vd. mock server)")
+    parser.add_argument("--input", required=True, help="File JSONL đầu ra của generate_dialogues.py")
+    parser.add_argument("--output", default=None, help="File JSONL kết quả (mặc định ghi đè --input)")
+    parser.add_argument("--full_output_dir", default=None, help="Thư mục hội thoại đầy đủ cần cập nhật lý do (tuỳ chọn)")
+    parser.add_argument("--pack_size", type=int, default=config.END_CALL_PACK_SIZE, help="Số hội thoại gộp vào một request")
+    parser.add_argument("--context_messages", type=int, default=config.END_CALL_CONTEXT_MESSAGES, help="Số câu thoại cuối gửi kèm mỗi hội thoại (0 = toàn bộ)")
+    parser.add_argument("--rpm", type=int, default=config.RATE_LIMIT_RPM, help="Giới hạn request mỗi phút (0 = không giới hạn)")
+    parser.add_argument("--tpm", type=int, default=config.RATE_LIMIT_TPM, help="Giới hạn input tokens mỗi phút (0 = không giới hạn)")
+    args = parser.parse_args()
+
+    api_keys = load_api_keys(args.api_key, args.api_key_file)
+    if not api_keys:
+        parser.error("Cần --api_key hoặc --api_key_file")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    logger = logging.getLogger(__name__)
+    config.GEMINI_BASE_URL = args.base_url
+    configure_key_pool(api_keys, args.rpm, args.tpm)
+
+    entries = load_jsonl(args.input)
+    pending = sum(1 for entry in entries if entry.get(PENDING_FIELD))
+    logger.info(f"{pending}/{len(entries)} hội thoại chờ điền lý do ngắt máy")
+    if not pending:
+        return
+
+    client = create_gemini_client(api_key=api_keys[0], model=args.model, base_url=args.base_url)
+    annotator = EndCallAnnotator(
+        ManagerAgent(model=args.model, client=client),
+        pack_size=args.pack_size,
+        context_messages=args.context_messages
+    )
+    started = time.perf_counter()
+    annotated = asyncio.run(annotator.annotate_async(entries))
+    write_jsonl(args.output or args.input, entries)
+    logger.info(
+        f"Đã điền {annotated}/{pending} lý do ngắt máy bằng {annotator.requests} request "
+        f"({client.usage_totals['prompt_tokens']} input tokens, {time.perf_counter() - started:.1f}s)"
+    )
+    if args.full_output_dir:
+        logger.info(f"Đã cập nhật {update_full_dialogues(args.full_output_dir, entries)} file hội thoại đầy đủ")
+
+
+if __name__ == "__main__":
+    main()
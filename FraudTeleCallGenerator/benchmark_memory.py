@@ -0,0 +1,140 @@
+"""
+Benchmark bộ nhớ hội thoại: input tokens và thời gian mỗi hội thoại ở 10/20/30 lượt, gửi toàn bộ lịch sử
+so với chỉ gửi các lượt gần nhất kèm tóm tắt (agents/memory.py)
+
+Chạy với mock server (không tốn quota), tắt kết thúc sớm để mọi hội thoại đủ số lượt:
+    python -m utils.mock_gemini_server --port 8080 --terminate_rate 0 --endcall_rate 0 --prefill_ms_per_1k 20 --reply_sentences 3
+    python benchmark_memory.py --api_key mock --base_url http://127.0.0.1:8080/v1beta --rpm 0
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+from typing import Dict, Any, List
+
+from agents.left_agent import LeftAgent
+from agents.right_agent import RightAgent
+from agents.manager_agent import ManagerAgent
+from agents.memory import configure_memory, get_memory_registry, parse_memory_roles
+from logic.dialogue_orchestrator import DialogueOrchestrator
+from utils.conversation_logger import ConversationLogger
+from utils.gemini_client import create_gemini_client
+from utils.api_key_pool import configure_key_pool
+from utils.context_cache import configure_context_cache
+import config
+
+
+async def run_one(args, max_turns: int) -> Dict[str, Any]:
+    """Sinh một hội thoại, trả về số lượt, tokens và thời gian"""
+    client = create_gemini_client(api_key=args.api_key, model=args.model, base_url=args.base_url)
+    left_agent = LeftAgent(model=args.model, fraud_type=args.fraud_type, client=client)
+    right_agent = RightAgent(
+        model=args.model,
+        user_profile={"age": 60, "awareness": "trung bình", "occupation": "người nghỉ hưu"},
+        client=client
+    )
+    manager_agent = ManagerAgent(model=args.model, strictness="medium", client=client)
+    orchestrator = DialogueOrchestrator(
+        left_agent=left_agent,
+        right_agent=right_agent,
+        manager_agent=manager_agent,
+        max_turns=max_turns,
+        logger=ConversationLogger(console_output=False)
+    )
+    started = time.perf_counter()
+    result = await orchestrator.run_dialogue_async()
+    return {
+        "turns": result["turns"],
+        "seconds": time.perf_counter() - started,
+        **client.usage_totals,
+    }
+
+
+async def run_cell(args, max_turns: int, window: int) -> Dict[str, Any]:
+    """Chạy --dialogues hội thoại với một cấu hình bộ nhớ, trả về giá trị trung bình mỗi hội thoại"""
+    configure_memory(window, args.summary_every, args.memory_roles)
+    runs = [await run_one(args, max_turns) for _ in range(args.dialogues)]
+    summaries = get_memory_registry().stats()["summaries"]
+    return {
+        "max_turns": max_turns,
+        "memory_window": window,
+        "turns": statistics.mean(r["turns"] for r in runs),
+        "requests": statistics.mean(r["requests"] for r in runs),
+        "prompt_tokens": statistics.mean(r["prompt_tokens"] for r in runs),
+        "output_tokens": statistics.mean(r["output_tokens"] for r in runs),
+        "seconds": statistics.mean(r["seconds"] for r in runs),
+        "summaries": summaries / len(runs),
+    }
+
+
+def format_table(rows: List[Dict[str, Any]]) -> str:
+    """Bảng markdown: mỗi số lượt một cặp dòng (toàn bộ lịch sử / bộ nhớ giới hạn)"""
+    lines = [
+        "| Lượt tối đa | Bộ nhớ | Lượt thực tế | Request | Input tokens | Output tokens | Thời gian (s) |",
+        "|---|---|---|---|---|---|---|",
+    ]
+    baseline: Dict[int, Dict[str, Any]] = {}
+    for row in rows:
+        if row["memory_window"] == 0:
+            baseline[row["max_turns"]] = row
+            memory = "toàn bộ lịch sử"
+            saving = ""
+        else:
+            memory = f"{row['memory_window']} lượt + tóm tắt"
+            base = baseline.get(row["max_turns"])
+            saving = f" ({row['prompt_tokens'] / base['prompt_tokens'] - 1:+.0%})" if base and base["prompt_tokens"] else ""
+        lines.append(
+            f"| {row['max_turns']} | {memory} | {row['turns']:.1f} | {row['requests']:.1f} | "
+            f"{row['prompt_tokens']:.0f}{saving} | {row['output_tokens']:.0f} | {row['seconds']:.2f} |"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tokens và thời gian mỗi hội thoại khi bật/tắt bộ nhớ có giới hạn")
+    parser.add_argument("--api_key", required=True, help="Gemini API key")
+    parser.add_argument("--model", default=config.DEFAULT_MODEL, help="Tên model Gemini")
+    parser.add_argument("--base_url", default=config.GEMINI_BASE_URL, help="Endpoint API tương thích Gemini (vd. mock server)")
+    parser.add_argument("--turns", type=int, nargs="+", default=[10, 20, 30], help="Các mức số lượt tối đa cần đo")
+    parser.add_argument("--dialogues", type=int, default=3, help="Số hội thoại cho mỗi cấu hình")
+    parser.add_argument("--fraud_type", default="Ngân hàng", help="Loại lừa đảo dùng cho mọi hội thoại")
+    parser.add_argument("--memory_window", type=int, default=8, help="Số lượt gần nhất gửi nguyên văn khi bật bộ nhớ (MEMORY_WINDOW_TURNS mặc định tắt)")
+    parser.add_argument("--summary_every", type=int, default=config.MEMORY_SUMMARY_EVERY, help="Cập nhật tóm tắt mỗi khi có thêm từng ấy lượt rơi ra khỏi cửa sổ")
+    parser.add_argument("--memory_roles", default=",".join(config.MEMORY_ROLES), help="Các vai trò dùng bộ nhớ có giới hạn")
+    parser.add_argument("--rpm", type=int, default=config.RATE_LIMIT_RPM, help="Giới hạn request mỗi phút (0 = không giới hạn)")
+    parser.add_argument("--tpm", type=int, default=config.RATE_LIMIT_TPM, help="Giới hạn input tokens mỗi phút (0 = không giới hạn)")
+    parser.add_argument("--output", default=None, help="Ghi kết quả dạng JSON ra file này")
+    args = parser.parse_args()
+    try:
+        args.memory_roles = parse_memory_roles(args.memory_roles)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.memory_window <= 0:
+        parser.error("--memory_window phải lớn hơn 0")
+
+    logging.basicConfig(level=logging.WARNING)
+    config.GEMINI_BASE_URL = args.base_url
+    configure_key_pool([args.api_key], args.rpm, args.tpm)
+    # Context cache làm lệch thời gian xử lý prompt giữa hai cấu hình, benchmark chỉ đo riêng bộ nhớ
+    configure_context_cache(False)
+
+    rows = []
+    for max_turns in args.turns:
+        for window in (0, args.memory_window):
+            row = asyncio.run(run_cell(args, max_turns, window))
+            rows.append(row)
+            print(f"max_turns={max_turns} memory_window={window}: {row['prompt_tokens']:.0f} input tokens, "
+                  f"{row['seconds']:.2f}s mỗi hội thoại", flush=True)
+
+    print()
+    print(format_table(rows))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Benchmark chế độ kịch bản (logic/script_generator.py) so với chế độ agent: số hội thoại mỗi giờ, request,
+tokens và chi phí mỗi hội thoại khi sinh cùng các hội thoại (loại lừa đảo, mức nhận thức, số lượt tối đa)
+
+Chạy với mock server (không tốn quota); --decode_ms_per_1k để response dài như cả kịch bản tốn thời gian tương ứng:
+    python -m utils.mock_gemini_server --port 8080 --latency_ms 400 --decode_ms_per_1k 2000 --terminate_rate 0.15 --endcall_rate 0.02
+    python benchmark_script_mode.py --api_key mock --base_url http://127.0.0.1:8080/v1beta --rpm 0 --tpm 0
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, Any, List
+
+from agents.left_agent import LeftAgent
+from agents.right_agent import RightAgent
+from agents.manager_agent import ManagerAgent
+from logic.dialogue_orchestrator import DialogueOrchestrator
+from logic.script_generator import ScriptGenerator, configure_script_mode
+from utils.conversation_logger import ConversationLogger
+from utils.gemini_client import create_gemini_client
+from utils.api_key_pool import configure_key_pool
+from utils.context_cache import configure_context_cache
+import config
+
+
+async def run_one(args, mode: str, fraud_type: str, awareness: str) -> Dict[str, Any]:
+    """Sinh một hội thoại ở chế độ `mode`, trả về số câu thoại, request và tokens (hội thoại lỗi có ok=False)"""
+    client = create_gemini_client(api_key=args.api_key, model=args.model, base_url=args.base_url)
+    left_agent = LeftAgent(model=args.model, fraud_type=fraud_type, client=client)
+    right_agent = RightAgent(
+        model=args.model,
+        user_profile={"age": 45, "awareness": awareness, "occupation": "nhân viên văn phòng"},
+        client=client
+    )
+    try:
+        if mode == "script":
+            result = await ScriptGenerator(left_agent, right_agent, max_turns=args.max_turns).generate_async()
+        else:
+            orchestrator = DialogueOrchestrator(
+                left_agent=left_agent,
+                right_agent=right_agent,
+                manager_agent=ManagerAgent(model=args.model, strictness="medium", client=client),
+                max_turns=args.max_turns,
+                logger=ConversationLogger(console_output=False)
+            )
+            result = await orchestrator.run_dialogue_async()
+        messages, ok = len(result["dialogue_history"]), True
+    except Exception as e:
+        logging.warning(f"Hội thoại {mode}/{fraud_type} lỗi: {e}")
+        messages, ok = 0, False
+    return {"ok": ok, "messages": messages, **client.usage_totals}
+
+
+async def run_mode(args, mode: str) -> Dict[str, Any]:
+    """Sinh --dialogues hội thoại (xoay vòng loại lừa đảo và mức nhận thức), tối đa --concurrency hội thoại cùng lúc"""
+    configure_script_mode(mode)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    awareness_levels = list(config.AWARENESS_LEVELS)
+
+    async def run_limited(i: int) -> Dict[str, Any]:
+        async with semaphore:
+            return await run_one(args, mode, args.fraud_types[i % len(args.fraud_types)],
+                                 awareness_levels[i % len(awareness_levels)])
+
+    started = time.perf_counter()
+    runs = await asyncio.gather(*(run_limited(i) for i in range(args.dialogues)))
+    elapsed = time.perf_counter() - started
+    done = [r for r in runs if r["ok"]]
+    count = max(1, len(done))
+    requests = sum(r["requests"] for r in runs)
+    prompt_tokens = sum(r["prompt_tokens"] for r in runs)
+    output_tokens = sum(r["output_tokens"] for r in runs)
+    return {
+        "mode": mode,
+        "dialogues": len(done),
+        "failed": len(runs) - len(done),
+        "seconds": elapsed,
+        "dialogues_per_hour": len(done) / elapsed * 3600 if elapsed > 0 else 0.0,
+        "messages_per_dialogue": sum(r["messages"] for r in done) / count,
+        # Request và tokens của hội thoại lỗi vẫn tính vào chi phí của các hội thoại sinh được
+        "requests_per_dialogue": requests / count,
+        "prompt_tokens_per_dialogue": prompt_tokens / count,
+        "output_tokens_per_dialogue": output_tokens / count,
+        "cost_per_1k_dialogues": (prompt_tokens * args.price_input + output_tokens * args.price_output) / 1e6 / count * 1000,
+    }
+
+
+def quota_ceiling(args, row: Dict[str, Any]) -> float:
+    """Số hội thoại mỗi giờ tối đa của một API key theo quota RPM/TPM (không tính độ trễ)"""
+    by_rpm = args.quota_rpm * 60 / row["requests_per_dialogue"] if row["requests_per_dialogue"] else 0.0
+    by_tpm = args.quota_tpm * 60 / row["prompt_tokens_per_dialogue"] if row["prompt_tokens_per_dialogue"] else 0.0
+    return min(by_rpm, by_tpm)
+
+
+def format_table(args, rows: List[Dict[str, Any]]) -> str:
+    """Bảng markdown: mỗi chế độ một dòng, cột cuối so với chế độ agent"""
+    lines = [
+        "| Chế độ | Hội thoại/giờ | Trần quota/giờ | Câu thoại/hội thoại | Request/hội thoại | "
+        "Input tokens/hội thoại | Output tokens/hội thoại | USD/1000 hội thoại |",
+        "|---|---|---|---|---|---|---|---|",
+    ]
+    base = next(row for row in rows if row["mode"] == "agents")
+    for row in rows:
+        change = "" if row is base else f" ({row['cost_per_1k_dialogues'] / base['cost_per_1k_dialogues'] - 1:+.0%})"
+        speedup = "" if row is base else f" (×{row['dialogues_per_hour'] / base['dialogues_per_hour']:.1f})"
+        lines.append(
+            f"| {row['mode']} | {row['dialogues_per_hour']:.0f}{speedup} | {quota_ceiling(args, row):.0f} | "
+            f"{row['messages_per_dialogue']:.1f} | {row['requests_per_dialogue']:.1f} | "
+            f"{row['prompt_tokens_per_dialogue']:.0f} | {row['output_tokens_per_dialogue']:.0f} | "
+            f"{row['cost_per_1k_dialogues']:.2f}{change} |"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hội thoại/giờ và chi phí tokens của chế độ kịch bản so với chế độ agent")
+    parser.add_argument("--api_key", required=True, help="Gemini API key")
+    parser.add_argument("--model", default=config.DEFAULT_MODEL, help="Tên model Gemini")
+    parser.add_argument("--base_url", default=config.GEMINI_BASE_URL, help="Endpoint API tương thích Gemini (vd. mock server)")
+    parser.add_argument("--fraud_types", nargs="+", default=list(config.FRAUD_TYPES), help="Các loại lừa đảo, dùng xoay vòng")
+    parser.add_argument("--dialogues", type=int, default=30, help="Số hội thoại cho mỗi chế độ")
+    parser.add_argument("--concurrency", type=int, default=10, help="Số hội thoại chạy đồng thời")
+    parser.add_argument("--max_turns", type=int, default=15, help="Số lượt tối đa mỗi hội thoại")
+    parser.add_argument("--price_input", type=float, default=0.10, help="Giá input (USD mỗi 1 triệu tokens)")
+    parser.add_argument("--price_output", type=float, default=0.40, help="Giá output (USD mỗi 1 triệu tokens)")
+    parser.add_argument("--quota_rpm", type=int, default=2000, help="Quota request mỗi phút của một key, để tính trần hội thoại/giờ")
+    parser.add_argument("--quota_tpm", type=int, default=4_000_000, help="Quota input tokens mỗi phút của một key, để tính trần hội thoại/giờ")
+    parser.add_argument("--rpm", type=int, default=config.RATE_LIMIT_RPM, help="Giới hạn request mỗi phút (0 = không giới hạn)")
+    parser.add_argument("--tpm", type=int, default=config.RATE_LIMIT_TPM, help="Giới hạn input tokens mỗi phút (0 = không giới hạn)")
+    parser.add_argument("--output", default=None, help="Ghi kết quả dạng JSON ra file này")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    config.GEMINI_BASE_URL = args.base_url
+    configure_key_pool([args.api_key], args.rpm, args.tpm)
+    # Kịch bản chỉ gửi system prompt một lần nên context cache chỉ có lợi cho chế độ agent; tắt để so sánh tokens thô
+    configure_context_cache(False)
+
+    rows = []
+    # Chế độ theo đợt chờ batch job nên không so được hội thoại/giờ với hai chế độ này
+    for mode in ("agents", "script"):
+        row = asyncio.run(run_mode(args, mode))
+        rows.append(row)
+        print(f"{mode}: {row['dialogues']} hội thoại ({row['failed']} lỗi) trong {row['seconds']:.1f}s, "
+              f"{row['requests_per_dialogue']:.1f} request mỗi hội thoại", flush=True)
+
+    print()
+    print(format_table(args, rows))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmark sinh trước lượt của bên gọi (logic/speculation.py): thời gian và input tokens mỗi lượt theo từng loại lừa đảo,
+chạy tuần tự so với sinh trước song song với manager, kèm tỉ lệ lượt sinh trước bị bỏ
+
+Chạy với mock server (không tốn quota); --terminate_rate quyết định tỉ lệ manager kết thúc hội thoại ở mỗi lần đánh giá:
+    python -m utils.mock_gemini_server --port 8080 --latency_ms 300 --terminate_rate 0.15 --endcall_rate 0.02
+    python benchmark_speculation.py --api_key mock --base_url http://127.0.0.1:8080/v1beta --rpm 0
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, Any, List
+
+from agents.left_agent import LeftAgent
+from agents.right_agent import RightAgent
+from agents.manager_agent import ManagerAgent
+from logic.dialogue_orchestrator import DialogueOrchestrator
+from logic.speculation import configure_speculation, get_speculation_registry
+from utils.conversation_logger import ConversationLogger
+from utils.gemini_client import create_gemini_client
+from utils.api_key_pool import configure_key_pool
+from utils.context_cache import configure_context_cache
+import config
+
+
+async def run_one(args, fraud_type: str, speculative: bool) -> Dict[str, Any]:
+    """Sinh một hội thoại, trả về số lượt, tokens và thời gian"""
+    client = create_gemini_client(api_key=args.api_key, model=args.model, base_url=args.base_url)
+    left_agent = LeftAgent(model=args.model, fraud_type=fraud_type, client=client)
+    right_agent = RightAgent(
+        model=args.model,
+        user_profile={"age": 60, "awareness": "trung bình", "occupation": "người nghỉ hưu"},
+        client=client
+    )
+    manager_agent = ManagerAgent(model=args.model, strictness="medium", client=client)
+    orchestrator = DialogueOrchestrator(
+        left_agent=left_agent,
+        right_agent=right_agent,
+        manager_agent=manager_agent,
+        max_turns=args.max_turns,
+        logger=ConversationLogger(console_output=False),
+        speculative=speculative
+    )
+    started = time.perf_counter()
+    result = await orchestrator.run_dialogue_async()
+    # Lượt kết thúc ngay ở lần đánh giá đầu vẫn tính là một lượt để chia thời gian/tokens
+    return {
+        "turns": max(1, result["turns"]),
+        "seconds": time.perf_counter() - started,
+        **client.usage_totals,
+    }
+
+
+async def run_cell(args, fraud_type: str, speculative: bool) -> Dict[str, Any]:
+    """Chạy --dialogues hội thoại của một loại lừa đảo, trả về giá trị trung bình mỗi lượt"""
+    configure_speculation(speculative)
+    runs = [await run_one(args, fraud_type, speculative) for _ in range(args.dialogues)]
+    turns = sum(r["turns"] for r in runs)
+    entry = get_speculation_registry().stats()["by_label"].get(fraud_type, {})
+    return {
+        "fraud_type": fraud_type,
+        "speculative": speculative,
+        "turns": turns / len(runs),
+        "seconds_per_turn": sum(r["seconds"] for r in runs) / turns,
+        "prompt_tokens_per_turn": sum(r["prompt_tokens"] for r in runs) / turns,
+        "requests_per_turn": sum(r["requests"] for r in runs) / turns,
+        "speculated": entry.get("speculated", 0),
+        "wasted": entry.get("wasted", 0),
+    }
+
+
+def format_table(rows: List[Dict[str, Any]]) -> str:
+    """Bảng markdown: mỗi loại lừa đảo một dòng, so sánh sinh trước với chạy tuần tự"""
+    lines = [
+        "| Loại lừa đảo | Lượt TB | Thời gian/lượt (s) | Input tokens/lượt | Request/lượt | Lượt sinh trước bị bỏ |",
+        "|---|---|---|---|---|---|",
+    ]
+    baseline = {row["fraud_type"]: row for row in rows if not row["speculative"]}
+    for row in rows:
+        if not row["speculative"]:
+            continue
+        base = baseline[row["fraud_type"]]
+        wasted_rate = row["wasted"] / row["speculated"] if row["speculated"] else 0.0
+        lines.append(
+            f"| {row['fraud_type']} | {base['turns']:.1f} → {row['turns']:.1f} | "
+            f"{base['seconds_per_turn']:.2f} → {row['seconds_per_turn']:.2f} "
+            f"({row['seconds_per_turn'] / base['seconds_per_turn'] - 1:+.0%}) | "
+            f"{base['prompt_tokens_per_turn']:.0f} → {row['prompt_tokens_per_turn']:.0f} "
+            f"({row['prompt_tokens_per_turn'] / base['prompt_tokens_per_turn'] - 1:+.0%}) | "
+            f"{base['requests_per_turn']:.2f} → {row['requests_per_turn']:.2f} | "
+            f"{row['wasted']}/{row['speculated']} ({wasted_rate:.0%}) |"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark thời gian/tokens mỗi lượt khi bật/tắt sinh trước lượt của bên gọi")
+    parser.add_argument("--api_key", required=True, help="Gemini API key")
+    parser.add_argument("--model", default=config.DEFAULT_MODEL, help="Tên model Gemini")
+    parser.add_argument("--base_url", default=config.GEMINI_BASE_URL, help="Endpoint API tương thích Gemini (vd. mock server)")
+    parser.add_argument("--fraud_types", nargs="+", default=list(config.FRAUD_TYPES), help="Các loại lừa đảo cần đo")
+    parser.add_argument("--dialogues", type=int, default=3, help="Số hội thoại cho mỗi loại lừa đảo và mỗi cấu hình")
+    parser.add_argument("--max_turns", type=int, default=15, help="Số lượt tối đa mỗi hội thoại")
+    parser.add_argument("--rpm", type=int, default=config.RATE_LIMIT_RPM, help="Giới hạn request mỗi phút (0 = không giới hạn)")
+    parser.add_argument("--tpm", type=int, default=config.RATE_LIMIT_TPM, help="Giới hạn input tokens mỗi phút (0 = không giới hạn)")
+    parser.add_argument("--output", default=None, help="Ghi kết quả dạng JSON ra file này")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    config.GEMINI_BASE_URL = args.base_url
+    configure_key_pool([args.api_key], args.rpm, args.tpm)
+    # Context cache làm lệch thời gian xử lý prompt giữa hai cấu hình, benchmark chỉ đo riêng sinh trước
+    configure_context_cache(False)
+
+    rows = []
+    for fraud_type in args.fraud_types:
+        for speculative in (False, True):
+            row = asyncio.run(run_cell(args, fraud_type, speculative))
+            rows.append(row)
+            print(f"{fraud_type} speculative={speculative}: {row['seconds_per_turn']:.2f}s, "
+                  f"{row['prompt_tokens_per_turn']:.0f} input tokens mỗi lượt", flush=True)
+
+    print()
+    print(format_table(rows))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
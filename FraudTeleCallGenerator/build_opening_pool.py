@@ -0,0 +1,106 @@
+"""
+Sinh kho câu mở đầu cuộc gọi (utils/opening_pool.py) cho từng loại lừa đảo, mỗi request `--batch` câu
+
+Câu gần trùng với câu đã có bị bỏ; chạy lại với cùng --output sẽ bổ sung cho đủ `--per_type` câu mỗi loại:
+    python build_opening_pool.py --api_key YOUR_KEY --output opening_pool.json
+    python generate_dialogues.py --api_key YOUR_KEY --opening_pool opening_pool.json
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+from typing import List
+
+from agents.left_agent import LeftAgent
+from agents.prompts.left_prompts import OPENING_POOL_PROMPT
+from utils.gemini_client import create_gemini_client
+from utils.api_key_pool import configure_key_pool, load_api_keys
+from utils.opening_pool import OpeningPool, parse_openings
+from utils.retry_policy import NonRetryableError
+import config
+
+# responseSchema: mảng các câu mở đầu
+OPENING_POOL_SCHEMA = {"type": "ARRAY", "items": {"type": "STRING"}}
+
+
+async def fill_label_async(pool: OpeningPool, agent: LeftAgent, label: str, args, logger) -> int:
+    """Gọi API theo lô cho đến khi loại hội thoại đủ `per_type` câu hoặc hết `max_requests`; trả về số request"""
+    messages = [
+        {"role": "system", "content": agent.get_system_prompt()},
+        {"role": "user", "content": OPENING_POOL_PROMPT.format(count=args.batch)},
+    ]
+    requests = 0
+    while pool.count(label) < args.per_type and requests < args.max_requests:
+        requests += 1
+        try:
+            reply = await agent.client.chat_completion_async(
+                messages=messages,
+                response_schema=OPENING_POOL_SCHEMA,
+                **config.GENERATION_CONFIG["opening"]
+            )
+        except NonRetryableError:
+            raise
+        except Exception as e:
+            logger.warning(f"Không sinh được câu mở đầu cho {label}: {e}")
+            continue
+        pool.add(label, parse_openings(reply))
+    if pool.count(label) < args.per_type:
+        logger.warning(f"{label}: chỉ có {pool.count(label)}/{args.per_type} câu sau {requests} request")
+    return requests
+
+
+async def build_async(pool: OpeningPool, labels: List[str], args, api_keys: List[str], logger) -> int:
+    agents = []
+    for i, label in enumerate(labels):
+        client = create_gemini_client(api_key=api_keys[i % len(api_keys)], model=args.model, base_url=args.base_url)
+        agents.append(LeftAgent(model=args.model, fraud_type=label, client=client))
+    requests = await asyncio.gather(*(
+        fill_label_async(pool, agent, label, args, logger) for agent, label in zip(agents, labels)
+    ))
+    return sum(requests)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sinh kho câu mở đầu cuộc gọi cho từng loại lừa đảo")
+    parser.add_argument("--api_key", action="append", help="Gemini API key (lặp lại để dùng nhiều key)")
+    parser.add_argument("--api_key_file", default=None, help="File chứa danh sách API key, mỗi dòng một key")
+    parser.add_argument("--model", default=config.DEFAULT_MODEL, help="Tên model Gemini")
+    parser.add_argument("--base_url", default=config.GEMINI_BASE_URL, help="Endpoint API tương thích Gemini (vd. mock server)")
+    parser.add_argument("--output", default=config.OPENING_POOL_PATH, help="File JSON kho câu mở đầu (đã có thì bổ sung thêm)")
+    parser.add_argument("--types", nargs="+", default=list(config.FRAUD_TYPES), help="Các loại lừa đảo cần sinh")
+    parser.add_argument("--per_type", type=int, default=config.OPENING_POOL_SIZE, help="Số câu mở đầu cần có cho mỗi loại")
+    parser.add_argument("--batch", type=int, default=config.OPENING_POOL_BATCH, help="Số câu yêu cầu trong một request")
+    parser.add_argument("--similarity", type=float, default=config.OPENING_POOL_SIMILARITY, help="Ngưỡng độ giống để bỏ câu gần trùng (0-1)")
+    parser.add_argument("--max_requests", type=int, default=10, help="Số request tối đa cho mỗi loại")
+    parser.add_argument("--rpm", type=int, default=config.RATE_LIMIT_RPM, help="Giới hạn request mỗi phút (0 = không giới hạn)")
+    parser.add_argument("--tpm", type=int, default=config.RATE_LIMIT_TPM, help="Giới hạn input tokens mỗi phút (0 = không giới hạn)")
+    args = parser.parse_args()
+
+    api_keys = load_api_keys(args.api_key, args.api_key_file)
+    if not api_keys:
+        parser.error("Cần --api_key hoặc --api_key_file")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    logger = logging.getLogger(__name__)
+    config.GEMINI_BASE_URL = args.base_url
+    configure_key_pool(api_keys, args.rpm, args.tpm)
+
+    pool = OpeningPool(similarity=args.similarity)
+    if os.path.exists(args.output):
+        pool.load(args.output)
+        logger.info(f"Bổ sung kho có sẵn {args.output}: {pool.stats()['lines']} câu")
+
+    started = time.perf_counter()
+    requests = asyncio.run(build_async(pool, args.types, args, api_keys, logger))
+    pool.save(args.output)
+    stats = pool.stats()
+    logger.info(
+        f"Đã ghi {stats['lines']} câu mở đầu cho {stats['labels']} loại vào {args.output} "
+        f"({requests} request, {stats['rejected']} câu trùng/không hợp lệ bị bỏ, {time.perf_counter() - started:.1f}s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
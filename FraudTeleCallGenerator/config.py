@@ -3,12 +3,129 @@ GEMINI_API_KEY = ""  # API key sẽ được truyền từ command line
 
 # Model configuration - Gemini models
 DEFAULT_MODEL = "gemini-2.0-flash"  # Model Gemini mặc định
-FALLBACK_MODEL = "gemini-2.0-flash"  # Backup model
+FALLBACK_MODEL = ""  # Model dự phòng khi model chính liên tục bị 429/lỗi server ("" = không chuyển, bật bằng --fallback_model)
+# Model theo vai trò (utils/model_router.py): vai trò không có trong đây dùng --model; "conclusion" là câu kết thúc cuộc gọi
+ROLE_MODELS = {}                    # vd. {"right": "gemini-2.0-flash-lite", "manager": "gemini-2.0-flash-lite"}
+MODEL_FALLBACK_AFTER = 3            # Số lần 429/lỗi server/timeout liên tiếp của một model trước khi chuyển sang model dự phòng
+MODEL_FALLBACK_COOLDOWN = 60        # Số giây model chính nghỉ trước khi được thử lại
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta"  # Ghi đè bằng --base_url (vd. mock server)
+
+# Rate limit dùng chung cho toàn process (token bucket)
+RATE_LIMIT_RPM = 120        # Số request tối đa mỗi phút
+RATE_LIMIT_TPM = 1000000    # Số input tokens tối đa mỗi phút
+RATE_LIMIT_BURST = 5        # Số request được gửi dồn khi bucket đầy
+
+# Ngân sách retry dùng chung cho client, agent và batch
+RETRY_ATTEMPTS_PER_REQUEST = 5  # Số lần gửi tối đa cho một request Gemini
+RETRY_BUDGET_PER_DIALOGUE = 20  # Tổng số lần retry của một hội thoại, hết thì bỏ hội thoại
+RETRY_BUDGET_PER_RUN = 0        # Tổng số lần retry của cả lượt chạy (0 = không giới hạn)
+
+# Circuit breaker: tạm dừng mọi worker khi Gemini API liên tục lỗi 5xx/timeout
+CIRCUIT_BREAKER_THRESHOLD = 10  # Số lỗi upstream liên tiếp trước khi ngắt (0 = tắt)
+CIRCUIT_BREAKER_COOLDOWN = 30   # Số giây tạm dừng lần đầu, gấp đôi mỗi khi request thăm dò thất bại
+
+# Context cache: system prompt dài được lưu thành cachedContents phía server, các lượt sau chỉ gửi tên cache
+CONTEXT_CACHE_ENABLED = True
+CONTEXT_CACHE_TTL = 600          # Thời gian sống (giây) của mỗi cache, được gia hạn khi còn dùng
+CONTEXT_CACHE_MIN_TOKENS = 1024  # Không cache system prompt ngắn hơn mức này (Gemini có ngưỡng tối thiểu)
+CONTEXT_CACHE_MIN_USES = 2       # Chỉ tạo cache khi system prompt được dùng lại
 
 # Conversation configuration
 MAX_DIALOGUE_TURNS = 20
 MAX_TOKENS_PER_MESSAGE = 500
 
+# Tham số sinh (generationConfig) mặc định theo vai trò, có thể ghi đè ở từng lời gọi
+GENERATION_CONFIG = {
+    "left": {"temperature": 0.8, "max_tokens": MAX_TOKENS_PER_MESSAGE},     # Lượt thoại của bên gọi
+    "right": {"temperature": 0.8, "max_tokens": MAX_TOKENS_PER_MESSAGE},    # Lượt thoại của người dùng
+    "manager": {"temperature": 0.3, "max_tokens": 500},                     # Phán quyết JSON ngắn, cần ổn định
+    "conclusion": {"temperature": 0.7, "max_tokens": 200},                  # Câu chào kết thúc một dòng
+    "summary": {"temperature": 0.2, "max_tokens": 300},                     # Tóm tắt cuốn chiếu các lượt cũ
+    "annotation": {"temperature": 0.3, "max_tokens": 2048},                 # Lý do ngắt máy của cả một lô hội thoại
+    "opening": {"temperature": 1.0, "max_tokens": 2048},                    # Cả lô câu mở đầu cho kho câu mở đầu
+    "script": {"temperature": 0.9, "max_tokens": 8192},                     # Trọn một hội thoại JSON ở chế độ kịch bản
+}
+
+# Bộ nhớ hội thoại: chỉ gửi nguyên văn N lượt gần nhất, các lượt cũ hơn được gộp vào một bản tóm tắt
+MEMORY_WINDOW_TURNS = 0                        # Số lượt gần nhất giữ nguyên văn (0 = tắt, luôn gửi toàn bộ lịch sử; bật bằng --memory_window)
+MEMORY_SUMMARY_EVERY = 4                       # Cập nhật tóm tắt mỗi khi có thêm từng ấy lượt rơi ra khỏi cửa sổ
+MEMORY_ROLES = ["left", "right", "manager"]    # Các vai trò dùng bộ nhớ có giới hạn
+
+# Manager trả phán quyết qua responseSchema (JSON có cấu trúc) thay vì JSON trong văn xuôi
+MANAGER_STRUCTURED_OUTPUT = True
+
+# Manager chỉ nhận phán quyết, ghi chú lần trước và các câu thoại mới thay vì đọc lại cả hội thoại mỗi lần đánh giá
+MANAGER_INCREMENTAL_EVAL = True
+
+# Sinh trước lượt tiếp theo của bên gọi song song với lần đánh giá của manager (logic/speculation.py):
+# bớt một lượt chờ API mỗi lần đánh giá, đổi lại tốn thêm một request mỗi khi manager kết thúc hội thoại
+SPECULATIVE_LEFT_TURN = False
+
+# Lý do ngắt máy (##ENDCALL_SIGNAL##): mặc định manager đánh giá ngay, thêm một request chặn mỗi lần ngắt máy.
+# Khi hoãn, kết quả ghi lý do tạm kèm cờ end_call_reason_pending, annotate_end_calls.py điền lý do sau theo lô
+DEFER_END_CALL_REASONS = False
+END_CALL_PACK_SIZE = 8              # Số hội thoại gộp vào một request điền lý do
+END_CALL_CONTEXT_MESSAGES = 12      # Chỉ gửi từng ấy câu thoại cuối của mỗi hội thoại
+
+# Kho câu mở đầu (utils/opening_pool.py), sinh theo lô bằng build_opening_pool.py rồi dùng với --opening_pool
+OPENING_POOL_PATH = "opening_pool.json"
+OPENING_POOL_SIZE = 30              # Số câu mở đầu cần có cho mỗi loại hội thoại
+OPENING_POOL_BATCH = 10             # Số câu xin trong một request
+OPENING_POOL_SIMILARITY = 0.5       # Bỏ câu có Jaccard shingle 3 từ với một câu đã có từ ngưỡng này
+
+# Rẽ nhánh hội thoại (logic/branching.py): tại mỗi lượt trong BRANCH_TURNS, một request candidateCount sinh
+# BRANCH_FACTOR phản hồi của người dùng, mỗi phản hồi đi tiếp thành một hội thoại (phần đầu chung chỉ sinh một lần)
+BRANCH_TURNS = []                   # Rỗng = tắt; vd. [2, 5] cho tối đa BRANCH_FACTOR ** 2 hội thoại mỗi hội thoại gốc
+BRANCH_FACTOR = 3                   # Số phản hồi (nhánh) mỗi lần rẽ, gồm cả nhánh đang chạy
+
+# Chế độ sinh (logic/script_generator.py): "agents" sinh từng lượt qua DialogueOrchestrator,
+# "script" sinh trọn hội thoại (kèm bên kết thúc và lý do) bằng một request có cấu trúc,
+# "wave" cho mọi hội thoại cùng tiến một câu mỗi đợt qua batch job (logic/wave_runner.py)
+GENERATION_MODE = "agents"
+SCRIPT_ATTEMPTS = 3                 # Số lần gửi tối đa khi request lỗi hoặc kịch bản không hợp lệ
+WAVE_STATE_DIR = "wave_state"       # Thư mục lưu trạng thái và file request/kết quả của từng đợt (để tiếp tục khi bị dừng)
+WAVE_POLL_INTERVAL = 30             # Số giây giữa các lần hỏi trạng thái batch job
+WAVE_MAX_ATTEMPTS = 3               # Số lần gửi tối đa một batch job lỗi, và số đợt lỗi liên tiếp trước khi bỏ một hội thoại
+
+# Gộp lượt giữa các hội thoại (agents/turn_batcher.py, cần --async_mode): lượt đang chờ của các vai trong
+# TURN_BATCH_ROLES từ nhiều hội thoại được gói vào một request, khi bị giới hạn RPM trước TPM
+TURN_BATCH_ROLES = []               # Rỗng = tắt; vd. ["right"] hoặc ["left", "right"]
+TURN_BATCH_SIZE = 8                 # Số lượt tối đa mỗi request
+TURN_BATCH_WAIT_MS = 200            # Thời gian chờ gom lô tối đa trước khi gửi lô chưa đầy
+
+# Lịch gọi manager đánh giá (logic/evaluation_schedule.py): fixed = mỗi N lượt, backoff = giãn dần sau mỗi lần
+# "tiếp tục", hazard = chỉ gọi khi các dấu hiệu rẻ (chào/gác máy, từ chối, trả lời ngắn dần, gần max_turns) đủ mạnh
+MANAGER_SCHEDULE = "fixed"
+MANAGER_EVAL_EVERY = 2                 # fixed: đánh giá mỗi 2 lượt
+MANAGER_EVAL_MIN_MESSAGES = 6          # Chỉ đánh giá khi có ít nhất 3 lượt hội thoại (6 câu thoại)
+MANAGER_EVAL_MAX_GAP = 4               # backoff/hazard: không để quá 4 lượt liên tiếp không đánh giá
+MANAGER_HAZARD_THRESHOLD = 1.0         # hazard: điểm rủi ro tối thiểu để gọi manager
+MANAGER_HAZARD_END_HINTS = [
+    "tạm biệt", "cúp máy", "gác máy", "không nói chuyện nữa", "gọi lại sau", "báo công an", "chào anh", "chào chị",
+]
+MANAGER_HAZARD_REFUSALS = [
+    "không tin", "lừa đảo", "không cung cấp", "không chuyển", "không đồng ý", "từ chối", "không cần", "thôi",
+]
+
+# Phát hiện kết thúc cục bộ (logic/termination_detector.py), không tốn request:
+# off = tắt, flag = buộc manager đánh giá ngay lượt đó, end = kết thúc hội thoại luôn
+LOCAL_DETECTOR_MODE = "off"
+LOCAL_DETECTOR_MIN_MESSAGES = 6          # Chỉ xét khi có ít nhất 3 lượt hội thoại
+LOCAL_DETECTOR_SIMILARITY = 0.6          # Jaccard shingle 3 từ để coi hai câu là lặp lại
+LOCAL_DETECTOR_STALL_TURNS = 4           # Bế tắc khi lặp lại 4 lượt liên tiếp (khớp tiêu chí của manager)
+LOCAL_DETECTOR_REFUSAL_LIMIT = 3         # Người dùng từ chối dứt khoát từ 3 lần
+# Mẫu (regex trên câu đã chuẩn hoá chữ thường) cho thấy lừa đảo đã thành công: mô tả -> mẫu
+LOCAL_DETECTOR_DISCLOSURES = {
+    "đọc mã OTP": r"(otp|mã xác (nhận|thực))\D{0,25}\d{4,8}",
+    "cung cấp số tài khoản/số thẻ": r"(số tài khoản|stk|số thẻ)\D{0,25}\d{6,19}",
+    "đọc một dãy số (OTP/số tài khoản)": r"\b(không|một|hai|ba|bốn|năm|sáu|bảy|tám|chín)(\s*,?\s*(không|một|hai|ba|bốn|năm|sáu|bảy|tám|chín)\b){5,}",
+    "cung cấp mật khẩu": r"mật khẩu (của (tôi|em|cháu) )?(là|:)\s*\S+",
+    "đồng ý chuyển tiền": r"((tôi|em|cháu|cô|chú|bác) (sẽ |đang )?chuyển( khoản| tiền)? (ngay|luôn|liền|bây giờ))|((đã|vừa) chuyển (khoản|tiền|xong))",
+}
+LOCAL_DETECTOR_REFUSALS = [
+    r"không tin", r"(là|đây là|bọn|đồ) lừa đảo", r"báo (công an|cảnh sát)", r"không (cung cấp|đưa|chuyển|đọc)",
+]
+
 # Loại lừa đảo - cập nhật các kịch bản thực tế ở Việt Nam
 FRAUD_TYPES = [
     "Đầu tư",                          # Lừa đảo đầu tư tài chính, crypto, forex
@@ -2,6 +2,7 @@ import os
 import json
 import random
 import argparse
+import asyncio
 import time
 import logging
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -11,12 +12,33 @@ from typing import Dict, List, Any
 from agents.left_agent import LeftAgent
 from agents.right_agent import RightAgent
 from agents.manager_agent import ManagerAgent
+from agents.prompts import precompile_system_prompts
+from agents.memory import configure_memory, get_memory_registry, format_memory_stats, parse_memory_roles
+from agents.turn_batcher import configure_turn_batching, get_turn_batch_registry, format_turn_batch_stats, parse_turn_batch_roles
 from logic.dialogue_orchestrator import DialogueOrchestrator
+from logic.evaluation_schedule import configure_evaluation_schedule, get_evaluation_registry, format_evaluation_stats, SCHEDULES
+from logic.termination_detector import configure_termination_detector, get_detector_registry, format_detector_stats, DETECTOR_MODES
+from logic.speculation import configure_speculation, get_speculation_registry, format_speculation_stats
+from logic.branching import configure_branching, get_branching_registry, format_branching_stats, parse_branch_turns, branch_suffix
+from logic.end_call_annotation import PENDING_FIELD
+from logic.script_generator import ScriptGenerator, configure_script_mode, get_script_registry, format_script_stats, GENERATION_MODES
+from logic.wave_runner import WaveRunner, WaveDialogue, FAILED, configure_wave_mode, get_wave_registry, format_wave_stats
 from utils.conversation_logger import ConversationLogger
+from utils.gemini_client import create_gemini_client, release_context_caches
+from utils.http_pool import configure_session_pool, get_session_pool, format_pool_stats, close_async_sessions
+from utils.api_key_pool import configure_key_pool, get_key_pool, format_key_pool_stats, load_api_keys
+from utils.concurrency_controller import configure_concurrency_controller, get_concurrency_controller, format_concurrency_stats
+from utils.retry_policy import NonRetryableError, RetryBudgetExhausted, configure_retry_policy, get_retry_policy, format_retry_stats
+from utils.circuit_breaker import configure_circuit_breaker, get_circuit_breaker, format_breaker_stats
+from utils.cassette import configure_cassette, get_cassette, format_cassette_stats, CASSETTE_MODES
+from utils.context_cache import configure_context_cache, get_context_cache, format_context_cache_stats
+from utils.opening_pool import configure_opening_pool, get_opening_pool, format_opening_pool_stats
+from utils.model_router import configure_model_routing, get_model_router, format_model_routing_stats, parse_role_models
+from utils.batch_job_client import BatchJobClient, batch_api_urls
 import config
 
 # Thực hiện P(o|f,a) với fraud weights và age compatibility để tránh "sinh viên 90 tuổi"
-def _choose_occupation_with_weights(fraud_type: str, age_range: tuple) -> str:
+def _choose_occupation_with_weights(fraud_type: str, age_range: tuple, rng=random) -> str:
     """Chọn nghề nghiệp theo P(o|f,a) - phụ thuộc cả fraud type và age range
     Tránh tình trạng vô lý như sinh viên 70 tuổi hay người nghỉ hưu 20 tuổi
     
@@ -45,10 +67,10 @@ def _choose_occupation_with_weights(fraud_type: str, age_range: tuple) -> str:
         if combined_weights:
             occupations = list(combined_weights.keys())
             weights = list(combined_weights.values()) 
-            return random.choices(occupations, weights=weights, k=1)[0]
+            return rng.choices(occupations, weights=weights, k=1)[0]
     
     # Fallback: chọn random từ nghề phù hợp tuổi (ít nhất cũng logical)
-    return random.choice(age_appropriate_occs)
+    return rng.choice(age_appropriate_occs)
 
 # Cấu hình ghi log toàn cục với UTF-8 cho Windows
 import sys
@@ -87,7 +109,105 @@ OCCUPATIONS = config.OCCUPATIONS
 
 AWARENESS_LEVELS = config.AWARENESS_LEVELS
 
+def _dialogue_rng(args, tts_id: str):
+    """RNG riêng của một hội thoại khi có --seed, để kết quả không phụ thuộc thứ tự chạy của các luồng"""
+    seed = getattr(args, 'seed', None)
+    return random.Random(f"{seed}:{tts_id}") if seed is not None else random
+
+def _choose_occupation(args, tts_id: str, user_age: int, fraud_type: str) -> str:
+    """Chọn nghề của người dùng theo P(o|f,a), với age_range xác định từ user_age cụ thể"""
+    user_age_range = None
+    for age_range in AGE_RANGES:
+        if age_range[0] <= user_age <= age_range[1]:
+            user_age_range = age_range
+            break
+
+    if user_age_range is None:
+        # Fallback nếu user_age nằm ngoài ranges đã định nghĩa
+        user_age_range = AGE_RANGES[0]  # Default to first range
+
+    return _choose_occupation_with_weights(fraud_type, user_age_range, _dialogue_rng(args, tts_id))
+
+def _build_entry(args, tts_id: str, dialogue_result: Dict[str, Any], profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Entry JSONL (theo chuẩn TeleAntiFraud gốc) của một hội thoại, lưu kèm hội thoại đầy đủ nếu cần"""
+    # Ghi log lịch sử hội thoại
+    logger.info(
+        f"Hội thoại {tts_id} hoàn thành, tổng {len(dialogue_result['dialogue_history'])} lượt"
+    )
+    logger.info(f"Lịch sử hội thoại {tts_id}:")
+    for msg in dialogue_result['dialogue_history']:
+        role = "Kẻ lừa đảo" if msg['role'] == "left" else "Người dùng"
+        logger.info(f"{role}: {msg['content']}")
+
+    # Trích xuất lý do kết thúc
+    termination_reason = (
+        "Đạt tối đa lượt" if dialogue_result.get("reached_max_turns", False)
+        else dialogue_result.get("termination_reason", "Không xác định")
+    )
+    # Nếu do quản lý kết thúc, rút ngắn lý do
+    if dialogue_result.get("terminated_by_manager", False) and isinstance(termination_reason, str) and len(termination_reason) > 100:
+        short_reason = termination_reason.split("。")[0] if "。" in termination_reason[:100] else termination_reason[:100]
+        termination_reason = short_reason + "..."
+
+    # Tách biệt nội dung hội thoại của hai bên
+    left_messages: List[str] = []
+    right_messages: List[str] = []
+    for message in dialogue_result["dialogue_history"]:
+        if message["role"] == "left":
+            content = message["content"].replace('\n', ' ').strip()
+            left_messages.append(content)
+        elif message["role"] == "right":
+            content = message["content"].replace('\n', ' ').strip()
+            right_messages.append(content)
+
+    # Tạo entry dữ liệu JSONL
+    entry = {
+        "tts_id": tts_id,
+        "left": left_messages,
+        "right": right_messages,
+        **profile,
+        "termination_reason": termination_reason,
+        "terminator": dialogue_result.get("terminator", "natural")
+    }
+    if dialogue_result.get(PENDING_FIELD):
+        # Lý do ngắt máy được điền sau theo lô bằng annotate_end_calls.py
+        entry[PENDING_FIELD] = True
+
+    # Lưu trữ hội thoại đầy đủ (tùy chọn)
+    if args.save_full_dialogues:
+        full_dialogue_path = os.path.join(args.full_output_dir, f"{tts_id}.json")
+        with open(full_dialogue_path, 'w', encoding='utf-8') as f:
+            json.dump(dialogue_result, f, ensure_ascii=False, indent=2)
+        logger.info(f"Hội thoại {tts_id} xử lý xong, lý do kết thúc: {termination_reason}")
+        logger.info(f"Đã lưu hội thoại đầy đủ vào {full_dialogue_path}")
+    else:
+        logger.info(f"Hội thoại {tts_id} xử lý xong, lý do kết thúc: {termination_reason}")
+
+    return entry
+
+def _build_entries(args, root_id: str, dialogue_result: Dict[str, Any], profile: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Entry của hội thoại và mọi nhánh rẽ từ nó (duyệt theo chiều sâu), mỗi nhánh ghi nguồn gốc trong trường `branch`"""
+    branches = dialogue_result.pop("branches", [])
+    lineage = dialogue_result.get("lineage")
+    tts_id = root_id + branch_suffix(lineage["branch_id"]) if lineage else root_id
+    entry = _build_entry(args, tts_id, dialogue_result, profile)
+    if lineage:
+        entry["branch"] = {
+            "root": root_id,
+            "parent": root_id + branch_suffix(lineage["parent"]) if lineage["parent"] is not None else None,
+            "fork_turn": lineage["fork_turn"],
+            "shared_messages": lineage["shared_messages"]
+        }
+    entries = [entry]
+    for branch in branches:
+        entries.extend(_build_entries(args, root_id, branch, profile))
+    return entries
+
 def generate_dialogue(args, tts_id: str, user_age: int, user_awareness: str, fraud_type: str) -> Dict[str, Any]:
+    """Sinh một hội thoại (đồng bộ, dùng trong ThreadPoolExecutor)"""
+    return asyncio.run(generate_dialogue_async(args, tts_id, user_age, user_awareness, fraud_type))
+
+async def generate_dialogue_async(args, tts_id: str, user_age: int, user_awareness: str, fraud_type: str) -> Dict[str, Any]:
     """Sinh một hội thoại và trả về kết quả (theo chuẩn TeleAntiFraud gốc)"""
     try:
         # Ghi log tham số hội thoại
@@ -95,116 +215,158 @@ def generate_dialogue(args, tts_id: str, user_age: int, user_awareness: str, fra
             f"Bắt đầu sinh hội thoại {tts_id}: age={user_age}, awareness={user_awareness}, fraud_type={fraud_type}"
         )
 
+        # Một client dùng chung cho cả ba agent; --async_mode dùng client aiohttp
+        client = create_gemini_client(
+            api_key=getattr(args, 'api_key', None),
+            model=args.model,
+            async_mode=getattr(args, 'async_mode', False),
+            base_url=getattr(args, 'base_url', None)
+        )
+
         # Tạo agent bên trái (Kẻ lừa đảo)
         left_agent = LeftAgent(
-            model=args.model,
+            model=get_model_router().model_for("left", args.model),
             fraud_type=fraud_type,
-            api_key=getattr(args, 'api_key', None)
+            api_key=getattr(args, 'api_key', None),
+            client=client
         )
 
         # Tạo agent bên phải (Người dùng): chọn nghề theo P(o|f,a) 
-        # Xác định age_range từ user_age cụ thể
-        user_age_range = None
-        for age_range in AGE_RANGES:
-            if age_range[0] <= user_age <= age_range[1]:
-                user_age_range = age_range
-                break
-        
-        if user_age_range is None:
-            # Fallback nếu user_age nằm ngoài ranges đã định nghĩa
-            user_age_range = AGE_RANGES[0]  # Default to first range
-            
-        occupation = _choose_occupation_with_weights(fraud_type, user_age_range)
+        occupation = _choose_occupation(args, tts_id, user_age, fraud_type)
 
         right_agent = RightAgent(
-            model=args.model,
+            model=get_model_router().model_for("right", args.model),
             user_profile={
                 "age": user_age,
                 "awareness": user_awareness,
                 "occupation": occupation
             },
-            api_key=getattr(args, 'api_key', None)
+            api_key=getattr(args, 'api_key', None),
+            client=client
         )
 
-        # Tạo agent quản lý
-        manager_agent = ManagerAgent(
-            model=args.model,
-            strictness="medium",
-            api_key=getattr(args, 'api_key', None)
-        )
+        if getattr(args, 'mode', 'agents') == "script":
+            # Chế độ kịch bản: một request sinh trọn hội thoại từ hồ sơ của hai agent, không cần manager
+            script_generator = ScriptGenerator(left_agent, right_agent, max_turns=args.max_turns)
+            dialogue_result = await script_generator.generate_async(get_opening_pool().take(fraud_type))
+        else:
+            # Tạo agent quản lý
+            manager_agent = ManagerAgent(
+                model=get_model_router().model_for("manager", args.model),
+                strictness="medium",
+                api_key=getattr(args, 'api_key', None),
+                client=client,
+                incremental=not getattr(args, 'full_manager_eval', False)
+            )
 
-        # Tạo bộ điều phối hội thoại
-        conv_logger = ConversationLogger(console_output=False)
-        orchestrator = DialogueOrchestrator(
-            left_agent=left_agent,
-            right_agent=right_agent,
-            manager_agent=manager_agent,
-            max_turns=args.max_turns,
-            logger=conv_logger
-        )
+            # Tạo bộ điều phối hội thoại
+            conv_logger = ConversationLogger(console_output=False)
+            orchestrator = DialogueOrchestrator(
+                left_agent=left_agent,
+                right_agent=right_agent,
+                manager_agent=manager_agent,
+                max_turns=args.max_turns,
+                logger=conv_logger,
+                defer_end_call_reasons=getattr(args, 'defer_end_call_reasons', False)
+            )
 
-        # Sinh hội thoại
-        dialogue_result = orchestrator.run_dialogue()
+            # Sinh hội thoại (câu mở đầu lấy từ kho nếu bật --opening_pool, hết câu thì bên gọi tự sinh)
+            dialogue_result = await orchestrator.run_dialogue_async(get_opening_pool().take(fraud_type))
 
-        # Ghi log lịch sử hội thoại
-        logger.info(
-            f"Hội thoại {tts_id} hoàn thành, tổng {len(dialogue_result['dialogue_history'])} lượt"
-        )
-        logger.info(f"Lịch sử hội thoại {tts_id}:")
-        for msg in dialogue_result['dialogue_history']:
-            role = "Kẻ lừa đảo" if msg['role'] == "left" else "Người dùng"
-            logger.info(f"{role}: {msg['content']}")
-
-        # Trích xuất lý do kết thúc
-        termination_reason = (
-            "Đạt tối đa lượt" if dialogue_result.get("reached_max_turns", False)
-            else dialogue_result.get("termination_reason", "Không xác định")
-        )
-        # Nếu do quản lý kết thúc, rút ngắn lý do
-        if dialogue_result.get("terminated_by_manager", False) and isinstance(termination_reason, str) and len(termination_reason) > 100:
-            short_reason = termination_reason.split("。")[0] if "。" in termination_reason[:100] else termination_reason[:100]
-            termination_reason = short_reason + "..."
-
-        # Tách biệt nội dung hội thoại của hai bên
-        left_messages: List[str] = []
-        right_messages: List[str] = []
-        for message in dialogue_result["dialogue_history"]:
-            if message["role"] == "left":
-                content = message["content"].replace('\n', ' ').strip()
-                left_messages.append(content)
-            elif message["role"] == "right":
-                content = message["content"].replace('\n', ' ').strip()
-                right_messages.append(content)
-
-        # Tạo entry dữ liệu JSONL
-        entry = {
-            "tts_id": tts_id,
-            "left": left_messages,
-            "right": right_messages,
+        # Mỗi nhánh rẽ (--branch_turns) là một entry riêng, trả về kèm entry gốc trong trường "branches"
+        profile = {
             "user_age": user_age,
             "user_awareness": user_awareness,
             "fraud_type": fraud_type,
-            "occupation": occupation,
-            "termination_reason": termination_reason,
-            "terminator": dialogue_result.get("terminator", "natural")
+            "occupation": occupation
         }
-
-        # Lưu trữ hội thoại đầy đủ (tùy chọn)
-        if args.save_full_dialogues:
-            full_dialogue_path = os.path.join(args.full_output_dir, f"{tts_id}.json")
-            with open(full_dialogue_path, 'w', encoding='utf-8') as f:
-                json.dump(dialogue_result, f, ensure_ascii=False, indent=2)
-            logger.info(f"Hội thoại {tts_id} xử lý xong, lý do kết thúc: {termination_reason}")
-            logger.info(f"Đã lưu hội thoại đầy đủ vào {full_dialogue_path}")
-        else:
-            logger.info(f"Hội thoại {tts_id} xử lý xong, lý do kết thúc: {termination_reason}")
-
+        entries = _build_entries(args, tts_id, dialogue_result, profile)
+        entry = entries[0]
+        if len(entries) > 1:
+            entry["branches"] = entries[1:]
         return entry
 
+    except RetryBudgetExhausted as e:
+        # Hết ngân sách retry: bỏ hội thoại ngay để giải phóng worker
+        get_retry_policy().record_exhausted()
+        logger.error(f"Hội thoại {tts_id} dừng do hết ngân sách retry: {e}")
+        return {"error": str(e), "tts_id": tts_id}
+    except NonRetryableError as e:
+        # Request sai, sai API key/model hoặc cassette chưa ghi request này: retry không giúp gì
+        logger.error(f"Hội thoại {tts_id} dừng do lỗi không thể retry: {e}")
+        return {"error": str(e), "tts_id": tts_id}
     except Exception as e:
         logger.error(f"Lỗi khi sinh hội thoại {tts_id}: {e}", exc_info=True)
         return {"error": str(e), "tts_id": tts_id}
 
+def run_dialogues_threaded(args, tasks):
+    """Sinh hội thoại bằng ThreadPoolExecutor, trả về (task, result) theo thứ tự hoàn thành"""
+    logger.info(f"Bắt đầu sinh hội thoại song song, số luồng: {args.workers}")
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        # Gửi tất cả nhiệm vụ vào xử lý
+        future_to_task = {
+            executor.submit(generate_dialogue, args, *task): task
+            for task in tasks
+        }
+        for future in tqdm(as_completed(future_to_task), total=len(tasks), desc="Sinh hội thoại"):
+            task = future_to_task[future]
+            try:
+                yield task, future.result()
+            except Exception as e:
+                logger.error(f"Lỗi khi xử lý nhiệm vụ {task[0]}: {e}", exc_info=True)
+                yield task, {"error": str(e), "tts_id": task[0]}
+
+async def run_dialogues_async(args, tasks) -> List[tuple]:
+    """Sinh toàn bộ hội thoại trên một event loop, tối đa --concurrency hội thoại cùng lúc"""
+    logger.info(f"Bắt đầu sinh hội thoại bằng asyncio, số hội thoại đồng thời: {args.concurrency}")
+    semaphore = asyncio.Semaphore(args.concurrency)
+    progress = tqdm(total=len(tasks), desc="Sinh hội thoại")
+
+    async def run_one(task):
+        async with semaphore:
+            result = await generate_dialogue_async(args, *task)
+        progress.update(1)
+        return task, result
+
+    try:
+        return await asyncio.gather(*(run_one(task) for task in tasks))
+    finally:
+        progress.close()
+        await close_async_sessions()
+
+def run_dialogues_waves(args, tasks):
+    """Sinh hội thoại theo đợt qua batch job (--mode wave), trả về (task, result) như run_dialogues_threaded.
+    Đã có trạng thái trong --wave_dir thì tiếp tục lượt chạy đó và bỏ qua danh sách nhiệm vụ mới"""
+    client = BatchJobClient(api_key=args.api_key, model=args.model, base_url=args.base_url, poll_interval=args.wave_poll)
+    runner = WaveRunner(
+        args.wave_dir,
+        client,
+        max_turns=args.max_turns,
+        incremental=not args.full_manager_eval,
+        defer_end_call_reasons=args.defer_end_call_reasons
+    )
+    if not runner.resume():
+        states = []
+        for tts_id, user_age, user_awareness, fraud_type in tasks:
+            profile = {
+                "user_age": user_age,
+                "user_awareness": user_awareness,
+                "fraud_type": fraud_type,
+                "occupation": _choose_occupation(args, tts_id, user_age, fraud_type)
+            }
+            states.append(WaveDialogue.new_state(tts_id, profile, get_opening_pool().take(fraud_type)))
+        runner.begin(states)
+    elif len(runner.dialogues) != len(tasks):
+        logger.warning(f"Tiếp tục lượt chạy cũ với {len(runner.dialogues)} hội thoại, bỏ qua --count {args.count}")
+
+    for dialogue in runner.run():
+        profile = dialogue.state["profile"]
+        task = (dialogue.tts_id, profile["user_age"], profile["user_awareness"], profile["fraud_type"])
+        if dialogue.state["step"] == FAILED:
+            yield task, {"error": dialogue.state["error"], "tts_id": dialogue.tts_id}
+        else:
+            yield task, _build_entry(args, dialogue.tts_id, dialogue.result(), profile)
+
 def main():
     # Phân tích tham số dòng lệnh
     parser = argparse.ArgumentParser(description="Sinh dữ liệu hội thoại lừa đảo đa agent với Gemini")
@@ -212,11 +374,78 @@ def main():
     parser.add_argument("--output", default="fraud_dialogues.jsonl", help="Đường dẫn file kết quả")
     parser.add_argument("--full_output_dir", default="full_dialogues", help="Thư mục lưu hội thoại đầy đủ")
     parser.add_argument("--save_full_dialogues", action="store_true", help="Luu file hoi thoai day du (debug)")
-    parser.add_argument("--api_key", required=True, help="Gemini API key")
+    parser.add_argument("--api_key", action="append", help="Gemini API key (lặp lại để dùng nhiều key)")
+    parser.add_argument("--api_key_file", default=None, help="File chứa danh sách API key, mỗi dòng một key")
     parser.add_argument("--model", default="gemini-2.0-flash", help="Tên model Gemini sử dụng")
+    parser.add_argument("--role_models", default=",".join(f"{role}={model}" for role, model in config.ROLE_MODELS.items()), help="Model riêng theo vai trò, cách nhau bởi dấu phẩy (vd. right=gemini-2.0-flash-lite,manager=gemini-2.0-flash-lite); vai trò left, right, manager, conclusion (câu kết thúc) không có trong đây dùng --model")
+    parser.add_argument("--fallback_model", default=config.FALLBACK_MODEL, help="Model dự phòng khi model chính liên tục bị 429/lỗi server, vd. gemini-2.0-flash-lite (mặc định: không chuyển)")
+    parser.add_argument("--fallback_after", type=int, default=config.MODEL_FALLBACK_AFTER, help="Số lần 429/lỗi server/timeout liên tiếp của một model trước khi chuyển sang --fallback_model")
+    parser.add_argument("--fallback_cooldown", type=float, default=config.MODEL_FALLBACK_COOLDOWN, help="Số giây model chính nghỉ (request đi sang --fallback_model) trước khi được thử lại")
+    parser.add_argument("--base_url", default=config.GEMINI_BASE_URL, help="Endpoint API tương thích Gemini (vd. mock server http://127.0.0.1:8080/v1beta)")
     parser.add_argument("--max_turns", type=int, default=15, help="Số lượt hội thoại tối đa")
     parser.add_argument("--workers", type=int, default=10, help="Số luồng xử lý song song")
+    parser.add_argument("--pool_size", type=int, default=None, help="Số kết nối keep-alive tối đa mỗi endpoint (mặc định bằng --workers)")
+    parser.add_argument("--rpm", type=int, default=config.RATE_LIMIT_RPM, help="Giới hạn số request mỗi phút của mỗi API key (0 = không giới hạn)")
+    parser.add_argument("--tpm", type=int, default=config.RATE_LIMIT_TPM, help="Giới hạn số input tokens mỗi phút của mỗi API key (0 = không giới hạn)")
+    parser.add_argument("--burst", type=int, default=config.RATE_LIMIT_BURST, help="Số request được gửi dồn tối đa khi quota còn trống")
+    parser.add_argument("--max_in_flight", type=int, default=None, help="Trần số request đồng thời mà AIMD controller được phép tăng tới (mặc định bằng --workers, hoặc --concurrency khi dùng --async_mode)")
+    parser.add_argument("--retries_per_request", type=int, default=config.RETRY_ATTEMPTS_PER_REQUEST, help="Số lần gửi tối đa cho một request Gemini")
+    parser.add_argument("--retry_budget_dialogue", type=int, default=config.RETRY_BUDGET_PER_DIALOGUE, help="Tổng số lần retry (client + agent) cho một hội thoại trước khi bỏ hội thoại")
+    parser.add_argument("--retry_budget_run", type=int, default=config.RETRY_BUDGET_PER_RUN, help="Tổng số lần retry cho cả lượt chạy (0 = không giới hạn)")
+    parser.add_argument("--breaker_threshold", type=int, default=config.CIRCUIT_BREAKER_THRESHOLD, help="Số lỗi 5xx/timeout liên tiếp trước khi tạm dừng mọi worker (0 = tắt)")
+    parser.add_argument("--breaker_cooldown", type=float, default=config.CIRCUIT_BREAKER_COOLDOWN, help="Số giây tạm dừng khi circuit breaker mở")
+    parser.add_argument("--async_mode", action="store_true", help="Chạy mọi hội thoại trên một event loop asyncio với client aiohttp thay vì thread pool")
+    parser.add_argument("--concurrency", type=int, default=200, help="Số hội thoại chạy đồng thời trong --async_mode")
+    parser.add_argument("--seed", type=int, default=None, help="Seed cho việc chọn tham số hội thoại (cần để phát lại cassette đúng prompt)")
+    parser.add_argument("--cassette", default=None, help="File SQLite ghi/phát lại response Gemini")
+    parser.add_argument("--cassette_mode", choices=CASSETTE_MODES, default="auto", help="record: luôn gọi API và ghi; replay: chỉ phát lại; auto: phát lại nếu có, thiếu thì gọi API và ghi")
+    parser.add_argument("--cassette_latency", action="store_true", help="Khi phát lại, chờ đúng độ trễ đã ghi của từng response")
+    parser.add_argument("--no_context_cache", action="store_true", help="Không lưu system prompt thành context cache phía server (luôn gửi nguyên prompt)")
+    parser.add_argument("--cache_ttl", type=int, default=config.CONTEXT_CACHE_TTL, help="Thời gian sống (giây) của mỗi context cache")
+    parser.add_argument("--memory_window", type=int, default=config.MEMORY_WINDOW_TURNS, help="Số lượt gần nhất gửi nguyên văn, các lượt cũ hơn được tóm tắt (0 = luôn gửi toàn bộ lịch sử)")
+    parser.add_argument("--summary_every", type=int, default=config.MEMORY_SUMMARY_EVERY, help="Cập nhật tóm tắt mỗi khi có thêm từng ấy lượt rơi ra khỏi cửa sổ")
+    parser.add_argument("--manager_schedule", choices=SCHEDULES, default=config.MANAGER_SCHEDULE, help="Lịch gọi manager: fixed = mỗi N lượt, backoff = giãn dần sau mỗi lần 'tiếp tục', hazard = theo dấu hiệu kết thúc của lượt vừa rồi")
+    parser.add_argument("--manager_every", type=int, default=config.MANAGER_EVAL_EVERY, help="fixed: đánh giá mỗi N lượt; backoff: khoảng cách ban đầu")
+    parser.add_argument("--manager_max_gap", type=int, default=config.MANAGER_EVAL_MAX_GAP, help="backoff/hazard: số lượt tối đa liên tiếp không đánh giá")
+    parser.add_argument("--local_detector", choices=DETECTOR_MODES, default=config.LOCAL_DETECTOR_MODE, help="Phát hiện cục bộ (không gọi API) hội thoại đã ngã ngũ: flag = buộc manager đánh giá ngay, end = kết thúc hội thoại luôn")
+    parser.add_argument("--speculative", action="store_true", default=config.SPECULATIVE_LEFT_TURN, help="Sinh trước lượt tiếp theo của bên gọi trong lúc manager đánh giá, bỏ đi nếu manager kết thúc hội thoại (bớt một lượt chờ API mỗi lần đánh giá, tốn thêm một request mỗi khi manager kết thúc)")
+    parser.add_argument("--defer_end_call_reasons", action="store_true", default=config.DEFER_END_CALL_REASONS, help="Không gọi manager ngay khi một bên ngắt máy; đánh dấu kết quả và điền lý do sau theo lô bằng annotate_end_calls.py")
+    parser.add_argument("--branch_turns", default=",".join(map(str, config.BRANCH_TURNS)), help="Các lượt rẽ nhánh, cách nhau bởi dấu phẩy (vd. 2,5); mỗi lần rẽ một request candidateCount sinh --branch_factor phản hồi của người dùng, mỗi phản hồi đi tiếp thành một hội thoại riêng (mặc định: tắt)")
+    parser.add_argument("--branch_factor", type=int, default=config.BRANCH_FACTOR, help="Số nhánh mỗi lần rẽ, gồm cả nhánh đang chạy")
+    parser.add_argument("--opening_pool", default=None, help="File kho câu mở đầu sinh bằng build_opening_pool.py; mỗi hội thoại lấy một câu chưa dùng thay cho lượt sinh câu đầu tiên (mặc định: tắt)")
+    parser.add_argument("--turn_batch_roles", default=",".join(config.TURN_BATCH_ROLES), help="Các vai gộp lượt giữa các hội thoại, cách nhau bởi dấu phẩy (left,right); lượt đang chờ của nhiều hội thoại được gói vào một request (cần --async_mode, mặc định: tắt)")
+    parser.add_argument("--turn_batch_size", type=int, default=config.TURN_BATCH_SIZE, help="Số lượt tối đa mỗi request gộp lượt")
+    parser.add_argument("--turn_batch_wait_ms", type=float, default=config.TURN_BATCH_WAIT_MS, help="Thời gian chờ gom lô tối đa (ms) trước khi gửi lô chưa đầy")
+    parser.add_argument("--mode", choices=GENERATION_MODES, default=config.GENERATION_MODE, help="agents: sinh từng lượt bằng các agent và manager; script: mỗi hội thoại sinh trọn (kèm bên kết thúc và lý do) bằng một request có cấu trúc, nhanh và rẻ hơn nhiều nhưng các agent không phản ứng theo từng lượt; wave: mọi hội thoại cùng tiến một câu mỗi đợt qua batch job (rẻ hơn, không tính vào quota RPM/TPM, nhưng mỗi đợt chờ job chạy xong)")
+    parser.add_argument("--wave_dir", default=config.WAVE_STATE_DIR, help="--mode wave: thư mục lưu trạng thái và file của từng đợt; chạy lại với cùng thư mục để tiếp tục lượt chạy bị dừng")
+    parser.add_argument("--wave_poll", type=float, default=config.WAVE_POLL_INTERVAL, help="--mode wave: số giây giữa các lần hỏi trạng thái batch job")
+    parser.add_argument("--full_manager_eval", action="store_true", help="Manager đọc lại toàn bộ hội thoại mỗi lần đánh giá thay vì chỉ các câu thoại mới kèm ghi chú lần trước")
+    parser.add_argument("--memory_roles", default=",".join(config.MEMORY_ROLES), help="Các vai trò dùng bộ nhớ có giới hạn, phân tách bằng dấu phẩy (left,right,manager)")
     args = parser.parse_args()
+    try:
+        args.memory_roles = parse_memory_roles(args.memory_roles)
+        args.branch_turns = parse_branch_turns(args.branch_turns)
+        args.turn_batch_roles = parse_turn_batch_roles(args.turn_batch_roles)
+        args.role_models = parse_role_models(args.role_models)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.mode != "agents" and args.branch_turns:
+        parser.error("--branch_turns chỉ dùng được với --mode agents")
+    if args.mode == "wave" and args.turn_batch_roles:
+        parser.error("--turn_batch_roles không dùng được với --mode wave (mỗi đợt đã là một batch job)")
+    if args.mode == "wave" and args.role_models:
+        parser.error("--role_models không dùng được với --mode wave (mỗi batch job chỉ chạy một model)")
+    if args.mode == "wave":
+        try:
+            batch_api_urls(args.base_url)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.turn_batch_roles and not args.async_mode:
+        parser.error("--turn_batch_roles cần --async_mode (các hội thoại phải chạy trên cùng một event loop)")
+    args.api_keys = load_api_keys(args.api_key, args.api_key_file)
+    if not args.api_keys:
+        parser.error("Cần ít nhất một API key (--api_key hoặc --api_key_file)")
+    args.api_key = args.api_keys[0]
     
     # Ghi log thông tin khởi động
     logger.info(f"Bắt đầu sinh {args.count} hội thoại với Gemini model: {args.model}")
@@ -224,6 +453,54 @@ def main():
     # Cấu hình API key
     config.GEMINI_API_KEY = args.api_key
     config.DEFAULT_MODEL = args.model
+    config.GEMINI_BASE_URL = args.base_url
+
+    # Trần request đồng thời: số luồng, hoặc số hội thoại đồng thời khi chạy asyncio
+    max_in_flight = args.max_in_flight or (args.concurrency if args.async_mode else args.workers)
+    # Pool kết nối HTTP dùng chung cho mọi agent, kích thước khớp số request đồng thời
+    configure_session_pool(args.pool_size or max_in_flight)
+    # Mỗi API key có token bucket riêng (các luồng tự chờ lượt, không chặn nhau); request đi theo key ít tải nhất
+    configure_key_pool(args.api_keys, args.rpm, args.tpm, args.burst)
+    # AIMD controller dùng chung: giảm số request đồng thời khi gặp 429, tăng lại khi ổn định.
+    # Thread pool không gửi quá --workers request cùng lúc nên bắt đầu từ đó; asyncio bắt đầu ngay từ trần
+    initial_limit = max_in_flight if args.async_mode else min(args.workers, max_in_flight)
+    configure_concurrency_controller(initial_limit=initial_limit, max_limit=max_in_flight)
+    # Ngân sách retry dùng chung cho client, agent và batch
+    configure_retry_policy(args.retries_per_request, args.retry_budget_dialogue, args.retry_budget_run)
+    # Circuit breaker dùng chung: upstream sập thì mọi worker cùng dừng chờ
+    configure_circuit_breaker(args.breaker_threshold, args.breaker_cooldown)
+    # Model theo vai trò và model dự phòng khi model chính liên tục bị 429/lỗi server
+    configure_model_routing(args.role_models, args.fallback_model, args.fallback_after, args.fallback_cooldown)
+    # Cassette dùng chung: phát lại response đã ghi để chạy lại pipeline không tốn request
+    configure_cassette(args.cassette, args.cassette_mode if args.cassette else "off", args.cassette_latency)
+    # Context cache dùng chung: mỗi system prompt khác nhau có một cachedContents trên server
+    configure_context_cache(config.CONTEXT_CACHE_ENABLED and not args.no_context_cache, args.cache_ttl,
+                            config.CONTEXT_CACHE_MIN_TOKENS, config.CONTEXT_CACHE_MIN_USES)
+    # Bộ nhớ theo vai trò: hội thoại dài chỉ gửi các lượt gần nhất kèm tóm tắt phần trước
+    if args.mode == "wave" and args.memory_window > 0:
+        # Tóm tắt là request riêng ngoài đợt; mỗi đợt gửi toàn bộ lịch sử
+        logger.info("🌊 Chế độ theo đợt không dùng bộ nhớ có giới hạn, mỗi request gửi toàn bộ lịch sử")
+        args.memory_window = 0
+    configure_memory(args.memory_window, args.summary_every, args.memory_roles)
+    # Lịch gọi manager: mặc định giữ nhịp cũ, backoff/hazard bỏ bớt các lần đánh giá ít thông tin
+    configure_evaluation_schedule(args.manager_schedule, args.manager_every, config.MANAGER_EVAL_MIN_MESSAGES, args.manager_max_gap)
+    # Phát hiện cục bộ hội thoại đã ngã ngũ (lộ thông tin, từ chối nhiều lần, lặp lại) không tốn request
+    configure_termination_detector(args.local_detector)
+    # Sinh trước lượt của bên gọi song song với manager
+    configure_speculation(args.speculative)
+    # Rẽ nhánh: phần đầu chung của các hội thoại chỉ sinh một lần
+    configure_branching(args.branch_turns, args.branch_factor)
+    # Gộp lượt giữa các hội thoại: một request tiến được nhiều hội thoại khi bị giới hạn RPM
+    configure_turn_batching(args.turn_batch_roles, args.turn_batch_size, args.turn_batch_wait_ms)
+    # Chế độ sinh: từng lượt bằng agent hoặc cả hội thoại bằng một request
+    configure_script_mode(args.mode)
+    configure_wave_mode(args.mode == "wave", args.wave_dir)
+    # Kho câu mở đầu sinh sẵn: bỏ lượt gọi API đầu tiên của bên gọi
+    configure_opening_pool(args.opening_pool, args.seed)
+    # Ghép sẵn system prompt theo từng loại lừa đảo/nghề nghiệp/mức nhận thức: mỗi lượt chỉ gửi section liên quan
+    logger.info(f"📝 Đã ghép sẵn {precompile_system_prompts()} biến thể system prompt")
+    if args.seed is not None:
+        random.seed(args.seed)
     
     # Tạo thư mục lưu trữ kết quả nếu chưa tồn tại
     output_dir = os.path.dirname(args.output)
@@ -275,43 +552,42 @@ def main():
     # Xáo trộn thứ tự nhiệm vụ
     random.shuffle(tasks)
     
-    # Sinh hội thoại song song
-    logger.info(f"Bắt đầu sinh hội thoại song song, số luồng: {args.workers}")
-    with ThreadPoolExecutor(max_workers=args.workers) as executor:
-        # Gửi tất cả nhiệm vụ vào xử lý
-        future_to_task = {
-            executor.submit(generate_dialogue, args, tts_id, user_age, awareness, fraud): 
-            (tts_id, user_age, awareness, fraud) 
-            for tts_id, user_age, awareness, fraud in tasks
-        }
-          # Xử lý kết quả trả về
-        for future in tqdm(as_completed(future_to_task), total=len(tasks), desc="Sinh hội thoại"):
-            task = future_to_task[future]
-            try:
-                result = future.result()
-                if "error" not in result:
-                    results.append(result)
-                    success_count += 1
-                    
-                    # Cập nhật thống kê
-                    age = result["user_age"]
-                    awareness = result["user_awareness"] 
-                    fraud = result["fraud_type"]
-                    terminator = result["terminator"]
-                    occupation = result["occupation"]
-
-                    age_stats[age] = age_stats.get(age, 0) + 1
-                    awareness_stats[awareness] = awareness_stats.get(awareness, 0) + 1
-                    fraud_stats[fraud] = fraud_stats.get(fraud, 0) + 1
-                    terminator_stats[terminator] = terminator_stats.get(terminator, 0) + 1
-                    occupations_stats[occupation] = occupations_stats.get(occupation, 0) + 1
-                    
-                else:
-                    logger.error(f"Nhiệm vụ {task[0]} thất bại: {result['error']}")
-                    error_count += 1
-            except Exception as e:
-                logger.error(f"Lỗi khi xử lý nhiệm vụ {task[0]}: {e}", exc_info=True)
-                error_count += 1
+    # Sinh hội thoại song song (thread pool hoặc một event loop asyncio)
+    generation_started = time.time()
+    if args.mode == "wave":
+        task_results = run_dialogues_waves(args, tasks)
+    elif args.async_mode:
+        task_results = asyncio.run(run_dialogues_async(args, tasks))
+    else:
+        task_results = run_dialogues_threaded(args, tasks)
+
+    # Xử lý kết quả trả về
+    for task, result in task_results:
+        if "error" not in result:
+            # Các nhánh rẽ (--branch_turns) là những hội thoại riêng trong dataset
+            for dialogue in [result] + result.pop("branches", []):
+                results.append(dialogue)
+                success_count += 1
+                
+                # Cập nhật thống kê
+                age = dialogue["user_age"]
+                awareness = dialogue["user_awareness"] 
+                fraud = dialogue["fraud_type"]
+                terminator = dialogue["terminator"]
+                occupation = dialogue["occupation"]
+
+                age_stats[age] = age_stats.get(age, 0) + 1
+                awareness_stats[awareness] = awareness_stats.get(awareness, 0) + 1
+                fraud_stats[fraud] = fraud_stats.get(fraud, 0) + 1
+                terminator_stats[terminator] = terminator_stats.get(terminator, 0) + 1
+                occupations_stats[occupation] = occupations_stats.get(occupation, 0) + 1
+            
+        else:
+            logger.error(f"Nhiệm vụ {task[0]} thất bại: {result['error']}")
+            error_count += 1
+    # Xoá context cache ngay khi mọi hội thoại đã xong thay vì trả phí lưu trữ tới hết TTL
+    if get_context_cache().enabled:
+        logger.info(f"🗄️ Đã xoá {release_context_caches(args.base_url)} context cache")
       # Ghi kết quả vào file JSONL
     with open(args.output, 'w', encoding='utf-8') as f:
         for entry in results:
@@ -335,7 +611,28 @@ def main():
     stats_msg += f"\nPhân bố nhận thức: {awareness_stats}"
     stats_msg += f"\nPhân bố loại lừa đảo: {fraud_stats}"
     stats_msg += f"\nPhân bố bên kết thúc: {terminator_stats}"
-    stats_msg += f"\nPhân bố nghề nghiệp: {occupations_stats}"    
+    stats_msg += f"\nPhân bố nghề nghiệp: {occupations_stats}"
+    generation_elapsed = time.time() - generation_started
+    stats_msg += f"\nThông lượng: {success_count / generation_elapsed if generation_elapsed > 0 else 0:.2f} hội thoại/giây ({generation_elapsed:.1f}s)"
+    stats_msg += f"\n{format_pool_stats(get_session_pool().stats())}"
+    stats_msg += f"\n{format_key_pool_stats(get_key_pool().stats())}"
+    stats_msg += f"\n{format_concurrency_stats(get_concurrency_controller().stats())}"
+    stats_msg += f"\n{format_retry_stats(get_retry_policy().stats())}"
+    stats_msg += f"\n{format_breaker_stats(get_circuit_breaker().stats())}"
+    stats_msg += f"\n{format_model_routing_stats(get_model_router().stats())}"
+    if get_cassette().enabled:
+        stats_msg += f"\n{format_cassette_stats(get_cassette().stats())}"
+    if get_context_cache().enabled:
+        stats_msg += f"\n{format_context_cache_stats(get_context_cache().stats())}"
+    stats_msg += f"\n{format_memory_stats(get_memory_registry().stats())}"
+    stats_msg += f"\n{format_evaluation_stats(get_evaluation_registry().stats())}"
+    stats_msg += f"\n{format_detector_stats(get_detector_registry().stats())}"
+    stats_msg += f"\n{format_speculation_stats(get_speculation_registry().stats())}"
+    stats_msg += f"\n{format_opening_pool_stats(get_opening_pool().stats())}"
+    stats_msg += f"\n{format_branching_stats(get_branching_registry().stats())}"
+    stats_msg += f"\n{format_script_stats(get_script_registry().stats())}"
+    stats_msg += f"\n{format_turn_batch_stats(get_turn_batch_registry().stats())}"
+    stats_msg += f"\n{format_wave_stats(get_wave_registry().stats())}"
     try:
         print(stats_msg)
     except UnicodeEncodeError:
@@ -0,0 +1,99 @@
+"""
+Branching - Rẽ nhánh hội thoại tại các lượt chọn trước: một request (candidateCount) sinh nhiều phản hồi
+của người dùng cho cùng một câu của kẻ lừa đảo, mỗi phản hồi đi tiếp thành một hội thoại riêng
+nên phần đầu chung chỉ được sinh một lần
+"""
+
+import logging
+from threading import Lock
+from typing import Dict, Any, Iterable, List, Optional
+
+import config
+
+
+def parse_branch_turns(value: Optional[str]) -> List[int]:
+    """Đọc danh sách lượt rẽ nhánh dạng "2,5" (rỗng = tắt); raise ValueError nếu sai định dạng"""
+    turns = sorted({int(item) for item in (value or "").split(",") if item.strip()})
+    if any(turn < 0 for turn in turns):
+        raise ValueError(f"Lượt rẽ nhánh phải >= 0: {value}")
+    return turns
+
+
+def branch_suffix(branch_id: str) -> str:
+    """Hậu tố mã hội thoại của một nhánh: gốc "0" không có hậu tố, "0.2.1" thành _b2_1"""
+    path = branch_id.split(".")[1:]
+    return f"_b{'_'.join(path)}" if path else ""
+
+
+class BranchingRegistry:
+    """Cấu hình rẽ nhánh và thống kê số nhánh, số câu thoại dùng chung, dùng chung cho toàn process"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.logger = logging.getLogger(__name__)
+        self.configure(config.BRANCH_TURNS, config.BRANCH_FACTOR)
+
+    def configure(self, turns: Iterable[int], factor: int) -> None:
+        with self._lock:
+            self.turns = sorted(set(turns))
+            self.factor = max(1, factor)
+            self.forks = 0
+            self.branches = 0
+            self.shared_messages = 0
+            self.duplicates = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.turns) and self.factor > 1
+
+    def record(self, branches: int, shared_messages: int, duplicates: int = 0) -> None:
+        """Một lần rẽ nhánh: số nhánh con mở thêm, số câu thoại mỗi nhánh con nhận sẵn, số phản hồi trùng bị bỏ"""
+        with self._lock:
+            self.forks += 1
+            self.branches += branches
+            self.shared_messages += branches * shared_messages
+            self.duplicates += duplicates
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": bool(self.turns) and self.factor > 1,
+                "turns": list(self.turns),
+                "factor": self.factor,
+                "forks": self.forks,
+                "branches": self.branches,
+                "shared_messages": self.shared_messages,
+                "duplicates": self.duplicates,
+            }
+
+
+_branching_registry = BranchingRegistry()
+
+
+def get_branching_registry() -> BranchingRegistry:
+    """Trả về registry rẽ nhánh dùng chung của process"""
+    return _branching_registry
+
+
+def configure_branching(turns: Iterable[int] = config.BRANCH_TURNS,
+                        factor: int = config.BRANCH_FACTOR) -> BranchingRegistry:
+    """Đặt các lượt rẽ nhánh và số nhánh mỗi lần rẽ từ tham số dòng lệnh, đặt lại thống kê"""
+    _branching_registry.configure(turns, factor)
+    if _branching_registry.enabled:
+        turns = _branching_registry.turns
+        _branching_registry.logger.info(
+            f"🌿 Rẽ nhánh tại lượt {', '.join(map(str, turns))}, {_branching_registry.factor} nhánh mỗi lần "
+            f"(tối đa {_branching_registry.factor ** len(turns)} hội thoại cho mỗi hội thoại gốc)"
+        )
+    return _branching_registry
+
+
+def format_branching_stats(stats: Dict[str, Any]) -> str:
+    """Định dạng thống kê rẽ nhánh để ghi log"""
+    if not stats["enabled"]:
+        return "Rẽ nhánh hội thoại: tắt"
+    return (
+        f"Rẽ nhánh hội thoại: {stats['forks']} lần rẽ, {stats['branches']} nhánh con, "
+        f"{stats['shared_messages']} câu thoại dùng chung không phải sinh lại, "
+        f"{stats['duplicates']} phản hồi trùng hoặc không hợp lệ bị bỏ"
+    )
@@ -1,9 +1,21 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Sequence
 from agents.left_agent import LeftAgent
 from agents.right_agent import RightAgent 
 from agents.manager_agent import ManagerAgent
+from agents.memory import SummaryCache
+from agents.manager_verdict import ManagerVerdict, EndCallVerdict
 from agents.prompts.manager_prompts import LEFT_TERMINATION_PROMPT, RIGHT_TERMINATION_PROMPT
+from logic.evaluation_schedule import EvaluationSchedule, create_evaluation_schedule, get_evaluation_registry
+from logic.termination_detector import TerminationDetector, create_termination_detector, get_detector_registry
+from logic.speculation import SpeculativeTurn, get_speculation_registry
+from logic.end_call_annotation import PENDING_FIELD
+from logic.branching import get_branching_registry
+from utils.model_router import get_model_router
 from utils.conversation_logger import ConversationLogger
+import config
+import asyncio
+import copy
+import logging
 import time
 
 class DialogueOrchestrator:
@@ -14,42 +26,96 @@ class DialogueOrchestrator:
                  right_agent: RightAgent,
                  manager_agent: ManagerAgent,
                  max_turns: int = 20,
-                 logger: Optional[ConversationLogger] = None):
+                 logger: Optional[ConversationLogger] = None,
+                 schedule: Optional[EvaluationSchedule] = None,
+                 detector: Optional[TerminationDetector] = None,
+                 speculative: Optional[bool] = None,
+                 defer_end_call_reasons: Optional[bool] = None,
+                 branch_turns: Optional[Sequence[int]] = None,
+                 branch_factor: Optional[int] = None):
         self.left_agent = left_agent
         self.right_agent = right_agent
         self.manager_agent = manager_agent
         self.max_turns = max_turns
         self.logger = logger or ConversationLogger()
         self.full_dialogue_history = []
+        # Lịch gọi manager đánh giá (cố định, lùi dần hoặc theo rủi ro kết thúc), xem logic/evaluation_schedule.py
+        self.schedule = schedule or create_evaluation_schedule()
+        self.evaluations = 0
+        self.end_call_reviews = 0
+        # Phát hiện cục bộ hội thoại đã ngã ngũ (None = tắt), xem logic/termination_detector.py
+        self.detector = detector if detector is not None else create_termination_detector()
+        self.local_flags = []
+        # Sinh trước lượt của kẻ lừa đảo song song với manager (None = theo cấu hình), xem logic/speculation.py
+        self.speculative = get_speculation_registry().enabled if speculative is None else speculative
+        self.speculations = 0
+        self.wasted_speculations = 0
+        # Hoãn đánh giá lý do ngắt máy, điền sau theo lô bằng annotate_end_calls.py (None = theo cấu hình)
+        self.defer_end_call_reasons = config.DEFER_END_CALL_REASONS if defer_end_call_reasons is None else defer_end_call_reasons
+        # Rẽ nhánh tại các lượt trong branch_turns, mỗi lần branch_factor nhánh (None = theo cấu hình), xem logic/branching.py
+        branching = get_branching_registry()
+        self.branch_turns = set(branching.turns if branch_turns is None else branch_turns)
+        self.branch_factor = branching.factor if branch_factor is None else max(1, branch_factor)
+        self.branching = bool(self.branch_turns) and self.branch_factor > 1
+        self.branch_tasks: List[asyncio.Future] = []
+        # Vị trí của hội thoại này trong cây rẽ nhánh: "0" là gốc, "0.2" là nhánh con thứ hai của gốc...
+        self.lineage = {"branch_id": "0", "parent": None, "fork_turn": None, "shared_messages": 0}
+        # Ba agent gộp cùng một bản ghi cuộc gọi: dùng chung các lần tóm tắt
+        self.summaries = SummaryCache()
+        for agent in (left_agent, right_agent, manager_agent):
+            agent.memory.cache = self.summaries
         
     def run_dialogue(self, initial_message: str = None) -> Dict[str, Any]:
+        """Chạy hội thoại (đồng bộ), bọc quanh run_dialogue_async"""
+        return asyncio.run(self.run_dialogue_async(initial_message))
+    
+    async def run_dialogue_async(self, initial_message: str = None) -> Dict[str, Any]:
         """Chạy toàn bộ quy trình hội thoại"""
-        turn_count = 0
-        terminated_by_manager = False
-        end_call_signal_detected = False
-        termination_reason = ""
-        terminator = ""
-        conclusion_messages = []
-        
         # Nếu không cung cấp tin nhắn ban đầu, để kẻ lừa đảo tạo một tin nhắn
         if not initial_message:
-            left_message = self.left_agent.generate_response()
+            left_message = await self.left_agent.generate_response_async()
         else:
             left_message = initial_message
+            # Câu mở đầu có sẵn (kho câu mở đầu) phải nằm trong lịch sử của bên gọi như câu tự sinh
+            self.left_agent.update_history("assistant", left_message)
+            self.left_agent.last_model = None
         self.full_dialogue_history.append({
             "role": "left",
             "content": left_message,
+            "model": self.left_agent.last_model,
             "timestamp": time.time()
         })
         self.logger.log("Bắt đầu hội thoại")
         self.logger.log(f"Kẻ lừa đảo: {left_message}")
-          # Vòng lặp hội thoại chính
+        return await self.continue_dialogue_async(left_message, 0)
+    
+    async def continue_dialogue_async(self, left_message: str, turn_count: int,
+                                      branch_reply: Optional[str] = None) -> Dict[str, Any]:
+        """Vòng lặp hội thoại từ câu `left_message` của kẻ lừa đảo ở lượt `turn_count`.
+
+        Nhánh con bắt đầu tại điểm rẽ với `branch_reply` là phản hồi của người dùng đã sinh sẵn (đã nằm trong lịch sử của agent).
+        """
+        terminated_by_manager = False
+        terminated_locally = False
+        end_call_signal_detected = False
+        end_call_reason_pending = False
+        termination_reason = ""
+        terminator = ""
+        conclusion_messages = []
+        
+        # Vòng lặp hội thoại chính
         while turn_count < self.max_turns:
-            # Người dùng phản hồi
-            right_message = self.right_agent.generate_response(left_message)
+            # Người dùng phản hồi (tại lượt rẽ nhánh: một request sinh phản hồi cho mọi nhánh)
+            if branch_reply is not None:
+                right_message, branch_reply = branch_reply, None
+            elif self.branching and turn_count in self.branch_turns:
+                right_message = await self.fork_async(left_message, turn_count)
+            else:
+                right_message = await self.right_agent.generate_response_async(left_message)
             self.full_dialogue_history.append({
                 "role": "right",
                 "content": right_message,
+                "model": self.right_agent.last_model,
                 "timestamp": time.time()
             })
             self.logger.log(f"Người dùng: {right_message}")
@@ -61,36 +127,73 @@ class DialogueOrchestrator:
                 termination_reason = "Người dùng chủ động ngắt máy"
                 self.logger.log("Phát hiện tín hiệu ngắt máy, người dùng chủ động kết thúc hội thoại")
                 
-                # Nhận đánh giá từ quản lý về hành động ngắt máy
-                manager_evaluation = self.evaluate_end_call(terminator="right")
-                termination_reason = manager_evaluation["reason"]
+                # Nhận đánh giá từ quản lý về hành động ngắt máy (hoặc để điền sau theo lô)
+                if self.defer_end_call_reasons:
+                    end_call_reason_pending = True
+                else:
+                    manager_evaluation = await self.evaluate_end_call_async(terminator="right")
+                    termination_reason = manager_evaluation.reason
                 
                 # Không vào giai đoạn phản hồi cuối
                 break
             
-            # Chỉ đánh giá sau khi có ít nhất 3 lượt hội thoại (6 tin nhắn)
-            # và sau đó mỗi 2 lượt đánh giá 1 lần để giảm tần suất can thiệp
-            if len(self.full_dialogue_history) >= 6 and (turn_count % 2 == 0):
+            # Phát hiện cục bộ (không gọi API): người dùng lộ thông tin, từ chối nhiều lần hoặc hai bên lặp lại
+            local_verdict = self.detector.check(self.full_dialogue_history) if self.detector else None
+            if local_verdict is not None:
+                ended = self.detector.mode == "end"
+                self.local_flags.append({"turn": turn_count, **local_verdict.to_dict()})
+                get_detector_registry().record(local_verdict, ended, self.max_turns - turn_count)
+                if ended:
+                    terminated_locally = True
+                    termination_reason = local_verdict.reason
+                    terminator = local_verdict.terminator
+                    self.logger.log(f"Phát hiện cục bộ, kết thúc hội thoại: {termination_reason}")
+                    
+                    # Xử lý khi hội thoại kết thúc, giống như khi manager quyết định
+                    conclusion_messages = await self.handle_termination_async(terminator)
+                    break
+                self.logger.log(f"Phát hiện cục bộ: {local_verdict.reason}, chuyển cho manager đánh giá")
+            
+            # Mặc định chỉ đánh giá khi có ít nhất 3 lượt hội thoại (6 tin nhắn), sau đó mỗi 2 lượt một lần
+            # (luôn đánh giá khi bộ phát hiện cục bộ vừa báo)
+            speculation = None
+            if local_verdict is not None or self.schedule.should_evaluate(self.full_dialogue_history, turn_count, self.max_turns):
+                # Kẻ lừa đảo chỉ cần câu vừa rồi của người dùng: sinh trước lượt tiếp theo trong lúc manager đánh giá
+                if self.speculative:
+                    speculation = SpeculativeTurn(self.left_agent, right_message)
+                
                 # Quản lý đánh giá
-                manager_decision = self.evaluate_dialogue()
+                try:
+                    manager_decision = await self.evaluate_dialogue_async()
+                except BaseException:
+                    if speculation is not None:
+                        await speculation.discard_async()
+                    raise
+                self.schedule.record(turn_count, manager_decision.should_terminate)
+                if speculation is not None:
+                    await self.settle_speculation_async(speculation, manager_decision.should_terminate)
                 
-                if manager_decision["should_terminate"]:
+                if manager_decision.should_terminate:
                     terminated_by_manager = True
-                    termination_reason = manager_decision["reason"]
-                    terminator = manager_decision["terminator"]
+                    termination_reason = manager_decision.reason
+                    terminator = manager_decision.terminator
                     
                     self.logger.log(f"Quản lý kết thúc hội thoại: {termination_reason}")
                     self.logger.log(f"Cách kết thúc: {'Kẻ lừa đảo kết thúc' if terminator == 'left' else 'Người dùng kết thúc' if terminator == 'right' else 'Kết thúc tự nhiên'}")
                     
                     # Xử lý khi hội thoại kết thúc
-                    conclusion_messages = self.handle_termination(terminator)
+                    conclusion_messages = await self.handle_termination_async(terminator)
                     break
                 
-            # Kẻ lừa đảo phản hồi
-            left_message = self.left_agent.generate_response(right_message)
+            # Kẻ lừa đảo phản hồi (dùng lượt đã sinh trước nếu có)
+            if speculation is not None:
+                left_message = await speculation.result_async()
+            else:
+                left_message = await self.left_agent.generate_response_async(right_message)
             self.full_dialogue_history.append({
                 "role": "left",
                 "content": left_message,
+                "model": self.left_agent.last_model,
                 "timestamp": time.time()
             })
             self.logger.log(f"Kẻ lừa đảo: {left_message}")
@@ -102,17 +205,12 @@ class DialogueOrchestrator:
                 termination_reason = "Kẻ lừa đảo chủ động ngắt máy"
                 self.logger.log("Phát hiện tín hiệu ngắt máy, kẻ lừa đảo chủ động kết thúc hội thoại")
                 
-                # Nhận đánh giá từ quản lý về hành động ngắt máy
-                manager_evaluation = self.evaluate_end_call(terminator="left")
-                termination_reason = manager_evaluation["reason"]
-                
-                # Không vào giai đoạn phản hồi cuối
-                break
-                self.logger.log("Phát hiện tín hiệu ngắt máy, kẻ lừa đảo chủ động kết thúc hội thoại")
-                
-                # Nhận đánh giá từ quản lý về hành động ngắt máy
-                manager_evaluation = self.evaluate_end_call(terminator="left")
-                termination_reason = manager_evaluation["reason"]
+                # Nhận đánh giá từ quản lý về hành động ngắt máy (hoặc để điền sau theo lô)
+                if self.defer_end_call_reasons:
+                    end_call_reason_pending = True
+                else:
+                    manager_evaluation = await self.evaluate_end_call_async(terminator="left")
+                    termination_reason = manager_evaluation.reason
                 
                 # Không vào giai đoạn phản hồi cuối
                 break
@@ -128,79 +226,128 @@ class DialogueOrchestrator:
             "dialogue_history": self.full_dialogue_history,
             "turns": turn_count,
             "terminated_by_manager": terminated_by_manager,
+            "terminated_locally": terminated_locally,
+            "local_flags": self.local_flags,
             "end_call_signal_detected": end_call_signal_detected,
+            PENDING_FIELD: end_call_reason_pending,
             "termination_reason": termination_reason,
             "terminator": terminator,
             "conclusion_messages": conclusion_messages,
-            "reached_max_turns": turn_count >= self.max_turns
+            "reached_max_turns": turn_count >= self.max_turns,
+            "manager_calls": self.evaluations + self.end_call_reviews,
+            "speculative_turns": self.speculations,
+            "wasted_speculations": self.wasted_speculations
         }
+        if self.branching:
+            result["lineage"] = dict(self.lineage)
+        if self.branch_tasks:
+            # Chờ các nhánh con rẽ ra từ hội thoại này (mỗi nhánh con có thể rẽ tiếp)
+            result["branches"] = await self.gather_branches_async()
         
         self.logger.log("Kết thúc hội thoại")
+        # Huỷ các lần tóm tắt chạy nền chưa xong (cả cây rẽ nhánh dùng chung cache tóm tắt: chỉ nhánh gốc huỷ, sau khi mọi nhánh đã xong)
+        if self.lineage["parent"] is None:
+            self.summaries.cancel()
+        # Thống kê số lần gọi manager của lịch đánh giá
+        get_evaluation_registry().record(self.evaluations, self.end_call_reviews, self.schedule.skipped)
         return result
     
-    def evaluate_dialogue(self) -> Dict[str, Any]:
+    async def fork_async(self, left_message: str, turn_count: int) -> str:
+        """Rẽ nhánh: một request sinh tối đa `branch_factor` phản hồi của người dùng cho cùng câu của kẻ lừa đảo.
+        
+        Hội thoại này đi tiếp với phản hồi đầu tiên, mỗi phản hồi còn lại mở một nhánh con chạy song song.
+        Không sinh được phản hồi nào thì sinh một phản hồi như bình thường, không rẽ nhánh.
+        """
+        replies = await self.right_agent.generate_candidates_async(left_message, self.branch_factor)
+        if not replies:
+            return await self.right_agent.generate_response_async(left_message)
+        for reply in replies[1:]:
+            # Đánh số nhánh con liên tục qua các lần rẽ của hội thoại này
+            child = self.spawn_branch(f"{self.lineage['branch_id']}.{len(self.branch_tasks) + 1}", turn_count)
+            child.right_agent.update_history("user", left_message)
+            child.right_agent.update_history("assistant", reply)
+            self.branch_tasks.append(asyncio.ensure_future(child.continue_dialogue_async(left_message, turn_count, reply)))
+        get_branching_registry().record(len(replies) - 1, len(self.full_dialogue_history), self.branch_factor - len(replies))
+        self.logger.log(f"Rẽ nhánh tại lượt {turn_count}: {len(replies)} phản hồi của người dùng")
+        self.right_agent.update_history("user", left_message)
+        self.right_agent.update_history("assistant", replies[0])
+        return replies[0]
+    
+    def spawn_branch(self, branch_id: str, turn_count: int) -> "DialogueOrchestrator":
+        """Nhánh con tại điểm rẽ: chép sâu lịch sử và trạng thái (bộ nhớ, ghi chú của manager, lịch đánh giá, bộ phát hiện),
+        dùng chung client, logger và cache tóm tắt; số lần gọi manager và sinh trước của nhánh con tính từ điểm rẽ"""
+        shared = [self.logger, self.summaries]
+        for agent in (self.left_agent, self.right_agent, self.manager_agent):
+            shared += [agent.client, agent.memory.task]
+        memo = {id(obj): obj for obj in shared if obj is not None}
+        memo[id(self.branch_tasks)] = []
+        child = copy.deepcopy(self, memo)
+        child.evaluations = child.end_call_reviews = 0
+        child.speculations = child.wasted_speculations = 0
+        child.schedule.skipped = 0
+        child.lineage = {
+            "branch_id": branch_id,
+            "parent": self.lineage["branch_id"],
+            "fork_turn": turn_count,
+            "shared_messages": len(self.full_dialogue_history),
+        }
+        return child
+    
+    async def gather_branches_async(self) -> List[Dict[str, Any]]:
+        """Kết quả các nhánh con theo thứ tự rẽ; nhánh lỗi bị bỏ (phần đầu chung vẫn nằm trong hội thoại này)"""
+        branches = []
+        for task in self.branch_tasks:
+            try:
+                branches.append(await task)
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"Bỏ nhánh rẽ từ {self.lineage['branch_id']}: {e}")
+        self.branch_tasks = []
+        return branches
+    
+    def evaluate_dialogue(self) -> ManagerVerdict:
+        """Phiên bản đồng bộ của evaluate_dialogue_async"""
+        return asyncio.run(self.evaluate_dialogue_async())
+    
+    async def evaluate_dialogue_async(self) -> ManagerVerdict:
         """Quản lý đánh giá hội thoại và quyết định có nên kết thúc không"""
-        return self.manager_agent.evaluate_dialogue(self.full_dialogue_history)
+        self.evaluations += 1
+        return await self.manager_agent.evaluate_dialogue_async(self.full_dialogue_history)
+    
+    async def settle_speculation_async(self, speculation: SpeculativeTurn, wasted: bool) -> None:
+        """Ghi nhận lượt sinh trước sau khi manager quyết định; bỏ lượt đó nếu hội thoại kết thúc"""
+        manager_finished = time.perf_counter()
+        self.speculations += 1
+        completed = True
+        if wasted:
+            self.wasted_speculations += 1
+            completed = await speculation.discard_async()
+        get_speculation_registry().record(self.left_agent.fraud_type, wasted, completed, speculation.overlap(manager_finished))
+    
+    def evaluate_end_call(self, terminator: str) -> EndCallVerdict:
+        """Phiên bản đồng bộ của evaluate_end_call_async"""
+        return asyncio.run(self.evaluate_end_call_async(terminator))
     
-    def evaluate_end_call(self, terminator: str) -> Dict[str, Any]:
+    async def evaluate_end_call_async(self, terminator: str) -> EndCallVerdict:
         """Quản lý đánh giá hành vi ngắt máy"""
-        messages = [{"role": "system", "content": self.manager_agent.get_system_prompt()}]
-        
-        # Xây dựng lại lịch sử hội thoại
-        dialogue_text = "\n".join([
-            f"{'Kẻ lừa đảo' if msg['role'] == 'left' else 'Người dùng'}: {msg['content']}"
-            for msg in self.full_dialogue_history
-        ])
-        
-        terminator_name = "Kẻ lừa đảo" if terminator == "left" else "Người dùng"
-        messages.append({
-            "role": "user", 
-            "content": f"{terminator_name} chủ động ngắt máy. Hãy đánh giá hội thoại sau, phân tích lý do và ý định của {terminator_name} khi ngắt máy:\n\n{dialogue_text}\n\nVui lòng trả lời bằng JSON, gồm trường:\n- reason: chuỗi, giải thích chi tiết lý do và ý định của {terminator_name}"
-        })
+        self.end_call_reviews += 1
+        messages = await self.manager_agent.end_call_messages_async(self.full_dialogue_history, terminator)
         
         # Gọi API để tạo phản hồi
-        reply = self.manager_agent.client.chat_completion(
+        reply = await self.manager_agent.client.chat_completion_async(
             messages=messages,
             model=self.manager_agent.model,
-            temperature=0.3,
-            max_tokens=500
+            response_schema=self.manager_agent.end_call_schema,
+            **self.manager_agent.generation_config
         )
-          # Thử phân tích cú pháp JSON
-        try:
-            import json
-            json_match = self._extract_json(reply)
-            if json_match:
-                result = json.loads(json_match)
-            else:
-                result = json.loads(reply)
-            
-            if 'reason' not in result:
-                result['reason'] = f"{terminator_name} chủ động ngắt máy, lý do không rõ."
-            return result
-        except:
-            # Khi phân tích thất bại, trả về phản hồi gốc dưới dạng lý do
-            return {
-                "reason": f"{terminator_name} chủ động ngắt máy. {reply}"
-            }
-    
-    def _extract_json(self, text: str) -> str:
-        """Trích xuất phần JSON từ văn bản"""
-        import re
-        import json
-        json_pattern = r'\{(?:[^{}]|(?:\{[^{}]*\}))*\}'
-        matches = re.findall(json_pattern, text)
         
-        # Thử từng mục khớp, trả về JSON hợp lệ đầu tiên
-        for match in matches:
-            try:
-                json.loads(match)
-                return match
-            except json.JSONDecodeError:
-                continue
-        
-        return ""
+        # Đọc phán quyết JSON; không có lý do thì dùng phản hồi gốc
+        return self.manager_agent.read_end_call_verdict(reply, terminator)
     
     def handle_termination(self, terminator: str) -> List[Dict[str, str]]:
+        """Phiên bản đồng bộ của handle_termination_async"""
+        return asyncio.run(self.handle_termination_async(terminator))
+    
+    async def handle_termination_async(self, terminator: str) -> List[Dict[str, str]]:
         """Xử lý khi hội thoại kết thúc"""
         conclusion_messages = []
         
@@ -211,20 +358,22 @@ class DialogueOrchestrator:
             self.left_agent.update_history("user", last_right_message)
                 
             # Để kẻ lừa đảo kết thúc hội thoại
-            left_conclusion = self.get_conclusion_from_left()
+            left_conclusion = await self.get_conclusion_from_left_async()
             self.full_dialogue_history.append({
                 "role": "left",
                 "content": left_conclusion,
+                "model": self.left_agent.last_model,
                 "timestamp": time.time()
             })
             conclusion_messages.append({"role": "left", "content": left_conclusion})
             self.logger.log(f"Kẻ lừa đảo kết thúc: {left_conclusion}")
             
             # Phản hồi cuối cùng của người dùng
-            right_conclusion = self.right_agent.generate_response(left_conclusion)
+            right_conclusion = await self.right_agent.generate_response_async(left_conclusion)
             self.full_dialogue_history.append({
                 "role": "right",
                 "content": right_conclusion,
+                "model": self.right_agent.last_model,
                 "timestamp": time.time()
             })
             conclusion_messages.append({"role": "right", "content": right_conclusion})
@@ -232,20 +381,22 @@ class DialogueOrchestrator:
             
         elif terminator == "right":
             # Để người dùng kết thúc hội thoại
-            right_conclusion = self.get_conclusion_from_right()
+            right_conclusion = await self.get_conclusion_from_right_async()
             self.full_dialogue_history.append({
                 "role": "right",
                 "content": right_conclusion,
+                "model": self.right_agent.last_model,
                 "timestamp": time.time()
             })
             conclusion_messages.append({"role": "right", "content": right_conclusion})
             self.logger.log(f"Người dùng kết thúc: {right_conclusion}")
             
             # Phản hồi cuối cùng của kẻ lừa đảo
-            left_conclusion = self.left_agent.generate_response(right_conclusion)
+            left_conclusion = await self.left_agent.generate_response_async(right_conclusion)
             self.full_dialogue_history.append({
                 "role": "left",
                 "content": left_conclusion,
+                "model": self.left_agent.last_model,
                 "timestamp": time.time()
             })
             conclusion_messages.append({"role": "left", "content": left_conclusion})
@@ -253,19 +404,21 @@ class DialogueOrchestrator:
         
         else:  # Kết thúc tự nhiên
             # Cả hai bên đều đưa ra lời kết thúc
-            left_conclusion = self.get_conclusion_from_left()
+            left_conclusion = await self.get_conclusion_from_left_async()
             self.full_dialogue_history.append({
                 "role": "left",
                 "content": left_conclusion,
+                "model": self.left_agent.last_model,
                 "timestamp": time.time()
             })
             conclusion_messages.append({"role": "left", "content": left_conclusion})
             self.logger.log(f"Kẻ lừa đảo kết thúc: {left_conclusion}")
             
-            right_conclusion = self.right_agent.generate_response(left_conclusion)
+            right_conclusion = await self.right_agent.generate_response_async(left_conclusion)
             self.full_dialogue_history.append({
                 "role": "right",
                 "content": right_conclusion,
+                "model": self.right_agent.last_model,
                 "timestamp": time.time()
             })
             conclusion_messages.append({"role": "right", "content": right_conclusion})
@@ -274,37 +427,45 @@ class DialogueOrchestrator:
         return conclusion_messages
     
     def get_conclusion_from_left(self) -> str:
+        """Phiên bản đồng bộ của get_conclusion_from_left_async"""
+        return asyncio.run(self.get_conclusion_from_left_async())
+    
+    async def get_conclusion_from_left_async(self) -> str:
         """Yêu cầu kẻ lừa đảo sinh câu kết thúc"""
-        left_history = self.left_agent.get_history()
+        left_history = await self.left_agent.history_messages_async()
         messages = [
             {"role": "system", "content": self.left_agent.get_system_prompt()},
         ]+left_history+[{"role": "user", "content": LEFT_TERMINATION_PROMPT}]
 
-        # Gọi API để tạo phản hồi
-        reply = self.left_agent.client.chat_completion(
-            messages=messages,
-            model=self.left_agent.model,
-            temperature=0.7,
-            max_tokens=200
+        # Gọi API để tạo phản hồi (câu kết thúc có thể dùng model riêng, xem ROLE_MODELS)
+        completion = await self.left_agent.client.complete_async(
+            messages,
+            model=get_model_router().model_for("conclusion", self.left_agent.model),
+            **config.GENERATION_CONFIG["conclusion"]
         )
+        self.left_agent.last_model = completion.model
         
-        return reply
+        return completion.text
     
     def get_conclusion_from_right(self) -> str:
+        """Phiên bản đồng bộ của get_conclusion_from_right_async"""
+        return asyncio.run(self.get_conclusion_from_right_async())
+    
+    async def get_conclusion_from_right_async(self) -> str:
         """Yêu cầu người dùng sinh câu kết thúc"""
-        right_history = self.right_agent.get_history()
+        right_history = await self.right_agent.history_messages_async()
         messages = [
             {"role": "system", "content": self.right_agent.get_system_prompt()},
         ]+right_history+[
             {"role": "user", "content": RIGHT_TERMINATION_PROMPT}
         ]
         
-        # Gọi API để tạo phản hồi
-        reply = self.right_agent.client.chat_completion(
-            messages=messages,
-            model=self.right_agent.model,
-            temperature=0.7,
-            max_tokens=200
+        # Gọi API để tạo phản hồi (câu kết thúc có thể dùng model riêng, xem ROLE_MODELS)
+        completion = await self.right_agent.client.complete_async(
+            messages,
+            model=get_model_router().model_for("conclusion", self.right_agent.model),
+            **config.GENERATION_CONFIG["conclusion"]
         )
+        self.right_agent.last_model = completion.model
         
-        return reply
\ No newline at end of file
+        return completion.text
\ No newline at end of file
@@ -0,0 +1,105 @@
+"""
+End-call Annotation - Điền lý do ngắt máy (##ENDCALL_SIGNAL##) sau khi sinh xong,
+gộp nhiều hội thoại vào một request manager thay vì một request chặn ngay lúc ngắt máy
+"""
+
+import asyncio
+import logging
+from itertools import zip_longest
+from typing import Dict, Any, List, Sequence
+
+from agents.manager_agent import ManagerAgent
+from agents.manager_verdict import end_call_batch_schema, parse_end_call_batch
+from agents.memory import format_lines
+from agents.prompts.manager_prompts import MANAGER_END_CALL_BATCH_PROMPT, MANAGER_END_CALL_ITEM
+from utils.retry_policy import NonRetryableError
+import config
+
+# Cờ đánh dấu hội thoại ngắt máy chưa có lý do, trong kết quả đầy đủ và trong dòng JSONL
+PENDING_FIELD = "end_call_reason_pending"
+
+
+def entry_history(entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Lịch sử hội thoại của một kết quả: dialogue_history nếu có, ngược lại ghép xen kẽ hai danh sách left/right"""
+    if entry.get("dialogue_history"):
+        return entry["dialogue_history"]
+    history = []
+    for left, right in zip_longest(entry.get("left", []), entry.get("right", [])):
+        if left is not None:
+            history.append({"role": "left", "content": left})
+        if right is not None:
+            history.append({"role": "right", "content": right})
+    return history
+
+
+class EndCallAnnotator:
+    """Điền lý do ngắt máy cho các kết quả có cờ PENDING_FIELD, mỗi request gộp `pack_size` hội thoại"""
+
+    def __init__(self, manager_agent: ManagerAgent,
+                 pack_size: int = config.END_CALL_PACK_SIZE,
+                 context_messages: int = config.END_CALL_CONTEXT_MESSAGES):
+        self.manager_agent = manager_agent
+        self.pack_size = max(1, pack_size)
+        self.context_messages = context_messages
+        self.logger = logging.getLogger(__name__)
+        self.requests = 0
+
+    def transcript(self, entry: Dict[str, Any]) -> str:
+        """Các câu thoại cuối của hội thoại; lý do ngắt máy nằm ở đoạn cuối nên phần đầu được lược bớt"""
+        history = entry_history(entry)
+        if self.context_messages <= 0 or len(history) <= self.context_messages:
+            return format_lines(history, self.manager_agent.HISTORY_LABELS)
+        skipped = len(history) - self.context_messages
+        lines = format_lines(history[skipped:], self.manager_agent.HISTORY_LABELS)
+        return f"(... lược bớt {skipped} câu thoại đầu)\n{lines}"
+
+    async def annotate_async(self, entries: Sequence[Dict[str, Any]]) -> int:
+        """Điền lý do (sửa trực tiếp các entry), trả về số hội thoại đã có lý do; entry lỗi giữ nguyên cờ để chạy lại"""
+        pending = [entry for entry in entries if entry.get(PENDING_FIELD)]
+        packs = [pending[i:i + self.pack_size] for i in range(0, len(pending), self.pack_size)]
+        done = await asyncio.gather(*(self._annotate_pack_async(pack) for pack in packs))
+        return sum(done)
+
+    def annotate(self, entries: Sequence[Dict[str, Any]]) -> int:
+        """Phiên bản đồng bộ của annotate_async"""
+        return asyncio.run(self.annotate_async(entries))
+
+    async def _annotate_pack_async(self, pack: List[Dict[str, Any]]) -> int:
+        keys = [f"d{i + 1}" for i in range(len(pack))]
+        labels = self.manager_agent.HISTORY_LABELS
+        dialogues = "\n\n".join(
+            MANAGER_END_CALL_ITEM.format(
+                key=key,
+                terminator_name=labels.get(entry.get("terminator"), "Một bên"),
+                dialogue=self.transcript(entry)
+            )
+            for key, entry in zip(keys, pack)
+        )
+        messages = [
+            {"role": "system", "content": self.manager_agent.get_system_prompt()},
+            {"role": "user", "content": MANAGER_END_CALL_BATCH_PROMPT.format(
+                count=len(pack), dialogues=dialogues, keys=", ".join(keys)
+            )},
+        ]
+        self.requests += 1
+        try:
+            reply = await self.manager_agent.client.chat_completion_async(
+                messages=messages,
+                model=self.manager_agent.model,
+                response_schema=end_call_batch_schema(keys) if self.manager_agent.structured_output else None,
+                **config.GENERATION_CONFIG["annotation"]
+            )
+        except NonRetryableError:
+            raise
+        except Exception as e:
+            self.logger.warning(f"Không điền được lý do ngắt máy cho {len(pack)} hội thoại: {e}")
+            return 0
+
+        verdicts = parse_end_call_batch(reply, keys)
+        for key, entry in zip(keys, pack):
+            if key in verdicts:
+                entry["termination_reason"] = verdicts[key].reason
+                entry.pop(PENDING_FIELD, None)
+        if len(verdicts) < len(pack):
+            self.logger.warning(f"Thiếu lý do ngắt máy cho {len(pack) - len(verdicts)}/{len(pack)} hội thoại, giữ cờ để chạy lại")
+        return len(verdicts)
@@ -0,0 +1,123 @@
+"""
+Speculation - Sinh trước lượt tiếp theo của bên gọi song song với lần đánh giá của manager,
+bỏ đi nếu manager quyết định kết thúc hội thoại
+"""
+
+import asyncio
+import logging
+import time
+from threading import Lock
+from typing import Dict, Any, Optional
+
+import config
+
+
+class SpeculativeTurn:
+    """Một lượt sinh trước của bên gọi; orchestrator chờ `result_async` hoặc gọi `discard_async`"""
+
+    def __init__(self, agent, message: str):
+        self.agent = agent
+        # Độ dài lịch sử trước khi sinh, để khôi phục khi bỏ lượt này
+        self.mark = len(agent.conversation_history)
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.task = asyncio.ensure_future(agent.generate_response_async(message))
+        self.task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Future) -> None:
+        self.finished = time.perf_counter()
+
+    def overlap(self, manager_finished: float) -> float:
+        """Thời gian tiết kiệm so với chạy tuần tự: phần manager và bên gọi chạy chồng lên nhau"""
+        finished = self.finished if self.finished is not None else time.perf_counter()
+        return max(0.0, min(manager_finished, finished) - self.started)
+
+    async def result_async(self) -> str:
+        return await self.task
+
+    async def discard_async(self) -> bool:
+        """Bỏ lượt sinh trước; trả về True nếu request đã chạy xong (tokens đã tốn) trước khi bị bỏ"""
+        completed = self.task.done()
+        if not completed:
+            self.task.cancel()
+            await asyncio.wait([self.task])
+        elif not self.task.cancelled() and self.task.exception() is None:
+            # Xoá câu của người dùng và câu trả lời vừa được thêm vào lịch sử của agent
+            del self.agent.conversation_history[self.mark:]
+        return completed
+
+
+class SpeculationRegistry:
+    """Bật/tắt sinh trước và thống kê số lượt bị bỏ theo từng loại hội thoại, dùng chung cho toàn process"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.logger = logging.getLogger(__name__)
+        self.configure(config.SPECULATIVE_LEFT_TURN)
+
+    def configure(self, enabled: bool) -> None:
+        with self._lock:
+            self.enabled = enabled
+            self.by_label: Dict[str, Dict[str, float]] = {}
+
+    def record(self, label: str, wasted: bool, completed: bool = True, saved_seconds: float = 0.0) -> None:
+        with self._lock:
+            entry = self.by_label.setdefault(
+                label, {"speculated": 0, "wasted": 0, "cancelled": 0, "saved_seconds": 0.0}
+            )
+            entry["speculated"] += 1
+            if wasted:
+                entry["wasted"] += 1
+                entry["cancelled"] += not completed
+            else:
+                entry["saved_seconds"] += saved_seconds
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            by_label = {label: dict(entry) for label, entry in self.by_label.items()}
+        speculated = sum(entry["speculated"] for entry in by_label.values())
+        wasted = sum(entry["wasted"] for entry in by_label.values())
+        return {
+            "enabled": self.enabled,
+            "speculated": speculated,
+            "wasted": wasted,
+            "cancelled": sum(entry["cancelled"] for entry in by_label.values()),
+            "saved_seconds": sum(entry["saved_seconds"] for entry in by_label.values()),
+            "wasted_rate": wasted / speculated if speculated else 0.0,
+            "by_label": by_label,
+        }
+
+
+_speculation_registry = SpeculationRegistry()
+
+
+def get_speculation_registry() -> SpeculationRegistry:
+    """Trả về registry sinh trước dùng chung của process"""
+    return _speculation_registry
+
+
+def configure_speculation(enabled: bool = config.SPECULATIVE_LEFT_TURN) -> SpeculationRegistry:
+    """Bật/tắt sinh trước lượt của bên gọi từ tham số dòng lệnh và đặt lại thống kê"""
+    _speculation_registry.configure(enabled)
+    if enabled:
+        _speculation_registry.logger.info(
+            "⏩ Sinh trước lượt của bên gọi song song với manager (bỏ đi nếu manager kết thúc hội thoại)"
+        )
+    return _speculation_registry
+
+
+def format_speculation_stats(stats: Dict[str, Any]) -> str:
+    """Định dạng thống kê sinh trước để ghi log, kèm tỉ lệ bị bỏ theo từng loại hội thoại"""
+    if not stats["enabled"]:
+        return "Sinh trước lượt của bên gọi: tắt"
+    lines = [
+        f"Sinh trước lượt của bên gọi: {stats['speculated']} lượt, {stats['wasted']} lượt bị bỏ "
+        f"({stats['wasted_rate']:.1%}, {stats['cancelled']} lượt huỷ kịp trước khi xong), "
+        f"tiết kiệm khoảng {stats['saved_seconds']:.1f}s chờ"
+    ]
+    for label, entry in sorted(stats["by_label"].items(), key=lambda item: -item[1]["wasted"] / item[1]["speculated"]):
+        lines.append(
+            f"  - {label}: {entry['wasted']}/{entry['speculated']} bị bỏ "
+            f"({entry['wasted'] / entry['speculated']:.0%}), tiết kiệm {entry['saved_seconds']:.1f}s"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,492 @@
+"""
+Wave Runner - Chế độ theo đợt (--mode wave) cho các lượt chạy lớn không cần độ trễ thấp: mọi hội thoại cùng tiến
+một câu thoại mỗi đợt, request của cả đợt gửi thành một batch job (utils/batch_job_client.py), phán quyết của manager
+được áp dụng khi đợt xong. Trạng thái lưu ra đĩa sau mỗi đợt: chạy lại với cùng --wave_dir thì tiếp tục từ đợt
+cuối cùng đã xong (job đã gửi nhưng chưa đọc kết quả thì chờ tiếp job đó, không gửi lại)
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from threading import Lock
+from typing import Dict, Any, List, Optional, Tuple
+
+from agents.left_agent import LeftAgent
+from agents.right_agent import RightAgent
+from agents.manager_agent import ManagerAgent
+from agents.manager_verdict import ManagerVerdict
+from agents.prompts.manager_prompts import LEFT_TERMINATION_PROMPT, RIGHT_TERMINATION_PROMPT
+from logic.evaluation_schedule import create_evaluation_schedule, get_evaluation_registry
+from logic.termination_detector import create_termination_detector, get_detector_registry
+from logic.end_call_annotation import PENDING_FIELD
+from utils.batch_job_client import BatchJobClient, BatchJobError, write_jsonl
+import config
+
+STATE_FILE = "state.json"
+ENDCALL_SIGNAL = "##ENDCALL_SIGNAL##"
+
+# Bước tiếp theo của một hội thoại
+OPEN = "open"          # Bên gọi sinh câu mở đầu
+RIGHT = "right"        # Người dùng trả lời
+LEFT = "left"          # Bên gọi trả lời, kèm đánh giá của manager nếu tới lịch
+CLOSING = "closing"    # Các câu kết thúc sau khi manager hoặc bộ phát hiện cục bộ kết thúc hội thoại
+END_CALL = "end_call"  # Manager đánh giá lý do ngắt máy
+DONE = "done"
+FAILED = "failed"
+
+MANAGER = "manager"
+# Câu kết thúc theo bên kết thúc, như DialogueOrchestrator.handle_termination_async:
+# *_close là câu kết theo LEFT/RIGHT_TERMINATION_PROMPT, left/right là câu trả lời thường của bên còn lại
+CLOSING_STEPS = {
+    "left": ["left_close", "right"],
+    "right": ["right_close", "left"],
+    "natural": ["left_close", "right"],
+}
+CLOSING_PROMPTS = {"left_close": LEFT_TERMINATION_PROMPT, "right_close": RIGHT_TERMINATION_PROMPT}
+
+# Các trường trạng thái của lịch đánh giá cần giữ giữa các đợt (phần còn lại là cấu hình)
+SCHEDULE_FIELDS = ("last_turn", "first_turn", "skipped", "current_gap")
+
+
+class WaveDialogue:
+    """Một hội thoại ở chế độ theo đợt; `state` ghi được ra JSON, agent và lịch đánh giá dựng lại từ đó khi tiếp tục.
+
+    Lịch sử của từng agent suy ra từ bản ghi cuộc gọi nên không cần lưu riêng; request luôn gửi toàn bộ lịch sử
+    (bộ nhớ có giới hạn cần request tóm tắt ngoài đợt nên không dùng ở chế độ này).
+    """
+
+    def __init__(self, state: Dict[str, Any], client: BatchJobClient, max_turns: int,
+                 incremental: bool = True, defer_end_call_reasons: bool = False, max_attempts: int = 3):
+        self.state = state
+        self.max_turns = max_turns
+        self.defer_end_call_reasons = defer_end_call_reasons
+        self.max_attempts = max(1, max_attempts)
+        profile = state["profile"]
+        self.left_agent = LeftAgent(model=client.model, fraud_type=profile["fraud_type"], client=client)
+        self.right_agent = RightAgent(
+            model=client.model,
+            user_profile={"age": profile["user_age"], "awareness": profile["user_awareness"], "occupation": profile["occupation"]},
+            client=client
+        )
+        self.manager_agent = ManagerAgent(model=client.model, strictness="medium", client=client, incremental=incremental)
+        verdict = state["manager"]["verdict"]
+        self.manager_agent.last_verdict = ManagerVerdict(**verdict) if verdict else None
+        self.manager_agent.evaluated = state["manager"]["evaluated"]
+        self.schedule = create_evaluation_schedule()
+        for field, value in state["schedule"].items():
+            setattr(self.schedule, field, value)
+        self.detector = create_termination_detector()
+        if self.detector is not None:
+            self.detector.repeats = state["detector"]["repeats"]
+            self.detector.fired = set(state["detector"]["fired"])
+
+    @staticmethod
+    def new_state(tts_id: str, profile: Dict[str, Any], opening: Optional[str] = None) -> Dict[str, Any]:
+        """Trạng thái ban đầu; có câu mở đầu sẵn (kho câu mở đầu) thì bắt đầu từ lượt trả lời của người dùng"""
+        return {
+            "tts_id": tts_id,
+            "profile": profile,
+            "history": [{"role": "left", "content": opening, "model": None, "timestamp": time.time()}] if opening else [],
+            "step": RIGHT if opening else OPEN,
+            "turn": 0,
+            "evaluate": False,
+            "closing": [],
+            "attempts": 0,
+            "error": None,
+            "terminated_by_manager": False,
+            "terminated_locally": False,
+            "end_call_signal_detected": False,
+            PENDING_FIELD: False,
+            "termination_reason": "",
+            "terminator": "",
+            "conclusion_messages": [],
+            "local_flags": [],
+            "evaluations": 0,
+            "end_call_reviews": 0,
+            "discarded": 0,
+            "manager": {"verdict": None, "evaluated": 0},
+            "schedule": {},
+            "detector": {"repeats": 0, "fired": []},
+        }
+
+    @property
+    def tts_id(self) -> str:
+        return self.state["tts_id"]
+
+    @property
+    def active(self) -> bool:
+        return self.state["step"] not in (DONE, FAILED)
+
+    @property
+    def history(self) -> List[Dict[str, Any]]:
+        return self.state["history"]
+
+    def kinds(self) -> List[str]:
+        """Loại các request của hội thoại trong đợt này"""
+        step = self.state["step"]
+        if step in (OPEN, LEFT):
+            return [LEFT, MANAGER] if step == LEFT and self.state["evaluate"] else [LEFT]
+        if step == RIGHT:
+            return [RIGHT]
+        if step == CLOSING:
+            return [self.state["closing"][0]]
+        if step == END_CALL:
+            return [END_CALL]
+        return []
+
+    def _messages(self, agent) -> List[Dict[str, str]]:
+        """System prompt của agent và bản ghi cuộc gọi theo góc nhìn của agent: câu của nó là assistant, bên kia là user"""
+        return [{"role": "system", "content": agent.get_system_prompt()}] + [
+            {"role": "assistant" if message["role"] == agent.role else "user", "content": message["content"]}
+            for message in self.history
+        ]
+
+    async def requests_async(self) -> List[Tuple[str, List[Dict[str, str]], Dict[str, Any]]]:
+        """Các request của đợt này: (loại, messages, tham số sinh), cùng nội dung với request của chế độ agent"""
+        requests = []
+        for kind in self.kinds():
+            if kind == MANAGER:
+                requests.append((kind, await self.manager_agent.evaluation_messages_async(self.history),
+                                 {**self.manager_agent.generation_config, "response_schema": self.manager_agent.verdict_schema}))
+            elif kind == END_CALL:
+                requests.append((kind, await self.manager_agent.end_call_messages_async(self.history, self.state["terminator"]),
+                                 {**self.manager_agent.generation_config, "response_schema": self.manager_agent.end_call_schema}))
+            elif kind in CLOSING_PROMPTS:
+                agent = self.left_agent if kind == "left_close" else self.right_agent
+                messages = self._messages(agent) + [{"role": "user", "content": CLOSING_PROMPTS[kind]}]
+                requests.append((kind, messages, config.GENERATION_CONFIG["conclusion"]))
+            else:
+                agent = self.left_agent if kind == LEFT else self.right_agent
+                messages = self._messages(agent)
+                if not self.history:
+                    messages.append({"role": "user", "content": LeftAgent.OPENING_REQUEST})
+                requests.append((kind, messages, agent.generation_config))
+        return requests
+
+    def apply(self, replies: Dict[str, Optional[str]]) -> int:
+        """Áp dụng kết quả của đợt, trả về số request lỗi. Thiếu kết quả nào thì cả bước được gửi lại ở đợt sau;
+        lỗi `max_attempts` đợt liên tiếp thì bỏ hội thoại"""
+        state = self.state
+        failed = [kind for kind, reply in replies.items()
+                  if not (reply and reply.strip()) or (kind == RIGHT and "API" in reply)]
+        if failed:
+            state["attempts"] += 1
+            if state["attempts"] >= self.max_attempts:
+                state["step"] = FAILED
+                state["error"] = f"Request {', '.join(failed)} lỗi ở {state['attempts']} đợt liên tiếp"
+            return len(failed)
+        state["attempts"] = 0
+
+        step = state["step"]
+        if step == OPEN:
+            self._append("left", replies[LEFT])
+            state["step"] = RIGHT
+        elif step == RIGHT:
+            self._after_right(replies[RIGHT])
+        elif step == LEFT:
+            self._after_left(replies[LEFT], replies.get(MANAGER))
+        elif step == CLOSING:
+            kind = state["closing"].pop(0)
+            role = "left" if kind.startswith("left") else "right"
+            self._append(role, replies[kind])
+            state["conclusion_messages"].append({"role": role, "content": replies[kind]})
+            if not state["closing"]:
+                self._finish()
+        elif step == END_CALL:
+            state["end_call_reviews"] += 1
+            state["termination_reason"] = self.manager_agent.read_end_call_verdict(replies[END_CALL], state["terminator"]).reason
+            self._finish()
+        return 0
+
+    def _append(self, role: str, content: str) -> None:
+        # Mỗi batch job chỉ chạy một model nên mọi câu đều do model của client sinh ra
+        self.history.append({"role": role, "content": content, "model": self.left_agent.model, "timestamp": time.time()})
+
+    def _after_right(self, reply: str) -> None:
+        """Câu của người dùng: ngắt máy, phát hiện cục bộ, rồi xếp lượt của bên gọi (kèm manager nếu tới lịch)"""
+        state = self.state
+        self._append("right", reply)
+        if ENDCALL_SIGNAL in reply:
+            self._end_call("right", "Người dùng chủ động ngắt máy")
+            return
+        verdict = self.detector.check(self.history) if self.detector else None
+        if verdict is not None:
+            ended = self.detector.mode == "end"
+            state["local_flags"].append({"turn": state["turn"], **verdict.to_dict()})
+            get_detector_registry().record(verdict, ended, self.max_turns - state["turn"])
+            if ended:
+                state["terminated_locally"] = True
+                state["termination_reason"] = verdict.reason
+                state["terminator"] = verdict.terminator
+                self._close(verdict.terminator)
+                return
+        state["evaluate"] = verdict is not None or self.schedule.should_evaluate(self.history, state["turn"], self.max_turns)
+        state["step"] = LEFT
+
+    def _after_left(self, reply: str, manager_reply: Optional[str]) -> None:
+        """Câu của bên gọi sinh cùng đợt với phán quyết của manager: manager kết thúc thì câu đó bị bỏ
+        (như lượt sinh trước của logic/speculation.py), ngược lại câu được giữ và hội thoại sang lượt mới"""
+        state = self.state
+        if state["evaluate"]:
+            verdict = self.manager_agent.read_verdict(manager_reply, self.history)
+            state["evaluations"] += 1
+            self.schedule.record(state["turn"], verdict.should_terminate)
+            if verdict.should_terminate:
+                state["discarded"] += 1
+                state["terminated_by_manager"] = True
+                state["termination_reason"] = verdict.reason
+                state["terminator"] = verdict.terminator
+                self._close(verdict.terminator)
+                return
+        self._append("left", reply)
+        if ENDCALL_SIGNAL in reply:
+            self._end_call("left", "Kẻ lừa đảo chủ động ngắt máy")
+            return
+        state["turn"] += 1
+        if state["turn"] < self.max_turns:
+            state["step"] = RIGHT
+        else:
+            self._finish()
+
+    def _end_call(self, terminator: str, reason: str) -> None:
+        """Một bên ngắt máy: manager đánh giá lý do ở đợt sau, hoặc để annotate_end_calls.py điền sau theo lô"""
+        state = self.state
+        state["end_call_signal_detected"] = True
+        state["terminator"] = terminator
+        state["termination_reason"] = reason
+        if self.defer_end_call_reasons:
+            state[PENDING_FIELD] = True
+            self._finish()
+        else:
+            state["step"] = END_CALL
+
+    def _close(self, terminator: str) -> None:
+        self.state["closing"] = list(CLOSING_STEPS.get(terminator, CLOSING_STEPS["natural"]))
+        self.state["step"] = CLOSING
+
+    def _finish(self) -> None:
+        self.state["step"] = DONE
+        get_evaluation_registry().record(self.state["evaluations"], self.state["end_call_reviews"], self.schedule.skipped)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Đồng bộ trạng thái của manager, lịch đánh giá và bộ phát hiện vào `state` trước khi lưu"""
+        verdict = self.manager_agent.last_verdict
+        self.state["manager"] = {"verdict": verdict.to_dict() if verdict else None, "evaluated": self.manager_agent.evaluated}
+        self.state["schedule"] = {field: value for field, value in vars(self.schedule).items() if field in SCHEDULE_FIELDS}
+        if self.detector is not None:
+            self.state["detector"] = {"repeats": self.detector.repeats, "fired": sorted(self.detector.fired)}
+        return self.state
+
+    def result(self) -> Dict[str, Any]:
+        """Kết quả theo cấu trúc của DialogueOrchestrator.run_dialogue_async"""
+        state = self.state
+        return {
+            "dialogue_history": [{**message, "content": message["content"].replace(ENDCALL_SIGNAL, "")}
+                                 for message in self.history],
+            "turns": state["turn"],
+            "terminated_by_manager": state["terminated_by_manager"],
+            "terminated_locally": state["terminated_locally"],
+            "local_flags": state["local_flags"],
+            "end_call_signal_detected": state["end_call_signal_detected"],
+            PENDING_FIELD: state[PENDING_FIELD],
+            "termination_reason": state["termination_reason"],
+            "terminator": state["terminator"],
+            "conclusion_messages": state["conclusion_messages"],
+            "reached_max_turns": state["turn"] >= self.max_turns,
+            "manager_calls": state["evaluations"] + state["end_call_reviews"],
+            "speculative_turns": state["evaluations"],
+            "wasted_speculations": state["discarded"],
+            "mode": "wave",
+        }
+
+
+class WaveRunner:
+    """Chạy các hội thoại theo đợt, mỗi đợt một batch job, lưu trạng thái vào `state_dir/state.json` sau mỗi đợt"""
+
+    def __init__(self, state_dir: str, client: BatchJobClient, max_turns: int = 15, incremental: bool = True,
+                 defer_end_call_reasons: bool = False, max_attempts: int = config.WAVE_MAX_ATTEMPTS):
+        self.state_dir = state_dir
+        self.path = os.path.join(state_dir, STATE_FILE)
+        self.client = client
+        self.max_turns = max_turns
+        self.incremental = incremental
+        self.defer_end_call_reasons = defer_end_call_reasons
+        self.max_attempts = max(1, max_attempts)
+        self.logger = logging.getLogger(__name__)
+        self.state: Dict[str, Any] = {}
+        self.dialogues: List[WaveDialogue] = []
+
+    def _load_dialogues(self) -> None:
+        self.dialogues = [
+            WaveDialogue(state, self.client, self.max_turns, self.incremental, self.defer_end_call_reasons, self.max_attempts)
+            for state in self.state["dialogues"]
+        ]
+
+    def resume(self) -> bool:
+        """Nạp trạng thái đã lưu trong `state_dir`; False nếu chưa có (lượt chạy mới)"""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "r", encoding="utf-8") as f:
+            self.state = json.load(f)
+        if self.state["model"] != self.client.model or self.state["max_turns"] != self.max_turns:
+            raise ValueError(
+                f"{self.path} thuộc lượt chạy với model {self.state['model']}, max_turns {self.state['max_turns']}; "
+                f"dùng --wave_dir khác để bắt đầu lượt chạy mới"
+            )
+        self._load_dialogues()
+        get_wave_registry().record_resume(self.state["wave"])
+        self.logger.info(f"🌊 Tiếp tục lượt chạy theo đợt từ {self.path}: đã xong {self.state['wave']} đợt, "
+                         f"{sum(d.active for d in self.dialogues)}/{len(self.dialogues)} hội thoại chưa xong")
+        return True
+
+    def begin(self, states: List[Dict[str, Any]]) -> None:
+        """Bắt đầu lượt chạy mới với trạng thái ban đầu của từng hội thoại (WaveDialogue.new_state)"""
+        os.makedirs(self.state_dir, exist_ok=True)
+        self.state = {"model": self.client.model, "max_turns": self.max_turns, "wave": 0, "job": None, "dialogues": states}
+        self._load_dialogues()
+        self.save()
+
+    def save(self) -> None:
+        """Ghi state.json qua file tạm rồi đổi tên: bị dừng giữa lúc ghi thì vẫn còn bản của đợt trước"""
+        self.state["dialogues"] = [dialogue.snapshot() for dialogue in self.dialogues]
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def run(self) -> List[WaveDialogue]:
+        """Chạy các đợt tới khi không còn hội thoại nào đang dở, trả về mọi hội thoại (đã xong hoặc bị bỏ)"""
+        while True:
+            active = [dialogue for dialogue in self.dialogues if dialogue.active]
+            if not active:
+                break
+            self._run_wave(self.state["wave"] + 1, active)
+        get_wave_registry().record_usage(self.client.usage_totals, self.client.jobs)
+        return self.dialogues
+
+    async def _build_lines_async(self, active: List[WaveDialogue]) -> List[Dict[str, Any]]:
+        lines = []
+        for dialogue in active:
+            for kind, messages, generation_config in await dialogue.requests_async():
+                lines.append(self.client.build_line(f"{dialogue.tts_id}/{kind}", messages, **generation_config))
+        return lines
+
+    def _run_wave(self, wave: int, active: List[WaveDialogue]) -> None:
+        prefix = os.path.join(self.state_dir, f"wave_{wave:04d}")
+        requests_path, results_path = f"{prefix}.requests.jsonl", f"{prefix}.results.jsonl"
+        job = self.state.get("job")
+        name = job["name"] if job and job["wave"] == wave else None
+        if not os.path.exists(results_path):
+            if name is None:
+                write_jsonl(requests_path, asyncio.run(self._build_lines_async(active)))
+            self._run_job(wave, requests_path, results_path, name)
+        results = self.client.read_results(results_path)
+
+        requests = failed = 0
+        for dialogue in active:
+            kinds = dialogue.kinds()
+            requests += len(kinds)
+            failed += dialogue.apply({kind: results.get(f"{dialogue.tts_id}/{kind}") for kind in kinds})
+        self.state["wave"] = wave
+        self.state["job"] = None
+        self.save()
+        remaining = sum(dialogue.active for dialogue in self.dialogues)
+        get_wave_registry().record_wave(requests, failed)
+        self.logger.info(f"🌊 Đợt {wave}: {len(active)} hội thoại, {requests} request ({failed} lỗi), "
+                         f"còn {remaining} hội thoại chưa xong")
+
+    def _run_job(self, wave: int, requests_path: str, results_path: str, name: Optional[str]) -> None:
+        """Gửi (hoặc chờ tiếp) batch job của đợt; job thất bại/hết hạn thì gửi lại, tối đa `max_attempts` lần"""
+        def on_submitted(job_name: str) -> None:
+            # Lưu tên job trước khi chờ: bị dừng trong lúc chờ thì lần chạy sau chờ tiếp job này thay vì gửi lại
+            self.state["job"] = {"wave": wave, "name": job_name}
+            self.save()
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.client.run(requests_path, results_path, f"wave-{wave:04d}", name, on_submitted)
+                return
+            except BatchJobError as e:
+                self.logger.warning(f"⚠️ Batch job của đợt {wave} lỗi (lần thử {attempt}/{self.max_attempts}): {e}")
+                name = None
+                self.state["job"] = None
+                self.save()
+        raise BatchJobError(f"Batch job của đợt {wave} lỗi {self.max_attempts} lần liên tiếp")
+
+
+class WaveRegistry:
+    """Chế độ theo đợt có bật không và thống kê đợt/batch job, dùng chung cho toàn process"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.logger = logging.getLogger(__name__)
+        self.configure(config.GENERATION_MODE == "wave")
+
+    def configure(self, enabled: bool) -> None:
+        with self._lock:
+            self.enabled = enabled
+            self.resumed_from = None
+            self.waves = 0
+            self.requests = 0
+            self.failed = 0
+            self.jobs = 0
+            self.prompt_tokens = 0
+            self.output_tokens = 0
+
+    def record_resume(self, wave: int) -> None:
+        with self._lock:
+            self.resumed_from = wave
+
+    def record_wave(self, requests: int, failed: int) -> None:
+        with self._lock:
+            self.waves += 1
+            self.requests += requests
+            self.failed += failed
+
+    def record_usage(self, usage: Dict[str, int], jobs: int) -> None:
+        with self._lock:
+            self.jobs += jobs
+            self.prompt_tokens += usage["prompt_tokens"]
+            self.output_tokens += usage["output_tokens"]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "resumed_from": self.resumed_from,
+                "waves": self.waves,
+                "requests": self.requests,
+                "failed": self.failed,
+                "jobs": self.jobs,
+                "prompt_tokens": self.prompt_tokens,
+                "output_tokens": self.output_tokens,
+            }
+
+
+_wave_registry = WaveRegistry()
+
+
+def get_wave_registry() -> WaveRegistry:
+    """Trả về registry chế độ theo đợt dùng chung của process"""
+    return _wave_registry
+
+
+def configure_wave_mode(enabled: bool, state_dir: str = config.WAVE_STATE_DIR) -> WaveRegistry:
+    """Bật/tắt chế độ theo đợt từ tham số dòng lệnh, đặt lại thống kê"""
+    _wave_registry.configure(enabled)
+    if enabled:
+        _wave_registry.logger.info(f"🌊 Chế độ theo đợt: mỗi đợt các hội thoại tiến một câu thoại bằng một batch job, trạng thái lưu ở {state_dir}")
+    return _wave_registry
+
+
+def format_wave_stats(stats: Dict[str, Any]) -> str:
+    """Định dạng thống kê chế độ theo đợt để ghi log"""
+    if not stats["enabled"]:
+        return "Chế độ theo đợt: tắt"
+    resumed = f", tiếp tục sau đợt {stats['resumed_from']}" if stats["resumed_from"] is not None else ""
+    return (
+        f"Chế độ theo đợt: {stats['waves']} đợt{resumed}, {stats['jobs']} batch job, {stats['requests']} request "
+        f"({stats['failed']} lỗi, gửi lại ở đợt sau), tokens vào/ra {stats['prompt_tokens']}/{stats['output_tokens']}"
+    )
@@ -24,17 +24,60 @@ import config
 from agents.left_agent import LeftAgent
 from agents.right_agent import RightAgent
 from agents.manager_agent import ManagerAgent
+from agents.prompts import precompile_system_prompts
+from agents.memory import configure_memory, get_memory_registry, format_memory_stats, parse_memory_roles
 from logic.dialogue_orchestrator import DialogueOrchestrator
+from logic.evaluation_schedule import configure_evaluation_schedule, get_evaluation_registry, format_evaluation_stats, SCHEDULES
+from logic.termination_detector import configure_termination_detector, get_detector_registry, format_detector_stats, DETECTOR_MODES
+from logic.speculation import configure_speculation, get_speculation_registry, format_speculation_stats
+from logic.end_call_annotation import PENDING_FIELD
 from utils.stratified_sampling import StratifiedSampler
+from utils.http_pool import configure_session_pool, get_session_pool, format_pool_stats
+from utils.api_key_pool import configure_key_pool, get_key_pool, format_key_pool_stats, load_api_keys
+from utils.concurrency_controller import configure_concurrency_controller, get_concurrency_controller, format_concurrency_stats
+from utils.retry_policy import NonRetryableError, RetryBudgetExhausted, configure_retry_policy, get_retry_policy, format_retry_stats
+from utils.circuit_breaker import configure_circuit_breaker, get_circuit_breaker, format_breaker_stats
+from utils.gemini_client import create_gemini_client, release_context_caches
+from utils.cassette import configure_cassette, get_cassette, format_cassette_stats, CASSETTE_MODES
+from utils.context_cache import configure_context_cache, get_context_cache, format_context_cache_stats
+from utils.opening_pool import configure_opening_pool, get_opening_pool, format_opening_pool_stats
 
 class OptimizedDialogueGenerator:
     """Generator tối ưu với retry logic và rate limiting"""
     
-    def __init__(self, api_key: str, model: str, max_workers: int = 3, delay: float = 2.0):
+    def __init__(self, api_key: str, model: str, max_workers: int = 3, delay: float = 2.0,
+                 rpm: int = config.RATE_LIMIT_RPM, tpm: int = config.RATE_LIMIT_TPM,
+                 burst: int = config.RATE_LIMIT_BURST,
+                 retries_per_request: int = config.RETRY_ATTEMPTS_PER_REQUEST,
+                 retry_budget_dialogue: int = config.RETRY_BUDGET_PER_DIALOGUE,
+                 retry_budget_run: int = config.RETRY_BUDGET_PER_RUN,
+                 breaker_threshold: int = config.CIRCUIT_BREAKER_THRESHOLD,
+                 breaker_cooldown: float = config.CIRCUIT_BREAKER_COOLDOWN,
+                 base_url: str = config.GEMINI_BASE_URL,
+                 cassette: Optional[str] = None,
+                 cassette_mode: str = "auto",
+                 api_keys: Optional[List[str]] = None,
+                 context_cache: bool = config.CONTEXT_CACHE_ENABLED,
+                 cache_ttl: int = config.CONTEXT_CACHE_TTL,
+                 memory_window: int = config.MEMORY_WINDOW_TURNS,
+                 summary_every: int = config.MEMORY_SUMMARY_EVERY,
+                 memory_roles: Optional[List[str]] = None,
+                 incremental_manager: bool = config.MANAGER_INCREMENTAL_EVAL,
+                 manager_schedule: str = config.MANAGER_SCHEDULE,
+                 manager_every: int = config.MANAGER_EVAL_EVERY,
+                 manager_max_gap: int = config.MANAGER_EVAL_MAX_GAP,
+                 local_detector: str = config.LOCAL_DETECTOR_MODE,
+                 speculative: bool = config.SPECULATIVE_LEFT_TURN,
+                 defer_end_call_reasons: bool = config.DEFER_END_CALL_REASONS,
+                 opening_pool: Optional[str] = None):
         self.api_key = api_key
         self.model = model
+        self.base_url = base_url
         self.max_workers = max_workers
         self.delay = delay
+        # Manager chỉ nhận các lượt mới kể từ phán quyết trước
+        self.incremental_manager = incremental_manager
+        self.defer_end_call_reasons = defer_end_call_reasons
         
         # Initialize Stratified Sampler
         self.stratified_sampler = StratifiedSampler()
@@ -42,10 +85,38 @@ class OptimizedDialogueGenerator:
         # Cập nhật config
         config.GEMINI_API_KEY = api_key
         config.DEFAULT_MODEL = model
+        config.GEMINI_BASE_URL = base_url
+        
+        # Pool kết nối keep-alive dùng chung, kích thước khớp số worker
+        configure_session_pool(max_workers)
+        # rpm/tpm là quota của từng key; request đi theo key ít tải nhất
+        configure_key_pool(api_keys or [api_key], rpm, tpm, burst)
+        # Các agent của một dialogue gọi API tuần tự nên mỗi worker có tối đa một request in-flight
+        configure_concurrency_controller(initial_limit=max_workers, max_limit=max_workers)
+        # Một retry policy cho cả ba tầng: request, hội thoại và cả batch
+        configure_retry_policy(retries_per_request, retry_budget_dialogue, retry_budget_run)
+        configure_circuit_breaker(breaker_threshold, breaker_cooldown)
+        # Record/replay response Gemini để chạy lại batch không tốn request
+        configure_cassette(cassette, cassette_mode if cassette else "off")
+        # System prompt lặp lại giữa các lượt được lưu thành cachedContents phía server
+        configure_context_cache(context_cache, cache_ttl, config.CONTEXT_CACHE_MIN_TOKENS, config.CONTEXT_CACHE_MIN_USES)
+        # Hội thoại dài chỉ gửi lại các lượt gần nhất kèm bản tóm tắt cuốn chiếu của các lượt cũ
+        configure_memory(memory_window, summary_every, config.MEMORY_ROLES if memory_roles is None else memory_roles)
+        # Nhịp đánh giá của manager: fixed giữ nhịp cũ, backoff/hazard bỏ qua các lần kiểm tra ít thông tin
+        configure_evaluation_schedule(manager_schedule, manager_every, config.MANAGER_EVAL_MIN_MESSAGES, manager_max_gap)
+        # Hội thoại đã ngã ngũ (lộ thông tin, từ chối, lặp lại) được phát hiện cục bộ, không tốn request API
+        configure_termination_detector(local_detector)
+        # Soạn trước lượt tiếp theo của kẻ lừa đảo trong lúc manager đánh giá
+        configure_speculation(speculative)
+        # Câu mở đầu dựng sẵn thay cho lượt đầu tiên (chưa có ngữ cảnh) của kẻ lừa đảo
+        configure_opening_pool(opening_pool)
         
         # Setup logging
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
+        
+        # System prompt chỉ chứa các phần khớp với từng hội thoại; dựng sẵn mọi biến thể một lần từ đầu
+        self.logger.info(f"Precompiled {precompile_system_prompts()} system prompt variants")
     
     def generate_single_dialogue(self, params: Dict[str, Any]) -> Dict[str, Any]:
         """Sinh một hội thoại với retry logic"""
@@ -53,7 +124,12 @@ class OptimizedDialogueGenerator:
         dialogue_type = params['type']  # 'fraud' hoặc 'normal'
         
         max_retries = 3
+        policy = get_retry_policy()
         for attempt in range(max_retries):
+            # Sinh lại cả hội thoại cũng là một lần retry, trừ vào budget của lượt chạy
+            if attempt > 0 and not policy.run_budget.try_consume():
+                self.logger.error(f"Retry budget of the run exhausted, giving up {dialogue_id}")
+                break
             try:
                 if dialogue_type == 'fraud':
                     result = self._generate_fraud_dialogue(params)
@@ -65,9 +141,18 @@ class OptimizedDialogueGenerator:
                     result['generation_params'] = params
                     return result
                     
+            except RetryBudgetExhausted as e:
+                # Hội thoại đã dùng hết budget: dừng ngay, không sinh lại
+                policy.record_exhausted()
+                self.logger.error(f"Dialogue {dialogue_id} failed fast: {e}")
+                return {"error": f"Failed to generate dialogue {dialogue_id}: {e}"}
+            except NonRetryableError as e:
+                # 400/401/403/404: sinh lại hội thoại cũng nhận đúng lỗi đó
+                self.logger.error(f"Dialogue {dialogue_id} failed with a non-retryable error: {e}")
+                return {"error": f"Failed to generate dialogue {dialogue_id}: {e}"}
             except requests.exceptions.HTTPError as e:
                 if "429" in str(e):  # Rate limit
-                    wait_time = (2 ** attempt) * self.delay  # Exponential backoff
+                    wait_time = policy.backoff(attempt, base_delay=self.delay)  # Exponential backoff
                     self.logger.warning(f"Rate limit hit for {dialogue_id}, waiting {wait_time}s...")
                     time.sleep(wait_time)
                     continue
@@ -85,10 +170,14 @@ class OptimizedDialogueGenerator:
     
     def _generate_fraud_dialogue(self, params: Dict[str, Any]) -> Dict[str, Any]:
         """Sinh hội thoại lừa đảo"""
+        # Ba agent dùng chung một client nên dùng chung budget retry của hội thoại
+        client = create_gemini_client(self.api_key, self.model, base_url=self.base_url)
+        
         left_agent = LeftAgent(
             model=self.model,
             api_key=self.api_key,
-            fraud_type=params['fraud_type']
+            fraud_type=params['fraud_type'],
+            client=client
         )
         
         right_agent = RightAgent(
@@ -98,23 +187,27 @@ class OptimizedDialogueGenerator:
                 "age": params['age'],
                 "awareness": params['awareness'],
                 "occupation": params['occupation']
-            }
+            },
+            client=client
         )
         
         manager_agent = ManagerAgent(
             model=self.model,
             api_key=self.api_key,
-            strictness=params.get('strictness', 'medium')
+            strictness=params.get('strictness', 'medium'),
+            client=client,
+            incremental=self.incremental_manager
         )
         
         orchestrator = DialogueOrchestrator(
             left_agent=left_agent,
             right_agent=right_agent,
             manager_agent=manager_agent,
-            max_turns=params.get('max_turns', 25)
+            max_turns=params.get('max_turns', 25),
+            defer_end_call_reasons=self.defer_end_call_reasons
         )
         
-        result = orchestrator.run_dialogue()
+        result = orchestrator.run_dialogue(get_opening_pool().take(params['fraud_type']))
         
         # Thêm delay để tránh rate limit
         time.sleep(self.delay)
@@ -171,6 +264,22 @@ class OptimizedDialogueGenerator:
                 except Exception as e:
                     errors.append({"task": task, "error": str(e)})
         
+        self.logger.info(format_pool_stats(get_session_pool().stats()))
+        self.logger.info(format_key_pool_stats(get_key_pool().stats()))
+        self.logger.info(format_concurrency_stats(get_concurrency_controller().stats()))
+        self.logger.info(format_retry_stats(get_retry_policy().stats()))
+        self.logger.info(format_breaker_stats(get_circuit_breaker().stats()))
+        if get_cassette().enabled:
+            self.logger.info(format_cassette_stats(get_cassette().stats()))
+        if get_context_cache().enabled:
+            self.logger.info(format_context_cache_stats(get_context_cache().stats()))
+            self.logger.info(f"🗄️ Deleted {release_context_caches(self.base_url)} context caches")
+        self.logger.info(format_memory_stats(get_memory_registry().stats()))
+        self.logger.info(format_evaluation_stats(get_evaluation_registry().stats()))
+        self.logger.info(format_detector_stats(get_detector_registry().stats()))
+        self.logger.info(format_speculation_stats(get_speculation_registry().stats()))
+        self.logger.info(format_opening_pool_stats(get_opening_pool().stats()))
+        
         # Save results
         with open(output_file, 'w', encoding='utf-8') as f:
             for result in results:
@@ -187,6 +296,9 @@ class OptimizedDialogueGenerator:
                     "termination_reason": result.get('termination_reason', ''),
                     "terminator": result.get('terminator', 'unknown')
                 }
+                if result.get(PENDING_FIELD):
+                    # Lý do kết thúc cuộc gọi được điền sau bằng annotate_end_calls.py
+                    simplified[PENDING_FIELD] = True
                 f.write(json.dumps(simplified, ensure_ascii=False) + '\n')
         
         return {
@@ -305,10 +417,36 @@ def main():
     parser = argparse.ArgumentParser(description="Enhanced dialogue generation with Stratified Sampling (Gemini only)")
     parser.add_argument("--fraud_count", type=int, default=500, help="Number of fraud dialogues")
     parser.add_argument("--normal_count", type=int, default=500, help="Number of normal dialogues")
-    parser.add_argument("--api_key", required=True, help="Gemini API key")
+    parser.add_argument("--api_key", action="append", help="Gemini API key (repeat for several keys)")
+    parser.add_argument("--api_key_file", default=None, help="File with one API key per line")
     parser.add_argument("--model", default="gemini-2.0-flash", help="Gemini model name")
+    parser.add_argument("--base_url", default=config.GEMINI_BASE_URL, help="Gemini-compatible endpoint (e.g. mock server http://127.0.0.1:8080/v1beta)")
     parser.add_argument("--max_workers", type=int, default=3, help="Number of parallel workers")
     parser.add_argument("--delay", type=float, default=2.0, help="Delay between requests")
+    parser.add_argument("--rpm", type=int, default=config.RATE_LIMIT_RPM, help="Requests per minute limit per API key (0 = unlimited)")
+    parser.add_argument("--tpm", type=int, default=config.RATE_LIMIT_TPM, help="Input tokens per minute limit per API key (0 = unlimited)")
+    parser.add_argument("--burst", type=int, default=config.RATE_LIMIT_BURST, help="Max requests sent back-to-back when quota is idle")
+    parser.add_argument("--retries_per_request", type=int, default=config.RETRY_ATTEMPTS_PER_REQUEST, help="Max attempts per Gemini request")
+    parser.add_argument("--retry_budget_dialogue", type=int, default=config.RETRY_BUDGET_PER_DIALOGUE, help="Total retries (client + agent) per dialogue before it fails fast")
+    parser.add_argument("--retry_budget_run", type=int, default=config.RETRY_BUDGET_PER_RUN, help="Total retries for the whole run (0 = unlimited)")
+    parser.add_argument("--breaker_threshold", type=int, default=config.CIRCUIT_BREAKER_THRESHOLD, help="Consecutive 5xx/timeouts before all workers pause (0 = off)")
+    parser.add_argument("--breaker_cooldown", type=float, default=config.CIRCUIT_BREAKER_COOLDOWN, help="Seconds to pause when the circuit breaker opens")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for task sampling (needed to replay a cassette)")
+    parser.add_argument("--cassette", default=None, help="SQLite file to record/replay Gemini responses")
+    parser.add_argument("--cassette_mode", choices=CASSETTE_MODES, default="auto", help="record: always call the API; replay: cassette only; auto: replay hits, record misses")
+    parser.add_argument("--no_context_cache", action="store_true", help="Always send the full system prompt instead of a server-side context cache")
+    parser.add_argument("--cache_ttl", type=int, default=config.CONTEXT_CACHE_TTL, help="TTL in seconds of each context cache")
+    parser.add_argument("--memory_window", type=int, default=config.MEMORY_WINDOW_TURNS, help="Latest turns sent verbatim, older turns are summarised (0 = always send the full history)")
+    parser.add_argument("--summary_every", type=int, default=config.MEMORY_SUMMARY_EVERY, help="Refresh the rolling summary whenever this many turns leave the window")
+    parser.add_argument("--manager_schedule", choices=SCHEDULES, default=config.MANAGER_SCHEDULE, help="When to call the manager: fixed every N turns, backoff after each 'continue' verdict, or hazard-based on cheap turn features")
+    parser.add_argument("--manager_every", type=int, default=config.MANAGER_EVAL_EVERY, help="fixed: evaluate every N turns; backoff: initial gap")
+    parser.add_argument("--manager_max_gap", type=int, default=config.MANAGER_EVAL_MAX_GAP, help="backoff/hazard: never skip more than this many turns in a row")
+    parser.add_argument("--local_detector", choices=DETECTOR_MODES, default=config.LOCAL_DETECTOR_MODE, help="Local, API-free check for settled dialogues (disclosed OTP/account, repeated refusals, repetition): flag = force a manager evaluation, end = end the dialogue")
+    parser.add_argument("--speculative", action="store_true", default=config.SPECULATIVE_LEFT_TURN, help="Generate the next caller turn while the manager evaluates; the draft is dropped when the manager ends the dialogue (saves a round trip per evaluation, costs one extra request per manager termination)")
+    parser.add_argument("--defer_end_call_reasons", action="store_true", default=config.DEFER_END_CALL_REASONS, help="Do not block on a manager call when a side hangs up; mark the result and fill in reasons later in batches with annotate_end_calls.py")
+    parser.add_argument("--opening_pool", default=None, help="Opening-line pool built by build_opening_pool.py; each dialogue takes an unused opener instead of generating the first caller turn (default: off)")
+    parser.add_argument("--full_manager_eval", action="store_true", help="Let the manager re-read the whole transcript on every evaluation instead of only the new turns plus its notes")
+    parser.add_argument("--memory_roles", default=",".join(config.MEMORY_ROLES), help="Comma-separated roles using bounded memory (left,right,manager)")
     parser.add_argument("--output_dir", default="optimized_dataset", help="Output directory")
     parser.add_argument("--use_stratified", action="store_true", default=True, 
                        help="Use stratified sampling for realistic user profiles")
@@ -316,6 +454,13 @@ def main():
                        help="Run sampling algorithm demo")
     
     args = parser.parse_args()
+    api_keys = load_api_keys(args.api_key, args.api_key_file)
+    if not api_keys:
+        parser.error("At least one API key is required (--api_key or --api_key_file)")
+    try:
+        memory_roles = parse_memory_roles(args.memory_roles)
+    except ValueError as e:
+        parser.error(str(e))
     
     # Demo sampling algorithm if requested
     if args.demo_sampling:
@@ -323,14 +468,40 @@ def main():
         demonstrate_stratified_sampling()
         return
     
+    if args.seed is not None:
+        random.seed(args.seed)
+    
     # Tạo đường dẫn đầu ra
     os.makedirs(args.output_dir, exist_ok=True)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     
     # Khởi tạo generator với Gemini
     generator = OptimizedDialogueGenerator(
-        args.api_key, args.model, 
-        args.max_workers, args.delay
+        api_keys[0], args.model, 
+        args.max_workers, args.delay,
+        rpm=args.rpm, tpm=args.tpm, burst=args.burst,
+        retries_per_request=args.retries_per_request,
+        retry_budget_dialogue=args.retry_budget_dialogue,
+        retry_budget_run=args.retry_budget_run,
+        breaker_threshold=args.breaker_threshold,
+        breaker_cooldown=args.breaker_cooldown,
+        base_url=args.base_url,
+        cassette=args.cassette,
+        cassette_mode=args.cassette_mode,
+        api_keys=api_keys,
+        context_cache=config.CONTEXT_CACHE_ENABLED and not args.no_context_cache,
+        cache_ttl=args.cache_ttl,
+        memory_window=args.memory_window,
+        summary_every=args.summary_every,
+        memory_roles=memory_roles,
+        incremental_manager=not args.full_manager_eval,
+        manager_schedule=args.manager_schedule,
+        manager_every=args.manager_every,
+        manager_max_gap=args.manager_max_gap,
+        local_detector=args.local_detector,
+        speculative=args.speculative,
+        defer_end_call_reasons=args.defer_end_call_reasons,
+        opening_pool=args.opening_pool
     )
     
     # Tạo cuộc hội thoại lừa đảo
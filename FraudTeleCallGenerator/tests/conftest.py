@@ -0,0 +1,50 @@
+"""
+Cấu hình chung cho test: import `config` và `utils.*` như các script ở thư mục gói, đặt lại các singleton
+dùng chung trước mỗi test và dựng mock Gemini server chạy trong process
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.api_key_pool import configure_key_pool
+from utils.cassette import configure_cassette
+from utils.circuit_breaker import configure_circuit_breaker
+from utils.concurrency_controller import DEFAULT_INITIAL_LIMIT, get_concurrency_controller
+from utils.context_cache import configure_context_cache
+from utils.mock_gemini_server import MockGeminiConfig, MockGeminiServer
+from utils.model_router import configure_model_routing
+from utils.retry_policy import configure_retry_policy
+
+
+@pytest.fixture(autouse=True)
+def shared_state():
+    """Mỗi test bắt đầu với key pool rỗng, breaker/AIMD/retry policy mặc định, không cassette, context cache hay model dự phòng"""
+    configure_key_pool([])
+    configure_circuit_breaker()
+    get_concurrency_controller().configure(DEFAULT_INITIAL_LIMIT)
+    configure_retry_policy()
+    configure_context_cache(False)
+    configure_model_routing({}, "")
+    yield
+    configure_cassette(None)
+
+
+@pytest.fixture
+def mock_gemini():
+    """Tạo mock Gemini server (độ trễ cố định, không ngắt máy) với tham số MockGeminiConfig tuỳ chọn"""
+    servers = []
+
+    def start(**kwargs) -> MockGeminiServer:
+        params = {"latency_ms": 5.0, "latency_dist": "fixed", "endcall_rate": 0.0, "seed": 1}
+        params.update(kwargs)
+        server = MockGeminiServer(cfg=MockGeminiConfig(**params)).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
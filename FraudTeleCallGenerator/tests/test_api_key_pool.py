@@ -0,0 +1,68 @@
+"""Key pool: key nhận 429 nghỉ trong cooldown, key bị từ chối (401/403) bị loại khỏi pool"""
+
+import pytest
+
+from utils.api_key_pool import ApiKeyPool, NoHealthyKeyError, configure_key_pool, get_key_pool
+from utils.gemini_client import GeminiClient
+
+MESSAGES = [{"role": "user", "content": "Alo, cho hỏi ai đang gọi vậy?"}]
+
+
+def test_throttled_key_cools_down_and_pool_rotates():
+    pool = ApiKeyPool()
+    pool.configure(["a", "b"], 0, 0)
+    first = pool.acquire()
+    pool.release(first, throttled=True)
+    assert pool.on_throttle(first, 60.0)
+
+    second = pool.acquire()
+    assert second.api_key != first.api_key
+    assert second.wait == 0.0
+    pool.release(second, throttled=True)
+    assert not pool.on_throttle(second, 30.0)
+    assert not pool.has_ready_key()
+
+    # Mọi key đều đang nghỉ: chờ key hết cooldown sớm nhất
+    third = pool.acquire()
+    assert third.api_key == second.api_key
+    assert 29.0 < third.wait <= 30.0
+
+
+def test_rejected_keys_are_disabled_until_none_left():
+    pool = ApiKeyPool()
+    pool.configure(["a", "b"], 0, 0)
+    rejected = pool.acquire()
+    assert pool.disable(rejected, "API key not valid")
+    for _ in range(3):
+        lease = pool.acquire()
+        assert lease.api_key != rejected.api_key
+        pool.release(lease)
+
+    assert not pool.disable(pool.acquire(), "API key not valid")
+    assert pool.stats()["healthy"] == 0
+    with pytest.raises(NoHealthyKeyError):
+        pool.acquire()
+
+
+def test_client_rotates_key_on_429(mock_gemini):
+    server = mock_gemini(rpm=1)
+    configure_key_pool(["a", "b"], 0, 0)
+    client = GeminiClient("a", base_url=server.base_url)
+
+    assert client.chat_completion(MESSAGES)
+    # Key vừa dùng đã hết quota phía server: nhận 429 rồi gửi lại ngay bằng key còn lại
+    assert client.chat_completion(MESSAGES)
+    assert server.state.stats()["status"] == {200: 2, 429: 1}
+    stats = get_key_pool().stats()
+    assert stats["throttles"] == 1
+    assert stats["healthy"] == 2
+
+
+def test_client_skips_rejected_key(mock_gemini):
+    server = mock_gemini(api_keys=["good"])
+    configure_key_pool(["bad", "good"], 0, 0)
+    client = GeminiClient("bad", base_url=server.base_url)
+
+    assert client.chat_completion(MESSAGES)
+    assert server.state.stats()["status"] == {403: 1, 200: 1}
+    assert [key["disabled"] for key in get_key_pool().stats()["keys"]] == [True, False]
@@ -0,0 +1,106 @@
+"""Circuit breaker: mở → half-open → đóng, và nhả lượt thăm dò khi lần gửi dừng giữa chừng"""
+
+import asyncio
+import time
+
+import pytest
+
+from utils.api_key_pool import NoHealthyKeyError, configure_key_pool, get_key_pool
+from utils.async_gemini_client import AsyncGeminiClient
+from utils.circuit_breaker import (
+    CLOSED, HALF_OPEN, OPEN, PROBE_POLL_INTERVAL, CircuitBreaker, configure_circuit_breaker
+)
+from utils.gemini_client import GeminiClient
+from utils.http_pool import close_async_sessions
+
+MESSAGES = [{"role": "user", "content": "Alo, cho hỏi ai đang gọi vậy?"}]
+
+
+def half_open(breaker: CircuitBreaker) -> None:
+    """Mở mạch bằng đủ số lỗi liên tiếp rồi chờ hết cooldown"""
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    assert breaker.state == OPEN
+    time.sleep(breaker.current_cooldown + 0.01)
+
+
+def test_opens_then_half_opens_then_closes():
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=0.05)
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert 0 < breaker.before_request() <= 0.05
+
+    time.sleep(0.06)
+    probe = breaker.wait()
+    assert probe is not None
+    assert breaker.state == HALF_OPEN
+    # Chỉ một request thăm dò được đi, các worker khác chờ kết quả
+    assert breaker.before_request() == PROBE_POLL_INTERVAL
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.wait() is None
+
+
+def test_failed_probe_reopens_with_doubled_cooldown():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0.05)
+    half_open(breaker)
+    breaker.wait()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.current_cooldown == pytest.approx(0.1)
+    assert breaker.before_request() > 0.05
+
+
+def test_release_probe_only_frees_its_own_trial_request():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0.01)
+    half_open(breaker)
+    first = breaker.wait()
+    breaker.release_probe(first)
+    assert not breaker.probe_in_flight
+
+    second = breaker.wait()
+    assert second != first
+    # Lượt cũ đã nhả rồi: không được nhả lượt thăm dò của worker khác
+    breaker.release_probe(first)
+    assert breaker.probe_in_flight
+    breaker.release_probe(second)
+    assert not breaker.probe_in_flight
+
+
+def test_sync_client_releases_probe_on_non_retryable_error():
+    breaker = configure_circuit_breaker(1, 0.01)
+    half_open(breaker)
+    configure_key_pool(["k"], 0, 0)
+    pool = get_key_pool()
+    pool.disable(pool.acquire(), "test")
+
+    client = GeminiClient("k", base_url="http://127.0.0.1:9/v1beta")
+    with pytest.raises(NoHealthyKeyError):
+        client.chat_completion(MESSAGES)
+    assert not breaker.probe_in_flight
+    # Worker kế tiếp nhận được lượt thăm dò ngay, không bị kẹt ở PROBE_POLL_INTERVAL
+    assert breaker.before_request() == 0.0
+
+
+def test_async_client_releases_probe_when_cancelled(mock_gemini):
+    server = mock_gemini(latency_ms=2000.0)
+    breaker = configure_circuit_breaker(1, 0.01)
+    half_open(breaker)
+    configure_key_pool(["k"], 0, 0)
+
+    async def run():
+        client = AsyncGeminiClient("k", base_url=server.base_url)
+        task = asyncio.create_task(client.chat_completion_async(MESSAGES))
+        await asyncio.sleep(0.2)
+        assert breaker.probe_in_flight
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await close_async_sessions()
+
+    asyncio.run(run())
+    assert not breaker.probe_in_flight
+    assert breaker.state == HALF_OPEN
@@ -0,0 +1,51 @@
+"""Retry budget: hết budget của hội thoại hoặc lượt chạy thì dừng ngay bằng NonRetryableError"""
+
+import pytest
+
+from utils.api_key_pool import configure_key_pool
+from utils.gemini_client import GeminiClient
+from utils.retry_policy import NonRetryableError, RetryBudget, RetryBudgetExhausted, RetryPolicy, configure_retry_policy
+
+MESSAGES = [{"role": "user", "content": "Alo, cho hỏi ai đang gọi vậy?"}]
+
+
+def test_exhausted_dialogue_budget_raises_non_retryable():
+    budget = RetryBudget(2)
+    budget.consume()
+    budget.consume()
+    with pytest.raises(NonRetryableError) as excinfo:
+        budget.consume("Gemini request")
+    assert isinstance(excinfo.value, RetryBudgetExhausted)
+    assert budget.exhausted
+    assert budget.remaining == 0
+
+
+def test_run_budget_is_shared_by_all_dialogues():
+    policy = RetryPolicy(dialogue_budget=5, run_budget=3)
+    first, second = policy.new_dialogue_budget(), policy.new_dialogue_budget()
+    first.consume()
+    first.consume()
+    second.consume()
+    with pytest.raises(RetryBudgetExhausted, match="run"):
+        second.consume()
+    assert policy.stats()["run_retries"] == 3
+
+
+def test_zero_limit_means_unlimited():
+    budget = RetryBudget(0)
+    for _ in range(100):
+        budget.consume()
+    assert budget.remaining is None
+
+
+def test_client_stops_retrying_once_budget_is_exhausted(mock_gemini):
+    server = mock_gemini(rate_429=1.0, retry_after=0.01)
+    configure_retry_policy(attempts_per_request=10, dialogue_budget=2, run_budget=0)
+    configure_key_pool(["a", "b"], 0, 0)
+
+    client = GeminiClient("a", base_url=server.base_url)
+    with pytest.raises(RetryBudgetExhausted):
+        client.chat_completion(MESSAGES)
+    # Lần gửi đầu không tính vào budget, hai lần gửi lại dùng hết budget, lần thứ tư không được gửi
+    assert client.retry_budget.used == 2
+    assert server.state.stats()["requests"] == 3
@@ -0,0 +1,207 @@
+"""
+API Key Pool - Nhiều Gemini API key, mỗi key có quota riêng, request đi theo key ít tải nhất
+"""
+
+import logging
+import time
+from typing import Dict, Any, List, NamedTuple, Optional
+from threading import Lock
+
+from utils.rate_limiter import TokenBucketRateLimiter, DEFAULT_RPM, DEFAULT_TPM, DEFAULT_BURST
+from utils.retry_policy import NonRetryableError
+
+DEFAULT_KEY_COOLDOWN = 10.0   # Số giây tạm ngừng dùng một key sau 429 nếu server không gợi ý
+THROTTLE_EWMA_ALPHA = 0.1     # Trọng số của kết quả mới nhất trong tỷ lệ 429 trung bình
+
+
+class NoHealthyKeyError(NonRetryableError):
+    """Mọi API key trong pool đều đã bị loại (401/403)"""
+
+
+def mask_key(api_key: str) -> str:
+    """Chỉ giữ 4 ký tự cuối của key khi ghi log"""
+    return f"…{api_key[-4:]}" if len(api_key) > 4 else "…"
+
+
+def load_api_keys(keys: Optional[List[str]] = None, key_file: Optional[str] = None) -> List[str]:
+    """Gộp key từ --api_key (lặp lại được) và --api_key_file (mỗi dòng một key, bỏ dòng trống và '#'), bỏ trùng"""
+    collected: List[str] = list(keys or [])
+    if key_file:
+        with open(key_file, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    collected.append(line)
+    return list(dict.fromkeys(k.strip() for k in collected if k and k.strip()))
+
+
+class KeyLease(NamedTuple):
+    """Một lần mượn key cho một lần gửi request"""
+    api_key: str
+    limiter: TokenBucketRateLimiter
+    wait: float
+
+
+class KeyState:
+    """Quota và sức khoẻ của một API key"""
+
+    def __init__(self, api_key: str, rpm: int, tpm: int, burst: int):
+        self.api_key = api_key
+        self.limiter = TokenBucketRateLimiter(rpm, tpm, burst)
+        self.in_flight = 0
+        self.requests = 0
+        self.throttles = 0
+        self.throttle_rate = 0.0
+        self.cooldown_until = 0.0
+        self.disabled_reason: Optional[str] = None
+
+    @property
+    def healthy(self) -> bool:
+        return self.disabled_reason is None
+
+
+class ApiKeyPool:
+    """Pool API key dùng chung cho toàn process.
+
+    Mỗi key có token bucket RPM/TPM riêng; mỗi lần gửi, pool chọn key khoẻ mạnh có
+    thời gian chờ quota ngắn nhất (rồi tới ít request in-flight nhất, ít 429 nhất).
+    Key vừa nhận 429 bị tạm ngừng trong cooldown, key trả 401/403 bị loại khỏi pool.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.logger = logging.getLogger(__name__)
+        self._keys: List[KeyState] = []
+
+    def configure(self, api_keys: List[str], rpm: int = DEFAULT_RPM, tpm: int = DEFAULT_TPM,
+                  burst: int = DEFAULT_BURST) -> None:
+        """Nạp danh sách key; rpm/tpm là quota của từng key"""
+        with self._lock:
+            self._keys = [KeyState(key, rpm, tpm, burst) for key in api_keys]
+            self.rpm = rpm
+            self.tpm = tpm
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._keys)
+
+    @property
+    def size(self) -> int:
+        return len(self._keys)
+
+    def _find(self, api_key: str) -> Optional[KeyState]:
+        for state in self._keys:
+            if state.api_key == api_key:
+                return state
+        return None
+
+    def acquire(self, tokens: int = 0) -> KeyLease:
+        """Chọn key ít tải nhất và đặt chỗ quota trên key đó; caller tự chờ `wait` giây"""
+        with self._lock:
+            healthy = [s for s in self._keys if s.healthy]
+            if not healthy:
+                raise NoHealthyKeyError("Không còn API key hợp lệ nào trong pool")
+            now = time.monotonic()
+            ready = [s for s in healthy if s.cooldown_until <= now]
+            if ready:
+                state = min(ready, key=lambda s: (s.limiter.peek(tokens), s.in_flight, s.throttle_rate))
+                cooldown = 0.0
+            else:
+                # Mọi key đều đang cooldown: dùng key hết cooldown sớm nhất
+                state = min(healthy, key=lambda s: s.cooldown_until)
+                cooldown = state.cooldown_until - now
+            state.in_flight += 1
+            state.requests += 1
+            wait = max(cooldown, state.limiter.reserve(tokens))
+            return KeyLease(state.api_key, state.limiter, wait)
+
+    def release(self, lease: KeyLease, throttled: bool = False) -> None:
+        """Trả key sau một lần gửi; cập nhật tỷ lệ 429 trung bình"""
+        with self._lock:
+            state = self._find(lease.api_key)
+            if state is None:
+                return
+            state.in_flight = max(0, state.in_flight - 1)
+            state.throttle_rate += THROTTLE_EWMA_ALPHA * ((1.0 if throttled else 0.0) - state.throttle_rate)
+
+    def on_throttle(self, lease: KeyLease, cooldown: Optional[float] = None) -> bool:
+        """Key nhận 429: tạm ngừng trong cooldown. Trả về True nếu còn key khác dùng được ngay"""
+        with self._lock:
+            state = self._find(lease.api_key)
+            if state is None:
+                return False
+            now = time.monotonic()
+            state.throttles += 1
+            state.cooldown_until = max(state.cooldown_until, now + (cooldown or DEFAULT_KEY_COOLDOWN))
+            return self._has_ready_key(now)
+
+    def has_ready_key(self) -> bool:
+        """Còn key khoẻ mạnh nào ngoài cooldown (gửi được ngay) hay không"""
+        with self._lock:
+            return self._has_ready_key(time.monotonic())
+
+    def _has_ready_key(self, now: float) -> bool:
+        return any(s.healthy and s.cooldown_until <= now for s in self._keys)
+
+    def disable(self, lease: KeyLease, reason: str) -> bool:
+        """Loại key bị từ chối (401/403). Trả về True nếu pool vẫn còn key khác"""
+        with self._lock:
+            state = self._find(lease.api_key)
+            if state is not None and state.healthy:
+                state.disabled_reason = reason
+                self.logger.error(f"🔑 Loại API key {mask_key(state.api_key)} khỏi pool: {reason}")
+            return any(s.healthy for s in self._keys)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            keys = []
+            for state in self._keys:
+                limiter_stats = state.limiter.stats()
+                keys.append({
+                    "key": mask_key(state.api_key),
+                    "requests": state.requests,
+                    "throttles": state.throttles,
+                    "total_wait_time": limiter_stats["total_wait_time"],
+                    "actual_tokens": limiter_stats["actual_tokens"],
+                    "disabled": state.disabled_reason is not None,
+                })
+            return {
+                "rpm": getattr(self, "rpm", 0),
+                "tpm": getattr(self, "tpm", 0),
+                "keys": keys,
+                "requests": sum(k["requests"] for k in keys),
+                "throttles": sum(k["throttles"] for k in keys),
+                "healthy": sum(1 for k in keys if not k["disabled"]),
+            }
+
+
+# Pool mặc định cho toàn process (rỗng: client dùng api_key của chính nó và rate limiter dùng chung)
+_key_pool = ApiKeyPool()
+
+
+def get_key_pool() -> ApiKeyPool:
+    """Trả về key pool dùng chung của process"""
+    return _key_pool
+
+
+def configure_key_pool(api_keys: List[str], rpm: int = DEFAULT_RPM, tpm: int = DEFAULT_TPM,
+                       burst: int = DEFAULT_BURST) -> ApiKeyPool:
+    """Cấu hình key pool dùng chung từ tham số dòng lệnh"""
+    _key_pool.configure(api_keys, rpm, tpm, burst)
+    _key_pool.logger.info(
+        f"🔑 Key pool: {len(api_keys)} API key, mỗi key {rpm} RPM, {tpm} TPM, burst={burst}"
+    )
+    return _key_pool
+
+
+def format_key_pool_stats(stats: Dict[str, Any]) -> str:
+    """Định dạng thống kê key pool để ghi log"""
+    per_key = ", ".join(
+        f"{k['key']}={k['requests']} req/{k['throttles']}x429/chờ {k['total_wait_time']:.1f}s"
+        + (" (đã loại)" if k["disabled"] else "")
+        for k in stats["keys"]
+    )
+    return (
+        f"Key pool ({len(stats['keys'])} key, {stats['healthy']} còn dùng được; mỗi key {stats['rpm']} RPM, "
+        f"{stats['tpm']} TPM): {stats['requests']} requests, {stats['throttles']} lần 429; {per_key}"
+    )
@@ -0,0 +1,196 @@
+"""
+Batch Job Client - Gửi một loạt request thành một batch job của Gemini (batchGenerateContent):
+file JSONL {key, request} tải lên Files API, chờ job chạy xong rồi tải file JSONL {key, response | error} về.
+Batch job không chiếm quota RPM/TPM của API thường và rẻ hơn, đổi lại phải chờ job chạy xong
+"""
+
+import json
+import os
+import re
+import time
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+
+from utils.gemini_client import GeminiClient, GeminiAPIError, NON_RETRYABLE_STATUS, _load_error
+from utils.retry_policy import get_retry_policy
+
+# Trạng thái cuối của batch job; API trả về dạng JOB_STATE_* hoặc BATCH_STATE_* nên chỉ so phần đuôi
+SUCCEEDED = "SUCCEEDED"
+TERMINAL_STATES = (SUCCEEDED, "FAILED", "CANCELLED", "EXPIRED")
+
+# Phiên bản API ở cuối base_url (v1, v1beta, v1alpha...); base_url không có path thì dùng DEFAULT_API_VERSION
+API_VERSION_PATTERN = re.compile(r"v\d+(?:alpha|beta)?\d*")
+DEFAULT_API_VERSION = "v1beta"
+
+
+class BatchJobError(Exception):
+    """Batch job kết thúc mà không có kết quả (FAILED, CANCELLED, EXPIRED) hoặc không đọc được kết quả"""
+
+
+def batch_state(resource: Dict[str, Any]) -> str:
+    """Trạng thái rút gọn của batch job (PENDING, RUNNING, SUCCEEDED...)"""
+    state = str((resource.get("metadata") or {}).get("state") or resource.get("state") or "")
+    return state.rsplit("_", 1)[-1] if state else ("SUCCEEDED" if resource.get("done") else "PENDING")
+
+
+def batch_api_urls(base_url: str) -> Tuple[str, str, str]:
+    """Endpoint API, Files API upload và download của batch job từ base_url.
+
+    Files API nằm ngoài phiên bản API: .../upload/v1beta/files và .../download/v1beta/files/..., nên base_url phải
+    kết thúc bằng phiên bản API (vd. https://generativelanguage.googleapis.com/v1beta); base_url chỉ có host
+    (vd. mock server http://127.0.0.1:8080) được thêm /v1beta. Raise ValueError với path khác.
+    """
+    parts = urlsplit(base_url.rstrip("/"))
+    if not parts.scheme or not parts.netloc:
+        raise ValueError(f"base_url không hợp lệ cho batch job: {base_url}")
+    prefix, _, version = parts.path.rpartition("/")
+    if not parts.path:
+        version = DEFAULT_API_VERSION
+    elif not API_VERSION_PATTERN.fullmatch(version):
+        raise ValueError(
+            f"base_url của batch job phải kết thúc bằng phiên bản API (vd. .../{DEFAULT_API_VERSION}): {base_url}"
+        )
+    root = urlunsplit((parts.scheme, parts.netloc, prefix, "", ""))
+    return f"{root}/{version}", f"{root}/upload/{version}/files", f"{root}/download/{version}"
+
+
+def write_jsonl(path: str, lines: Iterable[Dict[str, Any]]) -> None:
+    """Ghi file JSONL qua file tạm rồi đổi tên, để lượt chạy bị dừng giữa chừng không để lại file dở"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+
+class BatchJobClient(GeminiClient):
+    """Client batch job, dùng chung cách chuyển message sang payload và cách đọc response với GeminiClient.
+
+    Request không đi qua rate limiter, key pool hay AIMD controller: batch job có quota riêng.
+    """
+
+    def __init__(self, api_key: str, model: str = "gemini-2.0-flash", base_url: Optional[str] = None,
+                 poll_interval: float = 30.0):
+        super().__init__(api_key=api_key, model=model, base_url=base_url)
+        self.poll_interval = poll_interval
+        self.base_url, self.upload_url, self.download_url = batch_api_urls(self.base_url)
+        self.jobs = 0
+
+    def build_line(self, key: str, messages: List[Dict], **kwargs) -> Optional[Dict[str, Any]]:
+        """Một dòng của file request: `key` và payload generateContent (tham số sinh như chat_completion)"""
+        request_data = self._build_request_data(messages, self._build_generation_config(**kwargs))
+        return {"key": key, "request": request_data} if request_data is not None else None
+
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Gọi API với retry cho 429/5xx/lỗi mạng (mỗi lần gửi lại trừ vào budget retry của client);
+        lỗi 4xx khác raise GeminiAPIError"""
+        attempts = get_retry_policy().attempts_per_request
+        params = {"key": self.api_key, **kwargs.pop("params", {})}
+        for attempt in range(attempts):
+            if attempt > 0:
+                self.retry_budget.consume(f"batch job {method}")
+                time.sleep(get_retry_policy().backoff(attempt - 1))
+            try:
+                response = self.session.request(method, url, params=params, timeout=90, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self.logger.warning(f"🔌 Lỗi mạng khi gọi batch API (lần thử {attempt + 1}/{attempts}): {e}")
+                continue
+            if response.status_code == 200:
+                return response
+            message = _load_error(response.text).get("message") or response.text
+            if response.status_code in NON_RETRYABLE_STATUS:
+                raise GeminiAPIError(response.status_code, message)
+            self.logger.warning(f"🔄 Batch API lỗi {response.status_code} (lần thử {attempt + 1}/{attempts}): {message}")
+        raise BatchJobError(f"Batch API {method} {url} thất bại sau {attempts} lần thử")
+
+    def upload(self, path: str, display_name: str) -> str:
+        """Tải file JSONL lên Files API (upload resumable hai bước), trả về tên file dạng files/..."""
+        with open(path, "rb") as f:
+            data = f.read()
+        start = self._send("POST", self.upload_url, json={"file": {"display_name": display_name}}, headers={
+            "X-Goog-Upload-Protocol": "resumable",
+            "X-Goog-Upload-Command": "start",
+            "X-Goog-Upload-Header-Content-Length": str(len(data)),
+            "X-Goog-Upload-Header-Content-Type": "application/jsonl",
+        })
+        upload_url = start.headers.get("X-Goog-Upload-URL")
+        if not upload_url:
+            raise BatchJobError("Files API không trả về X-Goog-Upload-URL")
+        response = self._send("POST", upload_url, data=data, headers={
+            "X-Goog-Upload-Command": "upload, finalize",
+            "X-Goog-Upload-Offset": "0",
+        })
+        return response.json()["file"]["name"]
+
+    def submit(self, file_name: str, display_name: str) -> str:
+        """Tạo batch job từ file request đã tải lên, trả về tên job dạng batches/..."""
+        response = self._send("POST", f"{self.base_url}/models/{self.model}:batchGenerateContent", json={
+            "batch": {"display_name": display_name, "input_config": {"file_name": file_name}}
+        })
+        self.jobs += 1
+        return response.json()["name"]
+
+    def wait(self, name: str) -> Dict[str, Any]:
+        """Hỏi trạng thái job mỗi `poll_interval` giây tới khi job kết thúc; raise BatchJobError nếu job không thành công"""
+        while True:
+            resource = self._send("GET", f"{self.base_url}/{name}").json()
+            state = batch_state(resource)
+            if state in TERMINAL_STATES:
+                break
+            self.logger.debug(f"⏳ Batch job {name}: {state}")
+            time.sleep(self.poll_interval)
+        if state != SUCCEEDED:
+            error = resource.get("error") or {}
+            raise BatchJobError(f"Batch job {name} kết thúc với trạng thái {state}: {error.get('message', '')}")
+        return resource
+
+    def download(self, resource: Dict[str, Any], path: str) -> None:
+        """Ghi kết quả của job đã xong ra file JSONL {key, response | error}"""
+        response = resource.get("response") or {}
+        file_name = response.get("responsesFile") or ((resource.get("metadata") or {}).get("output") or {}).get("responsesFile")
+        if file_name:
+            body = self._send("GET", f"{self.download_url}/{file_name}:download", params={"alt": "media"})
+            with open(f"{path}.tmp", "wb") as f:
+                f.write(body.content)
+            os.replace(f"{path}.tmp", path)
+            return
+        # Job nhỏ có thể trả kết quả ngay trong resource
+        inlined = response.get("inlinedResponses")
+        if isinstance(inlined, dict):
+            inlined = inlined.get("inlinedResponses")
+        if not isinstance(inlined, list):
+            raise BatchJobError(f"Batch job {resource.get('name')} không có file kết quả")
+        write_jsonl(path, ({"key": (item.get("metadata") or {}).get("key"), **item} for item in inlined))
+
+    def read_results(self, path: str) -> Dict[str, Optional[str]]:
+        """Text của từng request theo key; request lỗi hoặc không có nội dung ứng với None"""
+        results: Dict[str, Optional[str]] = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get("response")
+                if not isinstance(response, dict):
+                    self.logger.warning(f"⚠️ Request {item.get('key')} trong batch job lỗi: {(item.get('error') or {}).get('message')}")
+                    results[item.get("key")] = None
+                    continue
+                self._add_usage(response.get("usageMetadata") or {})
+                candidates = self._parse_response(response)
+                results[item.get("key")] = candidates[0] if candidates else None
+        return results
+
+    def run(self, requests_path: str, results_path: str, display_name: str,
+            name: Optional[str] = None, on_submitted=None) -> Dict[str, Optional[str]]:
+        """Gửi file request thành một job (hoặc tiếp tục chờ job `name` đã gửi trước đó), tải và đọc kết quả.
+
+        `on_submitted(name)` được gọi ngay khi job được tạo, để caller lưu tên job trước khi chờ.
+        """
+        if name is None:
+            name = self.submit(self.upload(requests_path, display_name), display_name)
+            if on_submitted is not None:
+                on_submitted(name)
+        self.download(self.wait(name), results_path)
+        return self.read_results(results_path)
@@ -3,50 +3,172 @@ Gemini API Client - Tối ưu hóa rate limiting và exponential backoff
 """
 
 import requests
+import asyncio
+import email.utils
 import json
 import time
 import random
 import logging
-from typing import Dict, List, Any, Optional
-from threading import Lock
+from typing import Dict, List, Any, Optional, Tuple, NamedTuple
+
+from utils.http_pool import get_session_pool
+from utils.rate_limiter import get_rate_limiter, estimate_tokens
+from utils.concurrency_controller import get_concurrency_controller
+from utils.retry_policy import NonRetryableError, RetryBudget, get_retry_policy
+from utils.circuit_breaker import get_circuit_breaker
+from utils.cassette import CassetteEntry, get_cassette
+from utils.api_key_pool import KeyLease, get_key_pool, mask_key
+from utils.context_cache import CachePlan, CREATE, REFRESH, SKIP, get_context_cache
+from utils.model_router import get_model_router
+
+DEFAULT_BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
+
+# Lỗi mạng được nhận diện cho cả requests (sync) lẫn aiohttp/asyncio (async)
+TIMEOUT_ERRORS: Tuple[type, ...] = (requests.exceptions.Timeout, asyncio.TimeoutError)
+CONNECTION_ERRORS: Tuple[type, ...] = (requests.exceptions.ConnectionError, ConnectionError)
+
+# Request sai hoặc sai API key/model: gửi lại y nguyên cũng chỉ nhận lại đúng lỗi đó
+NON_RETRYABLE_STATUS: Tuple[int, ...] = (400, 401, 403, 404)
+SERVER_ERROR_STATUS: Tuple[int, ...] = (500, 502, 503, 504)
+
+# generationConfig mặc định khi caller không truyền tham số sinh
+DEFAULT_GENERATION_CONFIG: Dict[str, Any] = {
+    "temperature": 0.8,
+    "maxOutputTokens": 2048,
+    "topP": 0.9,
+    "topK": 40
+}
+
+# Tên tham số kiểu OpenAI -> trường generationConfig của Gemini
+GENERATION_PARAM_MAP: Dict[str, str] = {
+    "temperature": "temperature",
+    "max_tokens": "maxOutputTokens",
+    "top_p": "topP",
+    "top_k": "topK",
+    "stop": "stopSequences",
+    "response_mime_type": "responseMimeType",
+    "response_schema": "responseSchema",
+    "candidate_count": "candidateCount",
+}
+
+
+class GeminiAPIError(NonRetryableError):
+    """Lỗi không thể retry từ Gemini API (400/401/403/404)"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"Gemini API error {status_code}: {message}")
+        self.status_code = status_code
+
+
+class AttemptOutcome(NamedTuple):
+    """Kết quả của một lần gửi request: dừng (kèm text hoặc lỗi) hoặc chờ `wait` giây rồi thử lại"""
+    done: bool = False
+    text: Optional[str] = None
+    candidates: Tuple[str, ...] = ()
+    wait: float = 0.0
+    error: Optional[Exception] = None
+
+
+class Completion(NamedTuple):
+    """Kết quả của một request: text của các candidate và model thực sự sinh ra chúng (model dự phòng nếu đã chuyển)"""
+    candidates: Tuple[str, ...] = ()
+    model: Optional[str] = None
+
+    @property
+    def text(self) -> Optional[str]:
+        return self.candidates[0] if self.candidates else None
+
+
+def _load_error(body_text: str) -> Dict[str, Any]:
+    """Lấy object `error` trong body lỗi của Google API (rỗng nếu body không phải JSON)"""
+    try:
+        error = json.loads(body_text or "").get("error")
+    except (ValueError, AttributeError):
+        return {}
+    return error if isinstance(error, dict) else {}
+
+
+def parse_retry_hint(retry_after: Optional[str], body_text: str) -> Optional[float]:
+    """Thời gian chờ (giây) server yêu cầu trước khi thử lại, None nếu không có gợi ý.
+
+    Ưu tiên header Retry-After (số giây hoặc HTTP-date), sau đó tới `retryDelay`
+    của google.rpc.RetryInfo trong error.details (dạng Duration JSON như "12s").
+    """
+    if retry_after:
+        value = retry_after.strip()
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    for detail in _load_error(body_text).get("details") or []:
+        if not isinstance(detail, dict) or not str(detail.get("@type", "")).endswith("google.rpc.RetryInfo"):
+            continue
+        delay = str(detail.get("retryDelay", ""))
+        if delay.endswith("s"):
+            try:
+                return max(0.0, float(delay[:-1]))
+            except ValueError:
+                return None
+    return None
+
 
 class GeminiClient:
     """Client để gọi API Gemini của Google"""
     
-    # Class-level lock để đồng bộ hóa requests giữa các instances
-    _request_lock = Lock()
-    _last_request_time = 0
-    _min_request_interval = 0.5  # Tối thiểu 0.5 giây giữa các requests
-    
-    def __init__(self, api_key: str, model: str = "gemini-2.0-flash"):
+    def __init__(self, api_key: str, model: str = "gemini-2.0-flash", base_url: Optional[str] = None):
         self.api_key = api_key
         self.model = model
-        self.base_url = "https://generativelanguage.googleapis.com/v1beta"
+        # base_url khác mặc định cho phép trỏ tới endpoint tương thích (vd. utils/mock_gemini_server.py)
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip("/")
         self.logger = logging.getLogger(__name__)
         self.request_count = 0
+        self.last_usage: Dict[str, Any] = {}
+        # Tokens cộng dồn của mọi response client nhận được (một client phục vụ một hội thoại)
+        self.usage_totals: Dict[str, int] = {"requests": 0, "prompt_tokens": 0, "output_tokens": 0}
+        # Session keep-alive dùng chung cho mọi client cùng endpoint
+        self.session = get_session_pool().get_session(self.base_url)
+        # Budget retry của hội thoại mà client này phục vụ (agent dùng chung client thì dùng chung budget)
+        self.retry_budget: RetryBudget = get_retry_policy().new_dialogue_budget()
         
-    def _wait_for_rate_limit(self):
-        """Đảm bảo tuân thủ rate limit bằng cách chờ giữa các requests"""
-        with self._request_lock:
-            current_time = time.time()
-            time_since_last = current_time - self._last_request_time
-            
-            if time_since_last < self._min_request_interval:
-                wait_time = self._min_request_interval - time_since_last
-                # Thêm jitter để tránh thundering herd
-                jitter = random.uniform(0, 0.2)
-                wait_time += jitter
-                time.sleep(wait_time)
-            
-            self._last_request_time = time.time()
+    def _reserve_key(self, estimated_tokens: int) -> KeyLease:
+        """Chọn API key (key ít tải nhất trong key pool, hoặc api_key của client) và đặt chỗ quota của key đó"""
+        key_pool = get_key_pool()
+        if key_pool.enabled:
+            return key_pool.acquire(estimated_tokens)
+        limiter = get_rate_limiter()
+        return KeyLease(self.api_key, limiter, limiter.reserve(estimated_tokens))
         
-    def _make_request(self, messages: List[Dict], max_retries: int = 5) -> Optional[str]:
-        """Gửi request tới Gemini API"""
+    def _wait_for_key(self, estimated_tokens: int) -> KeyLease:
+        """Đặt chỗ quota rồi tự chờ tới lượt, không giữ lock khi ngủ"""
+        lease = self._reserve_key(estimated_tokens)
+        if lease.wait > 0:
+            self.logger.debug(f"⏱️ Chờ rate limit {lease.wait:.2f}s")
+            time.sleep(lease.wait)
+        return lease
         
-        # Áp dụng rate limiting trước khi gửi request
-        self._wait_for_rate_limit()
-        self.request_count += 1
+    @staticmethod
+    def _build_generation_config(**kwargs) -> Dict[str, Any]:
+        """Gộp tham số sinh của lời gọi (temperature, max_tokens, top_p, top_k, stop, response_schema) vào cấu hình mặc định"""
+        generation_config = dict(DEFAULT_GENERATION_CONFIG)
+        for name, gemini_name in GENERATION_PARAM_MAP.items():
+            value = kwargs.get(name)
+            if value is None:
+                continue
+            if name == "stop" and isinstance(value, str):
+                value = [value]
+            generation_config[gemini_name] = value
+        # Structured output: có schema thì bắt buộc trả về JSON
+        if "responseSchema" in generation_config:
+            generation_config.setdefault("responseMimeType", "application/json")
+        return generation_config
         
+    def _build_request_data(self, messages: List[Dict],
+                            generation_config: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Chuyển messages định dạng OpenAI sang payload generateContent của Gemini"""
         # Convert OpenAI format messages to Gemini format
         contents = []
         system_instruction = None
@@ -92,98 +214,350 @@ class GeminiClient:
             }
         
         # Request configuration
-        request_data["generationConfig"] = {
-            "temperature": 0.8,
-            "maxOutputTokens": 2048,
-            "topP": 0.9,
-            "topK": 40
+        request_data["generationConfig"] = generation_config or dict(DEFAULT_GENERATION_CONFIG)
+        return request_data
+    
+    def _plan_context_cache(self, request_data: Dict[str, Any], api_key: str, model: Optional[str] = None) -> CachePlan:
+        """Hỏi context cache manager xem lần gửi này có dùng cachedContents được không (cache gắn với từng model)"""
+        system_instruction = request_data.get("systemInstruction")
+        cache = get_context_cache()
+        if not cache.enabled or system_instruction is None:
+            return CachePlan(SKIP)
+        system_text = "".join(part.get("text", "") for part in system_instruction.get("parts", []))
+        return cache.plan(api_key, model or self.model, system_text,
+                          estimate_tokens({"systemInstruction": system_instruction}))
+    
+    def _cache_create_body(self, request_data: Dict[str, Any], model: Optional[str] = None) -> Dict[str, Any]:
+        """Body tạo cachedContents chứa system prompt của request"""
+        return {
+            "model": f"models/{model or self.model}",
+            "systemInstruction": request_data["systemInstruction"],
+            "ttl": get_context_cache().ttl_param,
         }
+    
+    def _on_cache_created(self, plan: CachePlan, status_code: Optional[int], body_text: str) -> Optional[str]:
+        """Ghi nhận kết quả tạo cache, trả về tên cache nếu thành công (dùng chung cho sync và async)"""
+        cache = get_context_cache()
+        if status_code == 200:
+            try:
+                name = json.loads(body_text).get("name")
+            except (ValueError, AttributeError):
+                name = None
+            if name:
+                cache.on_created(plan.key, name)
+                return name
+        # 400 (prompt quá ngắn, model không hỗ trợ) hay 404 (endpoint không có cache) thì gửi lại cũng vậy
+        permanent = status_code in (400, 404)
+        reason = _load_error(body_text).get("message") or body_text or f"HTTP {status_code}"
+        cache.on_create_failed(plan.key, permanent, reason)
+        return None
+    
+    @staticmethod
+    def _with_cached_content(request_data: Dict[str, Any], name: Optional[str]) -> Dict[str, Any]:
+        """Payload gửi đi: thay systemInstruction bằng tên cache (Gemini không cho gửi cả hai)"""
+        if name is None:
+            return request_data
+        payload = {key: value for key, value in request_data.items() if key != "systemInstruction"}
+        payload["cachedContent"] = name
+        return payload
+    
+    def _send_cache_request(self, method: str, path: str, params: Dict[str, str],
+                            body: Optional[Dict[str, Any]] = None) -> Tuple[Optional[int], str]:
+        """Gọi endpoint cachedContents; lỗi mạng trả về (None, thông báo lỗi) thay vì raise"""
+        try:
+            response = self.session.request(method, f"{self.base_url}/{path}", params=params,
+                                            json=body, timeout=30)
+            return response.status_code, response.text
+        except requests.exceptions.RequestException as e:
+            return None, str(e)
+    
+    def _use_context_cache(self, request_data: Dict[str, Any], api_key: str,
+                           model: Optional[str] = None) -> Tuple[Dict[str, Any], Optional[str]]:
+        """Tạo/gia hạn cache khi cần; trả về payload cần gửi và khoá cache đã dùng (None nếu gửi nguyên prompt)"""
+        plan = self._plan_context_cache(request_data, api_key, model)
+        name = plan.name
+        if plan.action == CREATE:
+            status_code, body_text = self._send_cache_request(
+                "POST", "cachedContents", {"key": api_key}, self._cache_create_body(request_data, model))
+            name = self._on_cache_created(plan, status_code, body_text)
+        elif plan.action == REFRESH:
+            status_code, _ = self._send_cache_request(
+                "PATCH", plan.name, {"key": api_key, "updateMask": "ttl"}, {"ttl": get_context_cache().ttl_param})
+            get_context_cache().on_refreshed(plan.key, status_code == 200)
+            if status_code != 200:
+                name = None
+        return self._with_cached_content(request_data, name), (plan.key if name else None)
+    
+    def _parse_response(self, result: Dict[str, Any]) -> List[str]:
+        """Lấy text của các candidate trong response (nhiều candidate khi request có candidateCount)"""
+        texts = []
+        for candidate in result.get("candidates") or []:
+            if "content" in candidate and "parts" in candidate["content"]:
+                text = candidate["content"]["parts"][0].get("text", "")
+                # Normalize newlines để đảm bảo JSONL format đúng
+                texts.append(text.replace('\n', ' ').replace('\r', ' ').strip())
+        if texts:
+            self.logger.info("✅ Gemini API response thành công")
+        else:
+            self.logger.warning(f"⚠️ Gemini response không có content: {result}")
+        return texts
+    
+    def _handle_response(self, status_code: int, result: Any, body_text: str,
+                         attempt: int, max_retries: int, estimated_tokens: int,
+                         retry_after: Optional[str] = None, lease: Optional[KeyLease] = None,
+                         cache_key: Optional[str] = None) -> AttemptOutcome:
+        """Quyết định kết quả của một lần thử dựa trên HTTP status (dùng chung cho sync và async)"""
+        controller = get_concurrency_controller()
+        breaker = get_circuit_breaker()
         
-        url = f"{self.base_url}/models/{self.model}:generateContent"
+        if status_code == 200:
+            controller.on_success()
+            breaker.record_success()
+            self._record_usage(result, estimated_tokens, lease.limiter if lease else None)
+            candidates = self._parse_response(result)
+            return AttemptOutcome(done=True, text=candidates[0] if candidates else None, candidates=tuple(candidates))
+            
+        elif status_code in NON_RETRYABLE_STATUS:
+            breaker.record_success()
+            if cache_key is not None:
+                # Tên cache hết hạn/bị xoá phía server: gửi lại ngay với system prompt đầy đủ
+                get_context_cache().invalidate(cache_key)
+                return AttemptOutcome()
+            message = _load_error(body_text).get("message") or body_text
+            if lease is not None and status_code in (401, 403) and get_key_pool().disable(lease, message):
+                # Key bị từ chối nhưng pool còn key khác: gửi lại ngay bằng key khác
+                return AttemptOutcome()
+            # Upstream vẫn sống, nhưng request/API key sai: dừng ngay, không tốn budget retry
+            self.logger.error(f"❌ Gemini API error {status_code} (không retry): {message}")
+            return AttemptOutcome(done=True, error=GeminiAPIError(status_code, message))
+            
+        elif status_code == 429:
+            # Báo cho controller dùng chung để mọi client cùng giảm tải
+            controller.on_throttle()
+            breaker.record_success()
+            wait_time = parse_retry_hint(retry_after, body_text)
+            if wait_time is None:
+                # Improved exponential backoff cho rate limit
+                base_wait = min(2 ** attempt, 60)  # Max 60 giây
+                jitter = random.uniform(0.5, 1.5)
+                wait_time = base_wait * jitter
+            
+            if lease is not None and get_key_pool().on_throttle(lease, wait_time):
+                # Key này nghỉ trong cooldown, request gửi lại ngay bằng key khác còn quota
+                self.logger.warning(f"🚫 Rate limit (429) trên key {mask_key(lease.api_key)}, chuyển sang key khác")
+                return AttemptOutcome()
+            self.logger.warning(f"🚫 Rate limit (429), đợi {wait_time:.1f}s...")
+            return AttemptOutcome(wait=wait_time)
+            
+        elif status_code in SERVER_ERROR_STATUS:
+            breaker.record_failure()
+            # 503 có thể kèm Retry-After; các lỗi server khác retry với backoff
+            wait_time = parse_retry_hint(retry_after, body_text) if status_code == 503 else None
+            if wait_time is None:
+                wait_time = min(2 ** attempt, 30) + random.uniform(0, 5)
+            self.logger.warning(f"🔄 Server error {status_code}, retry sau {wait_time:.1f}s...")
+            return AttemptOutcome(wait=wait_time)
+            
+        else:
+            breaker.record_neutral()
+            self.logger.error(f"❌ Gemini API error {status_code}: {body_text}")
+            if attempt == max_retries - 1:
+                return AttemptOutcome(done=True)
+            return AttemptOutcome(wait=2 ** attempt)
+    
+    def _handle_exception(self, error: Exception, attempt: int, max_retries: int) -> AttemptOutcome:
+        """Quyết định thời gian chờ sau lỗi mạng/timeout (dùng chung cho sync và async)"""
+        is_last = attempt >= max_retries - 1
+        breaker = get_circuit_breaker()
+        if isinstance(error, TIMEOUT_ERRORS):
+            breaker.record_failure()
+            wait_time = min(5 * (attempt + 1), 30)
+            self.logger.warning(f"⏰ Timeout lần thử {attempt + 1}, đợi {wait_time}s...")
+        elif isinstance(error, CONNECTION_ERRORS):
+            breaker.record_failure()
+            wait_time = min(5 * (attempt + 1), 30)
+            self.logger.warning(f"🔌 Connection error lần thử {attempt + 1}, đợi {wait_time}s...")
+        else:
+            breaker.record_neutral()
+            wait_time = min(3 * (attempt + 1), 20)
+            self.logger.error(f"❌ Exception khi gọi Gemini API: {error}")
+        return AttemptOutcome(wait=0 if is_last else wait_time)
+    
+    def _make_request(self, messages: List[Dict], max_retries: Optional[int] = None,
+                      generation_config: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """Gửi request tới Gemini API, trả về text của candidate đầu tiên"""
+        return self._complete(messages, max_retries, generation_config).text
+    
+    def _complete(self, messages: List[Dict], max_retries: Optional[int] = None,
+                  generation_config: Optional[Dict[str, Any]] = None, model: Optional[str] = None) -> Completion:
+        """Gửi request tới `model` (mặc định model của client); mỗi lần thử hỏi model router, nên khi model chính
+        đang nghỉ thì request đi sang model dự phòng. Trả về các candidate và model đã trả lời (rỗng nếu thất bại)"""
+        
+        self.request_count += 1
+        max_retries = max_retries or get_retry_policy().attempts_per_request
+        model = model or self.model
+        
+        request_data = self._build_request_data(messages, generation_config)
+        if request_data is None:
+            return Completion()
+        
+        # Cassette: phát lại response đã ghi thay vì gọi API (khoá theo model được yêu cầu, không theo model dự phòng)
+        cassette = get_cassette()
+        cassette_key = cassette.key(model, request_data)
+        entry = cassette.lookup(cassette_key)
+        if entry is not None:
+            if cassette.replay_latency:
+                time.sleep(entry.latency)
+            return Completion(tuple(self._replay(entry)), entry.model or model)
+        
+        estimated_tokens = estimate_tokens(request_data)
+        
+        router = get_model_router()
         headers = {
             "Content-Type": "application/json"
         }
+        controller = get_concurrency_controller()
+        breaker = get_circuit_breaker()
+        key_pool = get_key_pool()
         
         for attempt in range(max_retries):
+            if attempt > 0:
+                # Mỗi lần gửi lại trừ vào budget của hội thoại; hết budget thì dừng ngay
+                self.retry_budget.consume("Gemini request")
+            # Upstream đang sập thì mọi worker cùng chờ ở đây, không giữ slot in-flight
+            probe = breaker.wait()
+            sent_model = model
             try:
-                self.logger.info(f"Gửi request tới Gemini API (lần thử {attempt + 1}/{max_retries})")
-                
-                response = requests.post(
-                    f"{url}?key={self.api_key}",
-                    headers=headers,
-                    json=request_data,
-                    timeout=90  # Tăng timeout
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                      # Parse response
-                    if "candidates" in result and len(result["candidates"]) > 0:
-                        candidate = result["candidates"][0]
-                        if "content" in candidate and "parts" in candidate["content"]:
-                            text = candidate["content"]["parts"][0].get("text", "")
-                            # Normalize newlines để đảm bảo JSONL format đúng
-                            text = text.replace('\n', ' ').replace('\r', ' ').strip()
-                            self.logger.info("✅ Gemini API response thành công")
-                            return text
-                    
-                    self.logger.warning(f"⚠️ Gemini response không có content: {result}")
-                    return None
-                    
-                elif response.status_code == 429:
-                    # Improved exponential backoff cho rate limit
-                    base_wait = min(2 ** attempt, 60)  # Max 60 giây
-                    jitter = random.uniform(0.5, 1.5)
-                    wait_time = base_wait * jitter
-                    
-                    self.logger.warning(f"🚫 Rate limit (429), đợi {wait_time:.1f}s...")
-                    time.sleep(wait_time)
-                    
-                    # Tăng interval tối thiểu sau rate limit
-                    self._min_request_interval = min(self._min_request_interval * 1.5, 2.0)
-                    continue
-                    
-                elif response.status_code in [500, 502, 503, 504]:
-                    # Server errors - retry với backoff
-                    wait_time = min(2 ** attempt, 30) + random.uniform(0, 5)
-                    self.logger.warning(f"🔄 Server error {response.status_code}, retry sau {wait_time:.1f}s...")
-                    time.sleep(wait_time)
-                    continue
+                # Giữ một slot in-flight của AIMD controller trong lúc chờ quota và gửi request
+                with controller.slot():
+                    # Mỗi lần thử đều tiêu tốn quota của một key nên đều phải qua rate limiter
+                    lease = self._wait_for_key(estimated_tokens)
+                    sent_model = router.route(model)
+                    self.logger.info(f"Gửi request tới Gemini API (lần thử {attempt + 1}/{max_retries})")
                     
-                else:
-                    self.logger.error(f"❌ Gemini API error {response.status_code}: {response.text}")
-                    if attempt == max_retries - 1:
-                        return None
-                    time.sleep(2 ** attempt)
-                    
-            except requests.exceptions.Timeout:
-                wait_time = min(5 * (attempt + 1), 30)
-                self.logger.warning(f"⏰ Timeout lần thử {attempt + 1}, đợi {wait_time}s...")
-                if attempt < max_retries - 1:
-                    time.sleep(wait_time)
-                continue
-                
-            except requests.exceptions.ConnectionError:
-                wait_time = min(5 * (attempt + 1), 30)
-                self.logger.warning(f"🔌 Connection error lần thử {attempt + 1}, đợi {wait_time}s...")
-                if attempt < max_retries - 1:
-                    time.sleep(wait_time)
-                continue
+                    status_code = None
+                    try:
+                        payload, cache_key = self._use_context_cache(request_data, lease.api_key, sent_model)
+                        sent_at = time.monotonic()
+                        response = self.session.post(
+                            f"{self.base_url}/models/{sent_model}:generateContent?key={lease.api_key}",
+                            headers=headers,
+                            json=payload,
+                            timeout=90  # Tăng timeout
+                        )
+                        latency = time.monotonic() - sent_at
+                        status_code = response.status_code
+                    finally:
+                        key_pool.release(lease, throttled=status_code == 429)
                 
+                result = response.json() if status_code == 200 else None
+                outcome = self._handle_response(
+                    status_code, result, response.text,
+                    attempt, max_retries, estimated_tokens,
+                    retry_after=response.headers.get("Retry-After"), lease=lease, cache_key=cache_key
+                )
+                # Sau _handle_response: 429 đã đặt key vào cooldown, router biết pool còn key khác hay không
+                self._record_route(model, sent_model, status_code)
+                if result is not None and outcome.text is not None:
+                    cassette.record(cassette_key, sent_model, response.text, latency, self.last_usage)
+            except NonRetryableError:
+                raise
             except Exception as e:
-                wait_time = min(3 * (attempt + 1), 20)
-                self.logger.error(f"❌ Exception khi gọi Gemini API: {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(wait_time)
-                continue
+                if isinstance(e, TIMEOUT_ERRORS + CONNECTION_ERRORS):
+                    router.record_failure(sent_model)
+                outcome = self._handle_exception(e, attempt, max_retries)
+            finally:
+                # Lượt thăm dò của breaker dừng mà chưa báo kết quả (lỗi không thể retry...) phải được nhả
+                breaker.release_probe(probe)
+            
+            if outcome.error is not None:
+                raise outcome.error
+            if outcome.done:
+                return Completion(tuple(outcome.candidates), sent_model)
+            if outcome.wait > 0 and attempt < max_retries - 1:
+                time.sleep(outcome.wait)
         
         self.logger.error(f"❌ Gemini API failed sau {max_retries} lần thử")
-        return None
+        return Completion()
+    
+    @staticmethod
+    def _record_route(requested: str, sent_model: str, status_code: Optional[int]) -> None:
+        """Báo kết quả của lần gửi cho model router: lỗi server và 429 dồn tới lúc chuyển sang model dự phòng.
+
+        429 chỉ tính là lỗi của model khi pool không còn key nào gửi được ngay; 429 mà pool đã xử lý
+        bằng cách chuyển key (key hết quota) không liên quan tới model
+        """
+        router = get_model_router()
+        if status_code == 200:
+            router.record_success(requested, sent_model)
+        elif status_code in SERVER_ERROR_STATUS or (status_code == 429 and not get_key_pool().has_ready_key()):
+            router.record_failure(sent_model)
+    
+    def _replay(self, entry: CassetteEntry) -> List[str]:
+        """Trả về text các candidate của một response lấy từ cassette (không tính vào rate limiter)"""
+        result = json.loads(entry.body)
+        self.last_usage = result.get("usageMetadata") or {}
+        self._add_usage(self.last_usage)
+        return self._parse_response(result)
+    
+    def _add_usage(self, usage: Dict[str, Any]) -> None:
+        self.usage_totals["requests"] += 1
+        self.usage_totals["prompt_tokens"] += int(usage.get("promptTokenCount") or 0)
+        self.usage_totals["output_tokens"] += int(usage.get("candidatesTokenCount") or 0)
+    
+    def _record_usage(self, result: Dict[str, Any], estimated_tokens: int, limiter=None) -> None:
+        """Đối chiếu tokens thực tế trong usageMetadata với ước lượng của rate limiter (của key đã gửi)"""
+        usage = result.get("usageMetadata") or {}
+        self.last_usage = usage
+        self._add_usage(usage)
+        get_context_cache().record_usage(usage)
+        prompt_tokens = usage.get("promptTokenCount")
+        if prompt_tokens is not None:
+            (limiter or get_rate_limiter()).record_usage(estimated_tokens, int(prompt_tokens))
+    
+    def complete(self, messages: List[Dict], n: int = 1, model: Optional[str] = None, **kwargs) -> Completion:
+        """Gửi request tới `model` (mặc định model của client) với tham số sinh của lời gọi (xem GENERATION_PARAM_MAP),
+        `n` > 1 sinh nhiều candidate trong một request; trả về kèm model đã trả lời để ghi vào lịch sử"""
+        generation_config = self._build_generation_config(candidate_count=n if n > 1 else None, **kwargs)
+        return self._complete(messages, generation_config=generation_config, model=model)
+    
+    async def complete_async(self, messages: List[Dict], n: int = 1, model: Optional[str] = None, **kwargs) -> Completion:
+        """Phiên bản async; client đồng bộ chạy request trong thread để không chặn event loop"""
+        return await asyncio.to_thread(self.complete, messages, n, model, **kwargs)
     
     def chat_completion(self, messages: List[Dict], **kwargs) -> Optional[str]:
-        """Interface tương thích với OpenAI client"""
-        return self._make_request(messages)
+        """Interface tương thích với OpenAI client; tham số sinh (xem GENERATION_PARAM_MAP) áp dụng cho lời gọi này"""
+        return self.complete(messages, **kwargs).text
+    
+    async def chat_completion_async(self, messages: List[Dict], **kwargs) -> Optional[str]:
+        """Phiên bản async của chat_completion"""
+        return (await self.complete_async(messages, **kwargs)).text
+    
+    def chat_completions(self, messages: List[Dict], n: int, **kwargs) -> List[str]:
+        """Sinh `n` phản hồi khác nhau cho cùng một prompt trong một request (candidateCount); prompt chỉ tính tokens một lần"""
+        return list(self.complete(messages, n, **kwargs).candidates)
+    
+    async def chat_completions_async(self, messages: List[Dict], n: int, **kwargs) -> List[str]:
+        """Phiên bản async của chat_completions"""
+        return list((await self.complete_async(messages, n, **kwargs)).candidates)
+
+def release_context_caches(base_url: Optional[str] = None) -> int:
+    """Xoá các context cache còn sống khi kết thúc lượt chạy (không xoá thì server tự xoá khi hết TTL)"""
+    base_url = (base_url or DEFAULT_BASE_URL).rstrip("/")
+    session = get_session_pool().get_session(base_url)
+    deleted = 0
+    for api_key, name in get_context_cache().drain():
+        try:
+            response = session.delete(f"{base_url}/{name}", params={"key": api_key}, timeout=30)
+            deleted += response.status_code == 200
+        except requests.exceptions.RequestException as e:
+            logging.getLogger(__name__).warning(f"⚠️ Không xoá được context cache {name}: {e}")
+    return deleted
 
-def create_gemini_client(api_key: str, model: str = "gemini-2.0-flash") -> GeminiClient:
-    """Factory function để tạo Gemini client"""
-    return GeminiClient(api_key=api_key, model=model)
+def create_gemini_client(api_key: str, model: str = "gemini-2.0-flash",
+                         async_mode: bool = False, base_url: Optional[str] = None) -> GeminiClient:
+    """Factory function để tạo Gemini client (async_mode=True dùng aiohttp trên event loop)"""
+    if async_mode:
+        from utils.async_gemini_client import AsyncGeminiClient
+        return AsyncGeminiClient(api_key=api_key, model=model, base_url=base_url)
+    return GeminiClient(api_key=api_key, model=model, base_url=base_url)
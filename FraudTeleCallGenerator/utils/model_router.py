@@ -0,0 +1,129 @@
+"""
+Model Router - Chọn model theo vai trò (left, right, manager, conclusion) và chuyển sang model dự phòng
+(FALLBACK_MODEL) khi model chính liên tục bị 429 hoặc lỗi server: model chính nghỉ trong một khoảng cooldown,
+mọi lần gửi trong lúc đó đi sang model dự phòng, hết cooldown thì quay lại model chính
+"""
+
+import logging
+import time
+from collections import Counter
+from threading import Lock
+from typing import Dict, Any, Mapping, Optional
+
+import config
+
+# Câu kết thúc (LEFT/RIGHT_TERMINATION_PROMPT) là một vai riêng: có thể dùng model khác câu thoại thường của agent
+ROLES = ("left", "right", "manager", "conclusion")
+
+
+def parse_role_models(value: Optional[str]) -> Dict[str, str]:
+    """Đọc model theo vai trò dạng 'right=gemini-2.0-flash-lite,manager=gemini-2.0-flash-lite' (rỗng = mọi vai trò dùng --model)"""
+    models = {}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        role, sep, model = item.partition("=")
+        role, model = role.strip(), model.strip()
+        if not sep or not model:
+            raise ValueError(f"Model theo vai trò phải có dạng vai=model: {item.strip()}")
+        if role not in ROLES:
+            raise ValueError(f"Vai trò không hợp lệ: {role} (chỉ nhận {', '.join(ROLES)})")
+        models[role] = model
+    return models
+
+
+class ModelRouter:
+    """Model của từng vai trò, model dự phòng và thời gian nghỉ của từng model, dùng chung cho toàn process"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.logger = logging.getLogger(__name__)
+        self.configure(config.ROLE_MODELS, config.FALLBACK_MODEL, config.MODEL_FALLBACK_AFTER, config.MODEL_FALLBACK_COOLDOWN)
+
+    def configure(self, role_models: Mapping[str, str], fallback: Optional[str], failures: int, cooldown: float) -> None:
+        with self._lock:
+            self.role_models = {role: model for role, model in role_models.items() if role in ROLES and model}
+            self.fallback = fallback or None
+            self.failure_threshold = max(1, failures)
+            self.cooldown = max(0.0, cooldown)
+            self._failures: Counter = Counter()
+            self._resting_until: Dict[str, float] = {}
+            self.served: Counter = Counter()
+            self.rerouted = 0
+            self.trips = 0
+
+    def model_for(self, role: str, default: Optional[str] = None) -> str:
+        """Model chính của vai trò: model cấu hình riêng cho vai đó, không có thì `default` (mặc định DEFAULT_MODEL)"""
+        return self.role_models.get(role) or default or config.DEFAULT_MODEL
+
+    def route(self, model: str) -> str:
+        """Model thực sự nhận lần gửi này: model dự phòng trong lúc `model` đang nghỉ, ngược lại chính `model`"""
+        with self._lock:
+            if self.fallback and self.fallback != model and self._resting_until.get(model, 0.0) > time.monotonic():
+                return self.fallback
+            return model
+
+    def record_success(self, requested: str, served: str) -> None:
+        """Một response thành công của `served` cho request gửi tới `requested`"""
+        with self._lock:
+            self._failures[served] = 0
+            self.served[served] += 1
+            if served != requested:
+                self.rerouted += 1
+
+    def record_failure(self, model: str) -> None:
+        """Lỗi server, timeout hoặc 429 (khi pool hết key gửi được) của `model`: đủ FALLBACK_AFTER lần liên tiếp thì model này nghỉ `cooldown` giây"""
+        if not self.fallback or model == self.fallback or self.cooldown <= 0:
+            return
+        with self._lock:
+            self._failures[model] += 1
+            if self._failures[model] < self.failure_threshold:
+                return
+            self._failures[model] = 0
+            self._resting_until[model] = time.monotonic() + self.cooldown
+            self.trips += 1
+        self.logger.warning(f"🔀 Model {model} lỗi {self.failure_threshold} lần liên tiếp, "
+                            f"chuyển sang {self.fallback} trong {self.cooldown:g}s")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "role_models": dict(self.role_models),
+                "fallback": self.fallback,
+                "served": dict(self.served),
+                "rerouted": self.rerouted,
+                "trips": self.trips,
+                "resting": sorted(model for model, until in self._resting_until.items() if until > now),
+            }
+
+
+_model_router = ModelRouter()
+
+
+def get_model_router() -> ModelRouter:
+    """Trả về model router dùng chung của process"""
+    return _model_router
+
+
+def configure_model_routing(role_models: Mapping[str, str] = config.ROLE_MODELS,
+                            fallback: Optional[str] = config.FALLBACK_MODEL,
+                            failures: int = config.MODEL_FALLBACK_AFTER,
+                            cooldown: float = config.MODEL_FALLBACK_COOLDOWN) -> ModelRouter:
+    """Đặt model theo vai trò và model dự phòng từ tham số dòng lệnh, đặt lại thống kê"""
+    _model_router.configure(role_models, fallback, failures, cooldown)
+    if _model_router.role_models:
+        routes = ", ".join(f"{role}={model}" for role, model in _model_router.role_models.items())
+        _model_router.logger.info(f"🔀 Model theo vai trò: {routes}")
+    return _model_router
+
+
+def format_model_routing_stats(stats: Dict[str, Any]) -> str:
+    """Định dạng thống kê model router để ghi log"""
+    routes = ", ".join(f"{role}={model}" for role, model in stats["role_models"].items()) or "mọi vai trò dùng --model"
+    served = ", ".join(f"{model}: {count}" for model, count in sorted(stats["served"].items())) or "chưa có"
+    fallback = (
+        f"dự phòng {stats['fallback']}: chuyển {stats['trips']} lần, {stats['rerouted']} response từ model dự phòng"
+        if stats["fallback"] else "không có model dự phòng"
+    )
+    return f"Model theo vai trò ({routes}): response theo model {served}; {fallback}"
@@ -0,0 +1,145 @@
+"""
+Retry Policy - Ngân sách retry dùng chung cho client, agent và batch
+"""
+
+import logging
+import random
+from typing import Dict, Any, Optional
+from threading import Lock
+
+DEFAULT_ATTEMPTS_PER_REQUEST = 5   # Số lần gửi tối đa cho một HTTP request
+DEFAULT_DIALOGUE_BUDGET = 20       # Tổng số lần retry (mọi tầng) của một hội thoại
+DEFAULT_RUN_BUDGET = 0             # Tổng số lần retry của cả lượt chạy (0 = không giới hạn)
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 30.0
+
+
+class NonRetryableError(Exception):
+    """Lỗi mà không tầng nào (client, agent, batch) được thử lại"""
+
+
+class RetryBudgetExhausted(NonRetryableError):
+    """Hết ngân sách retry: hội thoại phải dừng ngay để giải phóng worker"""
+
+
+class RetryBudget:
+    """Bộ đếm retry của một phạm vi (hội thoại hoặc cả lượt chạy).
+
+    Mỗi lần retry ở bất kỳ tầng nào đều trừ vào budget của hội thoại và của
+    budget cha (lượt chạy), nên tổng số lần thử không còn nhân lên theo số tầng.
+    """
+
+    def __init__(self, limit: int, parent: Optional["RetryBudget"] = None, name: str = "dialogue"):
+        self.limit = limit
+        self.parent = parent
+        self.name = name
+        self.used = 0
+        self.exhausted = False
+        self._lock = Lock()
+
+    @property
+    def remaining(self) -> Optional[int]:
+        """Số lần retry còn lại (None nếu không giới hạn)"""
+        if self.limit <= 0:
+            return None
+        return max(0, self.limit - self.used)
+
+    def try_consume(self) -> bool:
+        """Lấy một lần retry; False nếu budget này hoặc budget cha đã hết"""
+        with self._lock:
+            if self.exhausted or (self.limit > 0 and self.used >= self.limit):
+                self.exhausted = True
+                return False
+            if self.parent is not None and not self.parent.try_consume():
+                self.exhausted = True
+                return False
+            self.used += 1
+            return True
+
+    def consume(self, context: str = "") -> None:
+        """Như try_consume nhưng raise RetryBudgetExhausted khi hết budget"""
+        if not self.try_consume():
+            scope = self.name if self.parent is None or not self.parent.exhausted else self.parent.name
+            raise RetryBudgetExhausted(f"Hết ngân sách retry ({scope}){': ' + context if context else ''}")
+
+
+class RetryPolicy:
+    """Chính sách retry dùng chung: số lần thử mỗi request, budget mỗi hội thoại và mỗi lượt chạy"""
+
+    def __init__(self, attempts_per_request: int = DEFAULT_ATTEMPTS_PER_REQUEST,
+                 dialogue_budget: int = DEFAULT_DIALOGUE_BUDGET,
+                 run_budget: int = DEFAULT_RUN_BUDGET,
+                 base_delay: float = DEFAULT_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_DELAY):
+        self.logger = logging.getLogger(__name__)
+        self._lock = Lock()
+        self.configure(attempts_per_request, dialogue_budget, run_budget, base_delay, max_delay)
+
+    def configure(self, attempts_per_request: int, dialogue_budget: int, run_budget: int,
+                  base_delay: float = DEFAULT_BASE_DELAY, max_delay: float = DEFAULT_MAX_DELAY) -> None:
+        """Đặt lại tham số; budget của lượt chạy được tạo mới"""
+        with self._lock:
+            self.attempts_per_request = max(1, attempts_per_request)
+            self.dialogue_budget = dialogue_budget
+            self.base_delay = base_delay
+            self.max_delay = max_delay
+            self.run_budget = RetryBudget(run_budget, name="run")
+            self.dialogues_started = 0
+            self.dialogues_exhausted = 0
+
+    def new_dialogue_budget(self) -> RetryBudget:
+        """Tạo budget cho một hội thoại mới, trừ chung vào budget của lượt chạy"""
+        with self._lock:
+            self.dialogues_started += 1
+        return RetryBudget(self.dialogue_budget, parent=self.run_budget)
+
+    def record_exhausted(self) -> None:
+        """Ghi nhận một hội thoại bị dừng vì hết budget"""
+        with self._lock:
+            self.dialogues_exhausted += 1
+
+    def backoff(self, retry_index: int, base_delay: Optional[float] = None) -> float:
+        """Thời gian chờ exponential có jitter trước lần retry thứ `retry_index` (tính từ 0)"""
+        base = self.base_delay if base_delay is None else base_delay
+        return min(base * (2 ** retry_index), self.max_delay) * random.uniform(0.5, 1.0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "attempts_per_request": self.attempts_per_request,
+                "dialogue_budget": self.dialogue_budget,
+                "run_budget": self.run_budget.limit,
+                "run_retries": self.run_budget.used,
+                "dialogues": self.dialogues_started,
+                "dialogues_exhausted": self.dialogues_exhausted,
+            }
+
+
+# Policy mặc định cho toàn process
+_retry_policy = RetryPolicy()
+
+
+def get_retry_policy() -> RetryPolicy:
+    """Trả về retry policy dùng chung của process"""
+    return _retry_policy
+
+
+def configure_retry_policy(attempts_per_request: int = DEFAULT_ATTEMPTS_PER_REQUEST,
+                           dialogue_budget: int = DEFAULT_DIALOGUE_BUDGET,
+                           run_budget: int = DEFAULT_RUN_BUDGET) -> RetryPolicy:
+    """Cấu hình retry policy dùng chung từ tham số dòng lệnh"""
+    _retry_policy.configure(attempts_per_request, dialogue_budget, run_budget)
+    _retry_policy.logger.info(
+        f"🔁 Retry policy: {attempts_per_request} lần thử/request, budget {dialogue_budget}/hội thoại, "
+        f"{run_budget or 'không giới hạn'}/lượt chạy"
+    )
+    return _retry_policy
+
+
+def format_retry_stats(stats: Dict[str, Any]) -> str:
+    """Định dạng thống kê retry để ghi log"""
+    return (
+        f"Retry: {stats['run_retries']} lần retry trên {stats['dialogues']} hội thoại "
+        f"(budget {stats['dialogue_budget']}/hội thoại, {stats['run_budget'] or 'không giới hạn'}/lượt chạy), "
+        f"{stats['dialogues_exhausted']} hội thoại dừng do hết budget"
+    )
@@ -1,19 +1,25 @@
 from typing import List, Dict, Any, Optional
 from .base_agent import BaseAgent
 from .prompts.left_prompts import LEFT_SYSTEM_PROMPT
+from utils.gemini_client import GeminiClient
+from utils.retry_policy import NonRetryableError
 import config
-import time
+import asyncio
 import logging
 
 class LeftAgent(BaseAgent):
     """Nhân viên dịch vụ, chịu trách nhiệm cung cấp dịch vụ và hỗ trợ khách hàng"""
     
+    HISTORY_LABELS = {"assistant": "Nhân viên dịch vụ", "user": "Người dùng"}
+    
     def __init__(self, model: Optional[str] = None, conversation_type: str = "Tư vấn dịch vụ khách hàng", 
-                 api_key: Optional[str] = None, max_retries: int = 10, retry_delay: float = 5):
+                 api_key: Optional[str] = None, max_retries: int = 10, retry_delay: float = 5,
+                 client: Optional[GeminiClient] = None):
         super().__init__(
             role="left", 
             model=model or config.DEFAULT_MODEL, 
-            api_key=api_key
+            api_key=api_key,
+            client=client
         )
         self.conversation_type = conversation_type
         self.max_retries = max_retries
@@ -24,13 +30,16 @@ class LeftAgent(BaseAgent):
         return LEFT_SYSTEM_PROMPT.format(conversation_type=self.conversation_type)
     
     def generate_response(self, message: Optional[str] = None) -> str:
+        """Tạo phản hồi dịch vụ (đồng bộ), bọc quanh generate_response_async"""
+        return asyncio.run(self.generate_response_async(message))
+    
+    async def generate_response_async(self, message: Optional[str] = None) -> str:
         """Tạo phản hồi dịch vụ, thêm cơ chế thử lại lỗi"""
         # Tin nhắn hoặc phản hồi ban đầu
         messages = [{"role": "system", "content": self.get_system_prompt()}]
         
-        # Thêm lịch sử trò chuyện
-        for msg in self.conversation_history:
-            messages.append(msg)
+        # Thêm lịch sử trò chuyện (các lượt cũ đã được tóm tắt)
+        messages.extend(await self.history_messages_async())
             
         # Nếu có tin nhắn mới, thêm vào danh sách tin nhắn
         if message:
@@ -40,11 +49,15 @@ class LeftAgent(BaseAgent):
             messages.append({"role": "user", "content": "Bắt đầu cuộc gọi tư vấn dịch vụ."})
         
         # Thêm logic retry khi gọi API
+        # Gộp lượt giữa các hội thoại (--turn_batch_roles); câu mở đầu chưa có ngữ cảnh thì luôn tự gửi
+        batched = await self.batched_reply_async(messages) if message else None
         retry_count = 0
         while True:
             try:
-                # Gọi API để sinh phản hồi (Gemini)
-                reply = self.client.chat_completion(messages=messages)
+                # Gọi API để sinh phản hồi (Gemini); câu nhận từ lô chỉ dùng ở lần thử đầu
+                completion = batched or await self.client.complete_async(messages, model=self.model, **self.generation_config)
+                batched = None
+                reply, self.last_model = completion.text, completion.model
                 
                 # Kiểm tra phản hồi hợp lệ
                 if reply and len(reply.strip()) > 0:
@@ -58,25 +71,30 @@ class LeftAgent(BaseAgent):
                     retry_count += 1
                     if retry_count <= self.max_retries:
                         logging.warning(f"API request thất bại (lần thử {retry_count}): Phản hồi trống hoặc không hợp lệ")
-                        time.sleep(self.retry_delay)
+                        await self._wait_before_retry(retry_count, self.retry_delay)
                         continue
                     else:
                         logging.error(f"Đã đạt số lần thử tối đa ({self.max_retries}), sử dụng phản hồi mặc định")
                         fallback_response = "Xin lỗi, tôi đang gặp sự cố kỹ thuật. Bạn có thể để lại thông tin liên hệ để chúng tôi hỗ trợ bạn sau không?"
+                        self.last_model = None
                         if message:
                             self.update_history("user", message)
                         self.update_history("assistant", fallback_response)
                         return fallback_response
                         
+            except NonRetryableError:
+                # Hết budget hoặc lỗi không thể retry: không thử lại ở tầng agent, để hội thoại dừng ngay
+                raise
             except Exception as e:
                 retry_count += 1
                 if retry_count <= self.max_retries:
                     logging.warning(f"Left agent API error (lần thử {retry_count}): {e}")
-                    time.sleep(self.retry_delay)
+                    await self._wait_before_retry(retry_count, self.retry_delay)
                     continue
                 else:
                     logging.error(f"Left agent error sau {self.max_retries} lần thử: {e}")
                     fallback_response = f"Xin lỗi, tôi đang gặp vấn đề kỹ thuật. Tôi sẽ liên hệ lại với bạn sau."
+                    self.last_model = None
                     if message:
                         self.update_history("user", message)
                     self.update_history("assistant", fallback_response)
@@ -1,115 +1,121 @@
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Tuple, Optional
 from .base_agent import BaseAgent
-from .prompts.manager_prompts import MANAGER_SYSTEM_PROMPT
+from .prompts.manager_prompts import (
+    MANAGER_PROMPT, MANAGER_EVALUATE_PROMPT, MANAGER_DELTA_PROMPT, MANAGER_VERDICT_FIELDS, MANAGER_NOTES_FIELD
+)
+from .manager_verdict import ManagerVerdict, VERDICT_SCHEMA, INCREMENTAL_VERDICT_SCHEMA, parse_verdict
+from .memory import format_lines
+from .prompts.summary_prompts import SUMMARY_CONTEXT_TEMPLATE
+from utils.gemini_client import GeminiClient
+from utils.retry_policy import NonRetryableError
 import config
-import json
-import time
+import asyncio
 import logging
 
 class ManagerAgent(BaseAgent):
     """Agent quản lý, đánh giá hội thoại và quyết định có nên kết thúc hay không"""
     
+    HISTORY_LABELS = {"left": "Nhân viên dịch vụ", "right": "Người dùng"}
+    
     def __init__(self, model: Optional[str] = None, strictness: str = "medium", 
-                 api_key: Optional[str] = None, retry_delay: float = 5):
+                 api_key: Optional[str] = None, retry_delay: float = 5,
+                 client: Optional[GeminiClient] = None,
+                 structured_output: Optional[bool] = None,
+                 incremental: Optional[bool] = None):
         super().__init__(role="manager", model=model or config.DEFAULT_MODEL, 
-                        api_key=api_key)
+                        api_key=api_key, client=client)
         self.strictness = strictness  # low, medium, high
         self.retry_delay = retry_delay
+        # Ràng buộc output bằng responseSchema để nhận phán quyết JSON trong một lần gọi
+        self.structured_output = config.MANAGER_STRUCTURED_OUTPUT if structured_output is None else structured_output
+        # Đánh giá tăng dần: sau lần đầu chỉ gửi phán quyết, ghi chú trước đó và các câu thoại mới
+        self.incremental = config.MANAGER_INCREMENTAL_EVAL if incremental is None else incremental
+        self.last_verdict: Optional[ManagerVerdict] = None
+        self.evaluated = 0  # Số câu thoại đã được đánh giá
         
     def get_system_prompt(self) -> str:
-        """Lấy prompt hệ thống đã được tuỳ biến"""
-        return MANAGER_SYSTEM_PROMPT.format(strictness=self.strictness)
+        """Lấy prompt hệ thống đã được tuỳ biến; structured output thì bỏ hướng dẫn trả lời bằng văn bản"""
+        return MANAGER_PROMPT.render(strictness=self.strictness, output="json" if self.structured_output else "text")
     
-    def generate_response(self, message: str) -> str:
+    async def generate_response_async(self, message: str) -> str:
         """Base implementation - not used in manager"""
         return ""
     
-    def evaluate_dialogue(self, dialogue_history: List[Dict[str, str]]) -> Dict[str, Any]:
+    async def transcript_async(self, dialogue_history: List[Dict[str, str]]) -> str:
+        """Văn bản hội thoại gửi cho manager: tóm tắt phần đầu (nếu có) và nguyên văn các lượt gần nhất"""
+        await self._refresh_memory_async(dialogue_history)
+        recent = format_lines(dialogue_history[self.memory.covered:], self.HISTORY_LABELS)
+        if not self.memory.text:
+            return recent
+        return f"{SUMMARY_CONTEXT_TEMPLATE.format(summary=self.memory.text)}\n\n{recent}"
+    
+    def clear_history(self) -> None:
+        """Xoá lịch sử và trạng thái đánh giá tăng dần"""
+        super().clear_history()
+        self.last_verdict = None
+        self.evaluated = 0
+    
+    async def evaluation_request_async(self, dialogue_history: List[Dict[str, str]]) -> str:
+        """Nội dung yêu cầu đánh giá: toàn bộ hội thoại ở lần đầu, các lần sau chỉ phần mới kể từ lần trước"""
+        if self.incremental and self.last_verdict is not None and self.evaluated <= len(dialogue_history):
+            content = MANAGER_DELTA_PROMPT.format(
+                evaluated=self.evaluated,
+                reason=self.last_verdict.reason or "(không có)",
+                notes=self.last_verdict.notes or "(không có)",
+                lines=format_lines(dialogue_history[self.evaluated:], self.HISTORY_LABELS) or "(không có)"
+            )
+        else:
+            # Lịch sử hội thoại (các lượt cũ đã được tóm tắt)
+            content = MANAGER_EVALUATE_PROMPT.format(dialogue=await self.transcript_async(dialogue_history))
+        return content + MANAGER_VERDICT_FIELDS + (MANAGER_NOTES_FIELD if self.incremental else "")
+    
+    def evaluate_dialogue(self, dialogue_history: List[Dict[str, str]]) -> ManagerVerdict:
+        """Đánh giá hội thoại (đồng bộ), bọc quanh evaluate_dialogue_async"""
+        return asyncio.run(self.evaluate_dialogue_async(dialogue_history))
+    
+    async def evaluate_dialogue_async(self, dialogue_history: List[Dict[str, str]]) -> ManagerVerdict:
         """Đánh giá hội thoại và trả về quyết định kết thúc, ai là người kết thúc và lý do"""
-        messages = [{"role": "system", "content": self.get_system_prompt()}]
-        
-        # Xây dựng lịch sử hội thoại đầy đủ
-        dialogue_text = "\n".join([
-            f"{'Kẻ lừa đảo' if msg['role'] == 'left' else 'Người dùng'}: {msg['content']}"
-            for msg in dialogue_history
-        ])
-        
-        # Sử dụng đoạn hội thoại đã xây dựng
-        messages.append({
-            "role": "user", 
-            "content": f"Hãy đánh giá đoạn hội thoại sau và quyết định có nên kết thúc không, ai là người nên kết thúc:\n\n{dialogue_text}\n\nVui lòng trả lời bằng định dạng JSON, gồm các trường sau:\n- should_terminate: giá trị True/False, cho biết có nên kết thúc không\n- terminator: chuỗi, giá trị có thể là 'left' (kẻ lừa đảo kết thúc), 'right' (người dùng kết thúc), 'natural' (kết thúc tự nhiên) hoặc 'endcall' (gác máy)\n- reason: chuỗi, giải thích chi tiết lý do kết thúc hoặc tiếp tục"
-        })
+        messages = [
+            {"role": "system", "content": self.get_system_prompt()},
+            {"role": "user", "content": await self.evaluation_request_async(dialogue_history)},
+        ]
+        schema = INCREMENTAL_VERDICT_SCHEMA if self.incremental else VERDICT_SCHEMA
         
         # Thêm logic retry
         retry_count = 0
         while True:
             try:
                 # Gọi API để sinh phản hồi
-                reply = self.client.chat_completion(
+                reply = await self.client.chat_completion_async(
                     messages=messages,
                     model=self.model or config.DEFAULT_MODEL,
-                    temperature=0.3,
-                    max_tokens=500
+                    response_schema=schema if self.structured_output else None,
+                    **self.generation_config
                 )
                 
-                # Kiểm tra lỗi API
-                if reply and "API" in reply:
-                    retry_count += 1
-                    if retry_count <= 3:
-                        logging.warning(f"API error, retrying ({retry_count}/3): {reply}")
-                        time.sleep(self.retry_delay)
-                        continue
-                    else:
-                        logging.error(f"API error after 3 retries: {reply}")
-                        return {"should_terminate": True, "terminator": "manager", "reason": f"Lỗi API: {reply}"}
-                
-                # Thử parse JSON
-                try:
-                    # Tìm JSON trong phản hồi
-                    json_match = self._extract_json(reply or "")
-                    if json_match:
-                        result = json.loads(json_match)
-                    else:
-                        # Nếu không tìm thấy JSON, thử parse toàn bộ reply
-                        result = json.loads(reply or "{}")
-                        
-                    # Kiểm tra các trường bắt buộc
-                    if "should_terminate" in result and "terminator" in result and "reason" in result:
-                        # Chuyển đổi các giá trị thành định dạng chuẩn
-                        result["should_terminate"] = bool(result["should_terminate"])
-                        result["terminator"] = str(result["terminator"])
-                        result["reason"] = str(result["reason"])
-                        
-                        return result
-                    else:
-                        # Thiếu trường bắt buộc, thử phân tích dạng text
-                        return self._fallback_text_analysis(reply or "")
-                        
-                except (json.JSONDecodeError, ValueError) as e:
-                    # Nếu không parse được JSON, thử phân tích dạng text
-                    return self._fallback_text_analysis(reply or "")
+                # Schema đảm bảo JSON hợp lệ; validator vẫn chấp nhận JSON lẫn chữ khi tắt structured output
+                verdict = parse_verdict(reply)
+                if verdict is None:
+                    # Không đọc được JSON (vd. model trả lời văn xuôi), phân tích dạng text
+                    verdict = self._fallback_text_analysis(reply or "")
+                self.last_verdict = verdict
+                self.evaluated = len(dialogue_history)
+                return verdict
                     
+            except NonRetryableError:
+                # Hết budget hoặc lỗi không thể retry: không thử lại ở tầng agent, để hội thoại dừng ngay
+                raise
             except Exception as e:
                 retry_count += 1
                 if retry_count <= 3:
                     logging.warning(f"Manager agent error, retrying ({retry_count}/3): {e}")
-                    time.sleep(self.retry_delay)
+                    await self._wait_before_retry(retry_count, self.retry_delay)
                     continue
                 else:
                     logging.error(f"Manager agent error after 3 retries: {e}")
-                    return {"should_terminate": True, "terminator": "manager", "reason": f"Lỗi hệ thống: {str(e)}"}
-    
-    def _extract_json(self, text: str) -> Optional[str]:
-        """Trích xuất chuỗi JSON từ text"""
-        import re
-        # Tìm pattern JSON
-        json_pattern = r'\{.*\}'
-        match = re.search(json_pattern, text, re.DOTALL)
-        if match:
-            return match.group(0)
-        return None
+                    return ManagerVerdict(should_terminate=True, terminator="manager", reason=f"Lỗi hệ thống: {str(e)}")
     
-    def _fallback_text_analysis(self, reply: str) -> Dict[str, Any]:
+    def _fallback_text_analysis(self, reply: str) -> ManagerVerdict:
         """Phân tích text khi không parse được JSON"""
         reply_lower = reply.lower()
         
@@ -125,8 +131,8 @@ class ManagerAgent(BaseAgent):
         else:
             terminator = "natural"
         
-        return {
-            "should_terminate": should_terminate,
-            "terminator": terminator,
-            "reason": reply[:100] + "..." if len(reply) > 100 else reply
-        }
+        return ManagerVerdict(
+            should_terminate=should_terminate,
+            terminator=terminator,
+            reason=reply[:100] + "..." if len(reply) > 100 else reply
+        )
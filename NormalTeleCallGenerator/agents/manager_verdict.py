@@ -0,0 +1,126 @@
+"""
+Manager Verdict - Phán quyết có cấu trúc của ManagerAgent và schema JSON tương ứng
+"""
+
+import json
+from typing import Any, Dict, NamedTuple, Optional, Sequence
+
+# Các giá trị terminator hợp lệ; "manager" chỉ dùng nội bộ khi manager lỗi
+TERMINATORS = ("left", "right", "natural", "endcall", "manager")
+
+# responseSchema gửi kèm generationConfig (tập con OpenAPI 3.0 mà Gemini hỗ trợ)
+VERDICT_SCHEMA: Dict[str, Any] = {
+    "type": "OBJECT",
+    "properties": {
+        "should_terminate": {"type": "BOOLEAN"},
+        "terminator": {"type": "STRING", "enum": ["left", "right", "natural", "endcall"]},
+        "reason": {"type": "STRING"},
+    },
+    "required": ["should_terminate", "terminator", "reason"],
+    "propertyOrdering": ["should_terminate", "terminator", "reason"],
+}
+
+# Đánh giá tăng dần: manager trả thêm ghi chú các dữ kiện then chốt, lần sau chỉ cần gửi ghi chú và các lượt mới
+INCREMENTAL_VERDICT_SCHEMA: Dict[str, Any] = {
+    "type": "OBJECT",
+    "properties": {
+        **VERDICT_SCHEMA["properties"],
+        "notes": {"type": "STRING"},
+    },
+    "required": ["should_terminate", "terminator", "reason", "notes"],
+    "propertyOrdering": ["should_terminate", "terminator", "reason", "notes"],
+}
+
+END_CALL_SCHEMA: Dict[str, Any] = {
+    "type": "OBJECT",
+    "properties": {
+        "reason": {"type": "STRING"},
+    },
+    "required": ["reason"],
+}
+
+
+def end_call_batch_schema(keys: Sequence[str]) -> Dict[str, Any]:
+    """Schema cho một request gộp nhiều hội thoại ngắt máy: mỗi mã hội thoại một trường lý do"""
+    return {
+        "type": "OBJECT",
+        "properties": {key: {"type": "STRING"} for key in keys},
+        "required": list(keys),
+        "propertyOrdering": list(keys),
+    }
+
+
+class ManagerVerdict(NamedTuple):
+    """Quyết định của manager: có kết thúc không, ai kết thúc, lý do và ghi chú dữ kiện (khi đánh giá tăng dần)"""
+    should_terminate: bool
+    terminator: str
+    reason: str
+    notes: str = ""
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self._asdict()
+
+
+class EndCallVerdict(NamedTuple):
+    """Đánh giá của manager khi một bên chủ động ngắt máy"""
+    reason: str
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self._asdict()
+
+
+def _load_json_object(text: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Đọc một JSON object; chấp nhận code fence hoặc chữ thừa bao quanh object"""
+    text = (text or "").strip()
+    if not text:
+        return None
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        start, end = text.find("{"), text.rfind("}")
+        if start < 0 or end <= start:
+            return None
+        try:
+            data = json.loads(text[start:end + 1])
+        except json.JSONDecodeError:
+            return None
+    return data if isinstance(data, dict) else None
+
+
+def _to_bool(value: Any) -> bool:
+    """Chuyển true/false, "True", "có", 1... về bool"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return value != 0
+    return str(value).strip().lower() in ("true", "yes", "có", "1")
+
+
+def parse_verdict(text: Optional[str]) -> Optional[ManagerVerdict]:
+    """Kiểm tra và chuẩn hoá phán quyết JSON; trả về None nếu không đọc được"""
+    data = _load_json_object(text)
+    if data is None or "should_terminate" not in data:
+        return None
+    terminator = str(data.get("terminator") or "natural").strip().lower()
+    if terminator not in TERMINATORS:
+        terminator = "natural"
+    return ManagerVerdict(
+        should_terminate=_to_bool(data["should_terminate"]),
+        terminator=terminator,
+        reason=str(data.get("reason") or ""),
+        notes=str(data.get("notes") or ""),
+    )
+
+
+def parse_end_call_verdict(text: Optional[str]) -> Optional[EndCallVerdict]:
+    """Đọc lý do ngắt máy từ JSON; trả về None nếu không có trường reason"""
+    data = _load_json_object(text)
+    if data is None or not data.get("reason"):
+        return None
+    return EndCallVerdict(reason=str(data["reason"]))
+
+
+def parse_end_call_batch(text: Optional[str], keys: Sequence[str]) -> Dict[str, EndCallVerdict]:
+    """Đọc lý do ngắt máy của nhiều hội thoại; bỏ qua các mã thiếu hoặc để trống"""
+    data = _load_json_object(text) or {}
+    return {key: EndCallVerdict(reason=str(data[key])) for key in keys if data.get(key)}
@@ -0,0 +1,206 @@
+"""
+Dialogue Memory - Giữ nguyên văn N lượt gần nhất, các lượt cũ hơn được gộp dần vào một bản tóm tắt ngắn
+"""
+
+import asyncio
+import logging
+from typing import Dict, Any, Awaitable, Callable, Iterable, List, NamedTuple, Optional, Tuple
+from threading import Lock
+
+ROLES = ("left", "right", "manager")
+DEFAULT_MEMORY_WINDOW = 0       # Số lượt (cặp tin nhắn) gần nhất gửi nguyên văn; 0 = gửi toàn bộ lịch sử
+DEFAULT_SUMMARY_EVERY = 4       # Cập nhật tóm tắt mỗi khi có thêm từng ấy lượt rơi ra khỏi cửa sổ
+FALLBACK_LINE_CHARS = 120       # Độ dài tối đa mỗi câu khi tóm tắt dự phòng (không gọi model)
+
+
+class MemoryPolicy(NamedTuple):
+    """Chính sách bộ nhớ của một vai trò"""
+    window: int = DEFAULT_MEMORY_WINDOW
+    summary_every: int = DEFAULT_SUMMARY_EVERY
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+
+class SummaryCache:
+    """Các lần cập nhật tóm tắt của một hội thoại, khoá theo nội dung (tóm tắt cũ + các lượt được gộp).
+
+    Ba agent cùng nhìn một bản ghi cuộc gọi nên cùng gộp một đoạn giống hệt nhau:
+    dùng chung một cache thì mỗi đoạn chỉ tốn một request tóm tắt.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Future] = {}
+
+    def get_or_start(self, key: str, factory: Callable[[], Awaitable[str]]) -> asyncio.Future:
+        """Trả về task tóm tắt của `key`, tạo mới (chạy nền) nếu chưa có hoặc đã bị huỷ"""
+        task = self._tasks.get(key)
+        if task is not None and not task.cancelled():
+            _memory_registry.record_shared()
+            return task
+        task = asyncio.ensure_future(factory())
+        self._tasks[key] = task
+        return task
+
+    def cancel(self) -> None:
+        """Huỷ các lần tóm tắt chưa xong khi hội thoại kết thúc"""
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()  # Đánh dấu lỗi (nếu có) đã được xử lý
+        self._tasks.clear()
+
+
+class RollingSummary:
+    """Bộ nhớ của một agent trong một hội thoại.
+
+    `covered` tin nhắn đầu lịch sử đã nằm trong `text`; phần còn lại được gửi nguyên văn.
+    Điểm cắt chỉ dịch theo bội số 2 * summary_every tin nhắn nên giữa hai lần cập nhật,
+    phần đầu request giữ nguyên và mỗi lần cập nhật chỉ gửi tóm tắt cũ cùng các lượt mới rơi ra.
+    Việc tóm tắt chạy nền (`task`): trong lúc chờ, các lượt đó vẫn được gửi nguyên văn.
+    """
+
+    def __init__(self, policy: Optional[MemoryPolicy] = None, cache: Optional[SummaryCache] = None):
+        self.policy = policy or MemoryPolicy()
+        self.cache = cache or SummaryCache()
+        self.text = ""
+        self.covered = 0
+        self.task: Optional[asyncio.Future] = None
+        self.task_end = 0
+
+    def pending(self, total: int) -> Optional[Tuple[int, int]]:
+        """Khoảng tin nhắn [start, end) cần gộp vào tóm tắt khi lịch sử có `total` tin nhắn, None nếu chưa cần"""
+        if not self.policy.enabled:
+            return None
+        step = 2 * max(1, self.policy.summary_every)
+        overflow = total - self.covered - 2 * self.policy.window
+        if overflow < step:
+            return None
+        return self.covered, self.covered + overflow // step * step
+
+    def start(self, task: asyncio.Future, end: int) -> None:
+        self.task = task
+        self.task_end = end
+
+    def apply(self) -> None:
+        """Nhận kết quả của task tóm tắt đã xong (ném lại lỗi không retry được nếu có)"""
+        task, self.task = self.task, None
+        self.update(task.result(), self.task_end)
+
+    def update(self, text: str, end: int) -> None:
+        self.text = text.strip()
+        self.covered = end
+
+    def reset(self) -> None:
+        self.text = ""
+        self.covered = 0
+        self.task = None
+
+
+def format_lines(messages: Iterable[Dict[str, Any]], labels: Dict[str, str]) -> str:
+    """Chuyển tin nhắn thành các dòng 'Người nói: nội dung'"""
+    return "\n".join(f"{labels.get(msg['role'], msg['role'])}: {msg['content']}" for msg in messages)
+
+
+def fallback_summary(previous: str, messages: Iterable[Dict[str, Any]], labels: Dict[str, str]) -> str:
+    """Tóm tắt dự phòng khi gọi model lỗi: nối tóm tắt cũ với từng câu đã cắt ngắn"""
+    lines = [previous] if previous else []
+    for msg in messages:
+        content = " ".join(msg["content"].split())
+        if len(content) > FALLBACK_LINE_CHARS:
+            content = content[:FALLBACK_LINE_CHARS].rstrip() + "…"
+        lines.append(f"{labels.get(msg['role'], msg['role'])}: {content}")
+    return "\n".join(lines)
+
+
+class MemoryRegistry:
+    """Chính sách bộ nhớ theo vai trò và thống kê tóm tắt dùng chung cho toàn process"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.logger = logging.getLogger(__name__)
+        self.configure({})
+
+    def configure(self, policies: Dict[str, MemoryPolicy]) -> None:
+        with self._lock:
+            self._policies = {role: policies.get(role, MemoryPolicy()) for role in ROLES}
+            self.summaries = 0
+            self.shared = 0
+            self.fallbacks = 0
+            self.folded_messages = 0
+
+    def policy(self, role: str) -> MemoryPolicy:
+        return self._policies.get(role, MemoryPolicy())
+
+    def record(self, folded: int, fallback: bool = False) -> None:
+        with self._lock:
+            self.summaries += 1
+            self.folded_messages += folded
+            if fallback:
+                self.fallbacks += 1
+
+    def record_shared(self) -> None:
+        with self._lock:
+            self.shared += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "policies": {role: policy._asdict() for role, policy in self._policies.items()},
+                "summaries": self.summaries,
+                "shared": self.shared,
+                "fallbacks": self.fallbacks,
+                "folded_messages": self.folded_messages,
+            }
+
+
+# Mặc định: mọi vai trò gửi toàn bộ lịch sử
+_memory_registry = MemoryRegistry()
+
+
+def get_memory_registry() -> MemoryRegistry:
+    """Trả về registry bộ nhớ dùng chung của process"""
+    return _memory_registry
+
+
+def get_memory_policy(role: str) -> MemoryPolicy:
+    """Chính sách bộ nhớ hiện tại của một vai trò (left, right, manager)"""
+    return _memory_registry.policy(role)
+
+
+def configure_memory(window: int, summary_every: int = DEFAULT_SUMMARY_EVERY,
+                     roles: Iterable[str] = ROLES) -> MemoryRegistry:
+    """Cấu hình bộ nhớ từ tham số dòng lệnh: các vai trò trong `roles` giữ `window` lượt gần nhất, vai trò khác gửi toàn bộ"""
+    roles = [role for role in roles if role in ROLES]
+    policy = MemoryPolicy(window, summary_every)
+    _memory_registry.configure({role: policy for role in roles})
+    if policy.enabled and roles:
+        _memory_registry.logger.info(
+            f"🧠 Bộ nhớ hội thoại ({', '.join(roles)}): giữ {window} lượt gần nhất, "
+            f"tóm tắt phần cũ mỗi {summary_every} lượt"
+        )
+    return _memory_registry
+
+
+def parse_memory_roles(value: str) -> List[str]:
+    """Đọc danh sách vai trò dạng 'left,right,manager' (rỗng = không vai trò nào)"""
+    roles = [role.strip() for role in value.split(",") if role.strip()]
+    unknown = [role for role in roles if role not in ROLES]
+    if unknown:
+        raise ValueError(f"Vai trò không hợp lệ: {', '.join(unknown)} (chỉ nhận {', '.join(ROLES)})")
+    return roles
+
+
+def format_memory_stats(stats: Dict[str, Any]) -> str:
+    """Định dạng thống kê bộ nhớ để ghi log"""
+    active = {role: p for role, p in stats["policies"].items() if p["window"] > 0}
+    if not active:
+        return "Bộ nhớ hội thoại: gửi toàn bộ lịch sử"
+    roles = ", ".join(f"{role}={p['window']} lượt" for role, p in active.items())
+    return (
+        f"Bộ nhớ hội thoại ({roles}): {stats['summaries']} lần cập nhật tóm tắt "
+        f"({stats['shared']} lần dùng chung giữa các agent, {stats['fallbacks']} lần dùng tóm tắt dự phòng), "
+        f"{stats['folded_messages']} tin nhắn đã gộp"
+    )
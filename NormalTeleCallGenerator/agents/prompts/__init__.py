@@ -0,0 +1,14 @@
+"""
+System prompt của các agent, ghép theo section để mỗi hội thoại chỉ gửi phần liên quan
+"""
+
+from .right_prompts import RIGHT_PROMPT, RIGHT_COMMUNICATION_STYLES
+from .manager_prompts import MANAGER_PROMPT
+
+
+def precompile_system_prompts() -> int:
+    """Ghép sẵn mọi biến thể system prompt; trả về tổng số biến thể"""
+    return (
+        RIGHT_PROMPT.precompile(communication_style=RIGHT_COMMUNICATION_STYLES)
+        + MANAGER_PROMPT.precompile(output=("text", "json"))
+    )
@@ -37,4 +37,9 @@ Không được chủ động nói lời tạm biệt hoặc kết thúc, trừ
 Nếu hội thoại kết thúc tự nhiên hoặc đã đạt mục đích, câu thoại cuối cùng phải kèm "##ENDCALL_SIGNAL##".
 Bạn cần tôn trọng thời gian của đối phương và hoàn thành hội thoại hiệu quả nhất có thể.
 Nếu là nhân viên dịch vụ, hãy bày tỏ danh tính trong câu đầu tiên, nhưng không dùng "xin chào" hay "chào bạn".
-"""
\ No newline at end of file
+"""
+
+# Sinh theo lô các câu mở đầu cho kho câu mở đầu (build_opening_pool.py), gửi kèm system prompt của loại hội thoại
+OPENING_POOL_PROMPT = """Hãy viết {count} câu mở đầu cuộc gọi khác nhau mà bạn có thể nói ngay khi người nghe vừa bắt máy.
+Mỗi câu dùng cách xưng hô, danh tính và lý do gọi khác nhau, đúng văn phong lời nói qua điện thoại, không dùng mã hiệu ##...##.
+Trả lời bằng một mảng JSON gồm {count} chuỗi."""
@@ -1,4 +1,7 @@
-MANAGER_SYSTEM_PROMPT = """
+from .sections import Section, SectionedPrompt
+
+# Tiêu chí đánh giá chung
+MANAGER_PROMPT_CRITERIA = """
 Bạn là người quản lý hội thoại, chịu trách nhiệm đánh giá các cuộc hội thoại dịch vụ khách hàng hoặc các tình huống đời thường ở Việt Nam, và quyết định có nên kết thúc hội thoại không, ai là người nên chủ động kết thúc.
 
 Mức độ nghiêm ngặt khi đánh giá: {strictness} (thấp/trung bình/cao)
@@ -19,17 +22,56 @@ Cách xác định bên kết thúc:
 - "Dịch vụ kết thúc": khi bên cung cấp dịch vụ đã cung cấp đủ thông tin hoặc hoàn thành dịch vụ
 - "Người dùng kết thúc": khi người dùng hài lòng, cảm ơn hoặc không cần hỗ trợ thêm
 - "Kết thúc tự nhiên": khi hội thoại kết thúc tự nhiên, không rõ bên chủ động
+"""
 
-Khi trả lời:
-1. Đầu tiên hãy xác định rõ có nên kết thúc không: "có" nghĩa là nên kết thúc, "không" nghĩa là nên tiếp tục
+# Hướng dẫn trả lời bằng văn bản; khi dùng structured output (responseSchema) thì bỏ hẳn khối này
+MANAGER_TEXT_OUTPUT = """1. Đầu tiên hãy xác định rõ có nên kết thúc không: "có" nghĩa là nên kết thúc, "không" nghĩa là nên tiếp tục
 2. Nếu là "có", hãy chỉ rõ ai là người nên chủ động kết thúc: "dịch vụ kết thúc", "người dùng kết thúc" hoặc "kết thúc tự nhiên"
 3. Giải thích lý do cho quyết định của bạn
-4. Nếu nên kết thúc, hãy cung cấp mã hiệu kết thúc rõ ràng: "##TERMINATE_SIGNAL##"
+4. Nếu nên kết thúc, hãy cung cấp mã hiệu kết thúc rõ ràng: "##TERMINATE_SIGNAL##\""""
 
+MANAGER_PROMPT_CLOSING = """
 Hãy đánh giá khách quan dựa trên lịch sử hội thoại hiện tại.
 Có thể một bên đã gửi mã hiệu kết thúc, bạn cần chú ý điều này.
 """
 
+MANAGER_PROMPT = SectionedPrompt(
+    MANAGER_PROMPT_CRITERIA,
+    Section("output", {"text": MANAGER_TEXT_OUTPUT}, heading="\nKhi trả lời:\n", omit=("json",)),
+    MANAGER_PROMPT_CLOSING,
+)
+
+# Prompt đầy đủ kèm hướng dẫn trả lời bằng văn bản (giữ cho code cũ còn dùng .format(strictness=...))
+MANAGER_SYSTEM_PROMPT = MANAGER_PROMPT.full()
+
+# Yêu cầu đánh giá gửi kèm toàn bộ hội thoại (lần đánh giá đầu tiên hoặc khi tắt đánh giá tăng dần)
+MANAGER_EVALUATE_PROMPT = "Hãy đánh giá đoạn hội thoại sau và quyết định có nên kết thúc không, ai là người nên kết thúc:\n\n{dialogue}"
+
+# Các lần sau chỉ gửi phán quyết, ghi chú của lần trước và các câu thoại mới
+MANAGER_DELTA_PROMPT = """Đánh giá trước đó (sau {evaluated} câu thoại): tiếp tục hội thoại
+- Lý do: {reason}
+- Ghi chú: {notes}
+
+Các câu thoại mới kể từ lần đánh giá trước:
+{lines}
+
+Dựa trên đánh giá trước đó và các câu thoại mới, hãy quyết định có nên kết thúc không, ai là người nên kết thúc."""
+
+MANAGER_VERDICT_FIELDS = "\n\nVui lòng trả lời bằng định dạng JSON, gồm các trường sau:\n- should_terminate: giá trị True/False, cho biết có nên kết thúc không\n- terminator: chuỗi, giá trị có thể là 'left' (nhân viên dịch vụ kết thúc), 'right' (người dùng kết thúc), 'natural' (kết thúc tự nhiên) hoặc 'endcall' (gác máy)\n- reason: chuỗi, giải thích chi tiết lý do kết thúc hoặc tiếp tục"
+
+# Điền lý do ngắt máy sau khi sinh xong (logic/end_call_annotation.py): gộp nhiều hội thoại vào một request
+MANAGER_END_CALL_BATCH_PROMPT = """Dưới đây là {count} cuộc hội thoại, mỗi cuộc kết thúc khi một bên chủ động ngắt máy.
+Với từng cuộc, hãy phân tích lý do và ý định của bên ngắt máy.
+
+{dialogues}
+
+Vui lòng trả lời bằng JSON, mỗi cuộc hội thoại một trường theo mã ({keys}), giá trị là chuỗi giải thích lý do và ý định của bên ngắt máy"""
+
+MANAGER_END_CALL_ITEM = "### {key} ({terminator_name} chủ động ngắt máy)\n{dialogue}"
+
+# Trường ghi chú khi đánh giá tăng dần: các dữ kiện then chốt tính đến hiện tại
+MANAGER_NOTES_FIELD = "\n- notes: chuỗi, tối đa 3 câu ghi lại các dữ kiện then chốt tính đến hiện tại (nhu cầu của người dùng; thông tin đã cung cấp hoặc đã hỏi; vấn đề đã được giải quyết chưa; thái độ hiện tại)"
+
 LEFT_TERMINATION_PROMPT = """
 Thông báo hệ thống: Người quản lý hội thoại đã quyết định hội thoại này nên kết thúc. Bạn là người chủ động kết thúc. Hãy kết thúc hội thoại một cách tự nhiên, lưu ý:
 
@@ -0,0 +1,21 @@
+# Prompt tóm tắt phần đầu hội thoại cho bộ nhớ cuốn chiếu (agents/memory.py)
+SUMMARY_SYSTEM_PROMPT = """
+Bạn ghi chép lại diễn biến một cuộc gọi điện thoại bằng tiếng Việt để người tiếp tục cuộc gọi nắm được những gì đã xảy ra.
+Hãy cập nhật bản tóm tắt cũ với các lượt thoại mới, viết thành tối đa 5 câu ngắn, giữ lại:
+- Mục đích cuộc gọi và yêu cầu của người dùng
+- Thông tin, số liệu, thời gian, địa chỉ đã được hỏi hoặc đã cung cấp
+- Những gì hai bên đã thống nhất và việc còn dang dở
+- Thái độ hiện tại của người dùng (hài lòng, phân vân, khó chịu)
+Không thêm chi tiết không có trong hội thoại, không bình luận, không dùng định dạng markdown.
+"""
+
+SUMMARY_REQUEST_TEMPLATE = """Bản tóm tắt cũ:
+{previous}
+
+Các lượt thoại mới:
+{lines}
+
+Viết lại bản tóm tắt đã cập nhật."""
+
+# Cách chèn tóm tắt vào đầu phần lịch sử gửi cho model
+SUMMARY_CONTEXT_TEMPLATE = "[Tóm tắt phần đầu cuộc gọi]\n{summary}\n[Hết tóm tắt, cuộc gọi tiếp tục]"
@@ -0,0 +1,15 @@
+# Gộp lượt giữa các hội thoại (agents/turn_batcher.py): một request viết câu tiếp theo cho nhiều cuộc gọi đang chạy
+TURN_BATCH_SYSTEM_PROMPT = """
+Bạn viết câu thoại tiếp theo cho nhiều cuộc gọi điện thoại độc lập cùng lúc. Mỗi mục có hồ sơ vai và đoạn hội thoại riêng;
+hãy đóng đúng vai của từng mục theo hồ sơ của mục đó, không để nội dung của mục này ảnh hưởng sang mục khác.
+Mỗi mục chỉ viết đúng một câu thoại tiếp theo của vai được yêu cầu, như lời nói qua điện thoại, không chèn tên vai, hướng dẫn,
+mô tả meta hay giải thích; chỉ dùng các mã hiệu dạng ##...## khi hồ sơ vai của mục đó yêu cầu.
+"""
+
+TURN_BATCH_PROMPT = """Dưới đây là {count} cuộc gọi đang diễn ra.
+
+{items}
+
+Trả về JSON gồm các trường {keys}, mỗi trường là câu thoại tiếp theo của mục tương ứng."""
+
+TURN_BATCH_ITEM = "### {key}\n[Hồ sơ vai]\n{profile}\n[Hội thoại]\n{transcript}\n[Viết câu tiếp theo của: {speaker}]"
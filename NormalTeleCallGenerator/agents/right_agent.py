@@ -1,19 +1,24 @@
 from typing import List, Dict, Any, Optional
 from .base_agent import BaseAgent
-from .prompts.right_prompts import RIGHT_SYSTEM_PROMPT
+from .prompts.right_prompts import RIGHT_PROMPT
+from utils.gemini_client import GeminiClient
+from utils.retry_policy import NonRetryableError
 import config
-import time
 import logging
 
 class RightAgent(BaseAgent):
     """Tác nhân người dùng, phản hồi cuộc hội thoại dịch vụ"""
     
+    HISTORY_LABELS = {"assistant": "Người dùng", "user": "Nhân viên dịch vụ"}
+    
     def __init__(self, model: Optional[str] = None, user_profile: Optional[Dict[str, Any]] = None, 
-                 api_key: Optional[str] = None, retry_delay: float = 5):
+                 api_key: Optional[str] = None, retry_delay: float = 5,
+                 client: Optional[GeminiClient] = None):
         super().__init__(
             role="right", 
             model=model or config.DEFAULT_MODEL, 
-            api_key=api_key
+            api_key=api_key,
+            client=client
         )
         self.user_profile = user_profile or {
             "age": 35,
@@ -23,31 +28,34 @@ class RightAgent(BaseAgent):
         self.retry_delay = retry_delay
         
     def get_system_prompt(self) -> str:
-        """Lấy prompt hệ thống đã được tuỳ biến"""
-        return RIGHT_SYSTEM_PROMPT.format(
+        """Lấy prompt hệ thống đã được tuỳ biến, chỉ gồm đặc điểm của phong cách giao tiếp này"""
+        return RIGHT_PROMPT.render(
             age=self.user_profile["age"],
             communication_style=self.user_profile["communication_style"],
             occupation=self.user_profile["occupation"]
         )
         
-    def generate_response(self, message: str) -> str:
+    async def generate_response_async(self, message: str) -> str:
         """Sinh phản hồi của người dùng, có cơ chế retry khi lỗi API"""
         messages = [{"role": "system", "content": self.get_system_prompt()}]
         
-        # Thêm lịch sử hội thoại
-        for msg in self.conversation_history:
-            messages.append(msg)
+        # Thêm lịch sử hội thoại (các lượt cũ đã được tóm tắt)
+        messages.extend(await self.history_messages_async())
             
         # Thêm tin nhắn từ nhân viên dịch vụ
         messages.append({"role": "user", "content": message})
         
         # Thêm logic retry khi gọi API
+        # Gộp lượt giữa các hội thoại (--turn_batch_roles): không gộp được thì tự gửi request như bình thường
+        batched = await self.batched_reply_async(messages)
         retry_count = 0
         max_retries = 10
         while True:
             try:
-                # Gọi API để sinh phản hồi (Gemini)
-                reply = self.client.chat_completion(messages=messages)
+                # Gọi API để sinh phản hồi (Gemini); câu nhận từ lô chỉ dùng ở lần thử đầu
+                completion = batched or await self.client.complete_async(messages, model=self.model, **self.generation_config)
+                batched = None
+                reply, self.last_model = completion.text, completion.model
                 
                 # Kiểm tra phản hồi hợp lệ
                 if reply and len(reply.strip()) > 0:
@@ -58,6 +66,9 @@ class RightAgent(BaseAgent):
                 else:
                     raise Exception("Phản hồi trống hoặc không hợp lệ")
                     
+            except NonRetryableError:
+                # Hết budget hoặc lỗi không thể retry: không thử lại ở tầng agent, để hội thoại dừng ngay
+                raise
             except Exception as e:
                 retry_count += 1
                 logging.warning(f"API request thất bại (lần thử {retry_count}): {str(e)}")
@@ -66,14 +77,35 @@ class RightAgent(BaseAgent):
                 if retry_count >= max_retries:
                     logging.error(f"Đã đạt số lần thử tối đa ({max_retries}), sử dụng phản hồi mặc định")
                     reply = "Tôi cần thời gian để suy nghĩ. Bạn có thể cho tôi thêm thông tin không?"
+                    self.last_model = None
                     break
                 
                 # Đợi một khoảng rồi thử lại
-                time.sleep(self.retry_delay)
+                await self._wait_before_retry(retry_count, self.retry_delay)
                 logging.info(f"Đang thử lại gọi API...")
         
         # Cập nhật lịch sử hội thoại, lưu ý right: left là user
         self.update_history("user", message)      # Tin nhắn từ nhân viên dịch vụ
         self.update_history("assistant", reply)   # Phản hồi của người dùng
         
-        return reply
\ No newline at end of file
+        return reply
+    
+    async def generate_candidates_async(self, message: str, n: int) -> List[str]:
+        """Sinh tối đa `n` phản hồi khác nhau cho cùng một tin nhắn trong một request (candidateCount) để rẽ nhánh hội thoại.
+
+        Không cập nhật lịch sử: mỗi nhánh tự ghi phản hồi của nó; last_model là model đã sinh các phản hồi. Trả về danh sách
+        rỗng nếu request lỗi hoặc không có phản hồi hợp lệ, khi đó orchestrator sinh một phản hồi như bình thường.
+        """
+        messages = [{"role": "system", "content": self.get_system_prompt()}]
+        messages.extend(await self.history_messages_async())
+        messages.append({"role": "user", "content": message})  # Tin nhắn từ nhân viên dịch vụ
+        try:
+            completion = await self.client.complete_async(messages, n, model=self.model, **self.generation_config)
+        except NonRetryableError:
+            raise
+        except Exception as e:
+            logging.warning(f"Không sinh được các phản hồi rẽ nhánh: {str(e)}")
+            return []
+        self.last_model = completion.model
+        # Bỏ phản hồi rỗng hoặc giống hệt nhau (các nhánh trùng không thêm dữ liệu mới)
+        return list(dict.fromkeys(reply for reply in completion.candidates if reply and reply.strip() and "API" not in reply))
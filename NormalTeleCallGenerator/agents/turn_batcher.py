@@ -0,0 +1,232 @@
+"""
+Turn Batcher - Gộp lượt giữa các hội thoại: các lượt đang chờ của cùng một vai từ nhiều hội thoại chạy đồng thời
+(cùng event loop, --async_mode) được gói vào một request có cấu trúc, mỗi hội thoại một trường, rồi trả về đúng hội thoại.
+Khi bị giới hạn bởi số request mỗi phút thay vì tokens, một request tiến được nhiều hội thoại cùng lúc
+"""
+
+import asyncio
+import json
+import logging
+from threading import Lock
+from typing import Dict, Any, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from .prompts.turn_batch_prompts import TURN_BATCH_SYSTEM_PROMPT, TURN_BATCH_PROMPT, TURN_BATCH_ITEM
+from utils.gemini_client import Completion, create_gemini_client
+from utils.model_router import get_model_router
+import config
+
+# Chỉ lượt thoại của hai bên được gộp; manager đã có đánh giá tăng dần và điền lý do theo lô riêng
+ROLES = ("left", "right")
+
+
+def parse_turn_batch_roles(value: Optional[str]) -> List[str]:
+    """Đọc danh sách vai trò gộp lượt dạng 'left,right' (rỗng = tắt)"""
+    roles = [role.strip() for role in (value or "").split(",") if role.strip()]
+    unknown = [role for role in roles if role not in ROLES]
+    if unknown:
+        raise ValueError(f"Vai trò gộp lượt không hợp lệ: {', '.join(unknown)} (chỉ nhận {', '.join(ROLES)})")
+    return roles
+
+
+def turn_batch_schema(keys: Sequence[str]) -> Dict[str, Any]:
+    """responseSchema của một lô: mỗi hội thoại một trường câu thoại"""
+    return {
+        "type": "OBJECT",
+        "properties": {key: {"type": "STRING"} for key in keys},
+        "required": list(keys),
+        "propertyOrdering": list(keys),
+    }
+
+
+def parse_turn_batch(text: Optional[str], keys: Sequence[str]) -> Dict[str, str]:
+    """Câu thoại của từng hội thoại trong lô; hội thoại thiếu hoặc rỗng không có trong kết quả (tự gửi như bình thường)"""
+    text = (text or "").strip()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        start, end = text.find("{"), text.rfind("}")
+        try:
+            data = json.loads(text[start:end + 1]) if 0 <= start < end else None
+        except json.JSONDecodeError:
+            data = None
+    if not isinstance(data, dict):
+        return {}
+    return {key: str(data[key]).strip() for key in keys if isinstance(data.get(key), str) and data[key].strip()}
+
+
+class TurnSlot(NamedTuple):
+    """Một lượt đang chờ: system prompt của agent, lịch sử đã định dạng và tên vai cần viết câu tiếp theo"""
+    profile: str
+    transcript: str
+    speaker: str
+
+
+class TurnBatcher:
+    """Hàng đợi lượt của một vai trên một event loop: gửi khi đủ `batch_size` lượt hoặc sau `max_wait` giây"""
+
+    def __init__(self, role: str, batch_size: int, max_wait: float, loop: asyncio.AbstractEventLoop):
+        self.role = role
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.loop = loop
+        self.logger = logging.getLogger(__name__)
+        self._pending: List[Tuple[TurnSlot, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+    async def submit_async(self, slot: TurnSlot) -> Optional[Completion]:
+        """Xếp lượt vào lô và chờ câu trả lời (kèm model đã trả lời lô); None nếu lô chỉ có lượt này, lỗi hoặc thiếu câu (agent tự gửi request)"""
+        future = self.loop.create_future()
+        self._pending.append((slot, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = self.loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Lượt đã bị huỷ trong lúc chờ (vd. lượt sinh trước bị bỏ) không chiếm chỗ trong lô
+        pending = [(slot, future) for slot, future in self._pending if not future.done()]
+        batch, self._pending = pending[:self.batch_size], pending[self.batch_size:]
+        if self._pending:
+            self._timer = self.loop.call_later(self.max_wait, self._flush)
+        if len(batch) == 1:
+            # Lô chỉ có một lượt: gói lại không tiết kiệm request nào, để agent gửi với prompt thường
+            get_turn_batch_registry().record_single()
+            batch[0][1].set_result(None)
+        elif batch:
+            task = asyncio.ensure_future(self._send_async(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send_async(self, batch: List[Tuple[TurnSlot, asyncio.Future]]) -> None:
+        keys = [f"s{i + 1}" for i in range(len(batch))]
+        items = "\n\n".join(
+            TURN_BATCH_ITEM.format(key=key, profile=slot.profile.strip(), transcript=slot.transcript, speaker=slot.speaker)
+            for key, (slot, _) in zip(keys, batch)
+        )
+        messages = [
+            {"role": "system", "content": TURN_BATCH_SYSTEM_PROMPT},
+            {"role": "user", "content": TURN_BATCH_PROMPT.format(count=len(batch), items=items, keys=", ".join(keys))},
+        ]
+        generation_config = dict(config.GENERATION_CONFIG[self.role])
+        generation_config["max_tokens"] = generation_config["max_tokens"] * len(batch)
+        replies: Dict[str, str] = {}
+        model = None
+        try:
+            # Mỗi lô một client: ngân sách retry tính theo lô, không dồn vào một hội thoại nào
+            client = create_gemini_client(api_key=config.GEMINI_API_KEY,
+                                          model=get_model_router().model_for(self.role, config.DEFAULT_MODEL),
+                                          async_mode=True, base_url=config.GEMINI_BASE_URL)
+            completion = await client.complete_async(
+                messages=messages,
+                response_schema=turn_batch_schema(keys),
+                **generation_config
+            )
+            replies, model = parse_turn_batch(completion.text, keys), completion.model
+        except Exception as e:
+            # Kể cả lỗi không thể retry: từng hội thoại tự gửi lại và tự dừng nếu lỗi vẫn còn
+            self.logger.warning(f"Lô {len(batch)} lượt của {self.role} lỗi, các hội thoại tự gửi lại: {e}")
+        finally:
+            for key, (_, future) in zip(keys, batch):
+                if not future.done():
+                    future.set_result(Completion((replies[key],), model) if key in replies else None)
+        get_turn_batch_registry().record(len(batch), len(replies))
+
+
+class TurnBatchRegistry:
+    """Cấu hình gộp lượt, các hàng đợi theo vai và thống kê, dùng chung cho toàn process"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.logger = logging.getLogger(__name__)
+        self._batchers: Dict[str, TurnBatcher] = {}
+        self.configure(config.TURN_BATCH_ROLES, config.TURN_BATCH_SIZE, config.TURN_BATCH_WAIT_MS)
+
+    def configure(self, roles: Iterable[str], batch_size: int, wait_ms: float) -> None:
+        with self._lock:
+            self.roles = [role for role in ROLES if role in set(roles)]
+            self.batch_size = max(1, batch_size)
+            self.max_wait = max(0.0, wait_ms) / 1000.0
+            self._batchers = {}
+            self.batches = 0
+            self.slots = 0
+            self.answered = 0
+            self.singles = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.roles) and self.batch_size > 1
+
+    def batcher(self, role: str) -> Optional[TurnBatcher]:
+        """Hàng đợi của vai trên event loop đang chạy; None nếu vai này không gộp lượt"""
+        if role not in self.roles or self.batch_size <= 1:
+            return None
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            batcher = self._batchers.get(role)
+            if batcher is None or batcher.loop is not loop:
+                batcher = TurnBatcher(role, self.batch_size, self.max_wait, loop)
+                self._batchers[role] = batcher
+            return batcher
+
+    def record(self, slots: int, answered: int) -> None:
+        """Một lô đã gửi: số lượt trong lô và số lượt nhận được câu trả lời"""
+        with self._lock:
+            self.batches += 1
+            self.slots += slots
+            self.answered += answered
+
+    def record_single(self) -> None:
+        with self._lock:
+            self.singles += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": bool(self.roles) and self.batch_size > 1,
+                "roles": list(self.roles),
+                "batch_size": self.batch_size,
+                "wait_ms": self.max_wait * 1000.0,
+                "batches": self.batches,
+                "slots": self.slots,
+                "answered": self.answered,
+                "fallbacks": self.slots - self.answered,
+                "singles": self.singles,
+            }
+
+
+_turn_batch_registry = TurnBatchRegistry()
+
+
+def get_turn_batch_registry() -> TurnBatchRegistry:
+    """Trả về registry gộp lượt dùng chung của process"""
+    return _turn_batch_registry
+
+
+def configure_turn_batching(roles: Iterable[str] = config.TURN_BATCH_ROLES,
+                            batch_size: int = config.TURN_BATCH_SIZE,
+                            wait_ms: float = config.TURN_BATCH_WAIT_MS) -> TurnBatchRegistry:
+    """Đặt các vai gộp lượt, số lượt tối đa mỗi lô và thời gian chờ gom lô từ tham số dòng lệnh, đặt lại thống kê"""
+    _turn_batch_registry.configure(roles, batch_size, wait_ms)
+    if _turn_batch_registry.enabled:
+        _turn_batch_registry.logger.info(
+            f"📦 Gộp lượt giữa các hội thoại cho {', '.join(_turn_batch_registry.roles)}: "
+            f"tối đa {_turn_batch_registry.batch_size} lượt mỗi request, chờ gom lô tối đa {wait_ms:g}ms"
+        )
+    return _turn_batch_registry
+
+
+def format_turn_batch_stats(stats: Dict[str, Any]) -> str:
+    """Định dạng thống kê gộp lượt để ghi log"""
+    if not stats["enabled"]:
+        return "Gộp lượt giữa các hội thoại: tắt"
+    average = stats["slots"] / stats["batches"] if stats["batches"] else 0.0
+    return (
+        f"Gộp lượt giữa các hội thoại ({', '.join(stats['roles'])}): {stats['batches']} lô, TB {average:.1f} lượt mỗi lô, "
+        f"{stats['answered']} lượt trả lời qua lô (bớt {max(0, stats['answered'] - stats['batches'])} request), "
+        f"{stats['fallbacks']} lượt tự gửi lại do lô lỗi hoặc thiếu câu, {stats['singles']} lượt tự gửi do lô chỉ có một lượt"
+    )
@@ -1,9 +1,21 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Sequence
 from agents.left_agent import LeftAgent
 from agents.right_agent import RightAgent 
 from agents.manager_agent import ManagerAgent
+from agents.memory import SummaryCache
+from agents.manager_verdict import ManagerVerdict, EndCallVerdict, END_CALL_SCHEMA, parse_end_call_verdict
 from agents.prompts.manager_prompts import LEFT_TERMINATION_PROMPT, RIGHT_TERMINATION_PROMPT
+from logic.evaluation_schedule import EvaluationSchedule, create_evaluation_schedule, get_evaluation_registry
+from logic.termination_detector import TerminationDetector, create_termination_detector, get_detector_registry
+from logic.speculation import SpeculativeTurn, get_speculation_registry
+from logic.end_call_annotation import PENDING_FIELD
+from logic.branching import get_branching_registry
+from utils.model_router import get_model_router
 from utils.conversation_logger import ConversationLogger
+import config
+import asyncio
+import copy
+import logging
 import time
 
 class DialogueOrchestrator:
@@ -14,45 +26,98 @@ class DialogueOrchestrator:
                  right_agent: RightAgent,
                  manager_agent: ManagerAgent,
                  max_turns: int = 20,
-                 logger: Optional[ConversationLogger] = None):
+                 logger: Optional[ConversationLogger] = None,
+                 schedule: Optional[EvaluationSchedule] = None,
+                 detector: Optional[TerminationDetector] = None,
+                 speculative: Optional[bool] = None,
+                 defer_end_call_reasons: Optional[bool] = None,
+                 branch_turns: Optional[Sequence[int]] = None,
+                 branch_factor: Optional[int] = None):
         self.left_agent = left_agent
         self.right_agent = right_agent
         self.manager_agent = manager_agent
         self.max_turns = max_turns
         self.logger = logger or ConversationLogger()
         self.full_dialogue_history = []
+        # When to ask the manager for a verdict (fixed, back-off or hazard-based), see logic/evaluation_schedule.py
+        self.schedule = schedule or create_evaluation_schedule()
+        self.evaluations = 0
+        self.end_call_reviews = 0
+        # Local check for settled dialogues (None = off), see logic/termination_detector.py
+        self.detector = detector if detector is not None else create_termination_detector()
+        self.local_flags = []
+        # Generate the next left turn while the manager evaluates (None = use config), see logic/speculation.py
+        self.speculative = get_speculation_registry().enabled if speculative is None else speculative
+        self.speculations = 0
+        self.wasted_speculations = 0
+        # Defer end-call reasons to the batched annotate_end_calls.py pass (None = use config)
+        self.defer_end_call_reasons = config.DEFER_END_CALL_REASONS if defer_end_call_reasons is None else defer_end_call_reasons
+        # Fork at the turns in branch_turns, branch_factor branches each time (None = use config), see logic/branching.py
+        branching = get_branching_registry()
+        self.branch_turns = set(branching.turns if branch_turns is None else branch_turns)
+        self.branch_factor = branching.factor if branch_factor is None else max(1, branch_factor)
+        self.branching = bool(self.branch_turns) and self.branch_factor > 1
+        self.branch_tasks: List[asyncio.Future] = []
+        # Position of this dialogue in the branch tree: "0" is the root, "0.2" the root's second child...
+        self.lineage = {"branch_id": "0", "parent": None, "fork_turn": None, "shared_messages": 0}
+        # The three agents fold the same transcript: share summary requests
+        self.summaries = SummaryCache()
+        for agent in (left_agent, right_agent, manager_agent):
+            agent.memory.cache = self.summaries
         
     def run_dialogue(self, initial_message: str = None) -> Dict[str, Any]:
+        """Run the dialogue synchronously, wrapping run_dialogue_async"""
+        return asyncio.run(self.run_dialogue_async(initial_message))
+    
+    async def run_dialogue_async(self, initial_message: str = None) -> Dict[str, Any]:
         """Run the complete dialogue process"""
-        turn_count = 0
-        terminated_by_manager = False
-        end_call_signal_detected = False
-        termination_reason = ""
-        terminator = ""
-        conclusion_messages = []
-        
         # If no initial message is provided, let the left agent generate one
         if not initial_message:
-            left_message = self.left_agent.generate_response()
+            left_message = await self.left_agent.generate_response_async()
         else:
             left_message = initial_message
+            # A pre-written opening (opening pool) must be in the caller's history like a generated one
+            self.left_agent.update_history("assistant", left_message)
+            self.left_agent.last_model = None
             
         self.full_dialogue_history.append({
             "role": "left",
             "content": left_message,
+            "model": self.left_agent.last_model,
             "timestamp": time.time()
         })
         
         self.logger.log("Dialogue started")
         self.logger.log(f"Left: {left_message}")
+        return await self.continue_dialogue_async(left_message, 0)
+    
+    async def continue_dialogue_async(self, left_message: str, turn_count: int,
+                                      branch_reply: Optional[str] = None) -> Dict[str, Any]:
+        """Dialogue loop from the left agent's `left_message` at turn `turn_count`.
+
+        A branch starts at its fork point with `branch_reply`, the user reply drawn for it (already in the agent's history).
+        """
+        terminated_by_manager = False
+        terminated_locally = False
+        end_call_signal_detected = False
+        end_call_reason_pending = False
+        termination_reason = ""
+        terminator = ""
+        conclusion_messages = []
         
         # Main dialogue loop
         while turn_count < self.max_turns:
-            # User responds
-            right_message = self.right_agent.generate_response(left_message)
+            # User responds (at a fork turn: one request draws the replies of every branch)
+            if branch_reply is not None:
+                right_message, branch_reply = branch_reply, None
+            elif self.branching and turn_count in self.branch_turns:
+                right_message = await self.fork_async(left_message, turn_count)
+            else:
+                right_message = await self.right_agent.generate_response_async(left_message)
             self.full_dialogue_history.append({
                 "role": "right",
                 "content": right_message,
+                "model": self.right_agent.last_model,
                 "timestamp": time.time()
             })
             self.logger.log(f"Right: {right_message}")
@@ -64,33 +129,71 @@ class DialogueOrchestrator:
                 termination_reason = "User actively ended the conversation"
                 self.logger.log("End signal detected, user actively ended the conversation")
                 
-                # Get manager's evaluation of the end action
-                manager_evaluation = self.evaluate_end_call(terminator="right")
-                termination_reason = manager_evaluation["reason"]
+                # Get manager's evaluation of the end action (or leave it to the batched pass)
+                if self.defer_end_call_reasons:
+                    end_call_reason_pending = True
+                else:
+                    manager_evaluation = await self.evaluate_end_call_async(terminator="right")
+                    termination_reason = manager_evaluation.reason
                 
                 # Do not enter the final response phase
                 break
             
-            # Manager evaluation
-            manager_decision = self.evaluate_dialogue()
+            # Local check without an API call: repeated refusals or both sides repeating themselves
+            local_verdict = self.detector.check(self.full_dialogue_history) if self.detector else None
+            if local_verdict is not None:
+                ended = self.detector.mode == "end"
+                self.local_flags.append({"turn": turn_count, **local_verdict.to_dict()})
+                get_detector_registry().record(local_verdict, ended, self.max_turns - turn_count)
+                if ended:
+                    terminated_locally = True
+                    termination_reason = local_verdict.reason
+                    terminator = local_verdict.terminator
+                    self.logger.log(f"Local detector ended the conversation: {termination_reason}")
+                    
+                    # Same closing phase as a manager decision
+                    conclusion_messages = await self.handle_termination_async(terminator)
+                    break
+                self.logger.log(f"Local detector flagged: {local_verdict.reason}, asking the manager")
             
-            if manager_decision["should_terminate"]:
-                terminated_by_manager = True
-                termination_reason = manager_decision["reason"]
-                terminator = manager_decision["terminator"]
+            # Manager evaluation (by default after every turn, always right after a local flag)
+            speculation = None
+            if local_verdict is not None or self.schedule.should_evaluate(self.full_dialogue_history, turn_count, self.max_turns):
+                # The left agent only needs the latest right message: draft its next turn while the manager evaluates
+                if self.speculative:
+                    speculation = SpeculativeTurn(self.left_agent, right_message)
                 
-                self.logger.log(f"Manager terminated the conversation: {termination_reason}")
-                self.logger.log(f"Termination type: {'Left ended' if terminator == 'left' else 'Right ended' if terminator == 'right' else 'Natural end'}")
+                try:
+                    manager_decision = await self.evaluate_dialogue_async()
+                except BaseException:
+                    if speculation is not None:
+                        await speculation.discard_async()
+                    raise
+                self.schedule.record(turn_count, manager_decision.should_terminate)
+                if speculation is not None:
+                    await self.settle_speculation_async(speculation, manager_decision.should_terminate)
                 
-                # Handle conversation termination
-                conclusion_messages = self.handle_termination(terminator)
-                break
+                if manager_decision.should_terminate:
+                    terminated_by_manager = True
+                    termination_reason = manager_decision.reason
+                    terminator = manager_decision.terminator
+                    
+                    self.logger.log(f"Manager terminated the conversation: {termination_reason}")
+                    self.logger.log(f"Termination type: {'Left ended' if terminator == 'left' else 'Right ended' if terminator == 'right' else 'Natural end'}")
+                    
+                    # Handle conversation termination
+                    conclusion_messages = await self.handle_termination_async(terminator)
+                    break
                 
-            # Left agent responds
-            left_message = self.left_agent.generate_response(right_message)
+            # Left agent responds (reusing the speculative turn if there is one)
+            if speculation is not None:
+                left_message = await speculation.result_async()
+            else:
+                left_message = await self.left_agent.generate_response_async(right_message)
             self.full_dialogue_history.append({
                 "role": "left",
                 "content": left_message,
+                "model": self.left_agent.last_model,
                 "timestamp": time.time()
             })
             self.logger.log(f"Left: {left_message}")
@@ -102,9 +205,12 @@ class DialogueOrchestrator:
                 termination_reason = "Left agent actively ended the conversation"
                 self.logger.log("End signal detected, left agent actively ended the conversation")
                 
-                # Get manager's evaluation of the end action
-                manager_evaluation = self.evaluate_end_call(terminator="left")
-                termination_reason = manager_evaluation["reason"]
+                # Get manager's evaluation of the end action (or leave it to the batched pass)
+                if self.defer_end_call_reasons:
+                    end_call_reason_pending = True
+                else:
+                    manager_evaluation = await self.evaluate_end_call_async(terminator="left")
+                    termination_reason = manager_evaluation.reason
                 
                 # Do not enter the final response phase
                 break
@@ -120,29 +226,114 @@ class DialogueOrchestrator:
             "dialogue_history": self.full_dialogue_history,
             "turns": turn_count,
             "terminated_by_manager": terminated_by_manager,
+            "terminated_locally": terminated_locally,
+            "local_flags": self.local_flags,
             "end_call_signal_detected": end_call_signal_detected,
+            PENDING_FIELD: end_call_reason_pending,
             "termination_reason": termination_reason,
             "terminator": terminator,
             "conclusion_messages": conclusion_messages,
-            "reached_max_turns": turn_count >= self.max_turns
+            "reached_max_turns": turn_count >= self.max_turns,
+            "manager_calls": self.evaluations + self.end_call_reviews,
+            "speculative_turns": self.speculations,
+            "wasted_speculations": self.wasted_speculations
         }
+        if self.branching:
+            result["lineage"] = dict(self.lineage)
+        if self.branch_tasks:
+            # Wait for the branches forked from this dialogue (each of them may fork again)
+            result["branches"] = await self.gather_branches_async()
         
         self.logger.log("Dialogue ended")
+        # Cancel background summaries that are still running (the branch tree shares one summary cache: only the root cancels, after every branch is done)
+        if self.lineage["parent"] is None:
+            self.summaries.cancel()
+        # Record manager calls for the schedule stats
+        get_evaluation_registry().record(self.evaluations, self.end_call_reviews, self.schedule.skipped)
         return result
     
-    def evaluate_dialogue(self) -> Dict[str, Any]:
+    async def fork_async(self, left_message: str, turn_count: int) -> str:
+        """Fork: one request draws up to `branch_factor` user replies to the same left message.
+        
+        This dialogue continues with the first reply, every other reply starts a branch running concurrently.
+        If no reply could be drawn, generate a single reply as usual without forking.
+        """
+        replies = await self.right_agent.generate_candidates_async(left_message, self.branch_factor)
+        if not replies:
+            return await self.right_agent.generate_response_async(left_message)
+        for reply in replies[1:]:
+            # Number the children of this dialogue across all of its forks
+            child = self.spawn_branch(f"{self.lineage['branch_id']}.{len(self.branch_tasks) + 1}", turn_count)
+            child.right_agent.update_history("user", left_message)
+            child.right_agent.update_history("assistant", reply)
+            self.branch_tasks.append(asyncio.ensure_future(child.continue_dialogue_async(left_message, turn_count, reply)))
+        get_branching_registry().record(len(replies) - 1, len(self.full_dialogue_history), self.branch_factor - len(replies))
+        self.logger.log(f"Forked at turn {turn_count}: {len(replies)} user replies")
+        self.right_agent.update_history("user", left_message)
+        self.right_agent.update_history("assistant", replies[0])
+        return replies[0]
+    
+    def spawn_branch(self, branch_id: str, turn_count: int) -> "DialogueOrchestrator":
+        """Branch at the fork point: deep-copies histories and state (memory, manager notes, schedule, detector),
+        shares the client, logger and summary cache; the branch counts manager calls and speculations from the fork on"""
+        shared = [self.logger, self.summaries]
+        for agent in (self.left_agent, self.right_agent, self.manager_agent):
+            shared += [agent.client, agent.memory.task]
+        memo = {id(obj): obj for obj in shared if obj is not None}
+        memo[id(self.branch_tasks)] = []
+        child = copy.deepcopy(self, memo)
+        child.evaluations = child.end_call_reviews = 0
+        child.speculations = child.wasted_speculations = 0
+        child.schedule.skipped = 0
+        child.lineage = {
+            "branch_id": branch_id,
+            "parent": self.lineage["branch_id"],
+            "fork_turn": turn_count,
+            "shared_messages": len(self.full_dialogue_history),
+        }
+        return child
+    
+    async def gather_branches_async(self) -> List[Dict[str, Any]]:
+        """Branch results in fork order; failed branches are dropped (the shared prefix is still in this dialogue)"""
+        branches = []
+        for task in self.branch_tasks:
+            try:
+                branches.append(await task)
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"Dropping a branch of {self.lineage['branch_id']}: {e}")
+        self.branch_tasks = []
+        return branches
+    
+    def evaluate_dialogue(self) -> ManagerVerdict:
+        """Synchronous version of evaluate_dialogue_async"""
+        return asyncio.run(self.evaluate_dialogue_async())
+    
+    async def evaluate_dialogue_async(self) -> ManagerVerdict:
         """Manager evaluates the dialogue and decides whether to terminate"""
-        return self.manager_agent.evaluate_dialogue(self.full_dialogue_history)
+        self.evaluations += 1
+        return await self.manager_agent.evaluate_dialogue_async(self.full_dialogue_history)
+    
+    async def settle_speculation_async(self, speculation: SpeculativeTurn, wasted: bool) -> None:
+        """Record a speculative left turn once the manager has decided; drop it if the dialogue ends"""
+        manager_finished = time.perf_counter()
+        self.speculations += 1
+        completed = True
+        if wasted:
+            self.wasted_speculations += 1
+            completed = await speculation.discard_async()
+        get_speculation_registry().record(self.left_agent.conversation_type, wasted, completed, speculation.overlap(manager_finished))
     
-    def evaluate_end_call(self, terminator: str) -> Dict[str, Any]:
+    def evaluate_end_call(self, terminator: str) -> EndCallVerdict:
+        """Synchronous version of evaluate_end_call_async"""
+        return asyncio.run(self.evaluate_end_call_async(terminator))
+    
+    async def evaluate_end_call_async(self, terminator: str) -> EndCallVerdict:
         """Manager evaluates the end call action"""
+        self.end_call_reviews += 1
         messages = [{"role": "system", "content": self.manager_agent.get_system_prompt()}]
         
-        # Build dialogue record
-        dialogue_text = "\n".join([
-            f"{'Left' if msg['role'] == 'left' else 'Right'}: {msg['content']}"
-            for msg in self.full_dialogue_history
-        ])
+        # Build dialogue record (older turns are summarised)
+        dialogue_text = await self.manager_agent.transcript_async(self.full_dialogue_history)
         
         terminator_name = "Left" if terminator == "left" else "Right"
         messages.append({
@@ -151,49 +342,26 @@ class DialogueOrchestrator:
         })
         
         # Call API to generate reply
-        reply = self.manager_agent.client.chat_completion(
+        reply = await self.manager_agent.client.chat_completion_async(
             messages=messages,
             model=self.manager_agent.model,
-            temperature=0.3,
-            max_tokens=500
+            response_schema=END_CALL_SCHEMA if self.manager_agent.structured_output else None,
+            **self.manager_agent.generation_config
         )
         
-        # Try to parse JSON
-        try:
-            import json
-            json_match = self._extract_json(reply)
-            if json_match:
-                result = json.loads(json_match)
-            else:
-                result = json.loads(reply)
-                
-            if 'reason' not in result:
-                result['reason'] = f"{terminator_name} actively ended the conversation, reason unknown."
-            return result
-        except:
-            # If parsing fails, return the original reply as reason
-            return {
-                "reason": f"{terminator_name} actively ended the conversation. {reply}"
-            }
-    
-    def _extract_json(self, text: str) -> str:
-        """Extract JSON part from text"""
-        import re
-        json_pattern = r'\{(?:[^{}]|(?:\{[^{}]*\}))*\}'
-        matches = re.findall(json_pattern, text)
-        
-        # Try each match, return the first valid JSON
-        for match in matches:
-            try:
-                import json
-                json.loads(match)
-                return match
-            except json.JSONDecodeError:
-                continue
-        
-        return None
+        # Parse the JSON verdict; fall back to the raw reply as reason
+        verdict = parse_end_call_verdict(reply)
+        if verdict is not None:
+            return verdict
+        if not reply:
+            return EndCallVerdict(reason=f"{terminator_name} actively ended the conversation, reason unknown.")
+        return EndCallVerdict(reason=f"{terminator_name} actively ended the conversation. {reply}")
     
     def handle_termination(self, terminator: str) -> List[Dict[str, str]]:
+        """Synchronous version of handle_termination_async"""
+        return asyncio.run(self.handle_termination_async(terminator))
+    
+    async def handle_termination_async(self, terminator: str) -> List[Dict[str, str]]:
         """Handle dialogue termination"""
         conclusion_messages = []
         
@@ -204,20 +372,22 @@ class DialogueOrchestrator:
             self.left_agent.update_history("user", last_right_message)
                 
             # Let left agent end the conversation
-            left_conclusion = self.get_conclusion_from_left()
+            left_conclusion = await self.get_conclusion_from_left_async()
             self.full_dialogue_history.append({
                 "role": "left",
                 "content": left_conclusion,
+                "model": self.left_agent.last_model,
                 "timestamp": time.time()
             })
             conclusion_messages.append({"role": "left", "content": left_conclusion})
             self.logger.log(f"Left ended: {left_conclusion}")
             
             # User's final response
-            right_conclusion = self.right_agent.generate_response(left_conclusion)
+            right_conclusion = await self.right_agent.generate_response_async(left_conclusion)
             self.full_dialogue_history.append({
                 "role": "right",
                 "content": right_conclusion,
+                "model": self.right_agent.last_model,
                 "timestamp": time.time()
             })
             conclusion_messages.append({"role": "right", "content": right_conclusion})
@@ -225,20 +395,22 @@ class DialogueOrchestrator:
             
         elif terminator == "right":
             # Let user end the conversation
-            right_conclusion = self.get_conclusion_from_right()
+            right_conclusion = await self.get_conclusion_from_right_async()
             self.full_dialogue_history.append({
                 "role": "right",
                 "content": right_conclusion,
+                "model": self.right_agent.last_model,
                 "timestamp": time.time()
             })
             conclusion_messages.append({"role": "right", "content": right_conclusion})
             self.logger.log(f"Right ended: {right_conclusion}")
             
             # Left agent's final response
-            left_conclusion = self.left_agent.generate_response(right_conclusion)
+            left_conclusion = await self.left_agent.generate_response_async(right_conclusion)
             self.full_dialogue_history.append({
                 "role": "left",
                 "content": left_conclusion,
+                "model": self.left_agent.last_model,
                 "timestamp": time.time()
             })
             conclusion_messages.append({"role": "left", "content": left_conclusion})
@@ -246,19 +418,21 @@ class DialogueOrchestrator:
         
         else:  # Natural end
             # Both sides give closing statements
-            left_conclusion = self.get_conclusion_from_left()
+            left_conclusion = await self.get_conclusion_from_left_async()
             self.full_dialogue_history.append({
                 "role": "left",
                 "content": left_conclusion,
+                "model": self.left_agent.last_model,
                 "timestamp": time.time()
             })
             conclusion_messages.append({"role": "left", "content": left_conclusion})
             self.logger.log(f"Left ended: {left_conclusion}")
             
-            right_conclusion = self.right_agent.generate_response(left_conclusion)
+            right_conclusion = await self.right_agent.generate_response_async(left_conclusion)
             self.full_dialogue_history.append({
                 "role": "right",
                 "content": right_conclusion,
+                "model": self.right_agent.last_model,
                 "timestamp": time.time()
             })
             conclusion_messages.append({"role": "right", "content": right_conclusion})
@@ -267,37 +441,45 @@ class DialogueOrchestrator:
         return conclusion_messages
     
     def get_conclusion_from_left(self) -> str:
+        """Synchronous version of get_conclusion_from_left_async"""
+        return asyncio.run(self.get_conclusion_from_left_async())
+    
+    async def get_conclusion_from_left_async(self) -> str:
         """Let the left agent generate a closing statement"""
-        left_history = self.left_agent.get_history()
+        left_history = await self.left_agent.history_messages_async()
         messages = [
             {"role": "system", "content": self.left_agent.get_system_prompt()},
         ]+left_history+[{"role": "user", "content": LEFT_TERMINATION_PROMPT}]
 
-        # Call API to generate reply
-        reply = self.left_agent.client.chat_completion(
-            messages=messages,
-            model=self.left_agent.model,
-            temperature=0.7,
-            max_tokens=200
+        # Call API to generate reply (closing lines may use their own model, see ROLE_MODELS)
+        completion = await self.left_agent.client.complete_async(
+            messages,
+            model=get_model_router().model_for("conclusion", self.left_agent.model),
+            **config.GENERATION_CONFIG["conclusion"]
         )
+        self.left_agent.last_model = completion.model
         
-        return reply
+        return completion.text
     
     def get_conclusion_from_right(self) -> str:
+        """Synchronous version of get_conclusion_from_right_async"""
+        return asyncio.run(self.get_conclusion_from_right_async())
+    
+    async def get_conclusion_from_right_async(self) -> str:
         """Let the right agent generate a closing statement"""
-        right_history = self.right_agent.get_history()
+        right_history = await self.right_agent.history_messages_async()
         messages = [
             {"role": "system", "content": self.right_agent.get_system_prompt()},
         ]+right_history+[
             {"role": "user", "content": RIGHT_TERMINATION_PROMPT}
         ]
         
-        # Call API to generate reply
-        reply = self.right_agent.client.chat_completion(
-            messages=messages,
-            model=self.right_agent.model,
-            temperature=0.7,
-            max_tokens=200
+        # Call API to generate reply (closing lines may use their own model, see ROLE_MODELS)
+        completion = await self.right_agent.client.complete_async(
+            messages,
+            model=get_model_router().model_for("conclusion", self.right_agent.model),
+            **config.GENERATION_CONFIG["conclusion"]
         )
+        self.right_agent.last_model = completion.model
         
-        return reply
\ No newline at end of file
+        return completion.text
\ No newline at end of file
@@ -0,0 +1,196 @@
+"""
+Evaluation Schedule - Quyết định sau câu trả lời nào của người dùng thì gọi manager đánh giá hội thoại
+"""
+
+import logging
+from threading import Lock
+from typing import Dict, Any, Optional, Sequence
+
+import config
+
+SCHEDULES = ("fixed", "backoff", "hazard")
+
+
+class EvaluationSchedule:
+    """Lịch cố định: đánh giá mỗi `every` lượt khi hội thoại có từ `min_messages` câu thoại.
+
+    Mỗi hội thoại dùng một instance riêng; orchestrator hỏi `should_evaluate` sau mỗi câu của người dùng
+    và gọi `record` sau mỗi lần manager đánh giá.
+    """
+
+    name = "fixed"
+
+    def __init__(self, every: int = 2, min_messages: int = 6, max_gap: int = 4):
+        self.every = max(1, every)
+        self.min_messages = min_messages
+        self.max_gap = max(1, max_gap)
+        self.last_turn: Optional[int] = None   # Lượt của lần đánh giá gần nhất
+        self.first_turn: Optional[int] = None  # Lượt đầu tiên đủ điều kiện đánh giá
+        self.skipped = 0                       # Số lượt đủ điều kiện nhưng không gọi manager
+
+    def should_evaluate(self, history: Sequence[Dict[str, Any]], turn: int, max_turns: int) -> bool:
+        if len(history) < self.min_messages:
+            return False
+        if self.first_turn is None:
+            self.first_turn = turn
+        if self._due(history, turn, max_turns):
+            return True
+        self.skipped += 1
+        return False
+
+    def _due(self, history: Sequence[Dict[str, Any]], turn: int, max_turns: int) -> bool:
+        return turn % self.every == 0
+
+    def gap(self, turn: int) -> int:
+        """Số lượt kể từ lần đánh giá gần nhất (hoặc từ lượt đầu tiên đủ điều kiện)"""
+        anchor = self.last_turn if self.last_turn is not None else self.first_turn
+        return turn - anchor if anchor is not None else 0
+
+    def record(self, turn: int, should_terminate: bool = False) -> None:
+        self.last_turn = turn
+
+
+class BackoffSchedule(EvaluationSchedule):
+    """Lùi dần: đánh giá ngay khi đủ điều kiện, sau mỗi phán quyết "tiếp tục" khoảng cách nhân đôi (tối đa max_gap)"""
+
+    name = "backoff"
+
+    def __init__(self, every: int = 1, min_messages: int = 6, max_gap: int = 4):
+        super().__init__(every, min_messages, max_gap)
+        self.current_gap = self.every
+
+    def _due(self, history: Sequence[Dict[str, Any]], turn: int, max_turns: int) -> bool:
+        return self.last_turn is None or self.gap(turn) >= self.current_gap
+
+    def record(self, turn: int, should_terminate: bool = False) -> None:
+        super().record(turn, should_terminate)
+        if not should_terminate:
+            self.current_gap = min(self.current_gap * 2, self.max_gap)
+
+
+class HazardSchedule(EvaluationSchedule):
+    """Theo rủi ro kết thúc: chấm điểm các dấu hiệu rẻ của lượt vừa rồi, chỉ gọi manager khi điểm đủ cao.
+
+    Dấu hiệu: câu chào/gác máy, câu từ chối, câu trả lời của người dùng ngắn dần, số lượt so với max_turns
+    và số lượt chưa được đánh giá. Quá max_gap lượt không đánh giá thì luôn gọi manager.
+    """
+
+    name = "hazard"
+
+    def __init__(self, every: int = 1, min_messages: int = 6, max_gap: int = 4,
+                 threshold: float = config.MANAGER_HAZARD_THRESHOLD,
+                 end_hints: Sequence[str] = config.MANAGER_HAZARD_END_HINTS,
+                 refusals: Sequence[str] = config.MANAGER_HAZARD_REFUSALS):
+        super().__init__(every, min_messages, max_gap)
+        self.threshold = threshold
+        self.end_hints = [phrase.lower() for phrase in end_hints]
+        self.refusals = [phrase.lower() for phrase in refusals]
+
+    def hazard(self, history: Sequence[Dict[str, Any]], turn: int, max_turns: int) -> float:
+        """Điểm rủi ro hội thoại sắp/nên kết thúc, dựa trên hai câu thoại cuối"""
+        recent = " ".join(msg["content"].lower() for msg in history[-2:])
+        right = [msg["content"] for msg in history if msg["role"] == "right"]
+        score = 0.0
+        if any(phrase in recent for phrase in self.end_hints):
+            score += 1.0
+        score += min(1.0, 0.5 * sum(phrase in right[-1].lower() for phrase in self.refusals)) if right else 0.0
+        # Người dùng trả lời ngắn dần: thường là dấu hiệu mất hứng hoặc muốn dừng
+        if len(right) >= 4:
+            earlier = sum(len(text) for text in right[:-2]) / (len(right) - 2)
+            latest = sum(len(text) for text in right[-2:]) / 2
+            if earlier and latest < 0.6 * earlier:
+                score += 0.4
+        score += 0.5 * turn / max_turns if max_turns else 0.0
+        score += 0.5 * self.gap(turn) / self.max_gap
+        return score
+
+    def _due(self, history: Sequence[Dict[str, Any]], turn: int, max_turns: int) -> bool:
+        if self.gap(turn) >= self.max_gap:
+            return True
+        return self.hazard(history, turn, max_turns) >= self.threshold
+
+
+_SCHEDULE_CLASSES = {cls.name: cls for cls in (EvaluationSchedule, BackoffSchedule, HazardSchedule)}
+
+
+class EvaluationRegistry:
+    """Lịch đánh giá mặc định và thống kê số lần gọi manager dùng chung cho toàn process"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.logger = logging.getLogger(__name__)
+        self.configure(config.MANAGER_SCHEDULE, config.MANAGER_EVAL_EVERY,
+                       config.MANAGER_EVAL_MIN_MESSAGES, config.MANAGER_EVAL_MAX_GAP)
+
+    def configure(self, name: str, every: int, min_messages: int, max_gap: int) -> None:
+        if name not in _SCHEDULE_CLASSES:
+            raise ValueError(f"Lịch đánh giá không hợp lệ: {name} (chỉ nhận {', '.join(SCHEDULES)})")
+        with self._lock:
+            self.name = name
+            self.every = every
+            self.min_messages = min_messages
+            self.max_gap = max_gap
+            self.dialogues = 0
+            self.evaluations = 0
+            self.end_call_reviews = 0
+            self.skipped = 0
+
+    def create(self) -> EvaluationSchedule:
+        return _SCHEDULE_CLASSES[self.name](every=self.every, min_messages=self.min_messages, max_gap=self.max_gap)
+
+    def record(self, evaluations: int, end_call_reviews: int, skipped: int) -> None:
+        with self._lock:
+            self.dialogues += 1
+            self.evaluations += evaluations
+            self.end_call_reviews += end_call_reviews
+            self.skipped += skipped
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = self.evaluations + self.end_call_reviews
+            return {
+                "schedule": self.name,
+                "every": self.every,
+                "max_gap": self.max_gap,
+                "dialogues": self.dialogues,
+                "manager_calls": calls,
+                "evaluations": self.evaluations,
+                "end_call_reviews": self.end_call_reviews,
+                "skipped": self.skipped,
+                "calls_per_dialogue": calls / self.dialogues if self.dialogues else 0.0,
+            }
+
+
+_evaluation_registry = EvaluationRegistry()
+
+
+def get_evaluation_registry() -> EvaluationRegistry:
+    """Trả về registry lịch đánh giá dùng chung của process"""
+    return _evaluation_registry
+
+
+def create_evaluation_schedule() -> EvaluationSchedule:
+    """Tạo lịch đánh giá cho một hội thoại theo cấu hình hiện tại"""
+    return _evaluation_registry.create()
+
+
+def configure_evaluation_schedule(name: str = config.MANAGER_SCHEDULE,
+                                  every: int = config.MANAGER_EVAL_EVERY,
+                                  min_messages: int = config.MANAGER_EVAL_MIN_MESSAGES,
+                                  max_gap: int = config.MANAGER_EVAL_MAX_GAP) -> EvaluationRegistry:
+    """Cấu hình lịch đánh giá từ tham số dòng lệnh và đặt lại thống kê"""
+    _evaluation_registry.configure(name, every, min_messages, max_gap)
+    _evaluation_registry.logger.info(
+        f"🧭 Lịch đánh giá của manager: {name} (mỗi {every} lượt, từ {min_messages} câu thoại, cách nhau tối đa {max_gap} lượt)"
+        if name != "fixed" else f"🧭 Lịch đánh giá của manager: mỗi {every} lượt, từ {min_messages} câu thoại"
+    )
+    return _evaluation_registry
+
+
+def format_evaluation_stats(stats: Dict[str, Any]) -> str:
+    """Định dạng thống kê số lần gọi manager để ghi log"""
+    return (
+        f"Manager (lịch {stats['schedule']}): {stats['manager_calls']} lần gọi cho {stats['dialogues']} hội thoại "
+        f"({stats['calls_per_dialogue']:.2f} lần/hội thoại; {stats['evaluations']} lần đánh giá, "
+        f"{stats['end_call_reviews']} lần đánh giá ngắt máy, {stats['skipped']} lượt bỏ qua)"
+    )
@@ -0,0 +1,274 @@
+"""
+Script Generator - Chế độ kịch bản: một request có cấu trúc (responseSchema) viết trọn cuộc gọi left/right
+kèm bên kết thúc và lý do, thay cho vòng lặp từng lượt của DialogueOrchestrator (2×số lượt + các lần gọi manager)
+"""
+
+import asyncio
+import json
+import logging
+import re
+import time
+from threading import Lock
+from typing import Dict, Any, List, NamedTuple, Optional
+
+from agents.base_agent import BaseAgent
+from agents.prompts.script_prompts import SCRIPT_SYSTEM_PROMPT, SCRIPT_REQUEST_PROMPT, SCRIPT_OPENING_PROMPT
+from logic.end_call_annotation import PENDING_FIELD
+from utils.retry_policy import NonRetryableError, get_retry_policy
+import config
+
+# agents: DialogueOrchestrator sinh từng lượt; script: một request sinh cả hội thoại
+GENERATION_MODES = ("agents", "script")
+
+SCRIPT_TERMINATORS = ("left", "right", "natural")
+
+# Mã hiệu điều khiển của chế độ agent (##ENDCALL_SIGNAL##, ...) không được lọt vào câu thoại
+SIGNAL_PATTERN = re.compile(r"##[A-Z_]+##")
+
+
+def script_schema(max_turns: int) -> Dict[str, Any]:
+    """responseSchema của một kịch bản: các câu thoại theo thứ tự (tối đa 2×max_turns câu), bên kết thúc và lý do"""
+    return {
+        "type": "OBJECT",
+        "properties": {
+            "turns": {
+                "type": "ARRAY",
+                "items": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "role": {"type": "STRING", "enum": ["left", "right"]},
+                        "content": {"type": "STRING"},
+                    },
+                    "required": ["role", "content"],
+                    "propertyOrdering": ["role", "content"],
+                },
+                "minItems": 2,
+                "maxItems": 2 * max_turns,
+            },
+            "terminator": {"type": "STRING", "enum": list(SCRIPT_TERMINATORS)},
+            "termination_reason": {"type": "STRING"},
+        },
+        "required": ["turns", "terminator", "termination_reason"],
+        "propertyOrdering": ["turns", "terminator", "termination_reason"],
+    }
+
+
+class DialogueScript(NamedTuple):
+    """Kịch bản đã chuẩn hoá: câu thoại xen kẽ bắt đầu từ left, bên kết thúc, lý do và có bị cắt ở max_turns không"""
+    messages: List[Dict[str, str]]
+    terminator: str
+    reason: str
+    truncated: bool = False
+
+
+def parse_script(text: Optional[str], max_turns: int, opening: Optional[str] = None) -> Optional[DialogueScript]:
+    """Đọc kịch bản JSON của model; None nếu không đọc được hoặc không đủ một câu của mỗi bên.
+
+    Câu rỗng hoặc sai vai bị bỏ, các câu liền nhau của cùng một vai được gộp để giữ thứ tự xen kẽ,
+    câu của bên nghe trước câu đầu tiên của bên gọi bị bỏ. Có câu mở đầu sẵn thì câu đầu tiên được thay bằng câu đó.
+    """
+    text = (text or "").strip()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        start, end = text.find("{"), text.rfind("}")
+        try:
+            data = json.loads(text[start:end + 1]) if 0 <= start < end else None
+        except json.JSONDecodeError:
+            data = None
+    if not isinstance(data, dict) or not isinstance(data.get("turns"), list):
+        return None
+
+    messages: List[Dict[str, str]] = []
+    for item in data["turns"]:
+        if not isinstance(item, dict):
+            continue
+        role = item.get("role")
+        content = " ".join(SIGNAL_PATTERN.sub(" ", str(item.get("content") or "")).split())
+        if role not in ("left", "right") or not content:
+            continue
+        if messages and messages[-1]["role"] == role:
+            messages[-1]["content"] += " " + content
+        elif messages or role == "left":
+            messages.append({"role": role, "content": content})
+    if opening:
+        if messages:
+            messages[0]["content"] = opening
+        else:
+            messages.append({"role": "left", "content": opening})
+
+    truncated = len(messages) > 2 * max_turns
+    messages = messages[:2 * max_turns]
+    if len(messages) < 2:
+        return None
+    terminator = data.get("terminator") if data.get("terminator") in SCRIPT_TERMINATORS else "natural"
+    reason = " ".join(str(data.get("termination_reason") or "").split()) or "Không xác định"
+    return DialogueScript(messages, terminator, reason, truncated)
+
+
+class ScriptRegistry:
+    """Chế độ sinh đang dùng và thống kê request của chế độ kịch bản, dùng chung cho toàn process"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.logger = logging.getLogger(__name__)
+        self.configure(config.GENERATION_MODE)
+
+    def configure(self, mode: str) -> None:
+        if mode not in GENERATION_MODES:
+            raise ValueError(f"Chế độ sinh phải thuộc {GENERATION_MODES}: {mode}")
+        with self._lock:
+            self.mode = mode
+            self.dialogues = 0
+            self.requests = 0
+            self.invalid = 0
+            self.failed = 0
+            self.truncated = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode == "script"
+
+    def record(self, requests: int, invalid: int, truncated: bool) -> None:
+        """Một hội thoại sinh xong: số request đã gửi, số kịch bản không hợp lệ phải sinh lại, có bị cắt ở max_turns không"""
+        with self._lock:
+            self.dialogues += 1
+            self.requests += requests
+            self.invalid += invalid
+            self.truncated += int(truncated)
+
+    def record_failure(self, requests: int, invalid: int) -> None:
+        """Một hội thoại bị bỏ vì không có kịch bản hợp lệ sau mọi lần thử"""
+        with self._lock:
+            self.failed += 1
+            self.requests += requests
+            self.invalid += invalid
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.mode == "script",
+                "mode": self.mode,
+                "dialogues": self.dialogues,
+                "requests": self.requests,
+                "invalid": self.invalid,
+                "failed": self.failed,
+                "truncated": self.truncated,
+            }
+
+
+_script_registry = ScriptRegistry()
+
+
+def get_script_registry() -> ScriptRegistry:
+    """Trả về registry chế độ kịch bản dùng chung của process"""
+    return _script_registry
+
+
+def configure_script_mode(mode: str = config.GENERATION_MODE) -> ScriptRegistry:
+    """Chọn chế độ sinh từ tham số dòng lệnh, đặt lại thống kê"""
+    _script_registry.configure(mode)
+    if _script_registry.enabled:
+        _script_registry.logger.info("📜 Chế độ kịch bản: mỗi hội thoại sinh trọn bằng một request có cấu trúc")
+    return _script_registry
+
+
+def format_script_stats(stats: Dict[str, Any]) -> str:
+    """Định dạng thống kê chế độ kịch bản để ghi log"""
+    if not stats["enabled"]:
+        return "Chế độ kịch bản: tắt (sinh từng lượt bằng agent)"
+    return (
+        f"Chế độ kịch bản: {stats['dialogues']} hội thoại bằng {stats['requests']} request, "
+        f"{stats['invalid']} kịch bản không hợp lệ phải sinh lại, {stats['truncated']} kịch bản bị cắt ở max_turns, "
+        f"{stats['failed']} hội thoại bị bỏ"
+    )
+
+
+class ScriptGenerator:
+    """Sinh trọn một hội thoại bằng một request; system prompt của hai agent làm hồ sơ cho hai vai.
+
+    Kết quả cùng cấu trúc với DialogueOrchestrator.run_dialogue_async nên đi qua cùng bước ghi JSONL.
+    """
+
+    def __init__(self, left_agent: BaseAgent, right_agent: BaseAgent, max_turns: int = 15,
+                 attempts: int = config.SCRIPT_ATTEMPTS, retry_delay: float = 1.0):
+        self.left_agent = left_agent
+        self.right_agent = right_agent
+        self.client = left_agent.client
+        self.max_turns = max_turns
+        self.attempts = max(1, attempts)
+        self.retry_delay = retry_delay
+        self.logger = logging.getLogger(__name__)
+
+    def build_messages(self, opening: Optional[str] = None) -> List[Dict[str, str]]:
+        request = SCRIPT_REQUEST_PROMPT.format(
+            max_turns=self.max_turns,
+            left_profile=self.left_agent.get_system_prompt().strip(),
+            right_profile=self.right_agent.get_system_prompt().strip()
+        )
+        if opening:
+            request += SCRIPT_OPENING_PROMPT.format(opening=opening)
+        return [
+            {"role": "system", "content": SCRIPT_SYSTEM_PROMPT},
+            {"role": "user", "content": request},
+        ]
+
+    async def generate_async(self, initial_message: Optional[str] = None) -> Dict[str, Any]:
+        """Sinh kịch bản, gửi lại khi request lỗi hoặc kịch bản không hợp lệ (mỗi lần gửi lại trừ vào budget retry);
+        raise ValueError nếu hết `attempts` lần thử"""
+        messages = self.build_messages(initial_message)
+        invalid = 0
+        for attempt in range(1, self.attempts + 1):
+            if attempt > 1:
+                self.client.retry_budget.consume(f"script, lần thử {attempt}")
+                await asyncio.sleep(get_retry_policy().backoff(attempt - 2, base_delay=self.retry_delay))
+            try:
+                completion = await self.client.complete_async(
+                    messages,
+                    response_schema=script_schema(self.max_turns),
+                    **config.GENERATION_CONFIG["script"]
+                )
+            except NonRetryableError:
+                raise
+            except Exception as e:
+                self.logger.warning(f"Không sinh được kịch bản (lần thử {attempt}): {e}")
+                continue
+            script = parse_script(completion.text, self.max_turns, initial_message)
+            if script is None:
+                invalid += 1
+                self.logger.warning(f"Kịch bản không hợp lệ (lần thử {attempt}), sinh lại")
+                continue
+            get_script_registry().record(attempt, invalid, script.truncated)
+            return self.to_result(script, completion.model, pooled_opening=bool(initial_message))
+
+        get_script_registry().record_failure(self.attempts, invalid)
+        raise ValueError(f"Không sinh được kịch bản hợp lệ sau {self.attempts} lần thử")
+
+    def generate(self, initial_message: Optional[str] = None) -> Dict[str, Any]:
+        """Phiên bản đồng bộ của generate_async"""
+        return asyncio.run(self.generate_async(initial_message))
+
+    def to_result(self, script: DialogueScript, model: Optional[str] = None, pooled_opening: bool = False) -> Dict[str, Any]:
+        """Kết quả theo cấu trúc của DialogueOrchestrator; cắt ở max_turns được ghi như hội thoại đạt tối đa lượt.
+        Mọi câu ghi `model` đã sinh kịch bản, trừ câu mở đầu lấy từ kho (`pooled_opening`)"""
+        now = time.time()
+        return {
+            "dialogue_history": [
+                {**message, "model": None if i == 0 and pooled_opening else model, "timestamp": now}
+                for i, message in enumerate(script.messages)
+            ],
+            "turns": sum(1 for message in script.messages if message["role"] == "right"),
+            "terminated_by_manager": False,
+            "terminated_locally": False,
+            "local_flags": [],
+            "end_call_signal_detected": False,
+            PENDING_FIELD: False,
+            "termination_reason": script.reason,
+            "terminator": script.terminator,
+            "conclusion_messages": [],
+            "reached_max_turns": script.truncated,
+            "manager_calls": 0,
+            "speculative_turns": 0,
+            "wasted_speculations": 0,
+            "mode": "script",
+        }
@@ -0,0 +1,170 @@
+"""
+Termination Detector - Nhận biết cục bộ (không gọi API) hội thoại đã ngã ngũ:
+người dùng lộ thông tin/đồng ý chuyển tiền, từ chối dứt khoát nhiều lần, hoặc hai bên lặp lại cùng một nội dung
+"""
+
+import logging
+import re
+from threading import Lock
+from typing import Dict, Any, List, Mapping, NamedTuple, Optional, Sequence
+
+from utils.text_similarity import normalize, max_similarity
+import config
+
+DETECTOR_MODES = ("off", "flag", "end")
+RULES = ("disclosure", "refusal", "stalemate")
+
+
+class LocalVerdict(NamedTuple):
+    """Kết luận của bộ phát hiện cục bộ, cùng dạng terminator/reason với phán quyết của manager"""
+    rule: str        # disclosure, refusal hoặc stalemate
+    terminator: str  # left, right hoặc natural
+    reason: str
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self._asdict()
+
+
+class TerminationDetector:
+    """Bộ phát hiện của một hội thoại; orchestrator gọi `check` sau mỗi câu của người dùng.
+
+    - disclosure: câu vừa rồi của người dùng khớp một mẫu lộ thông tin (OTP, số tài khoản, đồng ý chuyển tiền...)
+    - refusal: người dùng đã từ chối dứt khoát từ `refusal_limit` lần
+    - stalemate: `stall_turns` lượt liên tiếp mà câu của cả hai bên đều gần trùng một câu trước đó của chính họ
+    Ở chế độ flag mỗi quy tắc chỉ báo một lần để không buộc manager đánh giá ở mọi lượt sau đó.
+    """
+
+    def __init__(self, mode: str = "end",
+                 disclosures: Mapping[str, str] = config.LOCAL_DETECTOR_DISCLOSURES,
+                 refusals: Sequence[str] = config.LOCAL_DETECTOR_REFUSALS,
+                 refusal_limit: int = config.LOCAL_DETECTOR_REFUSAL_LIMIT,
+                 stall_turns: int = config.LOCAL_DETECTOR_STALL_TURNS,
+                 similarity_threshold: float = config.LOCAL_DETECTOR_SIMILARITY,
+                 min_messages: int = config.LOCAL_DETECTOR_MIN_MESSAGES):
+        self.mode = mode
+        self.disclosures = [(label, re.compile(pattern)) for label, pattern in disclosures.items()]
+        self.refusals = [re.compile(pattern) for pattern in refusals]
+        self.refusal_limit = refusal_limit
+        self.stall_turns = stall_turns
+        self.similarity_threshold = similarity_threshold
+        self.min_messages = min_messages
+        self.repeats = 0     # Số lượt lặp lại liên tiếp
+        self.fired = set()   # Các quy tắc đã báo (chế độ flag)
+
+    def check(self, history: Sequence[Dict[str, Any]]) -> Optional[LocalVerdict]:
+        """Kiểm tra sau câu mới nhất của người dùng; trả về None nếu chưa có dấu hiệu kết thúc"""
+        right = [msg["content"] for msg in history if msg["role"] == "right"]
+        left = [msg["content"] for msg in history if msg["role"] == "left"]
+        if not right:
+            return None
+        self._track_repetition(left, right)
+        if len(history) < self.min_messages:
+            return None
+        for verdict in (self._disclosure(right[-1]), self._refusal(right), self._stalemate()):
+            if verdict is not None and verdict.rule not in self.fired:
+                if self.mode == "flag":
+                    self.fired.add(verdict.rule)
+                return verdict
+        return None
+
+    def _disclosure(self, text: str) -> Optional[LocalVerdict]:
+        text = normalize(text)
+        for label, pattern in self.disclosures:
+            if pattern.search(text):
+                return LocalVerdict("disclosure", "left", f"Người dùng đã {label}")
+        return None
+
+    def _refusal(self, right: List[str]) -> Optional[LocalVerdict]:
+        if not self.refusals or self.refusal_limit <= 0:
+            return None
+        count = sum(1 for text in right if any(p.search(normalize(text)) for p in self.refusals))
+        if count >= self.refusal_limit:
+            return LocalVerdict("refusal", "right", f"Người dùng đã từ chối dứt khoát {count} lần")
+        return None
+
+    def _track_repetition(self, left: List[str], right: List[str]) -> None:
+        """Đếm số lượt liên tiếp mà câu mới nhất của cả hai bên đều lặp lại câu cũ của chính họ"""
+        repeated = all(
+            len(lines) >= 2 and max_similarity(lines[-1], lines[:-1]) >= self.similarity_threshold
+            for lines in (left, right)
+        )
+        self.repeats = self.repeats + 1 if repeated else 0
+
+    def _stalemate(self) -> Optional[LocalVerdict]:
+        if self.stall_turns > 0 and self.repeats >= self.stall_turns:
+            return LocalVerdict("stalemate", "natural", f"Hội thoại bế tắc, hai bên lặp lại nội dung {self.repeats} lượt liên tiếp")
+        return None
+
+
+class DetectorRegistry:
+    """Chế độ của bộ phát hiện và thống kê dùng chung cho toàn process"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.logger = logging.getLogger(__name__)
+        self.configure(config.LOCAL_DETECTOR_MODE)
+
+    def configure(self, mode: str) -> None:
+        if mode not in DETECTOR_MODES:
+            raise ValueError(f"Chế độ phát hiện không hợp lệ: {mode} (chỉ nhận {', '.join(DETECTOR_MODES)})")
+        with self._lock:
+            self.mode = mode
+            self.ended = {rule: 0 for rule in RULES}
+            self.flagged = {rule: 0 for rule in RULES}
+            self.turns_saved = 0
+
+    def create(self) -> Optional[TerminationDetector]:
+        return TerminationDetector(self.mode) if self.mode != "off" else None
+
+    def record(self, verdict: LocalVerdict, ended: bool, turns_left: int = 0) -> None:
+        with self._lock:
+            if ended:
+                self.ended[verdict.rule] += 1
+                self.turns_saved += max(0, turns_left)
+            else:
+                self.flagged[verdict.rule] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "ended": dict(self.ended),
+                "flagged": dict(self.flagged),
+                "turns_saved": self.turns_saved,
+            }
+
+
+_detector_registry = DetectorRegistry()
+
+
+def get_detector_registry() -> DetectorRegistry:
+    """Trả về registry bộ phát hiện dùng chung của process"""
+    return _detector_registry
+
+
+def create_termination_detector() -> Optional[TerminationDetector]:
+    """Tạo bộ phát hiện cho một hội thoại theo cấu hình hiện tại (None khi tắt)"""
+    return _detector_registry.create()
+
+
+def configure_termination_detector(mode: str = config.LOCAL_DETECTOR_MODE) -> DetectorRegistry:
+    """Cấu hình chế độ phát hiện từ tham số dòng lệnh và đặt lại thống kê"""
+    _detector_registry.configure(mode)
+    if mode != "off":
+        _detector_registry.logger.info(
+            f"🔎 Phát hiện kết thúc cục bộ: {'kết thúc hội thoại ngay' if mode == 'end' else 'buộc manager đánh giá'} "
+            f"khi người dùng lộ thông tin, từ chối nhiều lần hoặc hai bên lặp lại nội dung"
+        )
+    return _detector_registry
+
+
+def format_detector_stats(stats: Dict[str, Any]) -> str:
+    """Định dạng thống kê bộ phát hiện để ghi log"""
+    if stats["mode"] == "off":
+        return "Phát hiện kết thúc cục bộ: tắt"
+    ended = ", ".join(f"{rule}={count}" for rule, count in stats["ended"].items())
+    flagged = ", ".join(f"{rule}={count}" for rule, count in stats["flagged"].items())
+    return (
+        f"Phát hiện kết thúc cục bộ ({stats['mode']}): {sum(stats['ended'].values())} hội thoại kết thúc sớm ({ended}), "
+        f"tối đa {stats['turns_saved']} lượt được bỏ qua; {sum(stats['flagged'].values())} lần báo cho manager ({flagged})"
+    )
@@ -3,6 +3,7 @@ import json
 from agents.left_agent import LeftAgent
 from agents.right_agent import RightAgent
 from agents.manager_agent import ManagerAgent
+from agents.memory import configure_memory
 from logic.dialogue_orchestrator import DialogueOrchestrator
 from utils.conversation_logger import ConversationLogger
 import config
@@ -25,6 +26,8 @@ def main():
         config.GEMINI_API_KEY = args.api_key
     if args.model:
         config.DEFAULT_MODEL = args.model
+    # Bộ nhớ hội thoại theo cấu hình mặc định trong config.py
+    configure_memory(config.MEMORY_WINDOW_TURNS, config.MEMORY_SUMMARY_EVERY, config.MEMORY_ROLES)
     
     # Khởi tạo trình ghi nhật ký
     logger = ConversationLogger()
@@ -0,0 +1,42 @@
+"""Cassette: ghi response từ mock server rồi phát lại y hệt mà không gửi request nào"""
+
+import pytest
+
+from utils.api_key_pool import configure_key_pool
+from utils.cassette import Cassette, CassetteMiss, configure_cassette
+from utils.gemini_client import GeminiClient
+
+MESSAGES = [{"role": "user", "content": "Alo, cho hỏi ai đang gọi vậy?"}]
+
+
+def test_record_then_replay_round_trip(tmp_path, mock_gemini):
+    server = mock_gemini()
+    configure_key_pool(["k"], 0, 0)
+    path = str(tmp_path / "gemini.sqlite")
+
+    configure_cassette(path, "record")
+    client = GeminiClient("k", base_url=server.base_url)
+    recorded = [client.complete(MESSAGES) for _ in range(2)]
+    assert server.state.stats()["requests"] == 2
+
+    cassette = configure_cassette(path, "replay")
+    client = GeminiClient("k", base_url=server.base_url)
+    replayed = [client.complete(MESSAGES) for _ in range(2)]
+    assert replayed == recorded
+    assert server.state.stats()["requests"] == 2
+    assert cassette.stats()["hits"] == 2
+
+    with pytest.raises(CassetteMiss):
+        client.complete([{"role": "user", "content": "Một câu chưa từng được ghi"}])
+
+
+def test_replay_follows_recording_order_and_wraps(tmp_path):
+    cassette = Cassette(str(tmp_path / "gemini.sqlite"), "auto")
+    key = cassette.key("gemini-2.0-flash", {"contents": []})
+    assert cassette.lookup(key) is None
+    cassette.record(key, "gemini-2.0-flash", '{"n": 1}', 0.1)
+    cassette.record(key, "gemini-2.0-flash-lite", '{"n": 2}', 0.2)
+
+    bodies = [cassette.lookup(key).body for _ in range(3)]
+    assert bodies == ['{"n": 1}', '{"n": 2}', '{"n": 1}']
+    cassette.close()
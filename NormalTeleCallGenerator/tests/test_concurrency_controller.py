@@ -0,0 +1,103 @@
+"""AIMD controller: giảm theo 429, tăng sau chuỗi thành công và trao slot cho coroutine đang chờ"""
+
+import asyncio
+
+import pytest
+
+from utils.concurrency_controller import AdaptiveConcurrencyController
+
+
+def test_throttle_wave_halves_limit_once():
+    controller = AdaptiveConcurrencyController(initial_limit=8, max_limit=8, decrease_cooldown=60.0)
+    controller.on_throttle()
+    assert controller.current_limit == 4
+    # 429 đến trong cùng cooldown thuộc cùng một đợt
+    controller.on_throttle()
+    assert controller.current_limit == 4
+    assert controller.stats()["throttles"] == 2
+
+
+def test_decrease_stops_at_min_limit():
+    controller = AdaptiveConcurrencyController(initial_limit=4, min_limit=1, decrease_cooldown=0.0)
+    for _ in range(5):
+        controller.on_throttle()
+    assert controller.current_limit == 1
+
+
+def test_success_streak_adds_one_up_to_max():
+    controller = AdaptiveConcurrencyController(initial_limit=2, max_limit=3, increase_after=3)
+    controller.on_success()
+    controller.on_success()
+    assert controller.current_limit == 2
+    controller.on_success()
+    assert controller.current_limit == 3
+    for _ in range(10):
+        controller.on_success()
+    assert controller.current_limit == 3
+
+
+def test_throttle_resets_success_streak():
+    controller = AdaptiveConcurrencyController(initial_limit=4, max_limit=8, increase_after=4, decrease_cooldown=0.0)
+    for _ in range(3):
+        controller.on_success()
+    controller.on_throttle()
+    assert controller.current_limit == 2
+    for _ in range(3):
+        controller.on_success()
+    assert controller.current_limit == 2
+
+
+def test_release_hands_slot_to_async_waiters_in_order():
+    controller = AdaptiveConcurrencyController(initial_limit=1, max_limit=1)
+    order = []
+
+    async def worker(name):
+        async with controller.async_slot():
+            order.append(name)
+            await asyncio.sleep(0)
+
+    async def run():
+        await controller.acquire_async()
+        tasks = [asyncio.create_task(worker(name)) for name in ("a", "b", "c")]
+        await asyncio.sleep(0.01)
+        assert controller.in_flight == 1
+        assert order == []
+        controller.release()
+        await asyncio.wait_for(asyncio.gather(*tasks), timeout=1.0)
+
+    asyncio.run(run())
+    assert order == ["a", "b", "c"]
+    assert controller.in_flight == 0
+
+
+def test_increase_wakes_async_waiter():
+    controller = AdaptiveConcurrencyController(initial_limit=1, max_limit=2, increase_after=1)
+
+    async def run():
+        await controller.acquire_async()
+        waiter = asyncio.create_task(controller.acquire_async())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        controller.on_success()
+        await asyncio.wait_for(waiter, timeout=1.0)
+
+    asyncio.run(run())
+    assert controller.current_limit == 2
+    assert controller.in_flight == 2
+
+
+def test_cancelled_async_waiter_does_not_leak_slot():
+    controller = AdaptiveConcurrencyController(initial_limit=1, max_limit=1)
+
+    async def run():
+        await controller.acquire_async()
+        waiter = asyncio.create_task(controller.acquire_async())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        controller.release()
+
+    asyncio.run(run())
+    assert controller.in_flight == 0
+    assert controller.try_acquire()
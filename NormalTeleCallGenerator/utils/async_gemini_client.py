@@ -0,0 +1,171 @@
+"""
+Async Gemini API Client - Gửi request bằng aiohttp trên một event loop duy nhất
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.gemini_client import Completion, GeminiClient, TIMEOUT_ERRORS
+from utils.http_pool import get_session_pool
+from utils.rate_limiter import estimate_tokens
+from utils.concurrency_controller import get_concurrency_controller
+from utils.retry_policy import NonRetryableError, get_retry_policy
+from utils.circuit_breaker import get_circuit_breaker
+from utils.cassette import get_cassette
+from utils.api_key_pool import KeyLease, get_key_pool
+from utils.context_cache import CREATE, REFRESH, get_context_cache
+from utils.model_router import get_model_router
+
+
+class AsyncGeminiClient(GeminiClient):
+    """Client Gemini dùng aiohttp, chia sẻ cách chuyển đổi message và xử lý lỗi với GeminiClient.
+
+    Hàng trăm hội thoại có thể cùng chờ response trên một event loop; số request
+    thực sự được gửi đi vẫn do rate limiter và AIMD controller dùng chung quyết định.
+    Các hàm đồng bộ kế thừa từ GeminiClient vẫn hoạt động bình thường.
+    """
+
+    async def _wait_for_key_async(self, estimated_tokens: int) -> KeyLease:
+        """Đặt chỗ quota của API key rồi chờ bằng asyncio.sleep"""
+        lease = self._reserve_key(estimated_tokens)
+        if lease.wait > 0:
+            self.logger.debug(f"⏱️ Chờ rate limit {lease.wait:.2f}s")
+            await asyncio.sleep(lease.wait)
+        return lease
+
+    async def _send_cache_request_async(self, method: str, path: str, params: Dict[str, str],
+                                        body: Optional[Dict[str, Any]] = None) -> Tuple[Optional[int], str]:
+        """Phiên bản aiohttp của _send_cache_request"""
+        import aiohttp
+
+        session = get_session_pool().get_async_session(self.base_url)
+        try:
+            async with session.request(method, f"{self.base_url}/{path}", params=params, json=body,
+                                       timeout=aiohttp.ClientTimeout(total=30)) as response:
+                return response.status, await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return None, str(e)
+
+    async def _use_context_cache_async(self, request_data: Dict[str, Any], api_key: str,
+                                       model: Optional[str] = None) -> Tuple[Dict[str, Any], Optional[str]]:
+        """Phiên bản async của _use_context_cache"""
+        plan = self._plan_context_cache(request_data, api_key, model)
+        name = plan.name
+        if plan.action == CREATE:
+            status_code, body_text = await self._send_cache_request_async(
+                "POST", "cachedContents", {"key": api_key}, self._cache_create_body(request_data, model))
+            name = self._on_cache_created(plan, status_code, body_text)
+        elif plan.action == REFRESH:
+            status_code, _ = await self._send_cache_request_async(
+                "PATCH", plan.name, {"key": api_key, "updateMask": "ttl"}, {"ttl": get_context_cache().ttl_param})
+            get_context_cache().on_refreshed(plan.key, status_code == 200)
+            if status_code != 200:
+                name = None
+        return self._with_cached_content(request_data, name), (plan.key if name else None)
+
+    async def _make_request_async(self, messages: List[Dict], max_retries: Optional[int] = None,
+                                  generation_config: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """Gửi request tới Gemini API qua aiohttp, trả về text của candidate đầu tiên"""
+        return (await self._complete_async(messages, max_retries, generation_config)).text
+
+    async def _complete_async(self, messages: List[Dict], max_retries: Optional[int] = None,
+                              generation_config: Optional[Dict[str, Any]] = None,
+                              model: Optional[str] = None) -> Completion:
+        """Phiên bản aiohttp của _complete: trả về các candidate và model đã trả lời (rỗng nếu thất bại)"""
+        import aiohttp
+
+        self.request_count += 1
+        max_retries = max_retries or get_retry_policy().attempts_per_request
+        model = model or self.model
+
+        request_data = self._build_request_data(messages, generation_config)
+        if request_data is None:
+            return Completion()
+
+        cassette = get_cassette()
+        cassette_key = cassette.key(model, request_data)
+        entry = cassette.lookup(cassette_key)
+        if entry is not None:
+            if cassette.replay_latency:
+                await asyncio.sleep(entry.latency)
+            return Completion(tuple(self._replay(entry)), entry.model or model)
+
+        estimated_tokens = estimate_tokens(request_data)
+
+        router = get_model_router()
+        headers = {
+            "Content-Type": "application/json"
+        }
+        controller = get_concurrency_controller()
+        session = get_session_pool().get_async_session(self.base_url)
+        timeout = aiohttp.ClientTimeout(total=90)
+        breaker = get_circuit_breaker()
+        key_pool = get_key_pool()
+
+        for attempt in range(max_retries):
+            if attempt > 0:
+                self.retry_budget.consume("Gemini request")
+            probe = await breaker.wait_async()
+            sent_model = model
+            try:
+                async with controller.async_slot():
+                    lease = await self._wait_for_key_async(estimated_tokens)
+                    sent_model = router.route(model)
+                    self.logger.info(f"Gửi request async tới Gemini API (lần thử {attempt + 1}/{max_retries})")
+
+                    status_code = None
+                    try:
+                        payload, cache_key = await self._use_context_cache_async(request_data, lease.api_key, sent_model)
+                        sent_at = time.monotonic()
+                        async with session.post(
+                            f"{self.base_url}/models/{sent_model}:generateContent?key={lease.api_key}",
+                            headers=headers,
+                            json=payload,
+                            timeout=timeout
+                        ) as response:
+                            status_code = response.status
+                            body_text = await response.text()
+                            retry_after = response.headers.get("Retry-After")
+                        latency = time.monotonic() - sent_at
+                    finally:
+                        key_pool.release(lease, throttled=status_code == 429)
+
+                result = json.loads(body_text) if status_code == 200 else None
+                outcome = self._handle_response(
+                    status_code, result, body_text,
+                    attempt, max_retries, estimated_tokens,
+                    retry_after=retry_after, lease=lease, cache_key=cache_key
+                )
+                # Sau _handle_response: 429 đã đặt key vào cooldown, router biết pool còn key khác hay không
+                self._record_route(model, sent_model, status_code)
+                if result is not None and outcome.text is not None:
+                    cassette.record(cassette_key, sent_model, body_text, latency, self.last_usage)
+            except NonRetryableError:
+                raise
+            except aiohttp.ClientConnectionError as e:
+                router.record_failure(sent_model)
+                outcome = self._handle_exception(ConnectionError(str(e)), attempt, max_retries)
+            except Exception as e:
+                if isinstance(e, TIMEOUT_ERRORS):
+                    router.record_failure(sent_model)
+                outcome = self._handle_exception(e, attempt, max_retries)
+            finally:
+                # Lượt thăm dò của breaker dừng mà chưa báo kết quả (lỗi không thể retry, task bị huỷ) phải được nhả
+                breaker.release_probe(probe)
+
+            if outcome.error is not None:
+                raise outcome.error
+            if outcome.done:
+                return Completion(tuple(outcome.candidates), sent_model)
+            if outcome.wait > 0 and attempt < max_retries - 1:
+                await asyncio.sleep(outcome.wait)
+
+        self.logger.error(f"❌ Gemini API failed sau {max_retries} lần thử")
+        return Completion()
+
+    async def complete_async(self, messages: List[Dict], n: int = 1, model: Optional[str] = None, **kwargs) -> Completion:
+        """Interface async tương thích với complete; chat_completion_async/chat_completions_async kế thừa đi qua hàm này"""
+        generation_config = self._build_generation_config(candidate_count=n if n > 1 else None, **kwargs)
+        return await self._complete_async(messages, generation_config=generation_config, model=model)
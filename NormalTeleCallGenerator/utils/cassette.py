@@ -0,0 +1,207 @@
+"""
+Cassette - Ghi lại và phát lại response của Gemini API bằng SQLite
+
+Chế độ:
+    off     Không dùng cassette (mặc định)
+    record  Luôn gọi API, lưu mọi response 200 vào cassette
+    replay  Chỉ phát lại từ cassette, request chưa được ghi sẽ báo lỗi (không tốn request thật nào)
+    auto    Phát lại nếu có, chưa có thì gọi API và ghi lại
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from collections import Counter
+from typing import Dict, Any, List, NamedTuple, Optional
+from threading import Lock
+
+from utils.retry_policy import NonRetryableError
+
+CASSETTE_MODES = ("off", "record", "replay", "auto")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    request_hash  TEXT    NOT NULL,
+    seq           INTEGER NOT NULL,
+    model         TEXT    NOT NULL,
+    body          TEXT    NOT NULL,
+    latency       REAL    NOT NULL,
+    prompt_tokens INTEGER,
+    output_tokens INTEGER,
+    recorded_at   REAL    NOT NULL,
+    PRIMARY KEY (request_hash, seq)
+)
+"""
+
+
+class CassetteMiss(NonRetryableError):
+    """Chế độ replay nhưng request chưa từng được ghi"""
+
+
+class CassetteEntry(NamedTuple):
+    """Một response đã ghi: body JSON gốc, thời gian server trả lời và model đã trả lời (có thể là model dự phòng)"""
+    body: str
+    latency: float
+    model: str = ""
+
+
+class Cassette:
+    """Kho response theo (hash payload, thứ tự xuất hiện).
+
+    Nhiều hội thoại có thể gửi payload giống hệt nhau (cùng system prompt, cùng câu mở đầu)
+    nhưng nhận response khác nhau, nên mỗi hash giữ một danh sách response theo thứ tự ghi;
+    khi phát lại, lần thứ n gặp một hash nhận response thứ n (quay vòng nếu hết).
+    """
+
+    def __init__(self, path: Optional[str] = None, mode: str = "off", replay_latency: bool = False):
+        self._lock = Lock()
+        self.logger = logging.getLogger(__name__)
+        self._conn: Optional[sqlite3.Connection] = None
+        self.configure(path, mode, replay_latency)
+
+    def configure(self, path: Optional[str], mode: str = "off", replay_latency: bool = False) -> None:
+        """Mở (hoặc tạo) file cassette; mode khác off bắt buộc phải có path"""
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Cassette mode phải thuộc {CASSETTE_MODES}")
+        if mode != "off" and not path:
+            raise ValueError("Cần đường dẫn cassette khi bật record/replay")
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self.path = path
+            self.mode = mode
+            self.replay_latency = replay_latency
+            self._replay_counters: Counter = Counter()
+            self._entries: Dict[str, List[CassetteEntry]] = {}
+            self.hits = 0
+            self.misses = 0
+            self.recorded = 0
+            self.replayed_latency = 0.0
+            if mode != "off":
+                # Các luồng worker dùng chung một kết nối, mọi truy cập đều qua self._lock
+                self._conn = sqlite3.connect(path, check_same_thread=False)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(_SCHEMA)
+                self._conn.commit()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode in ("replay", "auto")
+
+    @property
+    def recording(self) -> bool:
+        return self.mode in ("record", "auto")
+
+    @staticmethod
+    def request_hash(model: str, request_data: Dict[str, Any]) -> str:
+        """Hash của payload đã chuẩn hoá (không gồm API key/base_url)"""
+        canonical = json.dumps({"model": model, "request": request_data},
+                               sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def key(self, model: str, request_data: Dict[str, Any]) -> Optional[str]:
+        """Khoá cassette của request, None khi cassette tắt"""
+        return self.request_hash(model, request_data) if self.enabled else None
+
+    def _load(self, request_hash: str) -> List[CassetteEntry]:
+        """Đọc (và cache) các response đã ghi của một hash (gọi khi đang giữ lock)"""
+        entries = self._entries.get(request_hash)
+        if entries is None:
+            rows = self._conn.execute(
+                "SELECT body, latency, model FROM responses WHERE request_hash = ? ORDER BY seq",
+                (request_hash,)
+            ).fetchall()
+            entries = [CassetteEntry(body, latency, model) for body, latency, model in rows]
+            self._entries[request_hash] = entries
+        return entries
+
+    def lookup(self, request_hash: Optional[str]) -> Optional[CassetteEntry]:
+        """Response cần phát lại cho request này, None nếu phải gọi API thật"""
+        if request_hash is None or not self.replaying:
+            return None
+        with self._lock:
+            entries = self._load(request_hash)
+            if entries:
+                index = self._replay_counters[request_hash] % len(entries)
+                self._replay_counters[request_hash] += 1
+                self.hits += 1
+                self.replayed_latency += entries[index].latency
+                return entries[index]
+            self.misses += 1
+        if self.mode == "replay":
+            raise CassetteMiss(f"Request {request_hash[:12]} chưa có trong cassette {self.path}")
+        return None
+
+    def record(self, request_hash: Optional[str], model: str, body: str, latency: float,
+               usage: Optional[Dict[str, Any]] = None) -> None:
+        """Ghi một response 200 vào cuối danh sách của hash"""
+        if request_hash is None or not self.recording:
+            return
+        usage = usage or {}
+        with self._lock:
+            seq = self._conn.execute(
+                "SELECT COALESCE(MAX(seq) + 1, 0) FROM responses WHERE request_hash = ?",
+                (request_hash,)
+            ).fetchone()[0]
+            self._conn.execute(
+                "INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (request_hash, seq, model, body, latency,
+                 usage.get("promptTokenCount"), usage.get("candidatesTokenCount"), time.time())
+            )
+            self._conn.commit()
+            cached = self._entries.get(request_hash)
+            if cached is not None:
+                cached.append(CassetteEntry(body, latency, model))
+            self.recorded += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "path": self.path,
+                "hits": self.hits,
+                "misses": self.misses,
+                "recorded": self.recorded,
+                "replayed_latency": self.replayed_latency,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self.mode = "off"
+
+
+# Cassette mặc định cho toàn process (tắt)
+_cassette = Cassette()
+
+
+def get_cassette() -> Cassette:
+    """Trả về cassette dùng chung của process"""
+    return _cassette
+
+
+def configure_cassette(path: Optional[str], mode: str = "off", replay_latency: bool = False) -> Cassette:
+    """Cấu hình cassette dùng chung từ tham số dòng lệnh"""
+    _cassette.configure(path, mode, replay_latency)
+    if _cassette.enabled:
+        _cassette.logger.info(
+            f"📼 Cassette {mode}: {path}{' (phát lại cả độ trễ gốc)' if replay_latency else ''}"
+        )
+    return _cassette
+
+
+def format_cassette_stats(stats: Dict[str, Any]) -> str:
+    """Định dạng thống kê cassette để ghi log"""
+    return (
+        f"Cassette ({stats['mode']}): phát lại {stats['hits']} response, {stats['misses']} request chưa có, "
+        f"ghi mới {stats['recorded']}; độ trễ gốc của phần phát lại {stats['replayed_latency']:.1f}s"
+    )
@@ -0,0 +1,184 @@
+"""
+Circuit Breaker - Tạm dừng mọi worker cùng lúc khi Gemini API rõ ràng đang sập
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Any, Optional, Tuple
+from threading import Lock
+
+DEFAULT_FAILURE_THRESHOLD = 10   # Số lỗi upstream liên tiếp (mọi worker cộng lại) trước khi ngắt
+DEFAULT_COOLDOWN = 30.0          # Thời gian ngắt lần đầu (giây)
+DEFAULT_MAX_COOLDOWN = 300.0     # Thời gian ngắt tối đa khi probe liên tục thất bại
+PROBE_POLL_INTERVAL = 1.0        # Chu kỳ các worker khác kiểm tra lại trong lúc probe đang chạy
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Circuit breaker dùng chung cho toàn process.
+
+    Lỗi upstream (5xx, timeout, mất kết nối) của mọi client được cộng dồn; khi đủ
+    `failure_threshold` lỗi liên tiếp thì mạch mở và mọi worker cùng chờ hết
+    cooldown thay vì mỗi luồng tự sleep/retry. Hết cooldown, đúng một request
+    được gửi thử (half-open): thành công thì đóng mạch, thất bại thì mở lại với
+    cooldown gấp đôi. wait() trả về mã của lượt thăm dò mà lần gửi đó giữ; lần gửi
+    dừng giữa chừng (lỗi không thể retry, bị huỷ) phải release_probe() để nhả lượt.
+    """
+
+    def __init__(self, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 cooldown: float = DEFAULT_COOLDOWN,
+                 max_cooldown: float = DEFAULT_MAX_COOLDOWN):
+        self._lock = Lock()
+        self.logger = logging.getLogger(__name__)
+        self.configure(failure_threshold, cooldown, max_cooldown)
+
+    def configure(self, failure_threshold: int, cooldown: float,
+                  max_cooldown: float = DEFAULT_MAX_COOLDOWN) -> None:
+        """Đặt lại tham số và đóng mạch; failure_threshold <= 0 nghĩa là tắt breaker"""
+        with self._lock:
+            self.failure_threshold = failure_threshold
+            self.base_cooldown = cooldown
+            self.max_cooldown = max(cooldown, max_cooldown)
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.current_cooldown = cooldown
+            self.open_until = 0.0
+            self.probe_in_flight = False
+            self.probe_id = 0
+            self.times_opened = 0
+            self.total_paused = 0.0
+
+    def before_request(self) -> float:
+        """Trả về số giây phải chờ trước khi được gửi request (0 = gửi được ngay)"""
+        return self._claim()[0]
+
+    def _claim(self) -> Tuple[float, Optional[int]]:
+        """Số giây phải chờ và mã lượt thăm dò nếu lần gọi này nhận lượt thăm dò của half-open (None nếu không)"""
+        with self._lock:
+            if self.state == CLOSED:
+                return 0.0, None
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now < self.open_until:
+                    return self.open_until - now, None
+                self.state = HALF_OPEN
+                self.probe_in_flight = False
+            # Half-open: chỉ một request thăm dò được đi, các worker khác chờ kết quả
+            if self.probe_in_flight:
+                return PROBE_POLL_INTERVAL, None
+            self.probe_in_flight = True
+            self.probe_id += 1
+            self.logger.info("🔌 Circuit breaker half-open: gửi một request thăm dò")
+            return 0.0, self.probe_id
+
+    def wait(self) -> Optional[int]:
+        """Chờ (đồng bộ) tới khi mạch cho phép gửi request. Trả về mã lượt thăm dò nếu request này là lượt thăm dò"""
+        waited = 0.0
+        delay, probe = self._claim()
+        while delay > 0:
+            time.sleep(delay)
+            waited += delay
+            delay, probe = self._claim()
+        self._add_paused(waited)
+        return probe
+
+    async def wait_async(self) -> Optional[int]:
+        """Phiên bản async của wait"""
+        waited = 0.0
+        delay, probe = self._claim()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            waited += delay
+            delay, probe = self._claim()
+        self._add_paused(waited)
+        return probe
+
+    def release_probe(self, probe: Optional[int]) -> None:
+        """Nhả lượt thăm dò `probe` nếu request đó kết thúc mà chưa báo kết quả (không làm gì nếu đã báo
+        hoặc lượt đó đã được thay bằng lượt khác)"""
+        if probe is None:
+            return
+        with self._lock:
+            if self.probe_in_flight and self.probe_id == probe:
+                self.probe_in_flight = False
+
+    def _add_paused(self, waited: float) -> None:
+        if waited > 0:
+            with self._lock:
+                self.total_paused += waited
+
+    def record_success(self) -> None:
+        """Upstream trả lời được (kể cả 4xx/429): reset bộ đếm, đóng mạch nếu đang thăm dò"""
+        with self._lock:
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                self.logger.info("✅ Circuit breaker đóng lại, Gemini API đã phục hồi")
+            self.state = CLOSED
+            self.current_cooldown = self.base_cooldown
+            self.probe_in_flight = False
+
+    def record_failure(self) -> None:
+        """Lỗi upstream (5xx, timeout, mất kết nối)"""
+        with self._lock:
+            if self.failure_threshold <= 0:
+                return
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN:
+                # Probe thất bại: mở lại với cooldown dài hơn
+                self.current_cooldown = min(self.current_cooldown * 2, self.max_cooldown)
+                self._open()
+            elif self.state == CLOSED and self.consecutive_failures >= self.failure_threshold:
+                self._open()
+
+    def record_neutral(self) -> None:
+        """Kết quả không nói lên tình trạng upstream; chỉ nhả lượt thăm dò nếu có"""
+        with self._lock:
+            self.probe_in_flight = False
+
+    def _open(self) -> None:
+        """Mở mạch (gọi khi đang giữ lock)"""
+        self.state = OPEN
+        self.open_until = time.monotonic() + self.current_cooldown
+        self.probe_in_flight = False
+        self.times_opened += 1
+        self.logger.warning(
+            f"⛔ Circuit breaker mở sau {self.consecutive_failures} lỗi upstream liên tiếp, "
+            f"tạm dừng mọi worker {self.current_cooldown:.0f}s"
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "times_opened": self.times_opened,
+                "total_paused": self.total_paused,
+                "consecutive_failures": self.consecutive_failures,
+            }
+
+
+# Breaker mặc định cho toàn process
+_circuit_breaker = CircuitBreaker()
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    """Trả về circuit breaker dùng chung của process"""
+    return _circuit_breaker
+
+
+def configure_circuit_breaker(failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                              cooldown: float = DEFAULT_COOLDOWN) -> CircuitBreaker:
+    """Cấu hình circuit breaker dùng chung"""
+    _circuit_breaker.configure(failure_threshold, cooldown)
+    return _circuit_breaker
+
+
+def format_breaker_stats(stats: Dict[str, Any]) -> str:
+    """Định dạng thống kê circuit breaker để ghi log"""
+    return (
+        f"Circuit breaker: trạng thái {stats['state']}, mở {stats['times_opened']} lần, "
+        f"tổng thời gian worker bị tạm dừng {stats['total_paused']:.1f}s"
+    )
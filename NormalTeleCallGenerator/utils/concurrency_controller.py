@@ -0,0 +1,225 @@
+"""
+Adaptive Concurrency Controller - Điều chỉnh số request đồng thời theo phản hồi 429 (AIMD)
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from typing import Dict, Any, List, Tuple
+from threading import Condition
+
+DEFAULT_INITIAL_LIMIT = 10
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 64
+DEFAULT_DECREASE_FACTOR = 0.5   # Giảm một nửa giới hạn khi bị 429
+DEFAULT_DECREASE_COOLDOWN = 5.0  # Gộp các 429 đến cùng lúc thành một lần giảm
+DEFAULT_INCREASE_AFTER = 10      # Số request thành công liên tiếp tối thiểu trước khi tăng
+
+
+class AdaptiveConcurrencyController:
+    """Giới hạn số request Gemini đang bay (in-flight) cho toàn process.
+
+    Additive increase: sau max(increase_after, limit) request thành công liên tiếp
+    thì tăng giới hạn thêm 1. Multiplicative decrease: mỗi đợt 429 nhân giới hạn
+    với decrease_factor. Mọi client dùng chung một controller nên backoff của một
+    agent lập tức áp dụng cho tất cả agent khác, và tự nới lỏng khi quota hồi phục.
+    """
+
+    def __init__(self, initial_limit: int = DEFAULT_INITIAL_LIMIT,
+                 min_limit: int = DEFAULT_MIN_LIMIT,
+                 max_limit: int = DEFAULT_MAX_LIMIT,
+                 decrease_factor: float = DEFAULT_DECREASE_FACTOR,
+                 decrease_cooldown: float = DEFAULT_DECREASE_COOLDOWN,
+                 increase_after: int = DEFAULT_INCREASE_AFTER,
+                 history_size: int = 200):
+        self._cond = Condition()
+        # Coroutine đang chờ slot (theo thứ tự đến), mỗi coroutine một future trên event loop của nó
+        self._async_waiters: deque = deque()
+        self.logger = logging.getLogger(__name__)
+        self.history: deque = deque(maxlen=history_size)
+        self.configure(initial_limit, min_limit, max_limit, decrease_factor,
+                       decrease_cooldown, increase_after)
+
+    def configure(self, initial_limit: int, min_limit: int = DEFAULT_MIN_LIMIT,
+                  max_limit: int = DEFAULT_MAX_LIMIT,
+                  decrease_factor: float = DEFAULT_DECREASE_FACTOR,
+                  decrease_cooldown: float = DEFAULT_DECREASE_COOLDOWN,
+                  increase_after: int = DEFAULT_INCREASE_AFTER) -> None:
+        """Đặt lại tham số và giới hạn ban đầu"""
+        with self._cond:
+            self.min_limit = max(1, min_limit)
+            self.max_limit = max(self.min_limit, max_limit)
+            self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+            self.decrease_factor = decrease_factor
+            self.decrease_cooldown = decrease_cooldown
+            self.increase_after = max(1, increase_after)
+            self.in_flight = 0
+            self.consecutive_successes = 0
+            self.last_decrease_at = 0.0
+            self.total_successes = 0
+            self.total_throttles = 0
+            self.history.clear()
+            self._record("init")
+            self._wake_async_waiters()
+            self._cond.notify_all()
+
+    @property
+    def current_limit(self) -> int:
+        return int(self.limit)
+
+    def _record(self, reason: str) -> None:
+        """Ghi một mốc thay đổi giới hạn (gọi khi đang giữ lock)"""
+        self.history.append({"time": time.time(), "limit": int(self.limit), "reason": reason})
+
+    def try_acquire(self) -> bool:
+        """Lấy một slot nếu còn trống, không chờ"""
+        with self._cond:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self) -> None:
+        """Chờ tới khi số request in-flight nhỏ hơn giới hạn hiện tại"""
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    async def acquire_async(self) -> None:
+        """Phiên bản async của acquire: chờ trên một future mà release() trao slot cho, không chặn event loop"""
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if not self._async_waiters and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return
+            waiter: Tuple[asyncio.AbstractEventLoop, asyncio.Future] = (loop, loop.create_future())
+            self._async_waiters.append(waiter)
+        future = waiter[1]
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._cond:
+                waiting = waiter in self._async_waiters
+                if waiting:
+                    self._async_waiters.remove(waiter)
+            # Slot đã được trao ngay trước khi bị huỷ: trả lại (future bị huỷ thì _grant_async tự trả)
+            if not waiting and future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def _wake_async_waiters(self) -> None:
+        """Trao slot trống cho các coroutine đang chờ theo thứ tự đến (gọi khi đang giữ lock)"""
+        while self._async_waiters and self.in_flight < int(self.limit):
+            loop, future = self._async_waiters.popleft()
+            self.in_flight += 1
+            try:
+                loop.call_soon_threadsafe(self._grant_async, future)
+            except RuntimeError:
+                # Event loop đã đóng: không còn ai nhận slot này
+                self.in_flight -= 1
+
+    def _grant_async(self, future: asyncio.Future) -> None:
+        """Chạy trên event loop của coroutine đang chờ: đánh thức nó, hoặc trả slot nếu nó đã bị huỷ"""
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            self._wake_async_waiters()
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        """Context manager giữ một slot in-flight trong lúc gửi request"""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def async_slot(self):
+        """Context manager async giữ một slot in-flight trong lúc gửi request"""
+        await self.acquire_async()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def on_success(self) -> None:
+        """Additive increase sau một chuỗi request thành công"""
+        with self._cond:
+            self.total_successes += 1
+            self.consecutive_successes += 1
+            if (self.consecutive_successes >= max(self.increase_after, int(self.limit))
+                    and self.limit < self.max_limit):
+                old_limit = int(self.limit)
+                self.limit = min(self.limit + 1, float(self.max_limit))
+                self.consecutive_successes = 0
+                self._record("increase")
+                self.logger.info(f"📈 AIMD: tăng giới hạn in-flight {old_limit} → {int(self.limit)}")
+                self._wake_async_waiters()
+                self._cond.notify_all()
+
+    def on_throttle(self) -> None:
+        """Multiplicative decrease khi nhận 429; các 429 trong cùng cooldown chỉ tính một lần"""
+        with self._cond:
+            self.total_throttles += 1
+            self.consecutive_successes = 0
+            now = time.monotonic()
+            if now - self.last_decrease_at < self.decrease_cooldown:
+                return
+            self.last_decrease_at = now
+            old_limit = int(self.limit)
+            self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+            self._record("429")
+            self.logger.warning(f"📉 AIMD: nhận 429, giảm giới hạn in-flight {old_limit} → {int(self.limit)}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "limit": int(self.limit),
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "in_flight": self.in_flight,
+                "successes": self.total_successes,
+                "throttles": self.total_throttles,
+                "history": list(self.history),
+            }
+
+
+# Controller mặc định cho toàn process
+_controller = AdaptiveConcurrencyController()
+
+
+def get_concurrency_controller() -> AdaptiveConcurrencyController:
+    """Trả về controller dùng chung của process"""
+    return _controller
+
+
+def configure_concurrency_controller(initial_limit: int, max_limit: int,
+                                     min_limit: int = DEFAULT_MIN_LIMIT) -> AdaptiveConcurrencyController:
+    """Cấu hình controller dùng chung, thường khởi đầu bằng số worker"""
+    _controller.configure(initial_limit, min_limit=min_limit, max_limit=max_limit)
+    _controller.logger.info(
+        f"🎚️ AIMD controller: giới hạn in-flight ban đầu {initial_limit} (min {min_limit}, max {max_limit})"
+    )
+    return _controller
+
+
+def format_concurrency_stats(stats: Dict[str, Any]) -> str:
+    """Định dạng giới hạn hiện tại và lịch sử thay đổi để ghi log"""
+    changes: List[str] = [
+        f"{time.strftime('%H:%M:%S', time.localtime(h['time']))}={h['limit']}({h['reason']})"
+        for h in stats["history"][-20:]
+    ]
+    return (
+        f"AIMD: giới hạn in-flight hiện tại {stats['limit']} (min {stats['min_limit']}, max {stats['max_limit']}), "
+        f"{stats['successes']} thành công, {stats['throttles']} lần 429; lịch sử: {', '.join(changes)}"
+    )
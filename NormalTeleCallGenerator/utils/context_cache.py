@@ -0,0 +1,215 @@
+"""
+Context Cache - Lưu system prompt tĩnh thành cachedContents phía server, các lượt sau chỉ gửi tên cache
+"""
+
+import hashlib
+import logging
+import time
+from typing import Dict, Any, List, NamedTuple, Optional, Tuple
+from threading import Lock
+
+DEFAULT_CACHE_TTL = 600           # Thời gian sống (giây) của một cache entry trên server
+DEFAULT_MIN_TOKENS = 1024         # Prompt ngắn hơn mức này không đáng (và thường không được phép) cache
+DEFAULT_MIN_USES = 2              # Chỉ tạo cache khi prompt xuất hiện lần thứ N (bỏ qua prompt dùng một lần)
+REFRESH_FRACTION = 0.25           # Gia hạn TTL khi thời gian sống còn lại dưới tỷ lệ này
+EXPIRY_MARGIN = 5.0               # Coi như đã hết hạn sớm hơn vài giây để tránh gửi tên cache vừa hết hạn
+CREATE_RETRY_DELAY = 60.0         # Sau lỗi tạm thời khi tạo cache, chờ bấy nhiêu giây mới thử tạo lại
+
+# Hành động client cần làm trước khi gửi một request
+USE = "use"            # Gửi tên cache thay cho systemInstruction
+CREATE = "create"      # Tạo cache (caller đã giữ quyền tạo), thành công thì dùng luôn
+REFRESH = "refresh"    # Gia hạn TTL (caller đã giữ quyền gia hạn) rồi dùng cache
+SKIP = "skip"          # Gửi nguyên systemInstruction
+
+
+class CachePlan(NamedTuple):
+    """Quyết định của cache manager cho một lần gửi"""
+    action: str
+    key: Optional[str] = None
+    name: Optional[str] = None
+
+
+class CacheEntry:
+    """Trạng thái cache của một (API key, model, system prompt)"""
+
+    def __init__(self):
+        self.uses = 0
+        self.name: Optional[str] = None
+        self.expire_at = 0.0
+        self.pending = False          # Đang có một request tạo hoặc gia hạn cache
+        self.unsupported = False      # Server từ chối cache prompt này (quá ngắn, model không hỗ trợ...)
+        self.retry_at = 0.0
+
+
+class ContextCacheManager:
+    """Quản lý cachedContents dùng chung cho toàn process.
+
+    Mỗi system prompt khác nhau (theo API key và model, vì cache thuộc về project
+    của key đã tạo) có tối đa một cache trên server. Request đầu tiên thấy prompt
+    đủ lần dùng sẽ tạo cache; trong lúc tạo hoặc khi server từ chối, các request
+    khác vẫn gửi nguyên systemInstruction nên không request nào phải chờ cache.
+    """
+
+    def __init__(self, enabled: bool = False, ttl: int = DEFAULT_CACHE_TTL,
+                 min_tokens: int = DEFAULT_MIN_TOKENS, min_uses: int = DEFAULT_MIN_USES):
+        self._lock = Lock()
+        self.logger = logging.getLogger(__name__)
+        self.configure(enabled, ttl, min_tokens, min_uses)
+
+    def configure(self, enabled: bool, ttl: int = DEFAULT_CACHE_TTL,
+                  min_tokens: int = DEFAULT_MIN_TOKENS, min_uses: int = DEFAULT_MIN_USES) -> None:
+        """Đặt lại tham số; các cache đã tạo trước đó bị quên (server tự xoá khi hết TTL)"""
+        with self._lock:
+            self.enabled = enabled and ttl > 0
+            self.ttl = ttl
+            self.min_tokens = min_tokens
+            self.min_uses = max(1, min_uses)
+            self._entries: Dict[str, CacheEntry] = {}
+            self._owners: Dict[str, Tuple[str, str]] = {}
+            self.hits = 0
+            self.created = 0
+            self.refreshed = 0
+            self.create_failures = 0
+            self.invalidated = 0
+            self.prompt_tokens = 0
+            self.cached_tokens = 0
+
+    @property
+    def ttl_param(self) -> str:
+        """TTL theo định dạng Duration JSON của Google API"""
+        return f"{self.ttl}s"
+
+    @staticmethod
+    def cache_key(api_key: str, model: str, system_text: str) -> str:
+        digest = hashlib.sha256(system_text.encode("utf-8")).hexdigest()
+        return f"{api_key}|{model}|{digest}"
+
+    def plan(self, api_key: str, model: str, system_text: str, estimated_tokens: int) -> CachePlan:
+        """Quyết định dùng, tạo, gia hạn hay bỏ qua cache cho system prompt này"""
+        if not self.enabled or estimated_tokens < self.min_tokens:
+            return CachePlan(SKIP)
+        key = self.cache_key(api_key, model, system_text)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.setdefault(key, CacheEntry())
+            entry.uses += 1
+            if entry.unsupported or entry.pending:
+                return CachePlan(SKIP)
+            if entry.name is not None and entry.expire_at - EXPIRY_MARGIN > now:
+                self.hits += 1
+                if entry.expire_at - now < self.ttl * REFRESH_FRACTION + EXPIRY_MARGIN:
+                    entry.pending = True
+                    return CachePlan(REFRESH, key, entry.name)
+                return CachePlan(USE, key, entry.name)
+            if entry.uses < self.min_uses or entry.retry_at > now:
+                return CachePlan(SKIP)
+            # Cache chưa có hoặc đã hết hạn: request này giữ quyền tạo
+            entry.name = None
+            entry.pending = True
+            self._owners[key] = (api_key, model)
+            return CachePlan(CREATE, key)
+
+    def on_created(self, key: str, name: str) -> None:
+        with self._lock:
+            entry = self._entries[key]
+            entry.name = name
+            entry.expire_at = time.monotonic() + self.ttl
+            entry.pending = False
+            self.created += 1
+        self.logger.info(f"🗄️ Tạo context cache {name} (TTL {self.ttl}s)")
+
+    def on_refreshed(self, key: str, ok: bool) -> None:
+        """Kết thúc gia hạn; thất bại thì quên cache để lần sau tạo lại"""
+        with self._lock:
+            entry = self._entries[key]
+            entry.pending = False
+            if ok:
+                entry.expire_at = time.monotonic() + self.ttl
+                self.refreshed += 1
+            else:
+                entry.name = None
+
+    def on_create_failed(self, key: str, permanent: bool, reason: str = "") -> None:
+        """Tạo cache thất bại: lỗi vĩnh viễn thì không thử lại prompt này nữa, lỗi tạm thời thì thử lại sau"""
+        with self._lock:
+            entry = self._entries[key]
+            entry.pending = False
+            entry.unsupported = permanent
+            entry.retry_at = time.monotonic() + CREATE_RETRY_DELAY
+            self.create_failures += 1
+        log = self.logger.info if permanent else self.logger.warning
+        log(f"🗄️ Không tạo được context cache{' (gửi nguyên system prompt)' if permanent else ''}: {reason}")
+
+    def invalidate(self, key: str) -> None:
+        """Server không còn nhận tên cache (hết hạn sớm, bị xoá): lần gửi sau dùng systemInstruction"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.name is None:
+                return
+            self.logger.warning(f"🗄️ Context cache {entry.name} không còn hợp lệ, gửi lại với system prompt đầy đủ")
+            entry.name = None
+            entry.retry_at = time.monotonic() + CREATE_RETRY_DELAY
+            self.invalidated += 1
+
+    def record_usage(self, usage: Dict[str, Any]) -> None:
+        """Cộng dồn promptTokenCount và cachedContentTokenCount từ usageMetadata"""
+        with self._lock:
+            self.prompt_tokens += int(usage.get("promptTokenCount") or 0)
+            self.cached_tokens += int(usage.get("cachedContentTokenCount") or 0)
+
+    def drain(self) -> List[Tuple[str, str]]:
+        """Lấy (api_key, tên cache) của mọi cache còn sống để xoá khi kết thúc lượt chạy"""
+        now = time.monotonic()
+        with self._lock:
+            live = [(self._owners[key][0], entry.name) for key, entry in self._entries.items()
+                    if entry.name is not None and entry.expire_at > now and key in self._owners]
+            for entry in self._entries.values():
+                entry.name = None
+            return live
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "ttl": self.ttl,
+                "prompts": len(self._entries),
+                "created": self.created,
+                "refreshed": self.refreshed,
+                "hits": self.hits,
+                "create_failures": self.create_failures,
+                "invalidated": self.invalidated,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+            }
+
+
+# Cache manager mặc định cho toàn process (tắt)
+_context_cache = ContextCacheManager()
+
+
+def get_context_cache() -> ContextCacheManager:
+    """Trả về context cache manager dùng chung của process"""
+    return _context_cache
+
+
+def configure_context_cache(enabled: bool, ttl: int = DEFAULT_CACHE_TTL, min_tokens: int = DEFAULT_MIN_TOKENS,
+                            min_uses: int = DEFAULT_MIN_USES) -> ContextCacheManager:
+    """Cấu hình context cache dùng chung từ tham số dòng lệnh"""
+    _context_cache.configure(enabled, ttl, min_tokens, min_uses)
+    if _context_cache.enabled:
+        _context_cache.logger.info(
+            f"🗄️ Context cache: TTL {ttl}s, cache system prompt từ {min_tokens} tokens, sau {min_uses} lần dùng"
+        )
+    return _context_cache
+
+
+def format_context_cache_stats(stats: Dict[str, Any]) -> str:
+    """Định dạng thống kê context cache để ghi log"""
+    if not stats["enabled"]:
+        return "Context cache: tắt"
+    share = stats["cached_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0
+    return (
+        f"Context cache: {stats['created']} cache cho {stats['prompts']} system prompt, {stats['hits']} request dùng cache, "
+        f"{stats['refreshed']} lần gia hạn, {stats['create_failures']} lần tạo lỗi, {stats['invalidated']} cache mất hiệu lực; "
+        f"{stats['cached_tokens']}/{stats['prompt_tokens']} input tokens lấy từ cache ({share:.0%})"
+    )
@@ -0,0 +1,188 @@
+"""
+HTTP Session Pool - Dùng chung kết nối keep-alive cho toàn bộ process
+"""
+
+import asyncio
+import logging
+from typing import Dict, Any, Tuple
+from threading import Lock
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 10
+
+
+class HTTPSessionPool:
+    """Quản lý một requests.Session cho mỗi endpoint, dùng chung giữa mọi GeminiClient"""
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE):
+        self.pool_size = max(1, int(pool_size))
+        self._sessions: Dict[str, requests.Session] = {}
+        self._adapters: Dict[str, HTTPAdapter] = {}
+        # Session aiohttp gắn với event loop tạo ra nó nên khoá theo (loop, endpoint)
+        self._async_sessions: Dict[Tuple[int, str], Any] = {}
+        self._async_counters: Dict[str, Dict[str, int]] = {}
+        self._lock = Lock()
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def _endpoint_key(url: str) -> str:
+        """Chuẩn hoá URL về dạng scheme://host[:port] để làm khoá session"""
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def get_session(self, url: str) -> requests.Session:
+        """Lấy (hoặc tạo mới) session keep-alive cho endpoint của URL"""
+        key = self._endpoint_key(url)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                # pool_maxsize khớp số worker để mỗi luồng giữ được một kết nối riêng
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=self.pool_size,
+                    pool_block=False,
+                )
+                session = requests.Session()
+                session.headers.update({"Connection": "keep-alive"})
+                session.mount(f"{key}/", adapter)
+                self._sessions[key] = session
+                self._adapters[key] = adapter
+                self.logger.info(f"🔗 Tạo HTTP session keep-alive cho {key} (pool_size={self.pool_size})")
+            return session
+
+    def _async_trace_config(self, key: str):
+        """Đếm request và kết nối mới của aiohttp để tính tỷ lệ tái sử dụng"""
+        import aiohttp
+
+        counters = self._async_counters.setdefault(key, {"requests": 0, "new_connections": 0})
+
+        async def on_request_start(session, context, params):
+            counters["requests"] += 1
+
+        async def on_connection_create_end(session, context, params):
+            counters["new_connections"] += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        return trace_config
+
+    def get_async_session(self, url: str):
+        """Lấy (hoặc tạo mới) aiohttp.ClientSession keep-alive cho endpoint trên event loop hiện tại"""
+        try:
+            import aiohttp
+        except ImportError as e:
+            raise ImportError("Chế độ async cần thư viện aiohttp: pip install aiohttp") from e
+
+        key = self._endpoint_key(url)
+        loop_key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            session = self._async_sessions.get(loop_key)
+            if session is None or session.closed:
+                connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+                session = aiohttp.ClientSession(
+                    connector=connector,
+                    trace_configs=[self._async_trace_config(key)],
+                )
+                self._async_sessions[loop_key] = session
+                self.logger.info(f"🔗 Tạo aiohttp session keep-alive cho {key} (pool_size={self.pool_size})")
+            return session
+
+    async def close_async_sessions(self) -> None:
+        """Đóng các aiohttp session thuộc event loop hiện tại (gọi trước khi loop kết thúc)"""
+        loop_id = id(asyncio.get_running_loop())
+        with self._lock:
+            keys = [k for k in self._async_sessions if k[0] == loop_id]
+            sessions = [self._async_sessions.pop(k) for k in keys]
+        for session in sessions:
+            await session.close()
+
+    def resize(self, pool_size: int) -> None:
+        """Đổi kích thước pool; các session cũ được đóng và tạo lại khi cần"""
+        with self._lock:
+            self.pool_size = max(1, int(pool_size))
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._adapters.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê số request và số kết nối mới, từ đó suy ra số lần tái sử dụng kết nối"""
+        total_requests = 0
+        total_connections = 0
+        endpoints = {}
+        with self._lock:
+            for key, adapter in self._adapters.items():
+                requests_count = 0
+                connections_count = 0
+                pools = adapter.poolmanager.pools
+                for pool_key in list(pools.keys()):
+                    pool = pools.get(pool_key)
+                    if pool is None:
+                        continue
+                    requests_count += pool.num_requests
+                    connections_count += pool.num_connections
+                endpoints[key] = {
+                    "requests": requests_count,
+                    "new_connections": connections_count,
+                    "reused": max(0, requests_count - connections_count),
+                }
+                total_requests += requests_count
+                total_connections += connections_count
+            for key, counters in self._async_counters.items():
+                entry = endpoints.setdefault(key, {"requests": 0, "new_connections": 0, "reused": 0})
+                entry["requests"] += counters["requests"]
+                entry["new_connections"] += counters["new_connections"]
+                entry["reused"] = max(0, entry["requests"] - entry["new_connections"])
+                total_requests += counters["requests"]
+                total_connections += counters["new_connections"]
+
+        reused = max(0, total_requests - total_connections)
+        return {
+            "pool_size": self.pool_size,
+            "requests": total_requests,
+            "new_connections": total_connections,
+            "reused": reused,
+            "reuse_ratio": reused / total_requests if total_requests else 0.0,
+            "endpoints": endpoints,
+        }
+
+    def close(self) -> None:
+        """Đóng toàn bộ session"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._adapters.clear()
+
+
+# Pool mặc định cho toàn process
+_session_pool = HTTPSessionPool()
+
+
+def get_session_pool() -> HTTPSessionPool:
+    """Trả về pool dùng chung của process"""
+    return _session_pool
+
+
+def configure_session_pool(pool_size: int) -> HTTPSessionPool:
+    """Cấu hình kích thước pool (thường bằng --workers) trước khi sinh hội thoại"""
+    if pool_size != _session_pool.pool_size:
+        _session_pool.resize(pool_size)
+    return _session_pool
+
+
+async def close_async_sessions() -> None:
+    """Đóng các aiohttp session của event loop hiện tại trong pool dùng chung"""
+    await _session_pool.close_async_sessions()
+
+
+def format_pool_stats(stats: Dict[str, Any]) -> str:
+    """Định dạng thống kê pool để ghi log"""
+    return (
+        f"HTTP pool: {stats['requests']} requests, {stats['new_connections']} kết nối mới, "
+        f"tái sử dụng {stats['reused']} lần ({stats['reuse_ratio'] * 100:.1f}%)"
+    )
@@ -0,0 +1,548 @@
+"""
+Mock Gemini Server - HTTP server giả lập endpoint generateContent để đo thông lượng mà không tốn quota
+
+Chạy độc lập:
+    python -m utils.mock_gemini_server --port 8080 --latency_ms 800 --rate_429 0.05
+rồi trỏ client vào server:
+    python generate_dialogues.py --api_key test --base_url http://127.0.0.1:8080/v1beta ...
+"""
+
+import argparse
+import json
+import logging
+import math
+import random
+import time
+from collections import Counter, deque
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Any, Deque, Dict, List, Optional
+
+ENDCALL_SIGNAL = "##ENDCALL_SIGNAL##"
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal")
+CHARS_PER_TOKEN = 3.0
+
+# Câu trả lời mẫu cho các lượt hội thoại thông thường
+CANNED_REPLIES: List[str] = [
+    "Alo, vâng tôi nghe đây, anh chị gọi cho tôi có việc gì vậy ạ?",
+    "Dạ em chào anh, em gọi từ bộ phận chăm sóc khách hàng của ngân hàng ạ.",
+    "Tài khoản của anh đang có giao dịch bất thường, em cần xác minh lại thông tin.",
+    "Ủa, sao tôi không nhận được tin nhắn nào từ ngân hàng hết vậy?",
+    "Anh vui lòng đọc giúp em mã OTP vừa gửi về điện thoại để hoàn tất xác minh.",
+    "Khoan đã, ngân hàng đâu có bao giờ hỏi mã OTP qua điện thoại đâu em.",
+    "Dạ đây là quy trình bắt buộc, nếu không tài khoản sẽ bị khoá trong hôm nay.",
+    "Để tôi gọi lên tổng đài chính thức kiểm tra lại rồi tính sau nha.",
+    "Chị ơi, đơn hàng của chị đang bị giữ ở kho, chị cần thanh toán phí lưu kho ạ.",
+    "Tôi đang bận chút, lát nữa tôi gọi lại được không?",
+    "Dạ vâng, em cảm ơn chị, chúc chị một ngày tốt lành.",
+    "Cháu nghe rồi, nhưng mà cháu phải hỏi lại con trai cô đã nhé.",
+]
+
+# Câu ngắn dùng khi cần kết thúc cuộc gọi hoặc điền lý do vào JSON
+CLOSING_REPLIES: List[str] = [
+    "Thôi tôi không nói chuyện nữa đâu, chào anh.",
+    "Dạ vâng, vậy em xin phép cúp máy ạ.",
+    "Tôi sẽ báo công an số điện thoại này, tạm biệt.",
+]
+REASONS: List[str] = [
+    "Người nghe đã nhận ra dấu hiệu lừa đảo và từ chối cung cấp thông tin.",
+    "Cuộc gọi đã đạt mục đích, hai bên chào nhau tự nhiên.",
+    "Hội thoại còn tiếp diễn, chưa có dấu hiệu kết thúc.",
+    "Một bên chủ động ngắt máy vì nghi ngờ.",
+]
+
+
+class MockGeminiConfig:
+    """Tham số giả lập: độ trễ, tỷ lệ lỗi, quota và tỷ lệ ngắt máy"""
+
+    def __init__(self, latency_ms: float = 500.0, latency_jitter_ms: float = 200.0,
+                 latency_dist: str = "lognormal", rate_429: float = 0.0, rate_5xx: float = 0.0,
+                 retry_after: float = 0.0, rpm: int = 0, endcall_rate: float = 0.1,
+                 terminate_rate: float = 0.2, api_keys: Optional[List[str]] = None,
+                 seed: Optional[int] = None, prefill_ms_per_1k: float = 0.0, cache_min_tokens: int = 1024,
+                 reply_sentences: int = 1, decode_ms_per_1k: float = 0.0):
+        if latency_dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"latency_dist phải thuộc {LATENCY_DISTRIBUTIONS}")
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.latency_dist = latency_dist
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.retry_after = retry_after
+        self.rpm = rpm
+        self.endcall_rate = endcall_rate
+        self.terminate_rate = terminate_rate
+        self.api_keys = set(api_keys) if api_keys else None
+        self.seed = seed
+        self.prefill_ms_per_1k = prefill_ms_per_1k
+        self.cache_min_tokens = cache_min_tokens
+        self.reply_sentences = max(1, reply_sentences)
+        self.decode_ms_per_1k = decode_ms_per_1k
+
+
+class MockGeminiState:
+    """Trạng thái dùng chung giữa các luồng xử lý request: RNG, cửa sổ quota và thống kê"""
+
+    def __init__(self, cfg: MockGeminiConfig):
+        self.cfg = cfg
+        self.random = random.Random(cfg.seed)
+        self._lock = Lock()
+        self._windows: Dict[str, Deque[float]] = {}
+        self.status_counts: Counter = Counter()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.cached_tokens = 0
+        self.caches: Dict[str, Dict[str, Any]] = {}
+        self.caches_created = 0
+        self.started_at = time.monotonic()
+
+    def draw(self, fn: str, *args):
+        """Gọi hàm của RNG dùng chung dưới lock để kết quả tái lập được theo seed"""
+        with self._lock:
+            return getattr(self.random, fn)(*args)
+
+    def latency(self) -> float:
+        """Độ trễ (giây) của một response theo phân phối cấu hình"""
+        cfg = self.cfg
+        mean, jitter = cfg.latency_ms, cfg.latency_jitter_ms
+        if cfg.latency_dist == "fixed" or mean <= 0:
+            value = mean
+        elif cfg.latency_dist == "uniform":
+            value = self.draw("uniform", mean - jitter, mean + jitter)
+        elif cfg.latency_dist == "normal":
+            value = self.draw("gauss", mean, jitter)
+        else:
+            # lognormal có đuôi dài như latency thật; mean/jitter là trung bình/độ lệch chuẩn mong muốn
+            sigma2 = math.log(1 + (jitter / mean) ** 2)
+            value = self.draw("lognormvariate", math.log(mean) - sigma2 / 2, math.sqrt(sigma2))
+        return max(0.0, value) / 1000.0
+
+    def over_quota(self, api_key: str) -> bool:
+        """Cửa sổ trượt 60 giây cho từng API key: True nếu request này vượt --rpm của key"""
+        if self.cfg.rpm <= 0:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.setdefault(api_key, deque())
+            while window and now - window[0] >= 60:
+                window.popleft()
+            if len(window) >= self.cfg.rpm:
+                return True
+            window.append(now)
+            return False
+
+    def prefill_latency(self, uncached_tokens: int) -> float:
+        """Thời gian xử lý phần input chưa có trong cache (giây), tỷ lệ với số token"""
+        return self.cfg.prefill_ms_per_1k * uncached_tokens / 1000.0 / 1000.0
+
+    def decode_latency(self, output_tokens: int) -> float:
+        """Thời gian sinh phần output (giây), tỷ lệ với số token trả về"""
+        return self.cfg.decode_ms_per_1k * output_tokens / 1000.0 / 1000.0
+
+    def create_cache(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Lưu một cachedContents, trả về resource như API thật"""
+        tokens = count_tokens(request_text(body))
+        ttl = parse_duration(body.get("ttl")) or 3600.0
+        with self._lock:
+            name = f"cachedContents/{self.random.getrandbits(64):016x}"
+            self.caches[name] = {
+                "model": body.get("model", ""),
+                "systemInstruction": body.get("systemInstruction"),
+                "contents": body.get("contents") or [],
+                "tokens": tokens,
+                "expire_at": time.monotonic() + ttl,
+            }
+            self.caches_created += 1
+        return cache_resource(name, body.get("model", ""), tokens, ttl)
+
+    def get_cache(self, name: str) -> Optional[Dict[str, Any]]:
+        """Cache còn sống theo tên, None nếu không có hoặc đã hết hạn"""
+        with self._lock:
+            cache = self.caches.get(name)
+            if cache is not None and cache["expire_at"] <= time.monotonic():
+                del self.caches[name]
+                cache = None
+            return cache
+
+    def update_cache_ttl(self, name: str, ttl: float) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            cache = self.caches.get(name)
+            if cache is None or cache["expire_at"] <= time.monotonic():
+                return None
+            cache["expire_at"] = time.monotonic() + ttl
+            return cache_resource(name, cache["model"], cache["tokens"], ttl)
+
+    def delete_cache(self, name: str) -> bool:
+        with self._lock:
+            return self.caches.pop(name, None) is not None
+
+    def record(self, status: int, prompt_tokens: int = 0, output_tokens: int = 0, cached_tokens: int = 0) -> None:
+        with self._lock:
+            self.requests += 1
+            self.status_counts[status] += 1
+            self.prompt_tokens += prompt_tokens
+            self.output_tokens += output_tokens
+            self.cached_tokens += cached_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = time.monotonic() - self.started_at
+            return {
+                "requests": self.requests,
+                "status": dict(self.status_counts),
+                "prompt_tokens": self.prompt_tokens,
+                "output_tokens": self.output_tokens,
+                "cached_tokens": self.cached_tokens,
+                "caches_created": self.caches_created,
+                "elapsed": elapsed,
+                "rps": self.requests / elapsed if elapsed > 0 else 0.0,
+            }
+
+
+def count_tokens(text: str) -> int:
+    """Số token giả lập cho usageMetadata"""
+    return max(1, math.ceil(len(text) / CHARS_PER_TOKEN)) if text else 0
+
+
+def request_text(body: Dict[str, Any]) -> str:
+    """Ghép toàn bộ text trong systemInstruction và contents để đếm token"""
+    parts = list((body.get("systemInstruction") or {}).get("parts") or [])
+    for content in body.get("contents") or []:
+        parts.extend(content.get("parts") or [])
+    return "\n".join(str(p.get("text", "")) for p in parts if isinstance(p, dict))
+
+
+def parse_duration(value: Any) -> Optional[float]:
+    """Duration JSON dạng "600s" -> số giây"""
+    text = str(value or "").strip()
+    if not text.endswith("s"):
+        return None
+    try:
+        return float(text[:-1])
+    except ValueError:
+        return None
+
+
+def cache_resource(name: str, model: str, tokens: int, ttl: float) -> Dict[str, Any]:
+    """Resource cachedContents trả về cho client (không kèm nội dung đã cache)"""
+    return {
+        "name": name,
+        "model": model,
+        "expireTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + ttl)),
+        "usageMetadata": {"totalTokenCount": tokens},
+    }
+
+
+def fill_schema(schema: Dict[str, Any], state: MockGeminiState, name: str = "") -> Any:
+    """Sinh giá trị ngẫu nhiên khớp responseSchema (tập con OpenAPI mà Gemini hỗ trợ)"""
+    kind = str(schema.get("type", "STRING")).upper()
+    if "enum" in schema:
+        return state.draw("choice", list(schema["enum"]))
+    if kind == "OBJECT":
+        props = schema.get("properties") or {}
+        order = schema.get("propertyOrdering") or list(props)
+        return {key: fill_schema(props[key], state, key) for key in order if key in props}
+    if kind == "ARRAY":
+        low = int(schema.get("minItems", 1))
+        high = max(low, int(schema.get("maxItems", max(low, 3))))
+        return [fill_schema(schema.get("items") or {}, state, name)
+                for _ in range(state.draw("randint", low, high))]
+    if kind == "BOOLEAN":
+        return state.draw("random") < state.cfg.terminate_rate
+    if kind == "INTEGER":
+        return state.draw("randint", 0, 10)
+    if kind == "NUMBER":
+        return round(state.draw("random"), 3)
+    if name == "content":
+        # Câu thoại trong kịch bản (chế độ kịch bản sinh cả hội thoại bằng một request)
+        return " ".join(state.draw("choice", CANNED_REPLIES) for _ in range(state.cfg.reply_sentences))
+    return state.draw("choice", REASONS)
+
+
+def generate_text(body: Dict[str, Any], state: MockGeminiState) -> str:
+    """Nội dung trả về: JSON khớp schema khi có structured output, ngược lại là reply_sentences câu tiếng Việt"""
+    generation_config = body.get("generationConfig") or {}
+    schema = generation_config.get("responseSchema")
+    if schema:
+        return json.dumps(fill_schema(schema, state), ensure_ascii=False)
+    if generation_config.get("responseMimeType") == "application/json":
+        return json.dumps({"reason": state.draw("choice", REASONS)}, ensure_ascii=False)
+    if state.draw("random") < state.cfg.endcall_rate:
+        return f"{state.draw('choice', CLOSING_REPLIES)} {ENDCALL_SIGNAL}"
+    return " ".join(state.draw("choice", CANNED_REPLIES) for _ in range(state.cfg.reply_sentences))
+
+
+def error_body(code: int, status: str, message: str, retry_delay: Optional[float] = None) -> Dict[str, Any]:
+    """Body lỗi theo định dạng google.rpc.Status của Google API"""
+    error: Dict[str, Any] = {"code": code, "message": message, "status": status}
+    if retry_delay:
+        error["details"] = [{
+            "@type": "type.googleapis.com/google.rpc.RetryInfo",
+            "retryDelay": f"{retry_delay:g}s",
+        }]
+    return {"error": error}
+
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+    """Xử lý POST .../models/{model}:generateContent, CRUD .../cachedContents và GET /stats"""
+
+    protocol_version = "HTTP/1.1"  # keep-alive để đo được hiệu quả của connection pool
+    server: "MockGeminiHTTPServer"
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format % args)
+
+    def _send_json(self, status: int, payload: Dict[str, Any],
+                   headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorize(self, query: str) -> Optional[str]:
+        """API key của request; sai key thì trả 403 và về None"""
+        state = self.server.state
+        params = dict(p.split("=", 1) for p in query.split("&") if "=" in p)
+        api_key = params.get("key", "")
+        if state.cfg.api_keys is not None and api_key not in state.cfg.api_keys:
+            state.record(403)
+            self._send_json(403, error_body(403, "PERMISSION_DENIED", "API key not valid. Please pass a valid API key."))
+            return None
+        return api_key
+
+    def _read_body(self) -> Optional[Dict[str, Any]]:
+        """Body JSON của request; JSON sai thì trả 400 và về None"""
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(raw.decode("utf-8") or "{}")
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            self.server.state.record(400)
+            self._send_json(400, error_body(400, "INVALID_ARGUMENT", f"Invalid JSON payload: {e}"))
+            return None
+
+    @staticmethod
+    def _cache_name(path: str) -> Optional[str]:
+        """Tên resource "cachedContents/{id}" trong path, None nếu path không trỏ tới một cache"""
+        marker = "/cachedContents/"
+        if marker not in path:
+            return None
+        return "cachedContents/" + path.split(marker, 1)[1].strip("/")
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.server.state.stats())
+        else:
+            self._send_json(404, error_body(404, "NOT_FOUND", f"Unknown path {self.path}"))
+
+    def do_PATCH(self):
+        """Gia hạn TTL của một cachedContents (updateMask=ttl)"""
+        path, _, query = self.path.partition("?")
+        body = self._read_body()
+        if body is None or self._authorize(query) is None:
+            return
+        name = self._cache_name(path)
+        resource = self.server.state.update_cache_ttl(name, parse_duration(body.get("ttl")) or 3600.0) if name else None
+        if resource is None:
+            self._send_json(404, error_body(404, "NOT_FOUND", f"CachedContent not found: {name}"))
+        else:
+            self._send_json(200, resource)
+
+    def do_DELETE(self):
+        path, _, query = self.path.partition("?")
+        if self._authorize(query) is None:
+            return
+        name = self._cache_name(path)
+        if name and self.server.state.delete_cache(name):
+            self._send_json(200, {})
+        else:
+            self._send_json(404, error_body(404, "NOT_FOUND", f"CachedContent not found: {name}"))
+
+    def do_POST(self):
+        state = self.server.state
+        cfg = state.cfg
+        path, _, query = self.path.partition("?")
+        body = self._read_body()
+        if body is None:
+            return
+
+        if path.rstrip("/").endswith("/cachedContents"):
+            self._create_cache(body, query)
+            return
+        if not path.endswith(":generateContent"):
+            state.record(404)
+            self._send_json(404, error_body(404, "NOT_FOUND", f"Unknown path {path}"))
+            return
+        api_key = self._authorize(query)
+        if api_key is None:
+            return
+
+        # Phần input nằm trong cachedContents không phải xử lý lại, chỉ tính prefill cho phần còn lại
+        cached_tokens = 0
+        cache_name = body.get("cachedContent")
+        if cache_name:
+            cache = state.get_cache(cache_name)
+            if cache is None:
+                state.record(404)
+                self._send_json(404, error_body(404, "NOT_FOUND", f"CachedContent not found (or permission denied): {cache_name}"))
+                return
+            if body.get("systemInstruction"):
+                state.record(400)
+                self._send_json(400, error_body(400, "INVALID_ARGUMENT",
+                                                "CachedContent can not be used with GenerateContent request setting system_instruction"))
+                return
+            cached_tokens = cache["tokens"]
+        uncached_tokens = count_tokens(request_text(body))
+
+        time.sleep(state.latency() + state.prefill_latency(uncached_tokens))
+
+        retry_headers = {"Retry-After": f"{cfg.retry_after:g}"} if cfg.retry_after > 0 else {}
+        if state.over_quota(api_key) or state.draw("random") < cfg.rate_429:
+            state.record(429)
+            self._send_json(429, error_body(429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota).",
+                                            retry_delay=cfg.retry_after or None))
+            return
+        if state.draw("random") < cfg.rate_5xx:
+            status = state.draw("choice", [500, 503])
+            if status == 503:
+                state.record(503)
+                self._send_json(503, error_body(503, "UNAVAILABLE", "The model is overloaded. Please try again later."),
+                                headers=retry_headers)
+            else:
+                state.record(500)
+                self._send_json(500, error_body(500, "INTERNAL", "An internal error has occurred."))
+            return
+
+        # candidateCount: mỗi candidate sinh độc lập, prompt chỉ tính tokens một lần như API thật
+        count = max(1, int((body.get("generationConfig") or {}).get("candidateCount") or 1))
+        texts = [generate_text(body, state) for _ in range(count)]
+        prompt_tokens = uncached_tokens + cached_tokens
+        output_tokens = sum(count_tokens(text) for text in texts)
+        time.sleep(state.decode_latency(output_tokens))
+        state.record(200, prompt_tokens, output_tokens, cached_tokens)
+        usage = {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens,
+        }
+        if cached_tokens:
+            usage["cachedContentTokenCount"] = cached_tokens
+        self._send_json(200, {
+            "candidates": [{
+                "content": {"role": "model", "parts": [{"text": text}]},
+                "finishReason": "STOP",
+                "index": index,
+            } for index, text in enumerate(texts)],
+            "usageMetadata": usage,
+            "modelVersion": path.rsplit("/", 1)[-1].split(":", 1)[0],
+        }, headers={"Date": formatdate(usegmt=True)})
+
+    def _create_cache(self, body: Dict[str, Any], query: str) -> None:
+        """POST .../cachedContents: từ chối nội dung ngắn hơn --cache_min_tokens như API thật"""
+        state = self.server.state
+        if self._authorize(query) is None:
+            return
+        tokens = count_tokens(request_text(body))
+        if tokens < state.cfg.cache_min_tokens:
+            self._send_json(400, error_body(
+                400, "INVALID_ARGUMENT",
+                f"Cached content is too small. total_token_count={tokens}, min_total_token_count={state.cfg.cache_min_tokens}"))
+            return
+        self._send_json(200, state.create_cache(body))
+
+
+class MockGeminiHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, state: MockGeminiState):
+        super().__init__(address, MockGeminiHandler)
+        self.state = state
+
+
+class MockGeminiServer:
+    """Chạy mock server trong một luồng nền (dùng cho benchmark/smoke test trong cùng process)"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, cfg: Optional[MockGeminiConfig] = None):
+        self.state = MockGeminiState(cfg or MockGeminiConfig())
+        self.httpd = MockGeminiHTTPServer((host, port), self.state)
+        self._thread: Optional[Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        """Giá trị dùng cho --base_url / GeminiClient(base_url=...)"""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1beta"
+
+    def start(self) -> "MockGeminiServer":
+        self._thread = Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "MockGeminiServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def format_mock_stats(stats: Dict[str, Any]) -> str:
+    """Định dạng thống kê mock server để ghi log"""
+    return (
+        f"Mock Gemini: {stats['requests']} requests trong {stats['elapsed']:.1f}s ({stats['rps']:.1f} req/s), "
+        f"status {stats['status']}, tokens vào/ra {stats['prompt_tokens']}/{stats['output_tokens']} "
+        f"({stats['cached_tokens']} tokens vào từ {stats['caches_created']} context cache)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock server tương thích Gemini generateContent để đo thông lượng")
+    parser.add_argument("--host", default="127.0.0.1", help="Địa chỉ lắng nghe")
+    parser.add_argument("--port", type=int, default=8080, help="Cổng lắng nghe")
+    parser.add_argument("--latency_ms", type=float, default=500.0, help="Độ trễ trung bình mỗi response (ms)")
+    parser.add_argument("--latency_jitter_ms", type=float, default=200.0, help="Độ lệch chuẩn / nửa biên độ của độ trễ (ms)")
+    parser.add_argument("--latency_dist", choices=LATENCY_DISTRIBUTIONS, default="lognormal", help="Phân phối độ trễ")
+    parser.add_argument("--rate_429", type=float, default=0.0, help="Xác suất trả về 429 RESOURCE_EXHAUSTED")
+    parser.add_argument("--rate_5xx", type=float, default=0.0, help="Xác suất trả về 500/503")
+    parser.add_argument("--retry_after", type=float, default=0.0, help="Giá trị Retry-After/retryDelay kèm 429 và 503 (0 = không gửi)")
+    parser.add_argument("--rpm", type=int, default=0, help="Quota giả lập của mỗi API key: số request mỗi phút trước khi trả 429 (0 = không giới hạn)")
+    parser.add_argument("--endcall_rate", type=float, default=0.1, help=f"Xác suất câu trả lời chứa {ENDCALL_SIGNAL}")
+    parser.add_argument("--terminate_rate", type=float, default=0.2, help="Xác suất các trường BOOLEAN trong structured output là true")
+    parser.add_argument("--api_key", action="append", help="Chỉ chấp nhận các API key này (lặp lại được), sai key trả 403 (mặc định chấp nhận mọi key)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed để nội dung và lỗi giả lập tái lập được")
+    parser.add_argument("--prefill_ms_per_1k", type=float, default=0.0, help="Độ trễ thêm cho mỗi 1000 input tokens chưa nằm trong context cache (ms)")
+    parser.add_argument("--cache_min_tokens", type=int, default=1024, help="Số token tối thiểu để tạo cachedContents (ít hơn trả 400)")
+    parser.add_argument("--decode_ms_per_1k", type=float, default=0.0, help="Độ trễ thêm cho mỗi 1000 output tokens (ms), để response dài như cả một kịch bản tốn thời gian tương ứng")
+    parser.add_argument("--reply_sentences", type=int, default=1, help="Số câu mẫu ghép thành mỗi câu trả lời (tăng để giống độ dài lượt thoại thật)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    cfg = MockGeminiConfig(
+        latency_ms=args.latency_ms, latency_jitter_ms=args.latency_jitter_ms, latency_dist=args.latency_dist,
+        rate_429=args.rate_429, rate_5xx=args.rate_5xx, retry_after=args.retry_after, rpm=args.rpm,
+        endcall_rate=args.endcall_rate, terminate_rate=args.terminate_rate, api_keys=args.api_key, seed=args.seed,
+        prefill_ms_per_1k=args.prefill_ms_per_1k, cache_min_tokens=args.cache_min_tokens,
+        reply_sentences=args.reply_sentences, decode_ms_per_1k=args.decode_ms_per_1k,
+    )
+    server = MockGeminiServer(args.host, args.port, cfg)
+    logging.info(f"🧪 Mock Gemini server lắng nghe tại {server.base_url} (GET /stats để xem thống kê)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        logging.info(format_mock_stats(server.state.stats()))
+
+
+if __name__ == "__main__":
+    main()
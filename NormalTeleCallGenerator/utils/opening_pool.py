@@ -0,0 +1,147 @@
+"""
+Opening Pool - Kho câu mở đầu cuộc gọi sinh sẵn theo lô cho từng loại hội thoại (build_opening_pool.py),
+lọc câu gần trùng và lấy không hoàn lại để bỏ lượt gọi API đầu tiên (chưa có ngữ cảnh) của mỗi hội thoại
+"""
+
+import json
+import logging
+import os
+import random
+from threading import Lock
+from typing import Dict, Any, Iterable, List, Optional
+
+from utils.text_similarity import max_similarity
+
+DEFAULT_SIMILARITY = 0.5    # Jaccard shingle 3 từ với một câu đã có từ ngưỡng này thì coi là trùng
+
+
+def parse_openings(text: Optional[str]) -> List[str]:
+    """Đọc danh sách câu mở đầu: mảng JSON, nếu không được thì mỗi dòng một câu"""
+    text = (text or "").strip()
+    try:
+        data = json.loads(text)
+        if isinstance(data, list):
+            return [str(item).strip() for item in data if str(item).strip()]
+    except json.JSONDecodeError:
+        pass
+    return [line.strip(" -*\t\"") for line in text.splitlines() if line.strip(" -*\t\"")]
+
+
+class OpeningPool:
+    """Câu mở đầu theo loại hội thoại; mỗi câu chỉ được lấy một lần trong một lượt chạy"""
+
+    def __init__(self, similarity: float = DEFAULT_SIMILARITY):
+        self._lock = Lock()
+        self.logger = logging.getLogger(__name__)
+        self.similarity = similarity
+        self.path: Optional[str] = None
+        self.openings: Dict[str, List[str]] = {}     # Toàn bộ câu trong kho
+        self._remaining: Dict[str, List[str]] = {}   # Câu chưa dùng (đã xáo trộn)
+        self.taken = 0
+        self.misses = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.openings)
+
+    def load(self, path: str, seed: Optional[int] = None) -> None:
+        """Nạp kho từ file JSON {loại hội thoại: [câu mở đầu, ...]} và đặt lại thống kê"""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        rng = random.Random(seed)
+        with self._lock:
+            self.path = path
+            self.openings = {label: list(lines) for label, lines in data.items()}
+            self._remaining = {label: rng.sample(lines, len(lines)) for label, lines in self.openings.items()}
+            self.taken = self.misses = self.rejected = 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self.path = None
+            self.openings = {}
+            self._remaining = {}
+            self.taken = self.misses = self.rejected = 0
+
+    def save(self, path: Optional[str] = None) -> None:
+        """Ghi kho ra file tạm rồi đổi tên"""
+        path = path or self.path
+        with self._lock:
+            data = {label: list(lines) for label, lines in self.openings.items()}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def add(self, label: str, lines: Iterable[str]) -> int:
+        """Thêm các câu mới, bỏ câu chứa mã hiệu ##...## hoặc gần trùng một câu đã có; trả về số câu được thêm"""
+        added = 0
+        with self._lock:
+            existing = self.openings.setdefault(label, [])
+            for line in lines:
+                line = " ".join(line.split())
+                if not line or "##" in line or max_similarity(line, existing) >= self.similarity:
+                    self.rejected += 1
+                    continue
+                existing.append(line)
+                self._remaining.setdefault(label, []).append(line)
+                added += 1
+        return added
+
+    def count(self, label: str) -> int:
+        with self._lock:
+            return len(self.openings.get(label, []))
+
+    def take(self, label: str) -> Optional[str]:
+        """Lấy một câu mở đầu chưa dùng; None khi kho tắt hoặc đã hết câu cho loại này (agent tự sinh như cũ)"""
+        with self._lock:
+            if not self.openings:
+                return None
+            remaining = self._remaining.get(label)
+            if not remaining:
+                self.misses += 1
+                return None
+            self.taken += 1
+            return remaining.pop()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": bool(self.openings),
+                "path": self.path,
+                "labels": len(self.openings),
+                "lines": sum(len(lines) for lines in self.openings.values()),
+                "left": sum(len(lines) for lines in self._remaining.values()),
+                "taken": self.taken,
+                "misses": self.misses,
+                "rejected": self.rejected,
+            }
+
+
+_opening_pool = OpeningPool()
+
+
+def get_opening_pool() -> OpeningPool:
+    """Trả về kho câu mở đầu dùng chung của process"""
+    return _opening_pool
+
+
+def configure_opening_pool(path: Optional[str] = None, seed: Optional[int] = None) -> OpeningPool:
+    """Nạp kho câu mở đầu từ tham số dòng lệnh (None = tắt, agent tự sinh câu đầu tiên như cũ)"""
+    if not path:
+        _opening_pool.clear()
+        return _opening_pool
+    _opening_pool.load(path, seed)
+    stats = _opening_pool.stats()
+    _opening_pool.logger.info(f"🎬 Kho câu mở đầu {path}: {stats['lines']} câu cho {stats['labels']} loại hội thoại")
+    return _opening_pool
+
+
+def format_opening_pool_stats(stats: Dict[str, Any]) -> str:
+    """Định dạng thống kê kho câu mở đầu để ghi log"""
+    if not stats["enabled"]:
+        return "Kho câu mở đầu: tắt"
+    return (
+        f"Kho câu mở đầu: {stats['taken']} hội thoại dùng câu có sẵn, {stats['misses']} hội thoại tự sinh do hết câu "
+        f"({stats['left']}/{stats['lines']} câu còn lại)"
+    )
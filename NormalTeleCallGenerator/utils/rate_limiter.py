@@ -0,0 +1,186 @@
+"""
+Token Bucket Rate Limiter - Giới hạn requests/phút và tokens/phút cho toàn process
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Any, Optional
+from threading import Lock
+
+DEFAULT_RPM = 120          # Tương đương khoảng cách 0.5 giây/request như trước
+DEFAULT_TPM = 1_000_000    # Quota input tokens/phút mặc định của Gemini Flash
+DEFAULT_BURST = 5          # Số request được phép bắn liền nhau khi bucket đầy
+CHARS_PER_TOKEN = 3.0      # Ước lượng thô cho tiếng Việt (có dấu tốn token hơn tiếng Anh)
+
+
+class TokenBucket:
+    """Một bucket đơn: nạp lại `rate` đơn vị/giây, chứa tối đa `capacity` đơn vị.
+
+    Số dư được phép âm: mỗi lần đặt chỗ trừ ngay số lượng cần dùng, phần âm
+    chính là "nợ" mà request phải chờ bucket nạp bù trước khi được gửi.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Trừ `amount` và trả về số giây phải chờ để khoản đặt chỗ này hợp lệ"""
+        self._refill(now)
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def peek(self, amount: float, now: float) -> float:
+        """Số giây một khoản đặt chỗ `amount` sẽ phải chờ, nhưng không trừ gì"""
+        self._refill(now)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def refund(self, amount: float, now: float) -> None:
+        """Hoàn lại (hoặc trừ thêm nếu âm) sau khi biết số tokens thực tế"""
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class TokenBucketRateLimiter:
+    """Giới hạn đồng thời theo requests/phút (RPM) và input tokens/phút (TPM).
+
+    Lock chỉ được giữ trong lúc tính toán đặt chỗ; mỗi luồng tự sleep ngoài lock
+    cho tới thời điểm của riêng nó, nên các luồng không phải xếp hàng sau một
+    luồng đang ngủ và quota được dùng hết đúng tốc độ cho phép.
+    """
+
+    def __init__(self, rpm: int = DEFAULT_RPM, tpm: int = DEFAULT_TPM, burst: int = DEFAULT_BURST):
+        self._lock = Lock()
+        self.logger = logging.getLogger(__name__)
+        self.configure(rpm, tpm, burst)
+
+    def configure(self, rpm: int, tpm: int, burst: int = DEFAULT_BURST) -> None:
+        """Đặt lại giới hạn; rpm/tpm <= 0 nghĩa là không giới hạn chiều đó"""
+        with self._lock:
+            self.rpm = rpm
+            self.tpm = tpm
+            self.burst = max(1, burst)
+            self._request_bucket: Optional[TokenBucket] = (
+                TokenBucket(rpm / 60.0, float(min(self.burst, rpm))) if rpm > 0 else None
+            )
+            # Bucket tokens chứa tối đa quota của một giây * burst để không dồn cục
+            self._token_bucket: Optional[TokenBucket] = (
+                TokenBucket(tpm / 60.0, max(tpm / 60.0 * self.burst, 1.0)) if tpm > 0 else None
+            )
+            self.total_requests = 0
+            self.total_wait_time = 0.0
+            self.estimated_tokens = 0
+            self.actual_tokens = 0
+
+    def reserve(self, tokens: int = 0) -> float:
+        """Đặt chỗ cho một request ước lượng `tokens` input tokens.
+
+        Returns:
+            float: Số giây phải chờ trước khi gửi (0 nếu gửi được ngay)
+        """
+        with self._lock:
+            now = time.monotonic()
+            delay = 0.0
+            if self._request_bucket is not None:
+                delay = max(delay, self._request_bucket.reserve(1, now))
+            if self._token_bucket is not None and tokens > 0:
+                delay = max(delay, self._token_bucket.reserve(tokens, now))
+            self.total_requests += 1
+            self.total_wait_time += delay
+            self.estimated_tokens += tokens
+            return delay
+
+    def peek(self, tokens: int = 0) -> float:
+        """Thời gian chờ nếu đặt chỗ ngay bây giờ (dùng để chọn API key ít tải nhất)"""
+        with self._lock:
+            now = time.monotonic()
+            delay = 0.0
+            if self._request_bucket is not None:
+                delay = max(delay, self._request_bucket.peek(1, now))
+            if self._token_bucket is not None and tokens > 0:
+                delay = max(delay, self._token_bucket.peek(tokens, now))
+            return delay
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Đặt chỗ rồi chờ (ngoài lock) tới lượt của mình. Trả về thời gian đã chờ"""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    async def acquire_async(self, tokens: int = 0) -> float:
+        """Phiên bản async của acquire: chờ bằng asyncio.sleep trên event loop"""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Điều chỉnh bucket theo số tokens thực tế server báo về (usageMetadata)"""
+        with self._lock:
+            self.actual_tokens += actual_tokens
+            if self._token_bucket is not None:
+                self._token_bucket.refund(estimated_tokens - actual_tokens, time.monotonic())
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê số request, tổng thời gian chờ và độ lệch ước lượng tokens"""
+        with self._lock:
+            return {
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "requests": self.total_requests,
+                "total_wait_time": self.total_wait_time,
+                "estimated_tokens": self.estimated_tokens,
+                "actual_tokens": self.actual_tokens,
+            }
+
+
+def estimate_tokens(request_data: Dict[str, Any]) -> int:
+    """Ước lượng input tokens của một request Gemini dựa trên số ký tự"""
+    chars = 0
+    system_instruction = request_data.get("systemInstruction") or {}
+    for part in system_instruction.get("parts", []):
+        chars += len(part.get("text", ""))
+    for content in request_data.get("contents", []):
+        for part in content.get("parts", []):
+            chars += len(part.get("text", ""))
+    return max(1, int(chars / CHARS_PER_TOKEN))
+
+
+# Limiter mặc định cho toàn process
+_rate_limiter = TokenBucketRateLimiter()
+
+
+def get_rate_limiter() -> TokenBucketRateLimiter:
+    """Trả về limiter dùng chung của process"""
+    return _rate_limiter
+
+
+def configure_rate_limiter(rpm: int = DEFAULT_RPM, tpm: int = DEFAULT_TPM,
+                           burst: int = DEFAULT_BURST) -> TokenBucketRateLimiter:
+    """Cấu hình limiter dùng chung từ tham số dòng lệnh"""
+    _rate_limiter.configure(rpm, tpm, burst)
+    _rate_limiter.logger.info(f"⏱️ Rate limiter: {rpm} RPM, {tpm} TPM, burst={burst}")
+    return _rate_limiter
+
+
+def format_rate_limit_stats(stats: Dict[str, Any]) -> str:
+    """Định dạng thống kê limiter để ghi log"""
+    return (
+        f"Rate limiter ({stats['rpm']} RPM, {stats['tpm']} TPM): {stats['requests']} requests, "
+        f"tổng chờ {stats['total_wait_time']:.1f}s, tokens ước lượng/thực tế "
+        f"{stats['estimated_tokens']}/{stats['actual_tokens']}"
+    )
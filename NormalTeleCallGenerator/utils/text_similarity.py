@@ -0,0 +1,46 @@
+"""
+Text Similarity - So khớp gần đúng các câu thoại tiếng Việt bằng shingle (n-gram từ), không cần gọi model
+"""
+
+import re
+import unicodedata
+from typing import FrozenSet, Iterable, List, Tuple
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_SIGNAL = re.compile(r"##[A-Z_]+##")
+
+
+def normalize(text: str) -> str:
+    """Chuẩn hoá để so khớp: dựng sẵn dấu (NFC), chữ thường, bỏ các mã hiệu ##...##"""
+    return _SIGNAL.sub(" ", unicodedata.normalize("NFC", text or "")).lower()
+
+
+def tokens(text: str) -> List[str]:
+    """Các từ (giữ dấu tiếng Việt) của câu thoại đã chuẩn hoá"""
+    return _WORD.findall(normalize(text))
+
+
+def shingles(text: str, n: int = 3) -> FrozenSet[Tuple[str, ...]]:
+    """Tập n-gram từ liên tiếp; câu ngắn hơn n từ thì cả câu là một shingle"""
+    words = tokens(text)
+    if len(words) < n:
+        return frozenset([tuple(words)]) if words else frozenset()
+    return frozenset(tuple(words[i:i + n]) for i in range(len(words) - n + 1))
+
+
+def jaccard(a: FrozenSet, b: FrozenSet) -> float:
+    """Hệ số Jaccard của hai tập shingle (0 = khác hẳn, 1 = trùng khớp)"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def similarity(text_a: str, text_b: str, n: int = 3) -> float:
+    """Độ giống nhau của hai câu thoại theo shingle n từ"""
+    return jaccard(shingles(text_a, n), shingles(text_b, n))
+
+
+def max_similarity(text: str, others: Iterable[str], n: int = 3) -> float:
+    """Độ giống nhau lớn nhất giữa một câu và các câu trước đó"""
+    target = shingles(text, n)
+    return max((jaccard(target, shingles(other, n)) for other in others), default=0.0)